@@ -8,11 +8,14 @@ def researcher_no_analytics(request):
     # researcher ip and set a template variable that will
     # allow google analytics to be suppressed
     if getattr(settings, 'RESEARCHER_NO_ANALYTICS', False):
-        ip_addr = request.META.get('REMOTE_ADDR', None)
-        if ip_addr is not None:
-            researcher_ip = ResearcherIP.objects.filter(ip_address__exact=ip_addr).count()
-            if researcher_ip:
-                return {
-                    'RESEARCHER_NO_ANALYTICS': True
-                }
+        # use researcher ip check from middleware when available
+        researcher_ip = getattr(request, 'is_researcher_ip', None)
+        if researcher_ip is None:
+            ip_addr = request.META.get('REMOTE_ADDR', None)
+            researcher_ip = ip_addr is not None and \
+                ResearcherIP.is_researcher_ip(ip_addr)
+        if researcher_ip:
+            return {
+                'RESEARCHER_NO_ANALYTICS': True
+            }
     return {}
@@ -5,6 +5,9 @@ class ResearcherAccessMiddleware(object):
 
     def process_request(self, request):
         ip_addr = request.META.get('REMOTE_ADDR', None)
-        if request.user.is_anonymous() and ip_addr is not None and \
-           ResearcherIP.objects.filter(ip_address__exact=ip_addr).exists():
+        # store researcher ip check on the request so it can be
+        # reused elsewhere (e.g., context processors)
+        request.is_researcher_ip = ip_addr is not None and \
+            ResearcherIP.is_researcher_ip(ip_addr)
+        if request.user.is_anonymous() and request.is_researcher_ip:
             request.user = AnonymousResearcher()
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import keep.accounts.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='researcherip',
+            name='ip_address',
+            field=models.CharField(help_text=b'IP address or CIDR network (e.g., 192.168.10.0/24)', max_length=50, verbose_name=b'IP Address', validators=[keep.accounts.models.validate_ip_network]),
+        ),
+    ]
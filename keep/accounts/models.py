@@ -1,25 +1,144 @@
+import binascii
+from collections import defaultdict
+import logging
+import socket
+import uuid
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.db import models
-from django.contrib.auth.models import AnonymousUser
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.contrib.auth.models import AnonymousUser, Group, Permission
+
+logger = logging.getLogger(__name__)
+
+
+def parse_ip_network(value):
+    '''Parse an IP address or CIDR network (IPv4 or IPv6) into a tuple
+    of address family, network address as an integer, and network mask
+    as an integer.  A single address is treated as a network with a
+    full-length prefix.
+
+    :raises: ValueError if the value is not a valid address or network
+    '''
+    address, sep, prefix = value.strip().partition('/')
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    try:
+        packed = socket.inet_pton(family, str(address))
+    except (socket.error, UnicodeEncodeError):
+        raise ValueError('%s is not a valid IP address or network' % value)
+
+    bits = len(packed) * 8
+    if sep:
+        if not prefix.isdigit() or int(prefix) > bits:
+            raise ValueError('%s is not a valid IP network prefix' % value)
+        prefix = int(prefix)
+    else:
+        prefix = bits
+
+    mask = ((1 << prefix) - 1) << (bits - prefix)
+    return family, int(binascii.hexlify(packed), 16) & mask, mask
+
+
+def validate_ip_network(value):
+    'Validator for an IP address or CIDR network'
+    try:
+        parse_ip_network(value)
+    except ValueError as err:
+        raise ValidationError(unicode(err))
+
+
+class IPNetworkMatcher(object):
+    '''Check IP addresses against a list of addresses and CIDR networks.
+    Networks are grouped by prefix length, so checking an address
+    requires one set lookup for each distinct prefix length.
+
+    :param networks: list of IP addresses or networks, e.g.
+        ``['127.0.0.1', '10.0.0.0/8']``
+    '''
+
+    def __init__(self, networks):
+        self.networks = defaultdict(set)
+        for network in networks:
+            try:
+                family, address, mask = parse_ip_network(network)
+            except ValueError as err:
+                logger.warning(err)
+                continue
+            self.networks[(family, mask)].add(address)
+
+    def __contains__(self, ip_addr):
+        try:
+            family, address, full_mask = parse_ip_network(ip_addr)
+        except ValueError:
+            return False
+        for (net_family, mask), addresses in self.networks.iteritems():
+            if net_family == family and address & mask in addresses:
+                return True
+        return False
 
 
 class ResearcherIP(models.Model):
     '''Model for IP addresses where anonymous users should be considered
     researchers (i.e., access from MARBL Reading Room).'''
     name = models.CharField(max_length=255)
-    ip_address = models.GenericIPAddressField('IP Address', max_length=30)
+    ip_address = models.CharField('IP Address', max_length=50,
+        validators=[validate_ip_network],
+        help_text='IP address or CIDR network (e.g., 192.168.10.0/24)')
 
     class Meta:
         verbose_name = 'Researcher IP'
 
+    VERSION_CACHE_KEY = 'researcher-ip-version'
+    'cache key used to signal changes to researcher IPs across processes'
+
+    _matcher = None
+    _matcher_version = None
+
     def __unicode__(self):
         return '%s <%s>' % (self.name, self.ip_address)
 
+    @classmethod
+    def matcher(cls):
+        '''Get an :class:`IPNetworkMatcher` for all configured researcher
+        IPs.  The matcher is loaded once per process and reloaded when
+        the version in the django cache changes (i.e., when any researcher
+        IP is added, changed, or removed).'''
+        version = cache.get(cls.VERSION_CACHE_KEY)
+        if cls._matcher is None or version != cls._matcher_version:
+            cls._matcher = IPNetworkMatcher(
+                cls.objects.values_list('ip_address', flat=True))
+            cls._matcher_version = version
+        return cls._matcher
+
+    @classmethod
+    def is_researcher_ip(cls, ip_addr):
+        '''Check if an IP address matches any configured researcher IP
+        address or network.'''
+        return ip_addr in cls.matcher()
+
+
+@receiver(post_save, sender=ResearcherIP)
+@receiver(post_delete, sender=ResearcherIP)
+def researcher_ips_changed(sender, **kwargs):
+    # store a new version so every process reloads researcher ips
+    cache.set(ResearcherIP.VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
 
 class AnonymousResearcher(AnonymousUser):
 
     # default group membership of 'Patron' now set in
     # app config, since it can only be done after models are loaded
 
+    PERMISSIONS_CACHE_KEY = 'researcher-permissions-version'
+    'cache key used to signal changes to researcher group permissions'
+
+    _all_permissions = None
+    _permissions_version = None
+    # permissions for this researcher (i.e., the current request)
+    _permissions = None
+
     def is_anonymous_researcher(self):
         return True
 
@@ -30,15 +149,41 @@ class AnonymousResearcher(AnonymousUser):
             perms.extend(g.permissions.all())
         return perms
 
-    def has_perm(self, perm):
-        app_label, codename = perm.split('.')
-        for perm in self.permissions:
+    def get_group_permissions(self, obj=None):
+        '''Permissions for researcher groups, as a frozenset of
+        ``app_label.codename`` strings.  Permissions are loaded once per
+        process and reloaded when group permissions change; the version
+        in the cache is only checked once per researcher instance, since
+        a new instance is created for each request.'''
+        if self._permissions is not None:
+            return self._permissions
+
+        cls = AnonymousResearcher
+        version = cache.get(cls.PERMISSIONS_CACHE_KEY)
+        if cls._all_permissions is None or version != cls._permissions_version:
+            perms = Permission.objects.filter(group__in=self.groups.all()) \
+                .values_list('content_type__app_label', 'codename')
             # django permission codes are tested on the *app* label
             # and not the model name
-            if perm.content_type.app_label == app_label and \
-              perm.codename == codename:
-                return True
-        return False
+            cls._all_permissions = frozenset('%s.%s' % (app_label, codename)
+                                             for app_label, codename in perms)
+            cls._permissions_version = version
+        self._permissions = cls._all_permissions
+        return self._permissions
+
+    def get_all_permissions(self, obj=None):
+        return self.get_group_permissions(obj)
+
+    def has_perm(self, perm, obj=None):
+        return perm in self.get_all_permissions(obj)
 
     def __str__(self):
-        return 'AnonymousResearcher'
\ No newline at end of file
+        return 'AnonymousResearcher'
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def researcher_permissions_changed(sender, **kwargs):
+    # store a new version so every process reloads researcher permissions
+    cache.set(AnonymousResearcher.PERMISSIONS_CACHE_KEY, uuid.uuid4().hex, None)
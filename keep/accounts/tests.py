@@ -1,8 +1,14 @@
+from django.contrib.auth.models import Group, Permission
+from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
-from django.test import Client
-from mock import patch
+from django.test import Client, TestCase, override_settings
+from mock import Mock, patch
 import ldap
 
+from keep.accounts.context_processors import researcher_no_analytics
+from keep.accounts.middleware import ResearcherAccessMiddleware
+from keep.accounts.models import ResearcherIP, AnonymousResearcher, \
+    validate_ip_network
 from keep.accounts.views import encrypt, decrypt, to_blocksize
 # import encryption algorithm from views in case we ever want to change it
 from keep.accounts.views import EncryptionAlgorithm
@@ -92,3 +98,79 @@ class AccountViewsTest(KeepTestCase):
         response = self.client.get(logout_url, follow=True)
         self.assertNotContains(response, logout_url,
             msg_prefix='when a user is not logged in, response page should not include logout url')
+
+
+class ResearcherIPTest(TestCase):
+
+    def setUp(self):
+        ResearcherIP.objects.create(name='reading room', ip_address='10.1.2.3')
+        ResearcherIP.objects.create(name='library network', ip_address='192.168.10.0/24')
+        ResearcherIP.objects.create(name='ipv6 network', ip_address='2001:db8::/32')
+
+    def test_is_researcher_ip(self):
+        self.assertTrue(ResearcherIP.is_researcher_ip('10.1.2.3'))
+        self.assertFalse(ResearcherIP.is_researcher_ip('10.1.2.4'))
+        self.assertTrue(ResearcherIP.is_researcher_ip('192.168.10.200'))
+        self.assertFalse(ResearcherIP.is_researcher_ip('192.168.11.1'))
+        self.assertTrue(ResearcherIP.is_researcher_ip('2001:db8:1::5'))
+        self.assertFalse(ResearcherIP.is_researcher_ip('not an ip'))
+
+    def test_matcher_reload(self):
+        matcher = ResearcherIP.matcher()
+        # matcher is reused until researcher ips change
+        with patch.object(ResearcherIP.objects, 'values_list') as mockvalues:
+            self.assertEqual(matcher, ResearcherIP.matcher())
+            mockvalues.assert_not_called()
+
+        ResearcherIP.objects.filter(ip_address='10.1.2.3').delete()
+        self.assertFalse(ResearcherIP.is_researcher_ip('10.1.2.3'))
+        ResearcherIP.objects.create(name='new', ip_address='10.1.2.4')
+        self.assertTrue(ResearcherIP.is_researcher_ip('10.1.2.4'))
+
+    def test_validate_ip_network(self):
+        validate_ip_network('10.1.0.0/16')
+        validate_ip_network('::1')
+        self.assertRaises(ValidationError, validate_ip_network, '10.1.0.0/33')
+        self.assertRaises(ValidationError, validate_ip_network, 'localhost')
+
+    def test_middleware(self):
+        request = Mock(META={'REMOTE_ADDR': '192.168.10.5'})
+        request.user.is_anonymous.return_value = True
+        ResearcherAccessMiddleware().process_request(request)
+        self.assertTrue(request.is_researcher_ip)
+        self.assert_(isinstance(request.user, AnonymousResearcher))
+
+        # context processor should use the result stored by the middleware
+        with override_settings(RESEARCHER_NO_ANALYTICS=True):
+            with patch.object(ResearcherIP, 'is_researcher_ip') as mockcheck:
+                self.assertEqual({'RESEARCHER_NO_ANALYTICS': True},
+                                 researcher_no_analytics(request))
+                mockcheck.assert_not_called()
+
+
+class AnonymousResearcherTest(TestCase):
+    fixtures = ['initial_groups']
+
+    def test_permissions(self):
+        researcher = AnonymousResearcher()
+        perms = researcher.get_all_permissions()
+        self.assert_(isinstance(perms, frozenset))
+        patron = Group.objects.get(name='Patron')
+        self.assertEqual(patron.permissions.count(), len(perms))
+        for perm in perms:
+            self.assertTrue(researcher.has_perm(perm))
+        self.assertFalse(researcher.has_perm('audio.delete_audio'))
+
+        # permissions are cached until group permissions change
+        with patch('keep.accounts.models.Permission') as mockperm:
+            self.assertEqual(perms, AnonymousResearcher().get_all_permissions())
+            mockperm.objects.filter.assert_not_called()
+
+        # cached version is only checked once per researcher (request)
+        with patch('keep.accounts.models.cache') as mockcache:
+            self.assertFalse(researcher.has_perm('audio.delete_audio'))
+            mockcache.get.assert_not_called()
+
+        perm = Permission.objects.get(codename='delete_audio')
+        patron.permissions.add(perm)
+        self.assertTrue(AnonymousResearcher().has_perm('audio.delete_audio'))
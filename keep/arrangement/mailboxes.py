@@ -0,0 +1,122 @@
+'''
+Streaming processing for Eudora mail folders.
+
+A Eudora folder consists of a mailbox data file and a ``.toc`` index
+file with the offset and size of each message.  :meth:`folder_messages`
+generates processed messages for a folder in folder order; the mailbox
+data file is memory-mapped, and the CPU-bound work of redacting,
+parsing, and checksumming each message is done in a pool of worker
+processes.
+
+Example::
+
+    for msg in folder_messages('/path/to/In'):
+        print msg.order, msg.checksum, msg.message['subject']
+
+'''
+from collections import namedtuple
+import codecs
+import email
+import hashlib
+import mmap
+from multiprocessing import Pool
+
+from bodatools.binfile import eudora
+
+from keep.common.utils import redact_email
+
+
+class MacEncodedMessage(email.message.Message):
+
+    charset_decoder = codecs.getdecoder('macroman')
+
+    def decode_headers(self):
+        new_headers = []
+
+        for key, val in self._headers:
+            val, length = self.charset_decoder(val)
+            new_headers.append((key, val))
+
+        self._headers = new_headers
+
+
+MailboxMessage = namedtuple('MailboxMessage',
+                            'order offset size data message checksum')
+'''A single message from a Eudora folder.  ``data`` is the redacted
+message content; ``message`` is the parsed
+:class:`MacEncodedMessage`; ``checksum`` is the MD5 of the message
+as it would be ingested.'''
+
+
+# memory-mapped mailbox data files, by path; opened once per process
+_mailbox_data = {}
+
+def read_message(path, offset, size):
+    '''Read raw message data from a memory-mapped mailbox data file.'''
+    if path not in _mailbox_data:
+        with open(path, 'rb') as mbox:
+            _mailbox_data[path] = mmap.mmap(mbox.fileno(), 0,
+                                            access=mmap.ACCESS_READ)
+    return _mailbox_data[path][offset:offset + size]
+
+
+def message_checksum(email_msg):
+    '''MD5 checksum of an email message as it will be serialized,
+    for matching content ingested into the repository.'''
+    md5 = hashlib.md5()
+    md5.update(str(email_msg))
+    return md5.hexdigest()
+
+
+def load_message(item):
+    '''Read, redact, parse, and checksum a single message.  Takes a
+    tuple of mailbox data file path, folder order, offset, and size,
+    as generated by :meth:`folder_messages`.
+
+    :returns: :class:`MailboxMessage`
+    '''
+    path, order, offset, size = item
+    data = redact_email(read_message(path, offset, size))
+    # generate an email message object from the data, using the
+    # exact character encoding used for ingesting content,
+    # so that content checksums will match
+    email_msg = email.message_from_string(data, _class=MacEncodedMessage)
+    return MailboxMessage(order, offset, size, data, email_msg,
+                          message_checksum(email_msg))
+
+
+def folder_messages(folder_path, toc_path=None, func=load_message,
+                    processes=None, chunksize=50):
+    '''Generate processed messages for a Eudora folder, in folder order.
+
+    :param folder_path: path to the mailbox data file
+    :param toc_path: path to the folder index file; defaults to the
+        data file path with a ``.toc`` extension
+    :param func: function to apply to each message; must be a module-level
+        function so it can be run in a worker process.  Takes the same
+        arguments as (and will typically call) :meth:`load_message`.
+    :param processes: number of worker processes; defaults to the number
+        of CPUs.  With a single process, messages are processed
+        in the current process.
+    :param chunksize: number of messages to send to a worker at a time
+    :returns: generator of the result of ``func`` for each message
+    '''
+    if toc_path is None:
+        toc_path = folder_path + '.toc'
+    toc = eudora.Toc(toc_path)
+    items = ((folder_path, order, msg.offset, msg.size)
+             for order, msg in enumerate(toc.messages))
+
+    if processes == 1:
+        for item in items:
+            yield func(item)
+        return
+
+    pool = Pool(processes)
+    try:
+        for result in pool.imap(func, items, chunksize):
+            yield result
+    finally:
+        # stop any outstanding work if the caller stops early
+        pool.terminate()
+        pool.join()
@@ -1,21 +1,54 @@
 import csv
 from datetime import datetime
-import email
 from glob import glob
-import hashlib
 import logging
+from optparse import make_option
 import os
 import re
 
 from django.core.management.base import BaseCommand, CommandError
 
-from bodatools.binfile import eudora
-from keep.common.utils import redact_email
-from keep.arrangement.management.commands.ingest_5300c_email import MacEncodedMessage
+from keep.arrangement.mailboxes import folder_messages, load_message
 
 logger = logging.getLogger(__name__)
 
 
+# date cannot be reliably accessed like a normal header
+date_re = re.compile('From \?\?\?\@\?\?\? (.*)')
+
+def get_date(msg):
+    '''
+    Retrieve and reformat the date from an email message.
+
+    Using a regular expression to pull from the content since
+    not all emails expose the date as an actual email header for some reason.
+
+    :returns: tuple of raw date string as found in the message, formatted date
+    '''
+    m = date_re.search(str(msg))
+    date_str = m.group(1)
+    dt = datetime.strptime(date_str, '%a %b %d %H:%M:%S %Y')
+    return date_str, dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def message_info(item):
+    '''Load a single message and extract the fields needed for the
+    CSV file; run in a worker process by
+    :meth:`keep.arrangement.mailboxes.folder_messages`.'''
+    msg = load_message(item)
+    email_msg = msg.message
+    raw_date, formatted_date = get_date(email_msg)
+    return {
+        'ID': email_msg.get('message-id'),
+        'SUBJECT': email_msg.get('subject'),
+        'CREATED': formatted_date,
+        'RAW SIZE': msg.size,
+        'CHECKSUM': msg.checksum,
+        'INGEST SIZE': len(str(email_msg)),
+        'RAW DATE': raw_date,
+    }
+
+
 class Command(BaseCommand):
     '''
     Generate a CSV file named emails.csv in the current directory with information
@@ -98,6 +131,11 @@ class Command(BaseCommand):
     series = 'Correspondence - Email'
     'name of the series all email content belongs to'
 
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int',
+                    help='Number of worker processes to use (defaults to number of CPUs)'),
+        )
+
     def handle(self, *args, **options):
 
         if len(args) == 0:
@@ -128,65 +166,24 @@ class Command(BaseCommand):
                 if verdict == 'UNKNOWN':
                     print 'Warning: unknown verdict for "%s"' % fname
 
-                # open the mailbox file as raw data
-                mbox = open(os.path.join(eudora_path, fname))
-                # open the toc file as a binfile eudora object
-                toc = eudora.Toc(toc_filepath)
-
-                # iterate through every email in the folder and add to csv output
+                # iterate through every email in the folder and add to csv output;
+                # messages are read, redacted to match content as ingested,
+                # and checksummed in parallel, but returned in folder order
                 msg_count = 0
-                for message in toc.messages:
+                for row in folder_messages(os.path.join(eudora_path, fname),
+                                           toc_filepath, func=message_info,
+                                           processes=options.get('processes')):
                     msg_count += 1
 
-                    # get individual message data based on size and offset from toc file
-                    mbox.seek(message.offset)
-                    message_data = mbox.read(message.size)
-                    # redact to match content as ingested
-                    message_data = redact_email(message_data)
-                    # generate an email message object from the data, using the
-                    # exact character encoding used for ingesting content,
-                    # so that content checksums will match
-                    email_msg = email.message_from_string(message_data,
-                                              _class=MacEncodedMessage)
-
-                    # get any fields that require calculation or extraction
-                    raw_date, formatted_date = self.get_date(email_msg)
-                    # md5sum
-                    md5sum = hashlib.md5()
-                    md5sum.update(str(email_msg))
-
-                    # create a dict with the row data
+                    # add folder-level data to the row
                     # (order here doesn't matter since Dictwriter will write out based on headers list)
-                    row = {
-                        'ID': email_msg.get('message-id'),
-                        'FOLDER-SUBJECT': '%s/%s' % (fname, email_msg.get('subject')),
+                    row.update({
+                        'FOLDER-SUBJECT': '%s/%s' % (fname, row.pop('SUBJECT')),
                         'VERDICT': verdict,
-                        'CREATED': formatted_date,
                         'COMPUTER': self.computer,
-                        'RAW SIZE': message.size,
                         'SERIES': self.series,
-                        'CHECKSUM': md5sum.hexdigest(),
-                        'INGEST SIZE': len(str(email_msg)),
-                        'RAW DATE': raw_date,
-                    }
+                    })
 
                     # write out the row data
                     writer.writerow(row)
                 print '  %d messages' % msg_count
-
-    def get_date(self, msg):
-        '''
-        Retrieve and reformat the date from an email message.
-
-        Using a regular expression to pull from the content since
-        not all emails expose the date as an actual email header for some reason.
-
-        :returns: tuple of raw date string as found in the message, formatted date
-        '''
-        date = str(msg)
-        # cannot be reliably accessed like a normal header
-        p = re.compile('From \?\?\?\@\?\?\? (.*)')
-        m = p.search(date)
-        date_str = m.group(1)
-        dt = datetime.strptime(date_str, '%a %b %d %H:%M:%S %Y')
-        return date_str, dt.strftime('%Y-%m-%d %H:%M:%S')
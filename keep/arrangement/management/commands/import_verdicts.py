@@ -3,12 +3,12 @@ from collections import defaultdict
 from optparse import make_option
 from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
 from django.core.management.base import BaseCommand, CommandError
-from eulfedora.util import RequestFailed
 
 from keep.arrangement.models import ArrangementObject, EmailMessage
+from keep.common.batch import ThreadRepositories, pool_map
 from keep.common.models import rights_access_terms_dict
-from keep.common.eadmap import Series
-from keep.common.utils import solr_interface
+from keep.common.eadmap import series_tree
+from keep.common.utils import solr_cursor, solr_interface
 
 class Command(BaseCommand):
     help = '''Import verdicts from a CSV file to arrangement objects in the repository.
@@ -24,6 +24,10 @@ class Command(BaseCommand):
         make_option('--email', dest='email',
                     action='store_true', default=False,
                     help='Use this option when processing CSV with verdicts for emails'),
+        make_option('--collection', dest='collection',
+                    help='Only match records that belong to the collection with this pid'),
+        make_option('--workers', dest='workers', type='int',
+                    help='Number of records to update concurrently'),
         make_option('-n', '--noact', action='store_true', default=False,
                     help='''Test run: report what would be done, but do not modify
                     anything in the repository'''),
@@ -74,13 +78,19 @@ class Command(BaseCommand):
     rushdie_eadid = 'rushdie1000'
     rushdie_ead_baseurl = 'https://findingaids.library.emory.edu/documents/rushdie1000/'
 
-    def handle(self, csvfile=None, verbosity=1, noact=False, email=False, *args, **options):
+    def handle(self, csvfile=None, verbosity=1, noact=False, email=False,
+               collection=None, workers=None, *args, **options):
         if csvfile is None:
             raise CommandError('CSV filename is required')
         self.verbosity = int(verbosity)  # ensure we compare int to int
 
         # load findingaid series/subseries info
-        self.load_series_subseries()
+        if not email:
+            self.load_series_subseries()
+
+        # load checksums and arrangement ids for all arrangement content
+        # up front, so csv rows can be matched without a query per row
+        self.load_index(collection)
 
         csvreader = csv.DictReader(open(csvfile, 'rb'),
                                 fieldnames=self.csv_fields)
@@ -90,112 +100,61 @@ class Command(BaseCommand):
         self.stats = defaultdict(int)
         self.verdict_stats = defaultdict(int)
         series_stats = defaultdict(int)
+
+        # match every row before changing anything, so that missing
+        # and ambiguous records are all reported at the start
+        matched = []
         for row in csvreader:
             self.stats['rows'] += 1
             try:
-                # if email flag then only run logic for email objects
                 if email:
-                    if not row['checksum']:
-                        print "Row Missing checksum"
-                        continue
-                    else:
-                        checksum = row['checksum']
-                    if not row['path']:
-                        print "Row Missing path"
-                        continue
-                    else:
-                        path = row['path']
-
-                    self.process_email(checksum, path, row['id'], noact)
+                    pid = self.match_email(row)
                 else:
-                    # check if there is a duplicate checksum
-                    if row['checksum']:
-                        solr = solr_interface()
-                        q = solr.query(content_md5=row['checksum'],
-                                       content_model=ArrangementObject.ARRANGEMENT_CONTENT_MODEL) \
-                                       .field_limit(['pid', 'title', 'simpleCollection_label'])
-                        num_found = len(q)
-                        if num_found > 1:
-                            print 'Error: found more than one record with matching checksum for %s:' \
-                                  % row['id']
-
-                            for record in q:
-                                # simple collection field is multiple, even though
-                                # our content currently only belongs to one;
-                                # join into a single field that can be used for output
-                                record['collection']  = ', '.join(record['simpleCollection_label'])
-                                print '  %(pid)s - %(title)s (%(collection)s)' % record
-
-                            # skip this record, must be handled manually
-                            continue
-
-                        # if there is exactly one match, save it to confirm with
-                        # pid found by arrangement id
-                        elif num_found == 1:
-                            checksum_pid = q[0]['pid']
-
-
-
-                    obj = ArrangementObject.by_arrangement_id(row['id'])
-                    if self.verbosity > self.v_normal:
-                        print 'Found %s for arrangement id %s' % \
-                              (obj.pid, row['id'])
-
-                    if obj.pid != checksum_pid:
-                        print 'Error: pid found by checksum (%s) does not match pid found by arrangement id (%s)' \
-                              % (checksum_pid, obj.pid)
-
-                        continue
-
-
-
-
-                    self.stats['found'] += 1
-
-                    # set rights status based on verdict in csv
-
-                    # if no verdict is set, default to undetermined
-                    if not row['verdict']:
-                        row['verdict'] = 'Undetermined'
-                        if self.verbosity >= self.v_normal:
-                            print 'No verdict set for %(id)s; defaulting to %(verdict)s' % row
-
-
-                    # set access code,
-                    verdict_assigned = self.set_access_status(obj,
-                                                              row['verdict'], row)
-                    if verdict_assigned:
-                        # update tally for this verdict if successful
-                        self.verdict_stats[verdict_assigned] += 1
-
-                    # set series/subseries information
-                    series = self.set_series(obj, row)
-                    if series:
-                        series_stats[series] += 1
-
-                    # if not noact mode, save object
-                    if not noact:
-                        try:
-                            # only save if changed, so we can keep track of
-                            # how many updates are made
-                            if obj.rights.isModified() or obj.mods.isModified():
-                                updated = obj.save('import verdict & series/subseries')
-                                self.stats['updated'] += 1
-
-                        except RequestFailed:
-                            print 'Error saving %s' % obj.pid
-                            self.stats['save_error'] += 1
-
-
+                    pid = self.match_arrangement(row)
             except ObjectDoesNotExist as err:
                 self.stats['not_found'] +=1
                 if self.verbosity >= self.v_normal:
                     print 'Error: %s' % err
+                continue
             except MultipleObjectsReturned as err:
                 self.stats['too_many'] += 1
                 if self.verbosity >= self.v_normal:
                     print 'Error: %s' % err
+                continue
+
+            if pid is not None:
+                self.stats['found'] += 1
+                matched.append((pid, row))
+
+        if self.verbosity >= self.v_normal:
+            print 'Matched %d of %d rows; updating records' % \
+                  (len(matched), self.stats['rows'])
+
+        # load and update matched records concurrently
+        repos = ThreadRepositories()
+        objtype = EmailMessage if email else ArrangementObject
+
+        def update_record(item):
+            pid, row = item
+            obj = repos.repo.get_object(pid, type=objtype)
+            if email:
+                return self.process_email(obj, row['path'], row['checksum'], noact)
+            return self.process_arrangement(obj, row, noact)
+
+        for item, result, err in pool_map(update_record, matched, workers):
+            if err is not None:
+                print 'Error saving %s: %s' % (item[0], err)
+                self.stats['save_error'] += 1
+                continue
 
+            verdict_assigned, series, updated = result
+            if verdict_assigned:
+                # update tally for this verdict if successful
+                self.verdict_stats[verdict_assigned] += 1
+            if series:
+                series_stats[series] += 1
+            if updated:
+                self.stats['updated'] += 1
 
         # summary
         if self.verbosity >= self.v_normal:
@@ -204,14 +163,152 @@ class Command(BaseCommand):
             print 'Verdicts imported:\n    ' + \
                   '; '.join('%d %s' % (n, v)
                             for v, n in self.verdict_stats.iteritems())
-            print 'Series and subseries assigned:\n  '+ \
-                  '\n  '.join('%s : %d' % (v, n)
-                            for v, n in series_stats.iteritems())
+            if not email:
+                print 'Series and subseries assigned:\n  '+ \
+                      '\n  '.join('%s : %d' % (v, n)
+                                for v, n in series_stats.iteritems())
             if not noact:
                 print 'Updated %(updated)d record(s); error saving %(save_error)d records' \
                       % self.stats
-                    
-            
+
+    def load_index(self, collection=None):
+        '''Load pid, checksum, and arrangement id for all arrangement
+        content (including email) from Solr in a single pass, and build
+        dictionaries to look up records by checksum and by arrangement id.
+
+        :param collection: optional collection pid, to only load records
+            that belong to that collection
+        '''
+        solr = solr_interface()
+        q = solr.query(content_model=ArrangementObject.ARRANGEMENT_CONTENT_MODEL)
+        if collection is not None:
+            q = q.query(collection_id=collection)
+        q = q.field_limit(['pid', 'title', 'content_md5', 'arrangement_id',
+                           'simpleCollection_label'])
+
+        self.by_checksum = defaultdict(list)
+        self.by_arrangement_id = defaultdict(list)
+        for record in solr_cursor(q, rows=1000):
+            if record.get('content_md5', None):
+                self.by_checksum[record['content_md5']].append(record)
+            if record.get('arrangement_id', None):
+                self.by_arrangement_id[record['arrangement_id']].append(record)
+
+        if self.verbosity > self.v_normal:
+            print 'Loaded %d checksums and %d arrangement ids from Solr' % \
+                  (len(self.by_checksum), len(self.by_arrangement_id))
+
+    def find_pid(self, index, field, value):
+        '''Find a single pid in one of the lookup dictionaries built
+        by :meth:`load_index`.
+
+        Raises :class:`django.core.exceptions.MultipleObjectsReturned`
+        if more than one match is found; raises
+        :class:`django.core.exceptions.ObjectDoesNotExist` if no
+        matches are found, consistent with
+        :meth:`ArrangementObject.by_arrangement_id`.
+        '''
+        found = index.get(value, [])
+        if len(found) > 1:
+            raise MultipleObjectsReturned('Found %d records with %s %s' % \
+                                          (len(found), field, value))
+        if not found:
+            raise ObjectDoesNotExist('No record found with %s %s' % (field, value))
+        return found[0]['pid']
+
+    def match_arrangement(self, row):
+        '''Find the pid for a row of arrangement csv data by arrangement
+        id, and confirm it matches the record found by checksum (if any).
+
+        :returns: pid, or None if the row must be handled manually
+        '''
+        checksum_pid = None
+        # check if there is a duplicate checksum
+        if row['checksum']:
+            found = self.by_checksum.get(row['checksum'], [])
+            if len(found) > 1:
+                print 'Error: found more than one record with matching checksum for %s:' \
+                      % row['id']
+
+                for record in found:
+                    # simple collection field is multiple, even though
+                    # our content currently only belongs to one;
+                    # join into a single field that can be used for output
+                    record['collection']  = ', '.join(record.get('simpleCollection_label', []))
+                    print '  %(pid)s - %(title)s (%(collection)s)' % record
+
+                # skip this record, must be handled manually
+                self.stats['duplicate_checksum'] += 1
+                return None
+
+            # if there is exactly one match, save it to confirm with
+            # pid found by arrangement id
+            elif len(found) == 1:
+                checksum_pid = found[0]['pid']
+
+        pid = self.find_pid(self.by_arrangement_id, 'arrangement id', row['id'])
+        if self.verbosity > self.v_normal:
+            print 'Found %s for arrangement id %s' % (pid, row['id'])
+
+        if checksum_pid is not None and pid != checksum_pid:
+            print 'Error: pid found by checksum (%s) does not match pid found by arrangement id (%s)' \
+                  % (checksum_pid, pid)
+            self.stats['mismatch'] += 1
+            return None
+
+        return pid
+
+    def match_email(self, row):
+        '''Find the pid for a row of email csv data by checksum,
+        falling back to message id.
+
+        :returns: pid, or None if the row is missing required data
+        '''
+        if not row['checksum']:
+            print "Row Missing checksum"
+            return None
+        if not row['path']:
+            print "Row Missing path"
+            return None
+
+        try:
+            return self.find_pid(self.by_checksum, 'checksum', row['checksum'])
+        except ObjectDoesNotExist as err:
+            # if search on checksum fails, try message id
+            if self.verbosity > self.v_normal:
+                print 'Warning: %s - attempting to find by message id' % err
+            # let any not found exceptions rise to outer loop
+            return self.find_pid(self.by_arrangement_id, 'message id', row['id'])
+
+    def process_arrangement(self, obj, row, noact):
+        '''Set rights and series for an arrangement object based on
+        a row of csv data, and save if anything changed.
+
+        :returns: tuple of verdict assigned, series assigned, and
+            whether the object was updated
+        '''
+        # set rights status based on verdict in csv
+
+        # if no verdict is set, default to undetermined
+        if not row['verdict']:
+            row['verdict'] = 'Undetermined'
+            if self.verbosity >= self.v_normal:
+                print 'No verdict set for %(id)s; defaulting to %(verdict)s' % row
+
+        # set access code,
+        verdict_assigned = self.set_access_status(obj, row['verdict'], row)
+
+        # set series/subseries information
+        series = self.set_series(obj, row)
+
+        # if not noact mode, save object
+        # only save if changed, so we can keep track of
+        # how many updates are made
+        updated = False
+        if not noact and (obj.rights.isModified() or obj.mods.isModified()):
+            updated = obj.save('import verdict & series/subseries')
+
+        return verdict_assigned, series, updated
 
     def set_access_status(self, obj, verdict, data):
         '''
@@ -258,24 +355,17 @@ class Command(BaseCommand):
     def load_series_subseries(self):
         # load series/subseries deails to map csv series names
 
-        # query the rushdie findingaid for series/subseries info
-        series = Series.objects.filter(eadid=self.rushdie_eadid)\
-                 	.only('id', 'did__unittitle', 'subseries', 'eadid')
+        # use the (cached) rushdie findingaid series/subseries info
+        tree = series_tree(self.rushdie_eadid)
 
         # create dictionaries to look up values
-        by_id = {}  # full details by id
         by_name = {} # name -> id to map from csv file
-        for s in series:
-            by_id[s.id] = {'title': s.title, 'short_id': s.short_id}
-            by_name[s.title] = s.id
-            #print 'title = %s id = %s' % (s.title, s.id)
-            for sub in s.subseries:
-                #print 'title = %s id = %s' % (sub.title, sub.id)
-                by_id[sub.id] = {'title': sub.title, 'short_id': sub.short_id,
-                                'series': s.id}
-                by_name[sub.title] = sub.id
-
-        self.series_by_id = by_id
+        for s in tree.series:
+            by_name[s['title']] = s['id']
+            for sub in s['subseries']:
+                by_name[sub['title']] = sub['id']
+
+        self.series_by_id = tree.by_id  # full details by id
         self.series_by_name = by_name
 
 
@@ -379,45 +469,30 @@ class Command(BaseCommand):
         url_parts.append(series_info['short_id'])
         mods_series.uri = '/'.join(url_parts)
 
-    def process_email(self, checksum, path, message_id, noact):
+
+    def process_email(self, obj, path, checksum, noact):
         '''Process verdicts for email content.
 
-        :param checksum: checksum from the CSV file to search on
+        :param obj: :class:`~keep.arrangement.models.EmailMessage`
 
         :param path: folder/subject of the email message.
         This is used to determine verdict
 
+        :param checksum: checksum from the CSV file, for reporting
+
         :param noact: specifies noact mode
 
+        :returns: tuple of verdict assigned, series assigned (always
+            None for email), and whether the object was updated
         '''
-        try:
-            obj = EmailMessage.by_checksum(checksum)
-        except ObjectDoesNotExist as err:
-            # if search on checksum fails, try message id
-            if self.verbosity > self.v_normal:
-                print 'Warning: %s - attempting to find by message id' % err
-            obj = EmailMessage.by_message_id(message_id)
-            # let any not found exceptions rise to outer loop
-            
-        self.stats['found'] += 1
-
         # FIXME: why are we not pulling numeric verdict from the verdict column?
         verdict = path.split('/')[0]
         verdict_assigned = self.set_access_status(obj, verdict, {'verdict': verdict, 'id': checksum})
-        self.verdict_stats[verdict_assigned] += 1
 
-        if not noact:
-            try:
-                # only save if changed, so we can keep track of
-                # how many updates are made
-                if obj.rights.isModified():
-                    updated = obj.save('import verdict & series/subseries')
-                    self.stats['updated'] += 1
-
-            except RequestFailed:
-                print 'Error saving %s' % obj.pid
-                self.stats['save_error'] += 1
+        # only save if changed, so we can keep track of
+        # how many updates are made
+        updated = False
+        if not noact and obj.rights.isModified():
+            updated = obj.save('import verdict & series/subseries')
 
-            # FIXME: this prints *every row in email mode; should only print once at the end
-            print 'Updated %(updated)d record(s); error saving %(save_error)d records' \
-                      % self.stats
+        return verdict_assigned, None, updated
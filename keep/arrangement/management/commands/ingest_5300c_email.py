@@ -1,8 +1,6 @@
-import codecs
 from collections import defaultdict
 import email
 from getpass import getpass
-import hashlib
 from optparse import make_option
 import os
 import re
@@ -11,19 +9,19 @@ from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.core.urlresolvers import reverse
 
-from bodatools.binfile import eudora
 from eulfedora.rdfns import relsext, model as modelns
 from eulfedora.util import RequestFailed
 from eulxml.xmlmap import mods, cerp
 from pidservices.clients import parse_ark
 from pidservices.djangowrapper.shortcuts import DjangoPidmanRestClient
 
+from keep.arrangement.mailboxes import MacEncodedMessage, folder_messages
 from keep.arrangement.models import ArrangementObject, RushdieArrangementFile, \
      EmailMessage, Mailbox
 from keep.collection.models import SimpleCollection as ProcessingBatch
 from keep.common.fedora import Repository, ArkPidDigitalObject
 from keep.common.models import rights_access_terms_dict
-from keep.common.utils import solr_interface, absolutize_url, redact_email
+from keep.common.utils import solr_interface, absolutize_url
 from keep.file.utils import md5sum
 
 
@@ -73,6 +71,9 @@ Eudora files. (One-time import for 5300c content)
         make_option('--purge-only', action='store_true', default=False,
                     help='''Only purge old metadata email records; do not
                     ingest email messages'''),
+        make_option('--processes', type='int',
+                    help='''Number of worker processes to use for reading email
+                    messages (defaults to number of CPUs)'''),
 
         # optional fedora credentials
         make_option('--user', metavar='FEDORA_USER', dest='user',
@@ -97,9 +98,11 @@ Eudora files. (One-time import for 5300c content)
     email_path_regex = '^(%s)/' % '|'.join(email_folders.keys())
 
     max_ingest = None
+    processes = None
 
     def handle(self, batch_id=None, folder_path=None, verbosity=1, noact=False,
-               max_ingest=None, skip_purge=False, purge_only=False, *args, **options):
+               max_ingest=None, skip_purge=False, purge_only=False,
+               processes=None, *args, **options):
 
         # check batch object
         if batch_id is None:
@@ -114,6 +117,7 @@ Eudora files. (One-time import for 5300c content)
         if not os.path.isdir(folder_path):
             raise CommandError('Eudora folder path "%s" is not a directory' % folder_path)
         self.noact = noact
+        self.processes = processes
 
         # check for any specified fedora credentials
         fedora_opts = {}
@@ -300,26 +304,17 @@ Eudora files. (One-time import for 5300c content)
                 # for access to parent collection
                 mailbox = self.repo.get_object(mailbox.pid, type=MailboxPidReuse)
 
-            with open(folder_toc) as tocdata:
-                with open(folder_path) as mbox:
-                    toc = eudora.Toc(tocdata)   # load as eudora toc binfile
+            # messages are read, redacted, parsed, and checksummed in
+            # parallel, but returned in folder order; folder order is
+            # stored in CERP for sorting/display
+            for msg in folder_messages(folder_path, folder_toc,
+                                       processes=self.processes):
+                self.stats['message'] += 1
 
-                    # eudora Toc returns messages in folder order;
-                    # pass order in to store in CERP for sorting/display
-                    folder_order = 0
-                    for msg in toc.messages:
-                        self.stats['message'] += 1
-
-                        # get data from mbox file based on msg offset/size
-                        mbox.seek(msg.offset)
-                        # read message content from mailbox data file
-                        msg_data = mbox.read(msg.size)
-
-                        self.ingest_message(msg_data, mailbox, folder_order)
-                        folder_order += 1
-                        # max to ingest for testing
-                        if self.max_ingest and self.stats['ingested'] >= self.max_ingest:
-                            break
+                self.ingest_message(msg, mailbox)
+                # max to ingest for testing
+                if self.max_ingest and self.stats['ingested'] >= self.max_ingest:
+                    break
 
         # summary
 
@@ -344,14 +339,30 @@ Eudora files. (One-time import for 5300c content)
         if len(q):
             return self.repo.get_object(q[0]['pid'], type=RushdieArrangementFile)
 
-    def ingest_message(self, msg_data, mailbox, folder_order):
+    def ingest_message(self, msg, mailbox):
+        '''Ingest a single email message.
 
-        # read content and redact IP addresses / email addresses
-        msg_data = redact_email(msg_data)
+        :param msg: :class:`keep.arrangement.mailboxes.MailboxMessage`,
+            with content already redacted
+        :param mailbox: mailbox object the message belongs to
+        '''
 
-        # generate email object from data
-        email_msg = email.message_from_string(msg_data,
-                                              _class=MacEncodedMessage)
+        # check if this email has already been ingested via checksum
+        # (calculated on the email content *as it will be serialized*);
+        # don't re-ingest if it is already in the repository
+        solr = solr_interface()
+        q = solr.query(content_md5=msg.checksum).field_limit('pid')
+        if len(q):
+            if self.verbosity >= self.v_normal:
+                print 'Email message has already been ingested as %s; skipping' \
+                      % q[0]['pid']
+            self.stats['previously_ingested'] += 1
+            return
+
+        msg_data = msg.data
+        folder_order = msg.order
+        # email object generated from redacted data
+        email_msg = msg.message
 
         # check and warn if email has attachments
         attachments = self.email_attachments(email_msg)
@@ -443,23 +454,7 @@ Eudora files. (One-time import for 5300c content)
         # (don't save modified charset, content type, etc.)
         msg_obj.mime_data.content = email.message_from_string(msg_data,
                                               _class=MacEncodedMessage)
-        # calculate an MD5 of the email content *as it will be serialized*
-        md5 = hashlib.md5()
-        md5.update(str(msg_obj.mime_data.content))
-        email_md5 = md5.hexdigest()
-        msg_obj.mime_data.checksum = email_md5
-
-
-        # check if this email has already been ingested via checksum;
-        # don't re-ingest if it is already in the repository
-        solr = solr_interface()
-        q = solr.query(content_md5=msg_obj.mime_data.checksum).field_limit('pid')
-        if len(q):
-            if self.verbosity >= self.v_normal:
-                print 'Email message has already been ingested as %s; skipping' \
-                      % q[0]['pid']
-            self.stats['previously_ingested'] += 1
-            return
+        msg_obj.mime_data.checksum = msg.checksum
 
 
         # associate with current mailbox object
@@ -499,20 +494,6 @@ Eudora files. (One-time import for 5300c content)
         return attachments
 
 
-class MacEncodedMessage(email.message.Message):
-
-    charset_decoder = codecs.getdecoder('macroman')
-
-    def decode_headers(self):
-        new_headers = []
-
-        for key, val in self._headers:
-            val, length = self.charset_decoder(val)
-            new_headers.append((key, val))
-
-        self._headers = new_headers
-
-
 class PidReuseDigitalObject(ArkPidDigitalObject):
 
     _unused_pid_result = None
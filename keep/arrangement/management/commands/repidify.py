@@ -1,4 +1,3 @@
-import base64
 from collections import OrderedDict
 from datetime import datetime
 from django.conf import settings
@@ -11,11 +10,14 @@ from eulfedora.util import RequestFailed
 from eulxml.xmlmap import mods
 import logging
 from pidservices.clients import parse_ark
-import re
+import tempfile
+import threading
 import urllib
 
 from keep.arrangement.models import ArrangementObject, LocalArrangementMods
+from keep.common.batch import pool_map
 from keep.common.fedora import ManagementRepository, pidman
+from keep.common.foxml import CHECKSUM_CLEANUP, rewrite_foxml, spool_response
 from keep.common.utils import absolutize_url
 
 
@@ -25,234 +27,224 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     '''Export an existing arrangement object and import it with a new pid,
 preserving all history, datastreams, audit trails, etc.
-NOTE: should not be used except in dire need; may fail on large objects.'''
-    help = __doc__
+NOTE: should not be used except in dire need.
 
-    # regular expressions to remove datastream checksums before reingest
-    dsre = {
-        # regex to remove datastream version checksum by datastream id
-        # for DC and RELS-EXT datastreams affected by pid change
-        'dcrels': re.compile(
-            r'(?P<dsversion><foxml:datastreamVersion ID="(DC|RELS-EXT).\d+"[^>]*>)\s+' +
-            r'<foxml:contentDigest[^>]*DIGEST="[0-9a-f]*"/>',
-            flags=re.MULTILINE|re.DOTALL),
-        # regex to remove checksums for all xml datastreams,
-        # for which Fedora historically has difficulty calculating reliable
-        # and repeatable checksums
-        'xml': re.compile(
-            r'(?P<dsversion><foxml:datastreamVersion[^>]*MIMETYPE="text/xml"[^>]*>)\s+' +
-            r'<foxml:contentDigest[^>]*DIGEST="[0-9a-f]*"/>',
-            flags=re.MULTILINE|re.DOTALL),
-        # regex to remove all datastream checksums, as a fallback for
-        # an object that can't be ingested due to checksum errors
-        'all': re.compile(r'(?P<digest><foxml:contentDigest[^>]+)DIGEST="[0-9a-f]*"\s*/>'),
-        # rels ext base64 encoded ocntent
-        'rels_encoded': re.compile(
-            r'<foxml:datastreamVersion ID="RELS-EXT.\d+"[^>]*>\s+' +
-            r'<foxml:contentDigest[^>]*DIGEST="[0-9a-f]*"/>\s+' +
-            r'<foxml:binaryContent>([^<]+)</foxml:binaryContent>',
-            flags=re.MULTILINE|re.DOTALL),
-    }
+Exports are spooled to temporary files and rewritten a piece at a time
+(see :mod:`keep.common.foxml`), so objects with large datastreams can be
+processed without loading the full export into memory.'''
+    help = __doc__
 
     def add_arguments(self, parser):
         parser.add_argument(
             'pids', nargs='+', metavar='PID',
             help='Specify one or more pids for objects to be updated')
         parser.add_argument(
-            '--checksum-cleanup', choices=['affected', 'xml', 'all'],
+            '--checksum-cleanup', choices=CHECKSUM_CLEANUP,
             default='xml',
             help='Datastream checksums to be removed before re-ingest. ' +
-                 '(affected: checksums for datastreams affected by pid change; '
+                 '(affected: checksums for datastreams affected by pid change '
+                 'and inline xml datastreams; '
                  'default: %(default)s)')
         parser.add_argument(
             '--no-purge', default=False, action='store_true',
             help='Disable automatic purge of old object even if validation ' +
                  'passes.')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of objects to process concurrently ' +
+                 '(default: %(default)s)')
+        parser.add_argument(
+            '--tmpdir',
+            help='Directory for temporary export files (default: system ' +
+                 'temporary directory); needs space for two copies of the ' +
+                 'largest export being processed by each worker')
 
     def handle(self, *args, **options):
         if pidman is None:
             raise CommandError("This script requires the PID manager client")
 
-        # use type-inferring repository
-        repo = TypeInferringRepository(username=settings.FEDORA_MANAGEMENT_USER,
-                                       password=settings.FEDORA_MANAGEMENT_PASSWORD)
-
-        for pid in options['pids']:
-            # initialize current object so we can determine type,
-            # and generate an appropriate Keep url
-
-            # NOTE: using type inferring repo to get arrangment *or*
-            # email content so each type is handled appropriately
-            obj = repo.get_object(pid)
-
-            # check that object exists and is an arrangement object
-            if not obj.exists:
-                self.stderr.write('Error: %s not found' % pid)
-                continue
-
-            obj_cmodels = [str(cmodel) for cmodel in obj.get_models()]
-
-            # check by content model instead of class, since could be
-            # email content or file content
-            if boda.Arrangement.ARRANGEMENT_CONTENT_MODEL not in \
-               obj_cmodels:
-                self.stderr.write('Error: %s is not an arrangement object' % pid)
-                continue
-
-            # explicitly do not convert mailbox objects, since we don't
-            # support generating premis for them (no content)
-            if boda.Mailbox.MAILBOX_CONTENT_MODEL in obj_cmodels:
-                self.stderr.write('Error: mailbox object %s is not supported' % pid)
-                continue
-
-            # skip anything without an original datastream (can't generate premis)
-            try:
-                obj.get_original_datastream()
-            except Exception:
-                self.stderr.write('Error: %s has no original datastream; not supported' % pid)
-                continue
-
-            # set flag so we can check for email messages
-            is_email = boda.EmailMessage.EMAIL_MESSAGE_CMODEL in obj_cmodels
-
-            # some email objects don't have a fedora object label, which is
-            # used to set the pid name; if email label is empty, use email
-            # label method to set it
-            if is_email and obj.label is None or obj.label == '':
-                obj.label = obj.email_label()
-
-            # todo use pidman client to search for pids in
-            # PIDMAN_RUSHDIE_DOMAIN with label PIDMAN_RUSHDIE_UNUSED
-            # if none, create a new one; if one is found,
-            # update it with object label and target
-
-            # get pid to use for the new object; either unused rushdie
-            # pid or a brand new pid; stores ark and ark uri in the metadata
+        self.options = options
+        # each worker thread uses its own repository connection
+        self._local = threading.local()
+        # pid lookup and update must be serialized, so that concurrent
+        # workers don't claim the same unused pid
+        self._pid_lock = threading.Lock()
+
+        failed = 0
+        for pid, result, err in pool_map(self.repidify, options['pids'],
+                                         options['workers']):
+            if err is not None:
+                self.stderr.write('Error re-ingesting %s: %s' % (pid, err))
+                failed += 1
+
+        if failed:
+            raise CommandError('%d of %d objects could not be re-ingested' %
+                               (failed, len(options['pids'])))
+
+    @property
+    def repo(self):
+        'Type-inferring repository for the current thread'
+        repo = getattr(self._local, 'repo', None)
+        if repo is None:
+            repo = TypeInferringRepository(username=settings.FEDORA_MANAGEMENT_USER,
+                                           password=settings.FEDORA_MANAGEMENT_PASSWORD)
+            self._local.repo = repo
+        return repo
+
+    def repidify(self, pid):
+        '''Re-ingest a single object with a new pid, validate the new
+        object against the old and purge the old one.'''
+        repo = self.repo
+        options = self.options
+
+        # initialize current object so we can determine type,
+        # and generate an appropriate Keep url
+
+        # NOTE: using type inferring repo to get arrangment *or*
+        # email content so each type is handled appropriately
+        obj = repo.get_object(pid)
+
+        # check that object exists and is an arrangement object
+        if not obj.exists:
+            self.stderr.write('Error: %s not found' % pid)
+            return
+
+        obj_cmodels = [str(cmodel) for cmodel in obj.get_models()]
+
+        # check by content model instead of class, since could be
+        # email content or file content
+        if boda.Arrangement.ARRANGEMENT_CONTENT_MODEL not in \
+           obj_cmodels:
+            self.stderr.write('Error: %s is not an arrangement object' % pid)
+            return
+
+        # explicitly do not convert mailbox objects, since we don't
+        # support generating premis for them (no content)
+        if boda.Mailbox.MAILBOX_CONTENT_MODEL in obj_cmodels:
+            self.stderr.write('Error: mailbox object %s is not supported' % pid)
+            return
+
+        # skip anything without an original datastream (can't generate premis)
+        try:
+            obj.get_original_datastream()
+        except Exception:
+            self.stderr.write('Error: %s has no original datastream; not supported' % pid)
+            return
+
+        # set flag so we can check for email messages
+        is_email = boda.EmailMessage.EMAIL_MESSAGE_CMODEL in obj_cmodels
+
+        # some email objects don't have a fedora object label, which is
+        # used to set the pid name; if email label is empty, use email
+        # label method to set it
+        if is_email and obj.label is None or obj.label == '':
+            obj.label = obj.email_label()
+
+        # get pid to use for the new object; either unused rushdie
+        # pid or a brand new pid; stores ark and ark uri in the metadata
+        with self._pid_lock:
             newpid = self.get_new_pid(obj)
 
-            # get the archival export of the object from fedora
-            response = repo.api.export(obj.pid, context='archive')
-            objexport = response.content
-
-            # if rels-ext content is base64 encoded, it needs to be
-            # decoded first so search and replacing the pid will work
-
-            # search and replace within the archive foxml to change
-            # every reference from the old pid to the new one
-            newpidobj = objexport.replace(obj.pid, newpid)
-
-            encoded_rels = self.dsre['rels_encoded'].findall(newpidobj)
-            for content in encoded_rels:
-                # decode the content
-                newcontent = base64.b64decode(content)
-                # replace old pid with new
-                newcontent = newcontent.replace(obj.pid, newpid)
-                # replace old encoded cntent with new encoded content
-                newpidobj = newpidobj.replace(content, base64.b64encode(newcontent))
+        # spool the archival export of the object from fedora to disk,
+        # then rewrite it to a second file, changing every reference
+        # from the old pid to the new one (including base64 encoded
+        # RELS-EXT content) and removing checksums as requested
+        with tempfile.TemporaryFile(dir=options['tmpdir']) as export, \
+             tempfile.TemporaryFile(dir=options['tmpdir']) as newpidobj:
+            response = repo.api.export(obj.pid, context='archive', stream=True)
+            spool_response(response, export)
+            export.seek(0)
+            rewrite_foxml(export, newpidobj, obj.pid, newpid,
+                          options['checksum_cleanup'])
 
             # NOTE: if problems come up with the import foxml,
-            # it may be useful to write it out to a tempfile for inspection
-            # import tempfile
-            # xmlfile = tempfile.NamedTemporaryFile(delete=False)
-            # xmlfile.write(newpidobj)
-            # xmlfile.close()
-            # print 'ingest content : ', xmlfile.name
-
-            # clean up checksums based on requested option
-            if options['checksum_cleanup'] == 'all':
-                newpidobj = self.dsre['all'].sub(r'', newpidobj)
-            else:
-                # if either xml or affected datastreams was requested,
-                # clean affected datastreams, since rels-ext will not
-                # be included by xml regex
-                newpidobj = self.dsre['dcrels'].sub(r'\g<dsversion>', newpidobj)
+            # use --tmpdir and a NamedTemporaryFile with delete=False
+            # to keep it for inspection
 
-                # if xml checksum removal was requested, run that also
-                if options['checksum_cleanup'] == 'xml':
-                    newpidobj = self.dsre['xml'] \
-                        .sub(r'\g<dsversion>', newpidobj)
-
-            # ingest the new version of the object
+            # ingest the new version of the object, streaming the
+            # rewritten export from disk
+            newpidobj.seek(0)
             try:
                 newpid = repo.ingest(newpidobj)
-                print 'Successfully re-ingested %s as %s' % (pid, newpid)
-                # init as same type of object as old
-                # newobj = repo.get_object(newpid, type=obj.__class__)
-                newobj = repo.get_object(newpid)
-
-                # for email objects, update mailbox reference to new pid
-                if is_email:
-                    # remove relation to old pid
-                    obj.mailbox.rels_ext.content.remove(
-                        (obj.mailbox.uriref, relsext.hasPart, obj.uriref))
-                    # and add relation to the new one
-                    obj.mailbox.rels_ext.content.add(
-                        (obj.mailbox.uriref, relsext.hasPart, newobj.uriref))
-                    obj.mailbox.save('Updating relation for identifier change %s -> %s' % \
-                        (obj.noid, newobj.noid))
-                    print 'Updated mailbox %s reference for new id %s' % \
-                        (obj.mailbox.noid, newobj.noid)
-
-                    # copy updated label if any before checking
-                    newobj.label = obj.label
-
-                # store ark and ark uri from in-memory old object before
-                # comparing, because comparison seems to replace model-based
-                # datastream object types with generic versions
-
-                ark = obj.mods.content.ark
-                ark_uri = obj.mods.content.ark_uri
-
-                # validate the new object before purging
-                errors = self.compare_objects(obj, newobj)
-                # if there are any errors, report and don't purge
-                if errors:
-                    print 'Error! object validation failed:'
-                    for key, val in errors.iteritems():
-                        print '%s\t%s' % (key, val)
-                else:
-                    # purge original unless no purge requested
-                    if options['no_purge']:
-                        print 'Validation succeeded for %s; not purging %s' % \
-                            (newobj.pid, obj.pid)
-                    else:
-                        purged = repo.purge_object(obj.pid)
-                        if purged:
-                            print 'Validation succeeded for %s; purged %s' % \
-                                (newobj.pid, obj.pid)
-                        else:
-                            print 'Validation succeeded for %s; error purging %s' % \
-                                (newobj.pid, obj.pid)
-
-                # re-init new objet to avoid any weirdness after comparison
-                newobj = repo.get_object(newpid)
-
-                # add ark to new object metadata using same logic as at ingest
-                # - if we have a mods datastream, store the ARK as mods:identifier
-                if hasattr(newobj, 'mods'):
-                    # store full uri and short-form ark
-                    newobj.mods.content.ark = ark
-                    newobj.mods.content.ark_uri = ark_uri
-                else:
-                    # otherwise, add full uri ARK to dc:identifier
-                    newobj.dc.content.identifier_list.append(ark_uri)
-
-                # add premis in order to document the identifier change
-                newobj.set_premis_object()
-                newobj.identifier_change_event(pid)
-                # generated premis should be valid, but double-check before
-                # saving invalid premis to fedora
-                if not newobj.provenance.content.is_valid():
-                    print 'Error! premis is not valid'
-                    print newobj.provenance.content.validation_errors()
-                else:
-                    newobj.save('Add premis with identifier change event; ' +
-                                'add ARK to descriptive metadata')
-
             except RequestFailed as err:
                 print 'Error ingesting %s as %s: %s' % (pid, newpid, err)
                 raise
 
+        print 'Successfully re-ingested %s as %s' % (pid, newpid)
+        # init as same type of object as old
+        # newobj = repo.get_object(newpid, type=obj.__class__)
+        newobj = repo.get_object(newpid)
+
+        # for email objects, update mailbox reference to new pid
+        if is_email:
+            # remove relation to old pid
+            obj.mailbox.rels_ext.content.remove(
+                (obj.mailbox.uriref, relsext.hasPart, obj.uriref))
+            # and add relation to the new one
+            obj.mailbox.rels_ext.content.add(
+                (obj.mailbox.uriref, relsext.hasPart, newobj.uriref))
+            obj.mailbox.save('Updating relation for identifier change %s -> %s' % \
+                (obj.noid, newobj.noid))
+            print 'Updated mailbox %s reference for new id %s' % \
+                (obj.mailbox.noid, newobj.noid)
+
+            # copy updated label if any before checking
+            newobj.label = obj.label
+
+        # store ark and ark uri from in-memory old object before
+        # comparing, because comparison seems to replace model-based
+        # datastream object types with generic versions
+
+        ark = obj.mods.content.ark
+        ark_uri = obj.mods.content.ark_uri
+
+        # validate the new object before purging
+        errors = self.compare_objects(obj, newobj)
+        # if there are any errors, report and don't purge
+        if errors:
+            print 'Error! object validation failed:'
+            for key, val in errors.iteritems():
+                print '%s\t%s' % (key, val)
+        else:
+            # purge original unless no purge requested
+            if options['no_purge']:
+                print 'Validation succeeded for %s; not purging %s' % \
+                    (newobj.pid, obj.pid)
+            else:
+                purged = repo.purge_object(obj.pid)
+                if purged:
+                    print 'Validation succeeded for %s; purged %s' % \
+                        (newobj.pid, obj.pid)
+                else:
+                    print 'Validation succeeded for %s; error purging %s' % \
+                        (newobj.pid, obj.pid)
+
+        # re-init new objet to avoid any weirdness after comparison
+        newobj = repo.get_object(newpid)
+
+        # add ark to new object metadata using same logic as at ingest
+        # - if we have a mods datastream, store the ARK as mods:identifier
+        if hasattr(newobj, 'mods'):
+            # store full uri and short-form ark
+            newobj.mods.content.ark = ark
+            newobj.mods.content.ark_uri = ark_uri
+        else:
+            # otherwise, add full uri ARK to dc:identifier
+            newobj.dc.content.identifier_list.append(ark_uri)
+
+        # add premis in order to document the identifier change
+        newobj.set_premis_object()
+        newobj.identifier_change_event(pid)
+        # generated premis should be valid, but double-check before
+        # saving invalid premis to fedora
+        if not newobj.provenance.content.is_valid():
+            print 'Error! premis is not valid'
+            print newobj.provenance.content.validation_errors()
+        else:
+            newobj.save('Add premis with identifier change event; ' +
+                        'add ARK to descriptive metadata')
+        return newpid
+
     def get_new_pid(self, obj):
         # TODO: first, make sure object label is set appropriately before
         # minting new pid or updating an existing one
@@ -97,6 +97,11 @@ class ArrangementObject(boda.Arrangement, ArkPidDigitalObject):
         'RELS-EXT': 'collection membership',  # TODO: revise when/if we add more relations
     }
 
+    partial_index_methods = dict(ArkPidDigitalObject.partial_index_methods, **{
+        'MODS': '_index_data_mods',
+        'Rights': '_index_data_rights',
+    })
+
     status_codes = {'processed': 'A', 'accessioned': 'I'}
     # map arrangement status to fedora object state
 
@@ -353,14 +358,7 @@ class ArrangementObject(boda.Arrangement, ArkPidDigitalObject):
         except Exception as e:
             logging.error("Error getting arrangement id or content MD5 for %s: %s" % self.pid, e)
 
-        # rights access status code
-        if self.rights.content.access_status:
-            data['access_code'] = self.rights.content.access_status.code
-            # normally this should be picked up via dc:rights, but arrangement
-            # objects don't seem to have DC fields populated
-            # NOTE: migrated items don't seem to have rights text set
-            if self.rights.content.access_status.text:
-                data['rights'] = self.rights.content.access_status.text
+        data.update(self._index_data_rights())
 
         # get simple collections that have an association with this object
         try:
@@ -383,6 +381,27 @@ class ArrangementObject(boda.Arrangement, ArkPidDigitalObject):
         if sc_labels:
             data["simpleCollection_label"] = sc_labels
 
+        # fields that are not set are not indexed
+        return dict((field, value) for field, value in data.iteritems()
+                    if value is not None)
+
+    # index data for individual datastreams, for use in full or partial
+    # index data; fields that are not set have a value of None
+
+    def _index_data_mods(self):
+        # MODS is not currently indexed for arrangement objects
+        return {}
+
+    def _index_data_rights(self):
+        data = {'access_code': None}
+        # rights access status code
+        if self.rights.content.access_status:
+            data['access_code'] = self.rights.content.access_status.code
+            # normally this should be picked up via dc:rights, but arrangement
+            # objects don't seem to have DC fields populated
+            # NOTE: migrated items don't seem to have rights text set
+            if self.rights.content.access_status.text:
+                data['rights'] = self.rights.content.access_status.text
         return data
 
     @staticmethod
@@ -518,6 +537,13 @@ class EmailMessage(boda.EmailMessage, ArrangementObject):
 
         return data
 
+    def partial_index_data(self, dsids):
+        # email label is generated from the message headers
+        data = super(EmailMessage, self).partial_index_data(dsids)
+        if data is not None:
+            data['label'] = self.email_label()
+        return data
+
     @property
     def content_md5(self):
         return self.mime_data.checksum
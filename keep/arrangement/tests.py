@@ -1,9 +1,12 @@
 from rdflib import URIRef
+from collections import defaultdict
 import logging
 import sys
 from mock import Mock, MagicMock, patch
 import os
+import shutil
 from sunburnt import sunburnt
+import tempfile
 
 from django.conf import settings
 from django.contrib.auth.models import Permission
@@ -19,13 +22,14 @@ from eulxml.xmlmap import cerp
 
 from keep import __version__
 from keep.arrangement.management.commands.migrate_rushdie import CONTENT_MODELS
-from keep.arrangement.management.commands import migrate_rushdie
+from keep.arrangement.management.commands import import_verdicts, migrate_rushdie
 from keep.arrangement.models import ArrangementObject, RushdieArrangementFile, \
      ACCESS_ALLOWED_CMODEL, ACCESS_RESTRICTED_CMODEL, EmailMessage, Mailbox
 from keep.collection.models import SimpleCollection, CollectionObject
 from keep.collection.fixtures import FedoraFixtures
+from keep.common.eadmap import SeriesTree
 from keep.common.fedora import Repository
-from keep.arrangement import forms as arrangementforms
+from keep.arrangement import forms as arrangementforms, mailboxes
 from keep.testutil import KeepTestCase, mocksolr_nodupes
 
 
@@ -198,6 +202,112 @@ class TestMigrateRushdie(TestCase):
         self.assertEqual(obj.mods.content.series.series.title, "Writings by Rushdie")
 
 
+class TestFolderMessages(TestCase):
+
+    messages = [
+        'From ???@??? Mon Jan 01 10:00:00 1996\nSubject: first\n\nhello\n',
+        'From ???@??? Tue Jan 02 11:00:00 1996\nSubject: second\n\nworld\n',
+    ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.mbox_path = os.path.join(self.tmpdir, 'In')
+        with open(self.mbox_path, 'wb') as mbox:
+            mbox.write(''.join(self.messages))
+        # toc index with offset and size for each message
+        self.toc_messages = []
+        offset = 0
+        for msg in self.messages:
+            self.toc_messages.append(Mock(offset=offset, size=len(msg)))
+            offset += len(msg)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @patch('keep.arrangement.mailboxes.redact_email', new=lambda data: data)
+    @patch('keep.arrangement.mailboxes.eudora')
+    def test_folder_messages(self, mockeudora):
+        mockeudora.Toc.return_value.messages = self.toc_messages
+        msgs = list(mailboxes.folder_messages(self.mbox_path, processes=1))
+        mockeudora.Toc.assert_called_with(self.mbox_path + '.toc')
+
+        self.assertEqual([0, 1], [m.order for m in msgs])
+        self.assertEqual(self.messages[1], msgs[1].data)
+        self.assertEqual('second', msgs[1].message['subject'])
+        self.assertEqual(mailboxes.message_checksum(msgs[0].message),
+                         msgs[0].checksum)
+
+
+class TestImportVerdicts(TestCase):
+
+    def setUp(self):
+        self.cmd = import_verdicts.Command()
+        self.cmd.verbosity = 0
+        self.cmd.stats = defaultdict(int)
+        self.cmd.by_checksum = {
+            'abc': [{'pid': 'arr:1'}],
+            'dup': [{'pid': 'arr:2', 'title': 'a'}, {'pid': 'arr:3', 'title': 'b'}],
+        }
+        self.cmd.by_arrangement_id = {
+            '001': [{'pid': 'arr:1'}],
+            '002': [{'pid': 'arr:2'}],
+            'msg-id': [{'pid': 'email:1'}],
+        }
+
+    @patch('keep.arrangement.management.commands.import_verdicts.solr_cursor')
+    @patch('keep.arrangement.management.commands.import_verdicts.solr_interface')
+    def test_load_index(self, mocksolr, mockcursor):
+        mockcursor.return_value = [
+            {'pid': 'arr:1', 'content_md5': 'abc', 'arrangement_id': '001'},
+            {'pid': 'arr:2', 'content_md5': 'abc'},
+        ]
+        self.cmd.load_index()
+        self.assertEqual(['arr:1', 'arr:2'],
+                         [r['pid'] for r in self.cmd.by_checksum['abc']])
+        self.assertEqual(['001'], self.cmd.by_arrangement_id.keys())
+
+    def test_match_arrangement(self):
+        self.assertEqual('arr:1',
+            self.cmd.match_arrangement({'id': '001', 'checksum': 'abc'}))
+        # no checksum - matched by arrangement id only
+        self.assertEqual('arr:2',
+            self.cmd.match_arrangement({'id': '002', 'checksum': ''}))
+        # duplicate checksum - skipped
+        self.assertEqual(None,
+            self.cmd.match_arrangement({'id': '002', 'checksum': 'dup'}))
+        self.assertEqual(1, self.cmd.stats['duplicate_checksum'])
+        # checksum and arrangement id do not agree - skipped
+        self.assertEqual(None,
+            self.cmd.match_arrangement({'id': '002', 'checksum': 'abc'}))
+        self.assertEqual(1, self.cmd.stats['mismatch'])
+        self.assertRaises(ObjectDoesNotExist, self.cmd.match_arrangement,
+                          {'id': '999', 'checksum': ''})
+
+    @patch('keep.arrangement.management.commands.import_verdicts.series_tree')
+    def test_load_series_subseries(self, mockseriestree):
+        tree = SeriesTree('rushdie1000')
+        writings = tree.add('rushdie1000_series2', 'Writings by Rushdie', 'series2')
+        tree.add('rushdie1000_subseries2.1', 'Fiction', 'subseries2.1', series=writings)
+        mockseriestree.return_value = tree
+        self.cmd.load_series_subseries()
+        self.assertEqual({'Writings by Rushdie': 'rushdie1000_series2',
+                          'Fiction': 'rushdie1000_subseries2.1'},
+                         self.cmd.series_by_name)
+        self.assertEqual('rushdie1000_series2',
+                         self.cmd.series_by_id['rushdie1000_subseries2.1']['series'])
+
+    def test_match_email(self):
+        self.assertEqual('arr:1',
+            self.cmd.match_email({'id': 'x', 'checksum': 'abc', 'path': 'In/foo'}))
+        # fall back to message id when checksum is not found
+        self.assertEqual('email:1',
+            self.cmd.match_email({'id': 'msg-id', 'checksum': 'def', 'path': 'In/foo'}))
+        self.assertRaises(MultipleObjectsReturned, self.cmd.match_email,
+                          {'id': 'x', 'checksum': 'dup', 'path': 'In/foo'})
+        self.assertEqual(None,
+            self.cmd.match_email({'id': 'x', 'checksum': 'abc', 'path': ''}))
+
+
 # mock solr used to avoid ingest failure to do pre-ingest duplicate checking
 @patch('keep.common.fedora.solr_interface', new=mocksolr_nodupes())
 class ArrangementViewsTest(KeepTestCase):
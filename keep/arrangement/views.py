@@ -1,7 +1,7 @@
 import json
 import logging
 
-from django.core.paginator import Paginator, EmptyPage, InvalidPage
+from django.core.paginator import EmptyPage, InvalidPage
 from django.core.urlresolvers import reverse
 from django.http import HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
@@ -18,10 +18,11 @@ from eulfedora.views import raw_datastream, raw_audit_trail
 
 from keep.common.fedora import Repository, history_view, \
      TypeInferringRepository
+from keep.common.paginator import SolrPaginator
 from keep.common.utils import solr_interface
 from keep.arrangement import forms as arrangementforms
 from keep.arrangement.models import ArrangementObject
-from keep.common.eadmap import Series
+from keep.common.eadmap import series_tree
 
 logger = logging.getLogger(__name__)
 
@@ -92,22 +93,9 @@ def edit(request, pid):
         else:
             raise
 
-    # Query for the finding aid information.
-    return_fields = ['eadid']
-    only_fields = ['id', 'did__unittitle', 'subseries', 'eadid']
-    search_fields = {'eadid': finding_aid_id}
-    queryset = Series.objects.also(*return_fields).only(*only_fields).filter(**search_fields)
-
-    # Builds an id and value dictionary for the jQuery autocomplete.
-    series_data = []
-    for series in queryset:
-        if(series.subseries):
-            for subseries in series.subseries:
-                series_data.append({'id': subseries.id, 'value': series.title + ": " + subseries.title})
-        else:
-            series_data.append({'id': series.id, 'value': series.title})
-
-    series_data = json.dumps(series_data)
+    # Builds an id and value dictionary for the jQuery autocomplete,
+    # using cached finding aid series information
+    series_data = json.dumps(series_tree(finding_aid_id).choices())
 
     return TemplateResponse(request, 'arrangement/edit.html',
                   {'obj': obj, 'form': form, 'series_data': series_data})
@@ -155,35 +143,32 @@ def get_selected_series_data(request, id):
         from.
     '''
 
-    # Query for the finding aid information.
-    return_fields = ['eadid']
-    only_fields = ['id', 'did__unittitle', 'subseries', 'eadid']
-    search_fields = {'eadid': finding_aid_id}
-    series_match_fields = {'id': id, 'subseries__id': id, 'subseries__subseries__id': id}
-    queryset = Series.objects.also(*return_fields).only(*only_fields).or_filter(**series_match_fields).filter(**search_fields)
+    # Look up the finding aid information in the cached series tree.
+    tree = series_tree(finding_aid_id)
+    selected = tree.by_id.get(id)
+    series = tree.parent(id)
 
     # Builds a JSON response of further data. A bit ugly currently.
     series_data = {}
-    for series in queryset:
-        if(series.subseries):
-            for subseries in series.subseries:
-                if(subseries.id == id):
-                    series_data['series1title'] = subseries.title
-                    series_data['series1uri'] = finding_aids_url + finding_aid_id + "/" + series.short_id + "/" + subseries.short_id
-                    series_data['series1ark'] = series.eadid.url
-                    series_data['series1fullid'] = subseries.id
-                    series_data['series1shortid'] = subseries.short_id
-                    series_data['series2title'] = series.title
-                    series_data['series2uri'] = finding_aids_url + finding_aid_id + "/" + series.short_id
-                    series_data['series2ark'] = series.eadid.url
-                    series_data['series2fullid'] = series.id
-                    series_data['series2shortid'] = series.short_id
-        else:
-            series_data['series1title'] = series.title
-            series_data['series1uri'] = finding_aids_url + finding_aid_id + "/" + series.short_id
-            series_data['series1ark'] = series.eadid.url
-            series_data['series1fullid'] = series.id
-            series_data['series1shortid'] = series.short_id
+    if series is not None:
+        # selected a subseries
+        series_data['series1title'] = selected['title']
+        series_data['series1uri'] = finding_aids_url + finding_aid_id + "/" + series['short_id'] + "/" + selected['short_id']
+        series_data['series1ark'] = tree.ark
+        series_data['series1fullid'] = selected['id']
+        series_data['series1shortid'] = selected['short_id']
+        series_data['series2title'] = series['title']
+        series_data['series2uri'] = finding_aids_url + finding_aid_id + "/" + series['short_id']
+        series_data['series2ark'] = tree.ark
+        series_data['series2fullid'] = series['id']
+        series_data['series2shortid'] = series['short_id']
+    elif selected is not None and not selected['subseries']:
+        # selected a series with no subseries
+        series_data['series1title'] = selected['title']
+        series_data['series1uri'] = finding_aids_url + finding_aid_id + "/" + selected['short_id']
+        series_data['series1ark'] = tree.ark
+        series_data['series1fullid'] = selected['id']
+        series_data['series1shortid'] = selected['short_id']
 
     series_data = json.dumps(series_data)
 
@@ -211,7 +196,7 @@ def view_item(request, pid):
         # use Solr to find paginated messages in this mailbox
         solr = solr_interface()
         q = solr.query(isPartOf=obj.uri)
-        paginator = Paginator(q, 30)
+        paginator = SolrPaginator(q, 30)
         try:
             page = int(request.GET.get('page', '1'))
         except ValueError:
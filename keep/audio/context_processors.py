@@ -1,7 +1,13 @@
+from django.utils.functional import SimpleLazyObject
+
 from keep.common.forms import ItemSearch
 
 def item_search(request):
     '''Template context processor: add the audio item search form
     (:class:`~keep.audio.forms.ItemSearch`) to context
-    so it can be used on any page (e.g., in the site sidebar).'''
-    return {'item_search': ItemSearch(prefix='audio')}
+    so it can be used on any page (e.g., in the site sidebar).
+
+    The form is only initialized if it is used when rendering the
+    page, since building the form requires a Solr query for simple
+    collection choices.'''
+    return {'item_search': SimpleLazyObject(lambda: ItemSearch(prefix='audio'))}
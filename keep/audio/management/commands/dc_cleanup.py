@@ -14,14 +14,11 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.core.paginator import Paginator
 from getpass import getpass
 from optparse import make_option
-from collections import defaultdict
-from eulfedora.server import Repository
 from keep.audio.models import AudioObject
+from keep.common.bulkedit import BulkEdit
 
 
 class Command(BaseCommand):
@@ -34,21 +31,24 @@ class Command(BaseCommand):
         make_option('--noact', '-n',
                     action='store_true',
                     default=False,
-                    help='Reports the pid(s) and total number of objects that would be processed but does not save anything.'),
+                    help='Reports the pid(s), DC changes, and total number of objects that would be processed but does not save anything.'),
         make_option('--username',
                     action='store',
                     help='Username of fedora user to connect as'),
         make_option('--password',
                     action='store',
                     help='Password for fedora user,  password=  will prompt for password'),
+        make_option('--workers',
+                    action='store', type='int',
+                    help='Number of objects to update concurrently'),
+        make_option('--checkpoint',
+                    action='store',
+                    help='Name to record progress under; rerunning with the same name skips objects already processed'),
         )
 
 
-    
-    def handle(self, *args, **options):
-        #counters
-        counts = defaultdict(int)
 
+    def handle(self, *args, **options):
         # check required options
         if not options['username']:
             raise CommandError('Username is required')
@@ -56,65 +56,44 @@ class Command(BaseCommand):
             if not options['password'] or options['password'] == '':
                 options['password'] = getpass()
 
-        #connection to repository
-        repo = Repository(username=options['username'], password=options['password'])
+        editor = BulkEdit(lambda obj: obj._update_dc(), type=AudioObject,
+                          datastreams=['dc'], log_message='cleanup DC',
+                          noact=options['noact'],
+                          checkpoint=options['checkpoint'],
+                          username=options['username'],
+                          password=options['password'],
+                          workers=options['workers'])
 
         try:
             #if pids specified, use that list
             if len(args) != 0:
                 pids = list(args)
-                pid_set = [repo.get_object(pid=p, type=AudioObject) for p in pids]
-
             else:
-                #search for Articles
-                pid_set = repo.get_objects_with_cmodel(AudioObject.AUDIO_CONTENT_MODEL, AudioObject)
-
+                #search for all audio objects
+                pids = editor.pids_from_query(content_model=AudioObject.AUDIO_CONTENT_MODEL)
         except Exception as e:
-            raise CommandError('Error gettings pids (%s)' % e.message)
-
-        try:
-            objects = Paginator(pid_set, 20)
-            counts['total'] = objects.count
-        except Exception as e:
-            self.output("Error paginating items: : %s " % (e.message))
+            raise CommandError('Error gettings pids (%s)' % e)
 
         #process all Objects
-        for p in objects.page_range:
-            try:
-                objs = objects.page(p).object_list
-            except Exception as e:
-                #print error and go to next iteration of loop
-                self.output("Error getting page: %s : %s " % (p, e.message))
-                counts['errors'] +=1
-                continue
-            for a in objs:
-                try:
-                    if not a.exists:
-                        self.output("Skipping %s because pid does not exist" % a.pid)
-                        counts['skipped'] +=1
-                        continue
-                    else:
-                        self.output("Processing %s" % a.pid)
-
-                        a._update_dc()
-
-                        # save object
-                        if not options['noact']:
-                            a.save("cleanup DC")
-                            self.output("SAVED %s" % a.pid)
-                            counts['saved'] +=1
-                        counts['processed'] +=1
-                except Exception as e:
-                    self.output("Error processing pid: %s : %s " % (a.pid, e.message))
-                    counts['errors'] +=1
+        for result in editor.run(pids):
+            if result.outcome == 'not found':
+                self.output("Skipping %s because pid does not exist" % result.pid)
+            elif result.outcome == 'error':
+                self.output("Error processing pid: %s : %s " % (result.pid, result.error))
+            elif result.outcome == 'updated':
+                self.output("%s %s" % ('CHANGED' if options['noact'] else 'SAVED',
+                                       result.pid))
+                if options['noact']:
+                    self.output(result.diff)
 
         # summarize what was done
+        counts = editor.stats
         self.stdout.write("\n\n")
         self.stdout.write("Total number selected: %s\n" % counts['total'])
-        self.stdout.write("Total number processed: %s\n" % counts['processed'])
-        self.stdout.write("Total number saved: %s\n" % counts['saved'])
-        self.stdout.write("Skipped: %s\n" % counts['skipped'])
-        self.stdout.write("Errors: %s\n" % counts['errors'])
+        self.stdout.write("Total number saved: %s\n" % (0 if options['noact'] else counts['updated']))
+        self.stdout.write("Unchanged: %s\n" % counts['unchanged'])
+        self.stdout.write("Skipped: %s\n" % (counts['not found'] + counts['skipped']))
+        self.stdout.write("Errors: %s\n" % counts['error'])
 
 
     def output(self, msg):
@@ -1,14 +1,17 @@
 from datetime import datetime
 from optparse import make_option
-import os
-from time import time
 
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from django.template.defaultfilters import filesizeformat
+
+from keep.common.staging import StagingJanitor
 
 class Command(BaseCommand):
-    '''Clean up any files uploaded for ingest older than a specified duration.
-Uses directory and file age configurations from django settings.  If minimal
+    '''Clean up any files uploaded for ingest older than a specified duration,
+along with expired temporary files in the ingest and large-file staging areas.
+Uses directory and file age configurations from django settings; see
+:mod:`keep.common.staging` for the content that is removed.  If minimal
 output is requested, only errors will be reported.
     '''
     help = __doc__
@@ -18,6 +21,9 @@ output is requested, only errors will be reported.
             dest='dryrun',
             action='store_true',
             help='''Report on what would be done, but don't delete any files'''),
+        make_option('--workers',
+            dest='workers', type='int',
+            help='Number of files and directories to check and remove concurrently'),
         )
 
     def handle(self, *args, **options):
@@ -30,55 +36,44 @@ output is requested, only errors will be reported.
             raise CommandError('INGEST_STAGING_TEMP_DIR setting is missing')
         if not hasattr(settings, 'INGEST_STAGING_KEEP_AGE'):
             raise CommandError('INGEST_STAGING_KEEP_AGE setting is missing')
-        
-        dir = settings.INGEST_STAGING_TEMP_DIR
-        max_age = settings.INGEST_STAGING_KEEP_AGE
 
-        if verbosity >= v_normal:
-            print "Cleaning up files in %s older than %s seconds" % (dir, max_age)
+        janitor = StagingJanitor(noact=options.get('dryrun', False),
+                                 workers=options.get('workers'))
 
-        # get a list of files for checking
-        try:
-            files = os.listdir(dir)
-        except OSError as e:
-            raise CommandError('Failure reading configured directory %s:\n%s' % \
-                               (dir, e))
+        if verbosity >= v_normal:
+            for area, dir, conventions in janitor.areas():
+                print "Cleaning up files in %s older than %s seconds" % (dir, janitor.keep_age)
 
-        # loop through any files and delete ones older than configured keep duration
-        errored = 0
-        removed = 0
-        for file in files:
-            filepath = os.path.join(dir, file)
-            try:
-                stat = os.stat(filepath)
-            except OSError as e:
-                errored += 1
+        for item in janitor.run():
+            if item.error is not None:
                 # display error message in any output verbosity level
-                print "Error reading file '%s' modification time: %s" % (file, e)
-                continue
+                print item.error
+            elif verbosity > v_normal:
+                # description for output messages
+                print "'%s' (%s, %s) last modified %s -- %s" % \
+                    (item.name, item.kind, filesizeformat(item.size),
+                     datetime.utcfromtimestamp(item.modified),
+                     'removing' if item.removed else 'not removing')
 
-            # description for output messages
-            file_lastmodified = "'%s' last modified %s" % (file,
-                                        datetime.utcfromtimestamp(stat.st_mtime))
-            # file modification time plus max age is older than the current time - delete
-            if stat.st_mtime + max_age < time():
-                if verbosity >= v_normal:
-                    print "%s -- removing" % file_lastmodified
-                if not options['dryrun']:
-                    try:
-                        os.unlink(filepath)
-                        removed += 1
-                    except OSError as e:
-                        # if there is a problem deleting a file, report but keep going                
-                        print "Error removing file '%s': %s" % (file, e)
-                        errored += 1
-            else:
-                if verbosity > v_normal:
-                    print "%s -- not removing" % file_lastmodified
+        ingest_stats = janitor.stats['ingest']
+        if ingest_stats['error'] is not None:
+            raise CommandError('Failure reading configured directory %s:\n%s' % \
+                               (settings.INGEST_STAGING_TEMP_DIR, ingest_stats['error']))
 
         # summarize what was done
         if verbosity >= v_normal:
-            print "%d file(s) checked" % len(files)
-            print "%d file(s) removed" % removed
-            print "%d error(s)" % errored
-
+            for area, stats in sorted(janitor.stats.iteritems()):
+                if stats['error'] is not None:
+                    print "Error reading %s: %s" % (stats['path'], stats['error'])
+                    continue
+                print "%s: %d file(s) checked (%s)" % \
+                    (stats['path'], stats['entries'], filesizeformat(stats['bytes']))
+                print "%d file(s) %sremoved, %s reclaimed" % \
+                    (stats['removed'], 'would be ' if options.get('dryrun') else '',
+                     filesizeformat(stats['reclaimed']))
+                for kind, kind_stats in sorted(stats['kinds'].iteritems()):
+                    print "  %s: %d removed (%s)" % \
+                        (kind, kind_stats['removed'], filesizeformat(kind_stats['reclaimed']))
+                print "%d error(s)" % stats['errors']
+                print "%s free of %s" % (filesizeformat(stats['free']),
+                                         filesizeformat(stats['total']))
@@ -17,7 +17,9 @@ from eulfedora.rdfns import relsext
 from eulfedora.util import RequestFailed
 from eulcm.xmlmap.boda import Rights
 from keep.collection.models import CollectionObject
+from keep.collection.tasks import indexed_collection, queue_researcher_content_update
 from keep.common.fedora import DigitalObject, Repository, LocalMODS
+from keep.common.fixity import fixity_index_data
 from keep.common.models import allow_researcher_access, _BaseDigitalTech, _BaseSourceTech, SourceTechMeasure, \
     TransferEngineer, CodecCreator
 
@@ -214,6 +216,10 @@ class AudioObject(DigitalObject):
 
     allowed_mimetypes = ['audio/x-wav', 'audio/wav']
 
+    #: file datastreams verified by periodic fixity checks; see
+    #: :mod:`keep.common.fixity`
+    fixity_datastreams = ['audio', 'compressed_audio']
+
     mods = XmlDatastream("MODS", "MODS Metadata", AudioMods, defaults={
             'control_group': 'M',
             'format': mods.MODS_NAMESPACE,
@@ -285,6 +291,13 @@ class AudioObject(DigitalObject):
     via `isMemberOfCollection` relation.
     '''
 
+    partial_index_methods = dict(DigitalObject.partial_index_methods, **{
+        'MODS': '_index_data_mods',
+        'Rights': '_index_data_rights',
+        'DigitalTech': '_index_data_digitaltech',
+        'SourceTech': '_index_data_sourcetech',
+    })
+
     @property
     def content_md5(self):
         return self.audio.checksum
@@ -307,7 +320,21 @@ class AudioObject(DigitalObject):
         if self.mods.isModified() and self.mods.content.title:
             self.label = self.mods.content.title
 
-        return super(AudioObject, self).save(logMessage)
+        # changes to rights, access copy, or collection may change whether
+        # the collection has content available to researchers
+        researcher_change = not self.exists or self.rights.isModified() or \
+            self.rels_ext.isModified() or self.compressed_audio.isModified()
+        previous_collection = None
+        if self.exists and self.rels_ext.isModified():
+            previous_collection = indexed_collection(self.pid)
+
+        saved = super(AudioObject, self).save(logMessage)
+
+        if researcher_change:
+            queue_researcher_content_update(self,
+                bool(self.researcher_access) and self.compressed_audio.exists,
+                previous_collection)
+        return saved
 
     @models.permalink
     def get_absolute_url(self):
@@ -415,61 +442,19 @@ class AudioObject(DigitalObject):
                 # pull parent & archive collection objects directly from fedora
                 parent = CollectionObject(self.api, self.collection.uri)
                 data['collection_label'] = parent.label
-                # NB: as of 2011-08-23, eulindexer doesn't support automatic
-                # reindexing of audio objects when their collection changes.
-                # as a result, archive_id and archive_label may be stale.
-                # disable indexing them until eulindexer supports those
-                # chained updates.
-                #data['archive_id'] = parent.collection_id
-                #archive = CollectionObject(self.api, parent.collection_id)
-                #data['archive_label'] = archive.label
+                # archive fields are denormalized so that items can be
+                # filtered by library without a solr join
+                data.update(parent._index_data_archive())
             except RequestFailed as rf:
                 logger.error('Error accessing collection or archive object in Fedora: %s' % rf)
 
-        # include resolvable ARK if available
-        if self.mods.content.ark_uri:
-            data['ark_uri'] = self.mods.content.ark_uri
-
-        # old identifiers from previous digital masters
-        dm1_ids = []
-        if self.mods.content.dm1_id:
-            dm1_ids.append(self.mods.content.dm1_id)
-        if self.mods.content.dm1_other_id:
-            dm1_ids.append(self.mods.content.dm1_other_id)
-        if dm1_ids:
-            data['dm1_id'] = dm1_ids
-
-        # digitization purpose, if not empty
-        if self.digitaltech.content.digitization_purpose_list:
-            # convert nodelist to a normal list that can be serialized as json
-            data['digitization_purpose'] = [dp for dp in self.digitaltech.content.digitization_purpose_list]
-
-        # related files
-        if self.sourcetech.content.related_files_list:
-            data['related_files'] = [rel for rel in self.sourcetech.content.related_files_list]
-
-        # part note
-        if self.mods.content.part_note and self.mods.content.part_note.text:
-            data['part'] = self.mods.content.part_note.text
-
-        # sublocation
-        if self.sourcetech.content.sublocation:
-            data['sublocation'] = self.sourcetech.content.sublocation
-
-        # rights access status code
-        if self.rights.content.access_status:
-            data['access_code'] = self.rights.content.access_status.code
-        # copyright date from rights metadata
-        if self.rights.content.copyright_date:
-            data['copyright_date'] = self.rights.content.copyright_date
-        # ip note from rights metadata
-        if self.rights.content.ip_note:
-            data['ip_note'] = self.rights.content.ip_note
+        data.update(self._index_data_mods())
+        data.update(self._index_data_rights())
+        data.update(self._index_data_digitaltech())
+        data.update(self._index_data_sourcetech())
 
         # boolean values that should always be available
         data.update({
-            # should this item be accessible to researchers?
-            'researcher_access': bool(self.researcher_access),  # if None, we want False
             # flags to indicate which datastreams are available
             'has_access_copy': self.compressed_audio.exists,
             'has_original': self.audio.exists,
@@ -480,23 +465,76 @@ class AudioObject(DigitalObject):
                 'access_copy_size': self.compressed_audio.size,
                 'access_copy_mimetype': self.compressed_audio.mimetype,
         })
-        if self.digitaltech.content.duration:
-            data['duration'] = self.digitaltech.content.duration
-
-        if self.mods.content.origin_info and \
-           self.mods.content.origin_info.issued \
-                and not self.mods.content.origin_info.issued.is_empty():
-            data['date_issued'] = [unicode(di) for di in self.mods.content.origin_info.issued]
-        if self.mods.content.origin_info and \
-           self.mods.content.origin_info.created \
-                and not self.mods.content.origin_info.created.is_empty():
-            data['date_created'] = [unicode(di) for di in self.mods.content.origin_info.created]
 
         if self.audio.exists:
-            data['content_md5'] = self.audio.checksum
-
+            data.update({
+                'content_md5': self.audio.checksum,
+                # master file size and type, for reporting
+                'content_size': self.audio.size,
+                'content_mimetype': self.audio.mimetype,
+            })
+
+        data.update(fixity_index_data(self.pid))
+
+        # fields that are not set are not indexed
+        return dict((field, value) for field, value in data.iteritems()
+                    if value is not None)
+
+    # index data for individual datastreams, for use in full or partial
+    # index data; fields that are not set have a value of None
+
+    def _index_data_mods(self):
+        mods = self.mods.content
+        data = {
+            # include resolvable ARK if available
+            'ark_uri': mods.ark_uri or None,
+            # old identifiers from previous digital masters
+            'dm1_id': [dm1 for dm1 in [mods.dm1_id, mods.dm1_other_id] if dm1] or None,
+            'part': None,
+            'date_issued': None,
+            'date_created': None,
+        }
+        # part note
+        if mods.part_note and mods.part_note.text:
+            data['part'] = mods.part_note.text
+        if mods.origin_info and mods.origin_info.issued \
+                and not mods.origin_info.issued.is_empty():
+            data['date_issued'] = [unicode(di) for di in mods.origin_info.issued]
+        if mods.origin_info and mods.origin_info.created \
+                and not mods.origin_info.created.is_empty():
+            data['date_created'] = [unicode(di) for di in mods.origin_info.created]
         return data
 
+    def _index_data_rights(self):
+        rights = self.rights.content
+        return {
+            # rights access status code
+            'access_code': rights.access_status.code if rights.access_status else None,
+            # copyright date and ip note from rights metadata
+            'copyright_date': rights.copyright_date or None,
+            'ip_note': rights.ip_note or None,
+            # should this item be accessible to researchers?
+            'researcher_access': bool(self.researcher_access),  # if None, we want False
+        }
+
+    def _index_data_digitaltech(self):
+        digitaltech = self.digitaltech.content
+        return {
+            # convert nodelist to a normal list that can be serialized as json
+            'digitization_purpose': list(digitaltech.digitization_purpose_list) or None,
+            'duration': digitaltech.duration or None,
+            'codec_quality': digitaltech.codec_quality or None,
+            'codec_software': (digitaltech.codec_creator.software or None)
+                              if digitaltech.codec_creator else None,
+        }
+
+    def _index_data_sourcetech(self):
+        sourcetech = self.sourcetech.content
+        return {
+            'related_files': list(sourcetech.related_files_list) or None,
+            'sublocation': sourcetech.sublocation or None,
+        }
+
     @staticmethod
     def init_from_file(filename, initial_label=None, request=None, checksum=None,
         mimetype=None):
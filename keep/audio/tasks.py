@@ -6,6 +6,7 @@ import subprocess
 import tempfile
 import traceback
 from celery import shared_task
+from celery.exceptions import Retry
 from pymediainfo import MediaInfo
 
 from django.conf import settings
@@ -13,13 +14,15 @@ from eulcommon.djangoextras.taskresult.models import TaskResult
 
 from keep.audio.models import AudioObject, check_wav_mp3_duration
 from keep.common.fedora import Repository
+from keep.common.instrumentation import stage
+from keep.common.scratch import ScratchSpaceTask
 from keep.file.utils import md5sum
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task
-def convert_wav_to_mp3(pid, use_wav=None, remove_wav=False):
+@shared_task(bind=True, base=ScratchSpaceTask)
+def convert_wav_to_mp3(self, pid, use_wav=None, remove_wav=False):
     """Generate an mp3 file from a wav file associated with an
     :class:`~keep.audio.models.AudioObject`.  When conversion is successful,
     save the generated file as the compressed audio datastream of the AudioObject
@@ -37,12 +40,15 @@ def convert_wav_to_mp3(pid, use_wav=None, remove_wav=False):
 
     This function currently stores all temporary files in the ingest staging
     directory configured in django settings (to make cleanup easier, and since
-    this task will normally be part of the ingest process).
+    this task will normally be part of the ingest process).  Space for the
+    temporary files is reserved before conversion starts, and the task is
+    deferred if there is not enough; see :mod:`keep.common.scratch`.
     """
     try:
         #Initialize temporary file names.
         mp3_file_path = None
         wav_file_path = None
+        reservation = None
 
         #Initialize repo and get the object for this pid.
         repo = Repository()
@@ -54,6 +60,12 @@ def convert_wav_to_mp3(pid, use_wav=None, remove_wav=False):
         if not os.path.exists(tempdir):
             os.makedirs(tempdir)
 
+        # reserve space for the downloaded wav and the generated mp3;
+        # a wav that was passed in is already in the staging area
+        wav_size = obj.audio.size
+        reservation = self.reserve_scratch('ingest', wav_size,
+            staged=wav_size if use_wav is not None else 0)
+
         if use_wav != None:
             wav_file_path = use_wav
             mp3_file_path = wav_file_path + ".mp3"
@@ -71,8 +83,9 @@ def convert_wav_to_mp3(pid, use_wav=None, remove_wav=False):
                 raise
 
             try:
-                for data in  obj.audio.get_chunked_content():
-                    destination.write(data)
+                with stage('download'):
+                    for data in  obj.audio.get_chunked_content():
+                        destination.write(data)
             except Exception as e:
                 logger.error("Error downloading master audio file for conversion: %s" % e)
                 logger.debug("Stack trace for download error:\n" + traceback.format_exc())
@@ -83,7 +96,8 @@ def convert_wav_to_mp3(pid, use_wav=None, remove_wav=False):
 
         # TODO: check file size against datastream? os.path.getsize(path)
 
-        calculated_checksum = md5sum(wav_file_path)
+        with stage('checksum'):
+            calculated_checksum = md5sum(wav_file_path)
         if obj.audio.checksum != calculated_checksum:
             raise Exception("Checksum for local audio file %s does not match Fedora datastream checksum %s" % \
                 (calculated_checksum, obj.audio.checksum))
@@ -94,12 +108,13 @@ def convert_wav_to_mp3(pid, use_wav=None, remove_wav=False):
 
         # NOTE: might be cleaner to call with subprocess.check_call
 
-        process = subprocess.Popen(['ffmpeg', '-y', '-i', wav_file_path, mp3_file_path],
-                stdout=subprocess.PIPE, preexec_fn=os.setsid, stdin=subprocess.PIPE,
-                stderr=subprocess.PIPE)
+        with stage('convert'):
+            process = subprocess.Popen(['ffmpeg', '-y', '-i', wav_file_path, mp3_file_path],
+                    stdout=subprocess.PIPE, preexec_fn=os.setsid, stdin=subprocess.PIPE,
+                    stderr=subprocess.PIPE)
 
-        # returns a tuple of stdout, stderr. The output of the FFMPEG goes to stderr.
-        stdout_output, stderr_output = process.communicate()
+            # returns a tuple of stdout, stderr. The output of the FFMPEG goes to stderr.
+            stdout_output, stderr_output = process.communicate()
         # Return code of the process.
         return_code = process.returncode
 
@@ -110,7 +125,7 @@ def convert_wav_to_mp3(pid, use_wav=None, remove_wav=False):
                 logger.error("Failed to convert audio file (duration of wav and mp3 did not match) for %s " % pid)
                 raise Exception("Error generating MP3 (duration of wav and mp3 did not match)")
 
-            with open(mp3_file_path) as f:
+            with open(mp3_file_path) as f, stage('save'):
                 obj.compressed_audio.content = f
                 obj.compressed_audio.checksum = md5sum(mp3_file_path)
                 obj.compressed_audio.label = obj.audio.label
@@ -126,6 +141,9 @@ def convert_wav_to_mp3(pid, use_wav=None, remove_wav=False):
         logger.error("FFMPEG output: %s" % stderr_output)
         raise Exception("Failed to convert audio (FFMPEG failed): %s" % stderr_output)
 
+    # task deferred for lack of staging space; not a conversion error
+    except Retry:
+        raise
     # General exception catch for logging.
     # possible more specific exceptions:
     # OSError - file open/write error
@@ -156,6 +174,9 @@ def convert_wav_to_mp3(pid, use_wav=None, remove_wav=False):
                 # log the exception but don't raise it - not a conversion error to report to user
                 logger.error("Error removing mp3 file %s: %s" % (mp3_file_path, e))
 
+        if reservation is not None:
+            reservation.release()
+
 
 def queue_access_copy(obj, **extra_convert_args):
     task = convert_wav_to_mp3.delay(obj.pid, **extra_convert_args)
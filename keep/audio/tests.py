@@ -1652,6 +1652,9 @@ class TestAudioObject(KeepTestCase):
         mockmss = Mock(CollectionObject)
         mockmss.label = 'mss collection'
         mockmss.collection_id = 'archive:pid'
+        mockmss._index_data_archive.return_value = {
+            'archive_id': 'archive:pid', 'archive_label': 'MARBL',
+            'archive_short_name': 'MARBL'}
         mockarchive = Mock(CollectionObject)
         mockarchive.label = 'MARBL'
 
@@ -1683,10 +1686,11 @@ class TestAudioObject(KeepTestCase):
                              'parent collection object id should be set in index data')
             self.assertEqual(mockmss.label, desc_data['collection_label'],
                           'parent collection object label should be set in index data')
-            # NB: as of 2011-08-23, eulindexer doesn't support automatic
-            # reindexing of audio objects when their collection changes. as a
-            # result, archive_id and archive_label may be stale. disable
-            # indexing them until eulindexer supports those chained updates.
+            # archive fields are denormalized from the parent collection
+            self.assertEqual('archive:pid', desc_data['archive_id'],
+                             'archive id should be set in index data from parent collection')
+            self.assertEqual('MARBL', desc_data['archive_label'],
+                             'archive label should be set in index data from parent collection')
             # check CollectionObject use
             # get all args for collection object initializations
             args, kwargs = mockcollobj.call_args
@@ -1798,10 +1802,44 @@ class TestAudioObject(KeepTestCase):
         with patch.object(obj, 'audio') as mockaudio:
             mockaudio.exists = True
             mockaudio.checksum = 'test audio MD5'
+            mockaudio.size = 40960
+            mockaudio.mimetype = 'audio/x-wav'
+            obj.digitaltech.content.codec_quality = 'lossless'
             desc_data = obj.index_data()
             self.assertEqual(True, desc_data['has_original'],
                              'has_original should be true when object has original audio datastream')
             self.assertEqual(mockaudio.checksum, desc_data['content_md5'])
+            self.assertEqual(mockaudio.size, desc_data['content_size'],
+                             'content_size should match original audio datastream size')
+            self.assertEqual(mockaudio.mimetype, desc_data['content_mimetype'],
+                             'content_mimetype should match original audio datastream mimetype')
+            self.assertEqual('lossless', desc_data['codec_quality'],
+                             'codec_quality should match digitaltech codec quality')
+
+    def test_partial_index_data(self):
+        obj = self.repo.get_object(type=audiomodels.AudioObject)
+        obj.pid = 'foo:1'
+        obj.label = 'audio item'
+        obj.dc.content.title = 'audio item'
+        obj.rights.content.create_access_status()
+        obj.rights.content.access_status.code = '8'
+
+        data = obj.partial_index_data(['Rights', 'DC'])
+        self.assertEqual('audio item', data['label'])
+        self.assertEqual(['audio item'], data['title'])
+        self.assertEqual('8', data['access_code'])
+        self.assertEqual(obj.researcher_access, data['researcher_access'])
+        # fields not set should be cleared in the index
+        self.assertEqual(None, data['ip_note'])
+        self.assertEqual(None, data['subject'])
+        # fields for unmodified datastreams should not be included
+        self.assert_('dm1_id' not in data)
+        self.assert_('collection_id' not in data)
+        self.assert_(json.dumps(data))
+
+        # datastreams that affect other index data require a full reindex
+        self.assertEqual(None, obj.partial_index_data(['Rights', 'RELS-EXT']))
+        self.assertEqual(None, obj.partial_index_data(['CompressedAudio']))
 
     def test_file_checksum(self):
         #This is just a sanity check that eulfedora is working as expected with checksums.
@@ -0,0 +1,10 @@
+'''
+Offline benchmarks for performance-sensitive Keep code paths.
+
+Benchmarks run against local stand-ins for Fedora
+(:class:`keep.benchmarks.fedora.FakeFedora`) and Solr
+(:class:`keep.benchmarks.solr.FakeSolr`) with configurable latency, so
+that changes can be compared on a development machine without access to
+the production services.  Run them with the ``benchmark`` management
+command; see :mod:`keep.benchmarks.suite` for the list of benchmarks.
+'''
@@ -0,0 +1,408 @@
+'''
+In-memory stand-in for the Fedora Commons 3.x REST API.
+
+Implements the subset of the REST API used by :mod:`eulfedora` for
+ingesting, loading, and updating objects and datastreams, so that Keep
+code can be benchmarked without a Fedora server.  Content is kept in
+memory, so corpora should be sized accordingly.  Resource index (risearch)
+queries return empty results.
+'''
+from datetime import datetime, timedelta
+import hashlib
+import threading
+
+from dateutil.tz import tzutc
+from lxml import etree
+
+from eulfedora.util import datetime_to_fedoratime
+from eulfedora.xml import FEDORA_ACCESS_NS, FEDORA_MANAGE_NS, FEDORA_AUDIT_NS
+
+from keep.benchmarks.standin import StandIn, Response, multipart_file
+
+
+FOXML_NS = 'info:fedora/fedora-system:def/foxml#'
+MODEL_NS = 'info:fedora/fedora-system:def/model#'
+FOXML = '{%s}' % FOXML_NS
+
+
+class FakeDatastream(object):
+    '''A single datastream, with only the current version content.'''
+
+    def __init__(self, dsid, control_group='M', label='', mimetype='',
+                 versionable=True, format=None, state='A'):
+        self.dsid = dsid
+        self.control_group = control_group
+        self.label = label
+        self.mimetype = mimetype
+        self.versionable = versionable
+        self.format = format
+        self.state = state
+        self.content = ''
+        self.checksum_type = 'MD5'
+        self.checksum = None
+        self.created = None
+        self.versions = 0
+
+    def set_content(self, content, created, checksum_type=None, checksum=None):
+        '''Update content; raises ValueError on a checksum mismatch.'''
+        if checksum_type:
+            self.checksum_type = checksum_type
+        self.content = content
+        if self.checksum_type == 'DISABLED':
+            self.checksum = 'none'
+        else:
+            digest = hashlib.new(self.checksum_type.replace('-', '').lower(), content)
+            if checksum and checksum.lower() != digest.hexdigest():
+                raise ValueError('Checksum Mismatch: %s' % checksum)
+            self.checksum = digest.hexdigest()
+        self.created = created
+        self.versions += 1
+
+
+class FakeObject(object):
+
+    def __init__(self, pid, label='', owner='', state='A', created=None):
+        self.pid = pid
+        self.label = label
+        self.owner = owner
+        self.state = state
+        self.created = created
+        self.modified = created
+        self.datastreams = {}
+        #: audit trail records as tuples of action, dsid, user, date, message
+        self.audit = []
+
+
+class FakeFedora(StandIn):
+    '''Fedora REST API stand-in.  Objects can be loaded by ingesting
+    them with :mod:`eulfedora` as usual.
+
+    :param latency: seconds added to every response
+    :param pidspace: pidspace for pids generated by ``nextPID``
+    '''
+    base_path = 'fedora'
+
+    def __init__(self, latency=0, pidspace='benchmark'):
+        super(FakeFedora, self).__init__(latency=latency)
+        self.pidspace = pidspace
+        self.objects = {}
+        self.uploads = {}
+        self._next_pid = 0
+        self._last_time = None
+        self._lock = threading.RLock()
+
+    def now(self):
+        # fedora modification times must be unique, at millisecond precision
+        with self._lock:
+            now = datetime.now(tzutc()).replace(microsecond=0)
+            if self._last_time is not None and now <= self._last_time:
+                now = self._last_time + timedelta(milliseconds=1)
+            self._last_time = now
+            return now
+
+    # responses
+
+    @staticmethod
+    def xml(root, status=200):
+        return Response(status, 'text/xml',
+            etree.tostring(root, xml_declaration=True, encoding='UTF-8'))
+
+    @staticmethod
+    def text(text, status=200):
+        return Response(status, 'text/plain', text)
+
+    @staticmethod
+    def not_found(msg='Not Found'):
+        return Response(404, 'text/plain', msg)
+
+    def handle(self, request):
+        parts = request.path.split('/')
+        params = dict((key, vals[-1]) for key, vals in request.params.iteritems())
+        with self._lock:
+            if parts[0] == 'upload' and request.method == 'POST':
+                return self.upload(request)
+            if parts[0] == 'risearch':
+                return self.risearch(params)
+            if parts[0] == 'describe':
+                return self.describe()
+            if parts[0] != 'objects':
+                return self.not_found()
+            if len(parts) == 1:
+                return self.find_objects()
+            if parts[1] == 'nextPID':
+                return self.next_pid(params)
+            if parts[1] == 'new' or (len(parts) == 2 and request.method == 'POST'):
+                return self.ingest(request, params)
+
+            obj = self.objects.get(parts[1])
+            if obj is None:
+                return self.not_found('Object not found in low-level storage: %s' % parts[1])
+            if len(parts) == 2:
+                if request.method == 'PUT':
+                    return self.modify_object(obj, params)
+                if request.method == 'DELETE':
+                    del self.objects[obj.pid]
+                    return self.text(datetime_to_fedoratime(self.now()))
+                return self.object_profile(obj)
+            if parts[2] == 'objectXML':
+                return self.object_xml(obj)
+            if parts[2] == 'versions':
+                return self.object_history(obj)
+            if parts[2] == 'relationships':
+                return Response(200, 'application/rdf+xml',
+                                obj.datastreams['RELS-EXT'].content
+                                if 'RELS-EXT' in obj.datastreams else '')
+            if parts[2] != 'datastreams':
+                return self.not_found()
+            if len(parts) == 3:
+                return self.list_datastreams(obj)
+            return self.datastream(request, params, obj, parts[3], parts[4:])
+
+    def upload(self, request):
+        content = multipart_file(request)
+        upload_id = 'uploaded://%d' % (len(self.uploads) + 1)
+        self.uploads[upload_id] = content or ''
+        return self.text(upload_id, status=202)
+
+    def next_pid(self, params):
+        root = etree.Element('{%s}pidList' % FEDORA_MANAGE_NS, nsmap={None: FEDORA_MANAGE_NS})
+        for i in range(int(params.get('numPIDs', 1))):
+            self._next_pid += 1
+            etree.SubElement(root, '{%s}pid' % FEDORA_MANAGE_NS).text = \
+                '%s:%d' % (params.get('namespace', self.pidspace), self._next_pid)
+        return self.xml(root)
+
+    def ingest(self, request, params):
+        doc = etree.fromstring(request.body)
+        pid = doc.get('PID')
+        if not pid:
+            self._next_pid += 1
+            pid = '%s:%d' % (self.pidspace, self._next_pid)
+        if pid in self.objects:
+            return self.text('The PID %s already exists in the registry' % pid, status=500)
+
+        props = dict((prop.get('NAME'), prop.get('VALUE')) for prop in
+                     doc.iterfind('%sobjectProperties/%sproperty' % (FOXML, FOXML)))
+        created = self.now()
+        obj = FakeObject(pid, label=props.get(MODEL_NS + 'label', ''),
+                         owner=props.get(MODEL_NS + 'ownerId', ''),
+                         state=props.get(MODEL_NS + 'state', 'A'), created=created)
+        try:
+            for dsnode in doc.iterfind(FOXML + 'datastream'):
+                version = dsnode.find(FOXML + 'datastreamVersion')
+                ds = FakeDatastream(dsnode.get('ID'), control_group=dsnode.get('CONTROL_GROUP'),
+                    label=version.get('LABEL', ''), mimetype=version.get('MIMETYPE', ''),
+                    versionable=dsnode.get('VERSIONABLE') != 'false',
+                    format=version.get('FORMAT_URI'), state=dsnode.get('STATE', 'A'))
+                digest = version.find(FOXML + 'contentDigest')
+                ds.set_content(self._foxml_content(version), created,
+                    checksum_type=digest.get('TYPE') if digest is not None else None,
+                    checksum=digest.get('DIGEST') if digest is not None else None)
+                obj.datastreams[ds.dsid] = ds
+        except ValueError as err:
+            return self.text(unicode(err), status=500)
+
+        obj.audit.append(('ingest', '', self._user(request), created,
+                          params.get('logMessage', '')))
+        self.objects[pid] = obj
+        return self.text(pid, status=201)
+
+    def _foxml_content(self, version):
+        xml_content = version.find(FOXML + 'xmlContent')
+        if xml_content is not None and len(xml_content):
+            return etree.tostring(xml_content[0], encoding='UTF-8')
+        location = version.find(FOXML + 'contentLocation')
+        if location is not None:
+            return self._location_content(location.get('REF'))
+        return ''
+
+    def _location_content(self, location):
+        if location in self.uploads:
+            return self.uploads.pop(location)
+        if location.startswith('file://'):
+            with open(location[len('file://'):]) as locfile:
+                return locfile.read()
+        return ''
+
+    def _user(self, request):
+        auth = request.headers.get('authorization', '')
+        if auth.startswith('Basic '):
+            return auth[len('Basic '):].decode('base64').split(':')[0]
+        return 'fedoraAdmin'
+
+    def modify_object(self, obj, params):
+        obj.label = params.get('label', obj.label)
+        obj.owner = params.get('ownerId', obj.owner)
+        obj.state = params.get('state', obj.state)
+        obj.modified = self.now()
+        return self.text(datetime_to_fedoratime(obj.modified))
+
+    def object_profile(self, obj):
+        E = lambda tag, text=None: self._element(FEDORA_ACCESS_NS, tag, text)
+        root = E('objectProfile')
+        root.set('pid', obj.pid)
+        for tag, value in [('objLabel', obj.label), ('objOwnerId', obj.owner),
+                           ('objCreateDate', datetime_to_fedoratime(obj.created)),
+                           ('objLastModDate', datetime_to_fedoratime(obj.modified)),
+                           ('objState', obj.state)]:
+            root.append(E(tag, value))
+        return self.xml(root)
+
+    def object_history(self, obj):
+        root = self._element(FEDORA_ACCESS_NS, 'fedoraObjectHistory')
+        root.set('pid', obj.pid)
+        for record in obj.audit:
+            root.append(self._element(FEDORA_ACCESS_NS, 'objectChangeDate',
+                                      datetime_to_fedoratime(record[3])))
+        return self.xml(root)
+
+    def object_xml(self, obj):
+        nsmap = {'foxml': FOXML_NS, 'audit': FEDORA_AUDIT_NS}
+        root = etree.Element(FOXML + 'digitalObject', nsmap=nsmap)
+        root.set('PID', obj.pid)
+        ds = etree.SubElement(root, FOXML + 'datastream', ID='AUDIT', CONTROL_GROUP='X')
+        version = etree.SubElement(ds, FOXML + 'datastreamVersion', ID='AUDIT.0')
+        content = etree.SubElement(version, FOXML + 'xmlContent')
+        trail = etree.SubElement(content, '{%s}auditTrail' % FEDORA_AUDIT_NS)
+        for i, (action, dsid, user, date, message) in enumerate(obj.audit):
+            record = etree.SubElement(trail, '{%s}record' % FEDORA_AUDIT_NS, ID='AUDREC%d' % (i + 1))
+            process = etree.SubElement(record, '{%s}process' % FEDORA_AUDIT_NS)
+            process.set('type', 'Fedora API-M')
+            for tag, value in [('action', action), ('componentID', dsid),
+                               ('responsibility', user),
+                               ('date', datetime_to_fedoratime(date)),
+                               ('justification', message)]:
+                etree.SubElement(record, '{%s}%s' % (FEDORA_AUDIT_NS, tag)).text = value
+        for dsid, dsobj in sorted(obj.datastreams.iteritems()):
+            dsnode = etree.SubElement(root, FOXML + 'datastream', ID=dsid,
+                                      CONTROL_GROUP=dsobj.control_group)
+            version = etree.SubElement(dsnode, FOXML + 'datastreamVersion',
+                                       ID='%s.%d' % (dsid, dsobj.versions - 1),
+                                       MIMETYPE=dsobj.mimetype)
+            etree.SubElement(version, FOXML + 'contentDigest',
+                             TYPE=dsobj.checksum_type, DIGEST=dsobj.checksum or '')
+        return self.xml(root)
+
+    def list_datastreams(self, obj):
+        root = self._element(FEDORA_ACCESS_NS, 'objectDatastreams')
+        root.set('pid', obj.pid)
+        for dsid, ds in sorted(obj.datastreams.iteritems()):
+            node = self._element(FEDORA_ACCESS_NS, 'datastream')
+            node.set('dsid', dsid)
+            node.set('label', ds.label)
+            node.set('mimeType', ds.mimetype)
+            root.append(node)
+        return self.xml(root)
+
+    def datastream(self, request, params, obj, dsid, rest):
+        ds = obj.datastreams.get(dsid)
+        if rest == ['content']:
+            if ds is None:
+                return self.not_found()
+            return Response(200, ds.mimetype or 'application/octet-stream', ds.content)
+        if rest == ['history']:
+            if ds is None:
+                return self.not_found()
+            root = self._element(FEDORA_MANAGE_NS, 'datastreamHistory')
+            root.set('pid', obj.pid)
+            root.set('dsID', dsid)
+            root.append(self._datastream_profile(ds))
+            return self.xml(root)
+
+        if request.method == 'DELETE':
+            obj.datastreams.pop(dsid, None)
+            return self.text('[]')
+        if request.method in ('POST', 'PUT'):
+            if request.method == 'POST':
+                if ds is not None:
+                    return self.text('Datastream %s already exists' % dsid, status=500)
+                ds = FakeDatastream(dsid, control_group=params.get('controlGroup', 'M'))
+            elif ds is None:
+                return self.not_found()
+            return self.save_datastream(request, params, obj, ds)
+        if ds is None:
+            return self.not_found()
+        profile = self._datastream_profile(ds)
+        if params.get('validateChecksum') == 'true':
+            profile.append(self._element(FEDORA_MANAGE_NS, 'dsChecksumValid', 'true'))
+        return self.xml(profile)
+
+    def save_datastream(self, request, params, obj, ds):
+        ds.label = params.get('dsLabel', ds.label)
+        ds.mimetype = params.get('mimeType', ds.mimetype)
+        ds.format = params.get('formatURI', ds.format)
+        ds.state = params.get('dsState', ds.state)
+        if 'versionable' in params:
+            ds.versionable = params['versionable'].lower() == 'true'
+
+        content = multipart_file(request)
+        if content is None and request.body:
+            content = request.body
+        if content is None and 'dsLocation' in params:
+            content = self._location_content(params['dsLocation'])
+        date = self.now()
+        try:
+            if content is not None:
+                ds.set_content(content, date, checksum_type=params.get('checksumType'),
+                               checksum=params.get('checksum'))
+            elif ds.created is None:
+                ds.set_content('', date, checksum_type=params.get('checksumType'))
+        except ValueError as err:
+            return self.text(unicode(err), status=500)
+
+        new = ds.dsid not in obj.datastreams
+        obj.datastreams[ds.dsid] = ds
+        obj.modified = date
+        if new:
+            action = 'addDatastream'
+        elif ds.control_group == 'X':
+            action = 'modifyDatastreamByValue'
+        else:
+            action = 'modifyDatastreamByReference'
+        obj.audit.append((action, ds.dsid, self._user(request), date,
+                          params.get('logMessage', '')))
+        profile = self._datastream_profile(ds)
+        return self.xml(profile, status=201 if new else 200)
+
+    def _datastream_profile(self, ds):
+        E = lambda tag, text=None: self._element(FEDORA_MANAGE_NS, tag, text)
+        root = E('datastreamProfile')
+        root.set('dsID', ds.dsid)
+        for tag, value in [('dsLabel', ds.label),
+                           ('dsVersionID', '%s.%d' % (ds.dsid, ds.versions - 1)),
+                           ('dsCreateDate', datetime_to_fedoratime(ds.created)),
+                           ('dsState', ds.state), ('dsMIME', ds.mimetype),
+                           ('dsFormatURI', ds.format or ''),
+                           ('dsControlGroup', ds.control_group),
+                           ('dsSize', str(len(ds.content))),
+                           ('dsVersionable', 'true' if ds.versionable else 'false'),
+                           ('dsChecksumType', ds.checksum_type),
+                           ('dsChecksum', ds.checksum or 'none')]:
+            root.append(E(tag, value))
+        return root
+
+    def find_objects(self):
+        root = self._element('http://www.fedora.info/definitions/1/0/types/', 'result')
+        return self.xml(root)
+
+    def risearch(self, params):
+        # the resource index is not implemented; return empty results
+        fmt = params.get('format', '')
+        if fmt == 'count':
+            return self.text('0')
+        if fmt == 'CSV':
+            return self.text('')
+        return Response(200, 'text/plain', '')
+
+    def describe(self):
+        root = self._element(FEDORA_ACCESS_NS, 'fedoraRepository')
+        root.append(self._element(FEDORA_ACCESS_NS, 'repositoryName', 'Benchmark Fedora'))
+        root.append(self._element(FEDORA_ACCESS_NS, 'repositoryVersion', '3.8.1'))
+        return self.xml(root)
+
+    @staticmethod
+    def _element(ns, tag, text=None):
+        el = etree.Element('{%s}%s' % (ns, tag), nsmap={None: ns})
+        if text is not None:
+            el.text = text
+        return el
@@ -0,0 +1,867 @@
+'''
+In-memory stand-in for a Solr 4 core using Keep's ``solr/schema.xml``.
+
+Implements the parts of the select and update handlers used by Keep
+through :mod:`sunburnt` and :mod:`keep.common.utils`: standard Lucene
+query syntax (boolean operators, fielded terms, phrases, ranges, and
+wildcards), filter queries, sorting, field lists, start/rows and
+cursorMark paging, field facets, result grouping, and XML updates
+(including atomic updates and delete by id or query).  Documents are
+kept in an inverted index by field, so query cost grows with the number
+of matching documents and distinct terms rather than with a full scan of
+the corpus.  Text analysis is simplified to lower-cased word tokens (no
+stemming, stop words, or synonyms) and all matches score the same, so
+result order without an explicit sort is index order.  Updates are
+visible immediately, as with the short auto-commit Keep is configured
+with.
+'''
+from collections import defaultdict
+from datetime import datetime
+import itertools
+import re
+import threading
+import time
+
+from dateutil.parser import parse as parse_date
+from lxml import etree
+
+from keep.benchmarks.standin import StandIn, Response
+
+
+class Field(object):
+    '''Schema information for a single field.
+
+    :param kind: one of ``string``, ``text``, ``int``, ``long``,
+        ``float``, ``double``, ``bool``, or ``date``
+    '''
+
+    def __init__(self, name, kind, stored=True, multi=False):
+        self.name = name
+        self.kind = kind
+        self.stored = stored
+        self.multi = multi
+
+    def convert(self, value):
+        'Convert a value from an update or a query to the stored type.'
+        if self.kind in ('int', 'long'):
+            return int(value)
+        if self.kind in ('float', 'double'):
+            return float(value)
+        if self.kind == 'bool':
+            return unicode(value).lower() == 'true'
+        if self.kind == 'date':
+            return format_date(value)
+        return unicode(value)
+
+    def terms(self, value):
+        '''Indexed terms for a stored value: lower-cased word tokens for
+        text fields and the value itself for everything else.'''
+        if self.kind == 'text':
+            return tokenize(value)
+        return [value]
+
+    def display(self, term):
+        'Format an indexed term as Solr does, e.g. in facet counts.'
+        if self.kind == 'bool':
+            return 'true' if term else 'false'
+        return unicode(term)
+
+
+# field type classes used in the schema, by kind
+_type_kinds = {
+    'solr.StrField': 'string',
+    'solr.TextField': 'text',
+    'solr.BoolField': 'bool',
+    'solr.TrieIntField': 'int',
+    'solr.TrieLongField': 'long',
+    'solr.TrieFloatField': 'float',
+    'solr.TrieDoubleField': 'double',
+    'solr.TrieDateField': 'date',
+}
+
+# element names used to return values of each kind
+_value_tags = {
+    'string': 'str', 'text': 'str', 'bool': 'bool', 'int': 'int',
+    'long': 'long', 'float': 'float', 'double': 'double', 'date': 'date'
+}
+
+
+class Schema(object):
+    '''Fields, dynamic fields, and copy fields from a Solr schema.'''
+
+    def __init__(self, path):
+        doc = etree.parse(path)
+        kinds = dict((ftype.get('name'), _type_kinds.get(ftype.get('class'), 'string'))
+                     for ftype in doc.iter('fieldType'))
+        make_field = lambda node: Field(node.get('name'), kinds[node.get('type')],
+                                        stored=node.get('stored') != 'false',
+                                        multi=node.get('multiValued') == 'true')
+        self.fields = dict((node.get('name'), make_field(node))
+                           for node in doc.iter('field'))
+        # longest patterns take precedence, as in solr
+        self.dynamic_fields = sorted([make_field(node) for node in doc.iter('dynamicField')],
+                                     key=lambda f: -len(f.name))
+        self.copy_fields = defaultdict(list)
+        for node in doc.iter('copyField'):
+            self.copy_fields[node.get('source')].append(node.get('dest'))
+        self.unique_key = doc.findtext('uniqueKey')
+        self.default_field = doc.findtext('defaultSearchField') or 'text'
+
+    def field(self, name):
+        if name not in self.fields:
+            for dynamic in self.dynamic_fields:
+                pattern = dynamic.name
+                if (pattern.startswith('*') and name.endswith(pattern[1:])) or \
+                   (pattern.endswith('*') and name.startswith(pattern[:-1])):
+                    self.fields[name] = Field(name, dynamic.kind, stored=dynamic.stored,
+                                              multi=dynamic.multi)
+                    break
+            else:
+                raise ValueError('undefined field %s' % name)
+        return self.fields[name]
+
+
+def tokenize(value):
+    'Simplified text analysis: lower-cased word tokens.'
+    return re.findall(r'\w+', unicode(value).lower(), re.UNICODE)
+
+
+def format_date(value):
+    '''Format a date value as Solr returns it (UTC, ISO 8601 with a
+    trailing Z and milliseconds only when non-zero).'''
+    if isinstance(value, basestring):
+        value = value.strip()
+        if value.upper().startswith('NOW'):
+            value = datetime.utcnow()
+        else:
+            value = parse_date(value.rstrip('Z'))
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None) - value.utcoffset()
+    millis = value.microsecond // 1000
+    formatted = value.strftime('%Y-%m-%dT%H:%M:%S')
+    if millis:
+        formatted += '.%03d' % millis
+    return formatted + 'Z'
+
+
+def _date_key(value):
+    # fixed-width version of a formatted date, for comparisons
+    return value[:-1] + '.000' if len(value) == 20 else value[:-1]
+
+
+# lucene query parsing
+
+#: query clause occurrence
+MUST, SHOULD, MUST_NOT = '+', '', '-'
+
+_special = set('+-&|!(){}[]^"~*?:\\/ \t\r\n')
+
+
+class QueryParser(object):
+    '''Recursive descent parser for Lucene query syntax, as generated by
+    :mod:`sunburnt`.  Produces a tree of tuples:
+
+    * ``('all',)`` for ``*:*``
+    * ``('term', field, text, phrase)``
+    * ``('wildcard', field, pattern)``
+    * ``('range', field, low, high, include_low, include_high)``, with
+      None for an open bound
+    * ``('bool', [(occur, node), ...])``
+
+    Local parameters (e.g., ``{!tag=x}``) are skipped.  Fields are None
+    when a term should be searched in the default field.
+    '''
+
+    def __init__(self, query):
+        self.query = query
+        self.pos = 0
+
+    @classmethod
+    def parse(cls, query):
+        parser = cls(query)
+        parser.skip_local_params()
+        node = parser.parse_clauses()
+        parser.skip_space()
+        if parser.pos < len(parser.query):
+            raise ValueError('unexpected %r at %d in %r' % (
+                parser.query[parser.pos], parser.pos, query))
+        return node
+
+    def peek(self, length=1):
+        return self.query[self.pos:self.pos + length]
+
+    def skip_space(self):
+        while self.pos < len(self.query) and self.query[self.pos].isspace():
+            self.pos += 1
+
+    def skip_local_params(self):
+        self.skip_space()
+        if self.peek(2) == '{!':
+            end = self.query.index('}', self.pos)
+            self.pos = end + 1
+
+    def keyword(self, word):
+        # boolean operators must be followed by a space or parenthesis
+        end = self.pos + len(word)
+        if self.query[self.pos:end] == word and \
+           (end >= len(self.query) or self.query[end].isspace() or self.query[end] == '('):
+            self.pos = end
+            return True
+        return False
+
+    def parse_clauses(self):
+        clauses = []
+        conjunction = None
+        while True:
+            self.skip_space()
+            if self.pos >= len(self.query) or self.peek() == ')':
+                break
+            if self.keyword('AND') or self.peek(2) == '&&':
+                if self.peek(2) == '&&':
+                    self.pos += 2
+                conjunction = 'AND'
+                # AND makes the preceding clause required
+                if clauses and clauses[-1][0] == SHOULD:
+                    clauses[-1] = (MUST, clauses[-1][1])
+                continue
+            if self.keyword('OR') or self.peek(2) == '||':
+                if self.peek(2) == '||':
+                    self.pos += 2
+                conjunction = 'OR'
+                continue
+
+            occur = SHOULD
+            if self.keyword('NOT') or self.peek() == '!':
+                if self.peek() == '!':
+                    self.pos += 1
+                occur = MUST_NOT
+            elif self.peek() in ('+', '-'):
+                occur = self.peek()
+                self.pos += 1
+            elif conjunction == 'AND':
+                occur = MUST
+            self.skip_space()
+            clauses.append((occur, self.parse_clause()))
+            conjunction = None
+
+        if len(clauses) == 1 and clauses[0][0] in (SHOULD, MUST):
+            return clauses[0][1]
+        return ('bool', clauses)
+
+    def parse_clause(self):
+        if self.peek() == '(':
+            return self.parse_group(None)
+        # field name, unless the term is followed by something other than a colon
+        start = self.pos
+        field = self.read_term()
+        if self.peek() == ':' and field:
+            self.pos += 1
+            field = unescape(field)
+            if field == '*' and self.peek() == '*':
+                self.pos += 1
+                return ('all',)
+            return self.parse_value(field)
+        self.pos = start
+        return self.parse_value(None)
+
+    def parse_group(self, field):
+        self.pos += 1
+        node = self.parse_clauses()
+        if self.peek() != ')':
+            raise ValueError('unbalanced parentheses in %r' % self.query)
+        self.pos += 1
+        self.skip_boost()
+        if field is not None:
+            node = _with_field(node, field)
+        return node
+
+    def parse_value(self, field):
+        char = self.peek()
+        if char == '(':
+            return self.parse_group(field)
+        if char == '"':
+            end = self.pos + 1
+            while end < len(self.query) and self.query[end] != '"':
+                end += 2 if self.query[end] == '\\' else 1
+            text = unescape(self.query[self.pos + 1:end])
+            self.pos = end + 1
+            self.skip_boost()
+            return ('term', field, text, True)
+        if char in ('[', '{'):
+            return self.parse_range(field)
+
+        raw = self.read_term()
+        if not raw:
+            raise ValueError('expected a term at %d in %r' % (self.pos, self.query))
+        self.skip_boost()
+        if re.search(r'(?<!\\)[*?]', raw):
+            return ('wildcard', field, raw)
+        return ('term', field, unescape(raw), False)
+
+    def parse_range(self, field):
+        include_low = self.peek() == '['
+        end = self.pos + 1
+        while end < len(self.query) and self.query[end] not in (']', '}'):
+            end += 2 if self.query[end] == '\\' else 1
+        bounds = re.split(r'\s+TO\s+', self.query[self.pos + 1:end].strip(), 1)
+        if end >= len(self.query) or len(bounds) != 2:
+            raise ValueError('invalid range at %d in %r' % (self.pos, self.query))
+        include_high = self.query[end] == ']'
+        self.pos = end + 1
+        low, high = bounds
+        bound = lambda val: None if val == '*' else unescape(val.strip('"'))
+        return ('range', field, bound(low), bound(high), include_low, include_high)
+
+    def read_term(self):
+        start = self.pos
+        while self.pos < len(self.query):
+            char = self.query[self.pos]
+            if char == '\\':
+                self.pos += 2
+                continue
+            if char in _special and char not in ('*', '?', '-', '+', '/') or \
+               (char in ('-', '+') and self.pos == start):
+                break
+            self.pos += 1
+        return self.query[start:self.pos]
+
+    def skip_boost(self):
+        if self.peek() in ('^', '~'):
+            self.pos += 1
+            while self.pos < len(self.query) and \
+                  (self.query[self.pos].isdigit() or self.query[self.pos] == '.'):
+                self.pos += 1
+
+
+def unescape(text):
+    return re.sub(r'\\(.)', r'\1', text)
+
+
+def _with_field(node, field):
+    # apply a field to unfielded terms in a group, e.g. field:(a OR b)
+    if node[0] == 'bool':
+        return ('bool', [(occur, _with_field(child, field)) for occur, child in node[1]])
+    if node[0] != 'all' and node[1] is None:
+        return (node[0], field) + node[2:]
+    return node
+
+
+def _wildcard_regex(pattern):
+    parts = []
+    for match in re.finditer(r'\\(.)|(\*)|(\?)|(.)', pattern, re.DOTALL):
+        escaped, star, question, char = match.groups()
+        if star:
+            parts.append('.*')
+        elif question:
+            parts.append('.')
+        else:
+            parts.append(re.escape(escaped or char))
+    return re.compile(''.join(parts) + r'\Z', re.DOTALL)
+
+
+class Index(object):
+    '''Inverted index of documents, with query evaluation.
+
+    :param schema: :class:`Schema`
+    '''
+
+    def __init__(self, schema):
+        self.schema = schema
+        #: stored documents by internal id, as dictionaries of value lists
+        self.docs = {}
+        #: internal id by unique key
+        self.ids = {}
+        #: field -> term -> set of internal ids
+        self.terms = defaultdict(lambda: defaultdict(set))
+        #: field -> set of internal ids with any value
+        self.has_field = defaultdict(set)
+        # internal id -> field -> token lists, for phrase matching
+        self.tokens = {}
+        # internal id -> field -> terms, for removal and sorting
+        self.doc_terms = {}
+        self._next_id = itertools.count()
+        self._version = itertools.count(int(time.time() * 1000) << 20)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc):
+        '''Add or replace a document.
+
+        :param doc: dictionary of field names and lists of values
+        '''
+        key = self.schema.unique_key
+        values = {}
+        for name, vals in doc.iteritems():
+            field = self.schema.field(name)
+            values[name] = [field.convert(val) for val in vals]
+        if not values.get(key):
+            raise ValueError('Document is missing mandatory uniqueKey field: %s' % key)
+        values['_version_'] = [next(self._version)]
+        if 'timestamp' not in values:
+            values['timestamp'] = [format_date(datetime.utcnow())]
+        self.delete(values[key][0])
+
+        docid = next(self._next_id)
+        self.ids[values[key][0]] = docid
+        self.docs[docid] = dict((name, vals) for name, vals in values.iteritems()
+                                if self.schema.field(name).stored)
+        indexed = defaultdict(list)
+        for name, vals in values.iteritems():
+            indexed[name].extend(vals)
+            for dest in self.schema.copy_fields.get(name, []):
+                indexed[dest].extend(self.schema.field(dest).convert(val) for val in vals)
+        self.tokens[docid] = {}
+        self.doc_terms[docid] = {}
+        for name, vals in indexed.iteritems():
+            field = self.schema.field(name)
+            terms = []
+            for val in vals:
+                val_terms = field.terms(val)
+                if field.kind == 'text':
+                    self.tokens[docid].setdefault(name, []).append(val_terms)
+                terms.extend(val_terms)
+            for term in terms:
+                self.terms[name][term].add(docid)
+            if vals:
+                self.has_field[name].add(docid)
+            self.doc_terms[docid][name] = terms
+        return docid
+
+    def get(self, key):
+        docid = self.ids.get(key)
+        return self.docs[docid] if docid is not None else None
+
+    def delete(self, key):
+        docid = self.ids.pop(key, None)
+        if docid is not None:
+            self._remove(docid)
+
+    def delete_query(self, query):
+        for docid in self.search(QueryParser.parse(query)):
+            del self.ids[self.docs[docid][self.schema.unique_key][0]]
+            self._remove(docid)
+
+    def _remove(self, docid):
+        for name, terms in self.doc_terms.pop(docid).iteritems():
+            for term in terms:
+                self.terms[name][term].discard(docid)
+                if not self.terms[name][term]:
+                    del self.terms[name][term]
+            self.has_field[name].discard(docid)
+        del self.docs[docid]
+        del self.tokens[docid]
+
+    def all(self):
+        return set(self.docs)
+
+    def search(self, node):
+        'Set of internal ids for documents matching a parsed query.'
+        kind = node[0]
+        if kind == 'all':
+            return self.all()
+        if kind == 'bool':
+            return self._search_bool(node[1])
+        field = self.schema.field(node[1] or self.schema.default_field)
+        if kind == 'term':
+            return self._search_term(field, node[2], node[3])
+        if kind == 'wildcard':
+            return self._search_wildcard(field, node[2])
+        return self._search_range(field, *node[2:])
+
+    def _search_bool(self, clauses):
+        must = [self.search(node) for occur, node in clauses if occur == MUST]
+        should = [self.search(node) for occur, node in clauses if occur == SHOULD]
+        must_not = [self.search(node) for occur, node in clauses if occur == MUST_NOT]
+        if must:
+            result = set.intersection(*must)
+        elif should:
+            result = set.union(*should)
+        else:
+            # purely negative queries match everything else
+            result = self.all()
+        for exclude in must_not:
+            result -= exclude
+        return result
+
+    def _search_term(self, field, text, phrase):
+        terms = self.terms[field.name]
+        if field.kind != 'text':
+            if text == '*':
+                return set(self.has_field[field.name])
+            try:
+                term = field.convert(text)
+            except ValueError:
+                return set()
+            return set(terms.get(term, ()))
+
+        tokens = tokenize(text)
+        if not tokens:
+            return set()
+        result = set.intersection(*[set(terms.get(token, ())) for token in tokens])
+        if len(tokens) > 1:
+            result = set(docid for docid in result
+                         if self._has_phrase(docid, field.name, tokens))
+        return result
+
+    def _has_phrase(self, docid, name, tokens):
+        for value_tokens in self.tokens[docid].get(name, []):
+            for i in range(len(value_tokens) - len(tokens) + 1):
+                if value_tokens[i:i + len(tokens)] == tokens:
+                    return True
+        return False
+
+    def _search_wildcard(self, field, pattern):
+        if pattern == '*':
+            return set(self.has_field[field.name])
+        if field.kind == 'text':
+            pattern = pattern.lower()
+        regex = _wildcard_regex(pattern)
+        result = set()
+        for term, docids in self.terms[field.name].iteritems():
+            if regex.match(unicode(term)):
+                result |= docids
+        return result
+
+    def _search_range(self, field, low, high, include_low, include_high):
+        if low is None and high is None:
+            return set(self.has_field[field.name])
+        key = self._sort_key(field)
+        if field.kind == 'text':
+            convert = lambda val: val.lower()
+        else:
+            convert = field.convert
+        low = key(convert(low)) if low is not None else None
+        high = key(convert(high)) if high is not None else None
+        result = set()
+        for term, docids in self.terms[field.name].iteritems():
+            term = key(term)
+            if low is not None and (term < low or (term == low and not include_low)):
+                continue
+            if high is not None and (term > high or (term == high and not include_high)):
+                continue
+            result |= docids
+        return result
+
+    @staticmethod
+    def _sort_key(field):
+        return _date_key if field.kind == 'date' else (lambda term: term)
+
+    def sort(self, docids, sort):
+        '''Sort internal ids by a Solr sort specification, e.g.
+        ``title_exact asc,pid desc``.  Missing values sort last; ties
+        are in index order.'''
+        result = sorted(docids)
+        specs = [spec.split() for spec in sort.split(',') if spec.strip()] if sort else []
+        for name, direction in reversed(specs):
+            if name == 'score':
+                continue
+            field = self.schema.field(name)
+            key = self._sort_key(field)
+            present = [docid for docid in result if self.doc_terms[docid].get(name)]
+            missing = [docid for docid in result if not self.doc_terms[docid].get(name)]
+            present.sort(key=lambda docid: key(self.doc_terms[docid][name][0]),
+                         reverse=direction.lower() == 'desc')
+            result = present + missing
+        return result
+
+    def facet(self, name, docids, mincount=0, prefix=None):
+        '''Counts of documents for each term in a field, within a set of
+        internal ids.
+
+        :returns: list of tuples of term and count, in index order
+        '''
+        field = self.schema.field(name)
+        counts = []
+        for term, term_docids in self.terms[name].iteritems():
+            display = field.display(term)
+            if prefix and not display.startswith(prefix):
+                continue
+            count = len(term_docids & docids)
+            if count >= mincount:
+                counts.append((term, display, count))
+        key = self._sort_key(field)
+        counts.sort(key=lambda item: key(item[0]))
+        return [(d, c) for _t, d, c in counts]
+
+
+class FakeSolr(StandIn):
+    '''Solr stand-in for a single core.
+
+    :param schema: path to the Solr schema
+    :param latency: seconds added to every response
+    :param doc_latency: additional seconds per matching document, to
+        approximate the cost of collecting, faceting, and sorting large
+        result sets
+    '''
+    base_path = 'solr'
+
+    def __init__(self, schema, latency=0, doc_latency=0):
+        super(FakeSolr, self).__init__(latency=latency)
+        self.index = Index(Schema(schema))
+        self.schema_path = schema
+        self.doc_latency = doc_latency
+        self._lock = threading.RLock()
+
+    def add(self, doc):
+        '''Add a document directly, without an update request.
+
+        :param doc: dictionary of field values; values may be single
+            values or lists
+        '''
+        with self._lock:
+            self.index.add(dict((name, val if isinstance(val, (list, tuple, set)) else [val])
+                                for name, val in doc.iteritems() if val is not None))
+
+    def handle(self, request):
+        parts = request.path.split('/')
+        if parts[-1] == 'select':
+            with self._lock:
+                return self.select(request.params)
+        if parts[-1] == 'update':
+            with self._lock:
+                return self.update(request.body)
+        if parts[-2:] == ['admin', 'file']:
+            with open(self.schema_path) as schema:
+                return Response(200, 'text/xml', schema.read())
+        if parts[-2:] == ['admin', 'ping']:
+            return self.xml(self.response_header({}))
+        return Response(404, 'text/plain', 'Not Found')
+
+    @staticmethod
+    def xml(root, status=200):
+        return Response(status, 'application/xml; charset=UTF-8',
+            etree.tostring(root, xml_declaration=True, encoding='UTF-8'))
+
+    def error(self, message, status=400):
+        root = self.response_header({}, status=status)
+        err = etree.SubElement(root, 'lst', name='error')
+        etree.SubElement(err, 'str', name='msg').text = message
+        etree.SubElement(err, 'int', name='code').text = str(status)
+        return self.xml(root, status=status)
+
+    def response_header(self, params, status=0, start=None):
+        root = etree.Element('response')
+        header = etree.SubElement(root, 'lst', name='responseHeader')
+        etree.SubElement(header, 'int', name='status').text = str(status)
+        elapsed = int((time.time() - start) * 1000) if start else 0
+        etree.SubElement(header, 'int', name='QTime').text = str(elapsed)
+        param_node = etree.SubElement(header, 'lst', name='params')
+        for name, vals in sorted(params.iteritems()):
+            if len(vals) == 1:
+                etree.SubElement(param_node, 'str', name=name).text = vals[0]
+            else:
+                arr = etree.SubElement(param_node, 'arr', name=name)
+                for val in vals:
+                    etree.SubElement(arr, 'str').text = val
+        return root
+
+    # select
+
+    def select(self, params):
+        started = time.time()
+        param = lambda name, default=None: params.get(name, [default])[-1]
+        try:
+            query = param('q') or '*:*'
+            docids = self.index.search(QueryParser.parse(query))
+            # filter queries, with tags for facet exclusions
+            filters = []
+            for fq in params.get('fq', []):
+                tags = set(re.findall(r'tag=([\w,]+)', fq.split('}')[0])[0].split(',')) \
+                       if fq.startswith('{!') and 'tag=' in fq else set()
+                filters.append((tags, self.index.search(QueryParser.parse(fq))))
+            for tags, fq_docids in filters:
+                docids = docids & fq_docids
+            sort = param('sort')
+            ordered = self.index.sort(docids, sort)
+        except ValueError as err:
+            return self.error(unicode(err))
+
+        start = int(param('start', 0) or 0)
+        rows = int(param('rows', 10))
+        cursor = param('cursorMark')
+        if cursor is not None:
+            if not sort or self.index.schema.unique_key not in \
+               [spec.split()[0] for spec in sort.split(',')]:
+                return self.error('Cursor functionality requires a sort containing '
+                                  'a uniqueKey field tie breaker')
+            start = 0 if cursor == '*' else int(cursor.decode('base64'))
+
+        root = self.response_header(params, start=started)
+        if param('group') == 'true':
+            self.grouped_results(root, params, ordered, start, rows)
+        else:
+            page = ordered[start:start + rows]
+            result = etree.SubElement(root, 'result', name='response',
+                                      numFound=str(len(ordered)), start=str(start))
+            self.add_docs(result, page, param('fl'))
+            if cursor is not None:
+                next_cursor = ('%d' % (start + len(page))).encode('base64').strip() \
+                              if page else cursor
+                etree.SubElement(root, 'str', name='nextCursorMark').text = next_cursor
+
+        if param('facet') == 'true':
+            self.facet_counts(root, params, docids, filters)
+
+        if self.doc_latency:
+            time.sleep(self.doc_latency * len(docids))
+        return self.xml(root)
+
+    def grouped_results(self, root, params, ordered, start, rows):
+        param = lambda name, default=None: params.get(name, [default])[-1]
+        name = param('group.field')
+        limit = int(param('group.limit', 1))
+        group_sort = param('group.sort')
+        groups = []
+        by_value = {}
+        for docid in ordered:
+            values = self.index.doc_terms[docid].get(name) or [None]
+            if values[0] not in by_value:
+                by_value[values[0]] = []
+                groups.append((values[0], by_value[values[0]]))
+            by_value[values[0]].append(docid)
+        if group_sort:
+            groups = [(value, self.index.sort(docids, group_sort)) for value, docids in groups]
+
+        grouped = etree.SubElement(root, 'lst', name='grouped')
+        group_node = etree.SubElement(grouped, 'lst', name=name)
+        etree.SubElement(group_node, 'int', name='matches').text = str(len(ordered))
+        if param('group.ngroups') == 'true':
+            etree.SubElement(group_node, 'int', name='ngroups').text = str(len(groups))
+        if param('group.format', 'grouped') == 'simple' or param('group.main') == 'true':
+            flat = [docid for value, docids in groups for docid in docids[:limit]]
+            parent = root if param('group.main') == 'true' else group_node
+            if parent is root:
+                root.remove(grouped)
+            result = etree.SubElement(parent, 'result', name='doclist' if parent is not root
+                                      else 'response', numFound=str(len(flat)), start=str(start))
+            self.add_docs(result, flat[start:start + rows], param('fl'))
+            return
+
+        field = self.index.schema.field(name)
+        group_list = etree.SubElement(group_node, 'arr', name='groups')
+        for value, docids in groups[start:start + rows]:
+            group = etree.SubElement(group_list, 'lst')
+            if value is None:
+                etree.SubElement(group, 'null', name='groupValue')
+            else:
+                etree.SubElement(group, 'str', name='groupValue').text = field.display(value)
+            result = etree.SubElement(group, 'result', name='doclist',
+                                      numFound=str(len(docids)), start='0')
+            self.add_docs(result, docids[:limit], param('fl'))
+
+    def add_docs(self, result, docids, fl=None):
+        fields = set(re.split(r'[\s,]+', fl.strip())) if fl else set(['*'])
+        for docid in docids:
+            doc = etree.SubElement(result, 'doc')
+            stored = self.index.docs[docid]
+            for name in sorted(stored):
+                if '*' not in fields and name not in fields:
+                    continue
+                field = self.index.schema.field(name)
+                tag = _value_tags[field.kind]
+                if field.multi:
+                    parent = etree.SubElement(doc, 'arr', name=name)
+                    for val in stored[name]:
+                        etree.SubElement(parent, tag).text = self._format(field, val)
+                else:
+                    etree.SubElement(doc, tag, name=name).text = \
+                        self._format(field, stored[name][0])
+            if 'score' in fields:
+                etree.SubElement(doc, 'float', name='score').text = '1.0'
+
+    @staticmethod
+    def _format(field, value):
+        if field.kind == 'bool':
+            return 'true' if value else 'false'
+        return unicode(value)
+
+    def facet_counts(self, root, params, docids, filters):
+        counts = etree.SubElement(root, 'lst', name='facet_counts')
+        queries = etree.SubElement(counts, 'lst', name='facet_queries')
+        for facet_query in params.get('facet.query', []):
+            matches = self.index.search(QueryParser.parse(facet_query)) & docids
+            etree.SubElement(queries, 'int', name=facet_query).text = str(len(matches))
+
+        fields = etree.SubElement(counts, 'lst', name='facet_fields')
+        for facet_field in params.get('facet.field', []):
+            excluded = set()
+            if facet_field.startswith('{!'):
+                local, facet_field = facet_field[2:].split('}', 1)
+                match = re.search(r'ex=([\w,]+)', local)
+                excluded = set(match.group(1).split(',')) if match else set()
+            facet_docids = docids
+            if excluded:
+                # recalculate without the excluded filters
+                facet_docids = self.index.search(QueryParser.parse(params.get('q', ['*:*'])[-1]))
+                for tags, fq_docids in filters:
+                    if not tags & excluded:
+                        facet_docids = facet_docids & fq_docids
+
+            option = lambda name, default: params.get('f.%s.facet.%s' % (facet_field, name),
+                                                      params.get('facet.%s' % name, [default]))[-1]
+            limit = int(option('limit', 100))
+            values = self.index.facet(facet_field, facet_docids,
+                                      mincount=int(option('mincount', 0)),
+                                      prefix=option('prefix', None))
+            if option('sort', 'count' if limit > 0 else 'index') in ('count', 'true'):
+                values.sort(key=lambda item: -item[1])
+            if limit >= 0:
+                values = values[int(option('offset', 0)):][:limit]
+            field_node = etree.SubElement(fields, 'lst', name=facet_field)
+            for value, count in values:
+                etree.SubElement(field_node, 'int', name=value).text = str(count)
+
+        for name in ('facet_dates', 'facet_ranges'):
+            etree.SubElement(counts, 'lst', name=name)
+
+    # update
+
+    def update(self, body):
+        started = time.time()
+        try:
+            root = etree.fromstring(body) if body.strip() else etree.Element('commit')
+            commands = [root] if root.tag != 'update' else list(root)
+            for command in commands:
+                if command.tag == 'add':
+                    for doc in command.iterfind('doc'):
+                        self.update_doc(doc)
+                elif command.tag == 'delete':
+                    for key in command.iterfind('id'):
+                        self.index.delete(key.text)
+                    for query in command.iterfind('query'):
+                        self.index.delete_query(query.text)
+                # commit, optimize, and rollback are no-ops
+        except (ValueError, etree.XMLSyntaxError) as err:
+            return self.error(unicode(err))
+        return self.xml(self.response_header({}, start=started))
+
+    def update_doc(self, node):
+        values = defaultdict(list)
+        modifiers = {}
+        for field in node.iterfind('field'):
+            name = field.get('name')
+            values.setdefault(name, [])
+            if field.get('update'):
+                modifiers[name] = field.get('update')
+            if field.get('null') != 'true':
+                values[name].append(field.text or '')
+
+        if modifiers:
+            # atomic update: apply changes to the stored document
+            key = self.index.schema.unique_key
+            existing = self.index.get(values[key][0])
+            doc = dict((name, list(vals)) for name, vals in (existing or {}).iteritems()
+                       if name not in ('_version_', 'timestamp'))
+            for name, vals in values.iteritems():
+                modifier = modifiers.get(name, 'set')
+                if modifier == 'add':
+                    doc.setdefault(name, []).extend(vals)
+                elif modifier == 'inc':
+                    field = self.index.schema.field(name)
+                    current = doc.get(name, [0])[0]
+                    doc[name] = [field.convert(current) + field.convert(vals[0])]
+                else:
+                    doc[name] = vals
+            values = doc
+        self.index.add(dict((name, vals) for name, vals in values.iteritems() if vals))
@@ -0,0 +1,163 @@
+'''
+Base class for local HTTP stand-ins for the services Keep depends on.
+
+Stand-ins are served by a threaded HTTP server on a local port, so that
+benchmarks exercise the same client code (eulfedora, sunburnt, HTTP
+connection handling, response parsing) as Keep does against the real
+services, with configurable latency in place of the network and server
+time.
+'''
+import BaseHTTPServer
+import cgi
+from collections import namedtuple
+import SocketServer
+from StringIO import StringIO
+import threading
+import time
+import urllib
+import urlparse
+
+
+#: an incoming request, as passed to :meth:`StandIn.handle`; ``params``
+#: is a dictionary of lists of values, as returned by
+#: :meth:`urlparse.parse_qs`
+Request = namedtuple('Request', 'method path params headers body')
+
+#: a response returned by :meth:`StandIn.handle`
+Response = namedtuple('Response', 'status content_type body')
+
+
+class _ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StandIn(object):
+    '''Base class for a stand-in service.  Subclasses implement
+    :meth:`handle` to generate a :class:`Response` for a
+    :class:`Request`.  Use :meth:`start` and :meth:`stop`, or use as a
+    context manager.
+
+    :param latency: number of seconds added to every response, to
+        approximate network and server overhead
+    '''
+
+    #: base path for the service, e.g. ``fedora``
+    base_path = ''
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        #: number of requests handled, by method
+        self.request_count = {}
+        self._count_lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        'Base url for the running service'
+        return 'http://127.0.0.1:%d/%s/' % (self.server.server_port, self.base_path)
+
+    def handle(self, request):
+        '''Generate a response for a request.
+
+        :param request: :class:`Request`, with the path relative to
+            :attr:`base_path`
+        :returns: :class:`Response`
+        '''
+        raise NotImplementedError
+
+    def start(self):
+        'Start serving on a free local port, in a background thread.'
+        self.server = _ThreadedHTTPServer(('127.0.0.1', 0), self._handler_class())
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _count(self, method):
+        with self._count_lock:
+            self.request_count[method] = self.request_count.get(method, 0) + 1
+
+    def _handler_class(self):
+        standin = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            # keep connections open, as the real services do
+            protocol_version = 'HTTP/1.1'
+
+            def dispatch(self):
+                url = urlparse.urlparse(self.path)
+                path = urllib.unquote(url.path).lstrip('/')
+                if standin.base_path and path.startswith(standin.base_path):
+                    path = path[len(standin.base_path):]
+                body = self.read_body()
+                params = urlparse.parse_qs(url.query, keep_blank_values=True)
+                if self.headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
+                    for key, vals in urlparse.parse_qs(body, keep_blank_values=True).iteritems():
+                        params.setdefault(key, []).extend(vals)
+
+                standin._count(self.command)
+                request = Request(self.command, path.strip('/'), params,
+                                  self.headers, body)
+                try:
+                    response = standin.handle(request)
+                except Exception as err:
+                    response = Response(500, 'text/plain', 'Error: %s' % err)
+                if standin.latency:
+                    time.sleep(standin.latency)
+
+                body = response.body
+                if isinstance(body, unicode):
+                    body = body.encode('utf-8')
+                self.send_response(response.status)
+                self.send_header('Content-Type', response.content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = dispatch
+
+            def read_body(self):
+                if 'chunked' in self.headers.get('transfer-encoding', ''):
+                    chunks = []
+                    while True:
+                        size = int(self.rfile.readline().split(';')[0], 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            break
+                        chunks.append(self.rfile.read(size))
+                        self.rfile.readline()
+                    return ''.join(chunks)
+                length = int(self.headers.get('content-length', 0) or 0)
+                return self.rfile.read(length) if length else ''
+
+            def log_message(self, *args):
+                # don't report every request on the console
+                pass
+
+        return Handler
+
+
+def multipart_file(request, field='file'):
+    '''Content of a file field in a multipart form request body, or
+    None if the request is not a multipart form.'''
+    content_type = request.headers.get('content-type', '')
+    if not content_type.startswith('multipart/form-data'):
+        return None
+    form = cgi.FieldStorage(fp=StringIO(request.body),
+        environ={'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': content_type,
+                 'CONTENT_LENGTH': str(len(request.body))})
+    return form[field].value if field in form else None
@@ -0,0 +1,593 @@
+'''
+Benchmark registry, environment, and timing.
+
+:class:`BenchmarkEnvironment` starts :class:`~keep.benchmarks.fedora.FakeFedora`
+and :class:`~keep.benchmarks.solr.FakeSolr`, points Django settings at
+them, creates a test database with a superuser, and loads a corpus:
+a few archives, collections, and items of each type are saved to Fedora
+with the real models and indexed with their own ``index_data``, and then
+the Solr index is filled out to the requested size with synthetic
+variants of those documents.
+
+Each :class:`Benchmark` prepares a run in :meth:`Benchmark.setup` (not
+timed) and exercises a single code path in :meth:`Benchmark.run`.
+Results report timings along with the number of Fedora and Solr requests
+per run, since request counts are what usually regress.
+'''
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from distutils.spawn import find_executable
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+import wave
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+
+from keep.audio import tasks as audio_tasks
+from keep.audio.models import AudioObject
+from keep.collection.models import CollectionObject
+from keep.common import fedora
+from keep.common.fedora import Repository
+from keep.file import views as file_views
+from keep.file.models import DiskImage
+from keep.file.utils import md5sum
+from keep.video.models import Video
+from keep.benchmarks.fedora import FakeFedora
+from keep.benchmarks.solr import FakeSolr
+
+logger = logging.getLogger(__name__)
+
+ISO_FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'file', 'fixtures', 'test.iso')
+
+#: words used to generate synthetic titles and search terms
+VOCABULARY = '''
+    oral history interview lecture recital concert sermon speech radio
+    broadcast commencement symposium panel reading poetry jazz gospel choir
+    orchestra quartet civil rights movement atlanta georgia southern
+    literature papers letters correspondence diaries photographs records
+    campus faculty students alumni university emory library archive
+    collection series box folder reel cassette tape disk video film
+    documentary performance festival memorial service dedication address
+    session conference workshop seminar remarks debate discussion
+'''.split()
+
+#: default synthetic corpus size (number of Solr documents)
+DEFAULT_CORPUS_SIZE = 5000
+
+#: default latencies, in seconds
+DEFAULT_FEDORA_LATENCY = 0.005
+DEFAULT_SOLR_LATENCY = 0.005
+DEFAULT_SOLR_DOC_LATENCY = 0.000002
+
+
+class SkipBenchmark(Exception):
+    '''Raised by :meth:`Benchmark.setup` when a benchmark cannot run in
+    the current environment, e.g. because a required program is not
+    installed.'''
+
+
+def make_wav(path, seconds, seed=None):
+    '''Write a 16-bit stereo 44.1 kHz WAV file of random noise, so that
+    each file has unique content (and checksum).'''
+    rng = random.Random(seed)
+    wav = wave.open(path, 'wb')
+    wav.setnchannels(2)
+    wav.setsampwidth(2)
+    wav.setframerate(44100)
+    frames = 44100 * seconds
+    # repeat a random block rather than generating every sample
+    block = struct.pack('<%dh' % 8820, *[rng.randint(-3000, 3000) for i in range(8820)])
+    for i in range(frames // 4410):
+        wav.writeframes(block)
+    wav.close()
+    return path
+
+
+@contextmanager
+def replaced(obj, name, value):
+    'Temporarily replace an attribute on a module or object.'
+    original = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, original)
+
+
+class BenchmarkEnvironment(object):
+    '''Stand-in services, settings, database, and corpus for running
+    benchmarks.  Use as a context manager.
+
+    :param corpus_size: number of documents in the Solr index
+    :param fedora_latency: seconds added to each Fedora response
+    :param solr_latency: seconds added to each Solr response
+    :param solr_doc_latency: seconds added to each Solr response per
+        matching document
+    :param seed: random seed for the synthetic corpus
+    '''
+
+    #: number of collections per archive, and items of each type per
+    #: collection, saved to Fedora
+    collections_per_archive = 2
+    items_per_collection = 2
+
+    def __init__(self, corpus_size=DEFAULT_CORPUS_SIZE,
+                 fedora_latency=DEFAULT_FEDORA_LATENCY,
+                 solr_latency=DEFAULT_SOLR_LATENCY,
+                 solr_doc_latency=DEFAULT_SOLR_DOC_LATENCY, seed=0):
+        self.corpus_size = corpus_size
+        self.random = random.Random(seed)
+        self.fedora = FakeFedora(latency=fedora_latency)
+        self.solr = FakeSolr(settings.SOLR_SCHEMA, latency=solr_latency,
+                             doc_latency=solr_doc_latency)
+        #: pids of objects saved to Fedora, by type
+        self.pids = {}
+        self.password = 'benchmark'
+
+    def __enter__(self):
+        self.tempdir = tempfile.mkdtemp(prefix='keep-benchmark-')
+        self.fedora.start()
+        self.solr.start()
+        self.settings = override_settings(
+            FEDORA_ROOT=self.fedora.url,
+            FEDORA_PIDSPACE=self.fedora.pidspace,
+            SOLR_SERVER_URL=self.solr.url,
+            INGEST_STAGING_TEMP_DIR=os.path.join(self.tempdir, 'staging'),
+            PIDMAN_HOST=None, PIDMAN_USER=None, PIDMAN_PASSWORD=None,
+            PIDMAN_DOMAIN=None,
+            # don't try to contact an LDAP server
+            AUTHENTICATION_BACKENDS=('django.contrib.auth.backends.ModelBackend',),
+            # use a private cache, so benchmarks can clear it
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                'LOCATION': 'keep-benchmarks'}},
+            DEBUG=False,
+        )
+        self.settings.enable()
+        self._pidman = fedora.pidman
+        fedora.pidman = None
+        CollectionObject._archives = None
+
+        self.old_db_name = settings.DATABASES['default']['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                           serialize=False)
+        self.user = User.objects.create_superuser('benchmark', 'benchmark@example.com',
+                                                  self.password)
+        try:
+            self.load_corpus()
+        except:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        connection.creation.destroy_test_db(self.old_db_name, verbosity=0)
+        fedora.pidman = self._pidman
+        CollectionObject._archives = None
+        self.settings.disable()
+        self.fedora.stop()
+        self.solr.stop()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def client(self):
+        'Django test client logged in as the benchmark superuser.'
+        client = Client()
+        client.login(username=self.user.username, password=self.password)
+        return client
+
+    def request(self, path='/'):
+        ':class:`~django.http.HttpRequest` for the benchmark superuser.'
+        request = RequestFactory().post(path)
+        request.user = self.user
+        request.session = {}
+        return request
+
+    def request_count(self):
+        'Total number of requests handled by Fedora and Solr so far.'
+        return (sum(self.fedora.request_count.values()),
+                sum(self.solr.request_count.values()))
+
+    def temp_file(self, suffix=''):
+        handle, path = tempfile.mkstemp(suffix=suffix, dir=self.tempdir)
+        os.close(handle)
+        return path
+
+    def wav_file(self, seconds=5):
+        'Generate a new, unique WAV file in the temporary directory.'
+        return make_wav(self.temp_file('.wav'), seconds, seed=self.random.random())
+
+    def random_file(self, suffix='', size=4096):
+        'Generate a new file of random data in the temporary directory.'
+        path = self.temp_file(suffix)
+        with open(path, 'wb') as outfile:
+            outfile.write(self.random_content(size))
+        return path
+
+    def random_content(self, size=4096):
+        return ''.join(chr(self.random.randint(0, 255)) for i in range(size))
+
+    # corpus
+
+    def save(self, obj):
+        obj.save('benchmark fixture')
+        self.pids.setdefault(type(obj), []).append(obj.pid)
+        return obj
+
+    def load_corpus(self):
+        '''Save archives, collections, and items to Fedora, index them,
+        and add synthetic documents to reach the corpus size.'''
+        repo = Repository()
+        collections = []
+        for alias, pid in sorted(settings.PID_ALIASES.iteritems())[:3]:
+            archive = repo.get_object(pid, type=CollectionObject, create=True)
+            archive.mods.content.title = '%s Library' % alias.title()
+            archive.mods.content.short_name = alias.upper()
+            archive.mods.content.resource_type = 'mixed material'
+            self.save(archive)
+            for i in range(self.collections_per_archive):
+                coll = repo.get_object(type=CollectionObject)
+                coll.mods.content.title = self.title()
+                coll.mods.content.source_id = self.random.randint(100, 9999)
+                coll.mods.content.resource_type = 'mixed material'
+                coll.collection = archive
+                collections.append(self.save(coll))
+
+        for coll in collections:
+            for i in range(self.items_per_collection):
+                for init in (self.audio, self.video, self.diskimage):
+                    obj = init(repo)
+                    obj.collection = coll
+                    self.save(obj)
+
+        # index everything that was saved, as eulindexer would
+        templates = []
+        for objtype, pids in self.pids.iteritems():
+            for pid in pids:
+                doc = repo.get_object(pid, type=objtype).index_data()
+                self.solr.add(doc)
+                templates.append(doc)
+        self.synthesize(templates)
+
+    def title(self):
+        return ' '.join(self.random.sample(VOCABULARY, self.random.randint(3, 6))).title()
+
+    def audio(self, repo):
+        filename = self.wav_file(seconds=2)
+        return AudioObject.init_from_file(filename, initial_label=self.title() + '.wav',
+                                          checksum=md5sum(filename), mimetype='audio/x-wav')
+
+    def video(self, repo):
+        obj = repo.get_object(type=Video)
+        obj.label = obj.dc.content.title = obj.mods.content.title = self.title()
+        obj.mods.content.resource_type = 'moving image'
+        obj.digitaltech.content.duration = '%d' % self.random.randint(60, 3600)
+        master = self.random_file('.mov')
+        obj.content.content = open(master, 'rb')
+        obj.content.checksum = md5sum(master)
+        obj.content.mimetype = 'video/quicktime'
+        access = self.random_file('.mp4')
+        obj.access_copy.content = open(access, 'rb')
+        obj.access_copy.checksum = md5sum(access)
+        obj.access_copy.mimetype = 'video/mp4'
+        return obj
+
+    def diskimage(self, repo):
+        filename = self.temp_file('.iso')
+        shutil.copyfile(ISO_FIXTURE, filename)
+        with open(filename, 'ab') as iso:
+            # make content unique
+            iso.write(self.random_content())
+        return DiskImage.init_from_file(filename, initial_label=self.title() + '.iso',
+                                        mimetype='application/x-iso9660-image')
+
+    def synthesize(self, templates):
+        '''Add variants of indexed documents to Solr until the index
+        reaches the corpus size.  Items are distributed across the
+        collections that were saved to Fedora, so that collection and
+        archive views have realistic numbers of items.'''
+        collections = [doc for doc in templates if 'archive_id' in doc
+                       and 'collection_id' not in doc]
+        items = [doc for doc in templates if 'collection_id' in doc]
+        start = datetime(2010, 1, 1)
+        for i in range(max(self.corpus_size - len(templates), 0)):
+            # roughly one synthetic collection for every 50 items
+            template = self.random.choice(collections if i % 50 == 0 else items)
+            doc = dict(template)
+            doc['pid'] = '%s:synthetic-%d' % (self.fedora.pidspace, i)
+            doc['title'] = doc['label'] = self.title()
+            created = start + timedelta(seconds=self.random.randint(0, 60 * 60 * 24 * 365 * 6))
+            doc['created'] = doc['last_modified'] = created
+            doc['created_date'] = created.strftime('%Y-%m-%d')
+            doc['created_month'] = created.strftime('%Y-%m')
+            doc['created_year'] = created.strftime('%Y')
+            if 'content_md5' in doc:
+                doc['content_md5'] = hashlib.md5(doc['pid']).hexdigest()
+            if 'date_created' in doc:
+                doc['date_created'] = str(self.random.randint(1900, 2015))
+            if 'collection_id' in doc:
+                coll = self.random.choice(collections)
+                doc['collection_id'] = coll['pid']
+                doc['collection_label'] = coll.get('title')
+                doc['collection_source_id'] = coll.get('source_id')
+                for field in ('archive_id', 'archive_label', 'archive_short_name'):
+                    doc[field] = coll.get(field)
+                doc['researcher_access'] = self.random.random() < 0.3
+                doc['has_access_copy'] = self.random.random() < 0.8
+            self.solr.add(doc)
+
+
+class Benchmark(object):
+    '''A single timed code path.  Subclasses set :attr:`name` and
+    implement :meth:`run`.'''
+
+    #: unique name, used to select benchmarks and in results
+    name = None
+
+    def setup(self, env):
+        '''Prepare for a single run; not timed.  Clears the Django cache,
+        so that each run measures an uncached request.'''
+        cache.clear()
+
+    def run(self, env):
+        raise NotImplementedError
+
+    def teardown(self, env):
+        'Clean up after a single run; not timed.'
+        pass
+
+
+class IngestFiles(Benchmark):
+    '''Ingest a batch of uploaded WAV files with
+    :meth:`keep.file.views.ingest_files`.  Access copy conversion is not
+    queued; it is timed separately by :class:`ConvertWavToMp3`.'''
+    name = 'ingest_files'
+    batch_size = 5
+
+    def setup(self, env):
+        super(IngestFiles, self).setup(env)
+        self.files = dict((env.wav_file(), 'upload-%d.wav' % i)
+                          for i in range(self.batch_size))
+        self.collection = Repository().get_object(env.pids[CollectionObject][-1],
+                                                  type=CollectionObject)
+        self.request = env.request()
+
+    def run(self, env):
+        with replaced(file_views, 'queue_access_copy', lambda obj, **kwargs: None):
+            results = file_views.ingest_files(self.files, self.collection,
+                                              'benchmark ingest', self.request)
+        failed = [result.get('message') for result in results if not result['success']]
+        if failed:
+            raise Exception('Ingest failed: %s' % '; '.join(failed))
+
+    def teardown(self, env):
+        for filename in self.files:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+class AjaxUpload(Benchmark):
+    'Upload a WAV file to the staging area with the ajax upload view.'
+    name = 'ajax_upload'
+
+    def setup(self, env):
+        super(AjaxUpload, self).setup(env)
+        filename = env.wav_file(seconds=10)
+        with open(filename, 'rb') as wav:
+            self.data = wav.read()
+        os.remove(filename)
+        self.client = env.client()
+
+    def run(self, env):
+        response = self.client.post(reverse('file:upload'), data=self.data,
+            content_type='audio/wav', HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            HTTP_CONTENT_DISPOSITION='filename="benchmark.wav"',
+            HTTP_CONTENT_MD5=hashlib.md5(self.data).hexdigest())
+        if response.status_code != 200:
+            raise Exception('Upload failed (%s): %s' % (response.status_code, response.content))
+        self.staged = os.path.join(settings.INGEST_STAGING_TEMP_DIR, response.content)
+
+    def teardown(self, env):
+        for filename in (self.staged, self.staged + '.md5'):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+
+class ConvertWavToMp3(Benchmark):
+    '''Generate an MP3 access copy for a newly ingested audio object with
+    :meth:`keep.audio.tasks.convert_wav_to_mp3`.'''
+    name = 'convert_wav_to_mp3'
+
+    def setup(self, env):
+        super(ConvertWavToMp3, self).setup(env)
+        if find_executable('ffmpeg') is None:
+            raise SkipBenchmark('ffmpeg is not installed')
+        self.obj = env.audio(Repository())
+        self.obj.save('benchmark ingest')
+
+    def run(self, env):
+        audio_tasks.convert_wav_to_mp3(self.obj.pid)
+
+
+class IndexData(Benchmark):
+    '''Generate full index data for an object of one type, as requested
+    by eulindexer.'''
+
+    def __init__(self, objtype):
+        self.objtype = objtype
+        self.name = 'index_data.%s' % objtype.__name__
+
+    def setup(self, env):
+        super(IndexData, self).setup(env)
+        # new instance each time, so datastreams are not already loaded
+        self.obj = Repository().get_object(env.pids[self.objtype][0], type=self.objtype)
+
+    def run(self, env):
+        self.obj.index_data()
+
+
+class ClientBenchmark(Benchmark):
+    '''Request a url with the Django test client as a logged-in
+    superuser, including template rendering.'''
+
+    def setup(self, env):
+        super(ClientBenchmark, self).setup(env)
+        self.client = env.client()
+
+    def url(self, env):
+        raise NotImplementedError
+
+    def run(self, env):
+        response = self.client.get(self.url(env))
+        if response.status_code != 200:
+            raise Exception('Request failed with status %s' % response.status_code)
+
+
+class KeywordSearch(ClientBenchmark):
+    'Admin keyword search across all indexed content.'
+    name = 'keyword_search'
+
+    def url(self, env):
+        return '%s?keyword=%s' % (reverse('repo-admin:search'),
+                                  env.random.choice(VOCABULARY))
+
+
+class CollectionView(ClientBenchmark):
+    'Collection view with the first page of items.'
+    name = 'collection_view'
+
+    def url(self, env):
+        return reverse('collection:view', kwargs={'pid': env.pids[CollectionObject][-1]})
+
+
+class ListArchives(ClientBenchmark):
+    'List archives with collection counts.'
+    name = 'list_archives'
+
+    def url(self, env):
+        return reverse('collection:list-archives')
+
+
+#: all benchmarks, in the order they are run
+BENCHMARKS = [
+    IngestFiles(),
+    AjaxUpload(),
+    ConvertWavToMp3(),
+    IndexData(CollectionObject),
+    IndexData(AudioObject),
+    IndexData(Video),
+    IndexData(DiskImage),
+    KeywordSearch(),
+    CollectionView(),
+    ListArchives(),
+]
+
+
+def time_benchmark(benchmark, env, repeat=5):
+    '''Run a benchmark and summarize the timings.
+
+    :returns: dictionary with ``min``, ``median``, ``mean``, and ``max``
+        times in seconds and the number of Fedora and Solr requests per
+        run; or with ``skipped`` or ``error`` and a message
+    '''
+    times = []
+    requests = []
+    for i in range(repeat):
+        try:
+            benchmark.setup(env)
+        except SkipBenchmark as err:
+            return {'skipped': unicode(err)}
+        try:
+            before = env.request_count()
+            start = time.time()
+            benchmark.run(env)
+            times.append(time.time() - start)
+            after = env.request_count()
+            requests.append((after[0] - before[0], after[1] - before[1]))
+        except Exception as err:
+            logger.exception('Error running benchmark %s' % benchmark.name)
+            return {'error': unicode(err)}
+        finally:
+            benchmark.teardown(env)
+
+    times.sort()
+    return {
+        'runs': len(times),
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'mean': sum(times) / len(times),
+        'max': times[-1],
+        'fedora_requests': max(count[0] for count in requests),
+        'solr_requests': max(count[1] for count in requests),
+    }
+
+
+def run_benchmarks(names=None, repeat=5, **env_options):
+    '''Run benchmarks in a new :class:`BenchmarkEnvironment`.
+
+    :param names: optional list of benchmark names (or name prefixes,
+        e.g. ``index_data``) to run; defaults to all
+    :param repeat: number of times to run each benchmark
+    :param env_options: options for :class:`BenchmarkEnvironment`
+    :returns: results dictionary, suitable for serializing as JSON
+    '''
+    benchmarks = [b for b in BENCHMARKS
+                  if not names or any(b.name == name or b.name.startswith(name + '.')
+                                      for name in names)]
+    results = {
+        'date': datetime.now().isoformat(),
+        'options': dict(env_options, repeat=repeat),
+        'benchmarks': {}
+    }
+    with BenchmarkEnvironment(**env_options) as env:
+        results['options']['corpus_size'] = len(env.solr.index)
+        for benchmark in benchmarks:
+            results['benchmarks'][benchmark.name] = time_benchmark(benchmark, env,
+                                                                   repeat=repeat)
+    return results
+
+
+def compare(previous, current, threshold=0.2):
+    '''Compare benchmark results with a previous run.
+
+    :param previous: results dictionary from an earlier run
+    :param current: results dictionary
+    :param threshold: relative increase in median time to report as a
+        regression
+    :returns: list of tuples of benchmark name, previous median, current
+        median, for benchmarks that regressed; benchmarks that now make
+        more Fedora or Solr requests are always included
+    '''
+    regressions = []
+    for name, result in sorted(current['benchmarks'].iteritems()):
+        old = previous['benchmarks'].get(name, {})
+        if 'median' not in result or 'median' not in old:
+            continue
+        slower = result['median'] > old['median'] * (1 + threshold)
+        more_requests = any(result[key] > old.get(key, result[key])
+                            for key in ('fedora_requests', 'solr_requests'))
+        if slower or more_requests:
+            regressions.append((name, old['median'], result['median']))
+    return regressions
+
+
+def load_results(path):
+    with open(path) as infile:
+        return json.load(infile)
+
+
+def save_results(results, path):
+    with open(path, 'w') as outfile:
+        json.dump(results, outfile, indent=2, sort_keys=True)
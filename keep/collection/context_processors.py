@@ -1,7 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
 from keep.collection.forms import CollectionSearch
 
 def collection_search(request):
     '''Template context processor: add the collection search form
     (:class:`~keep.collection.forms.CollectionSearch`) to context
-    so it can be used on any page (e.g., in the site sidebar).'''
-    return {'collection_search': CollectionSearch(prefix='collection')}
+    so it can be used on any page (e.g., in the site sidebar).
+    The form is only initialized if it is used when rendering the page.'''
+    return {'collection_search': SimpleLazyObject(lambda: CollectionSearch(prefix='collection'))}
@@ -109,8 +109,7 @@ class FindCollection(forms.Form):
         # - depending on permissions, restrict to collections with researcher audio
         if not self.user.has_perm('collection.view_collection') and \
                self.user.has_perm('collection.view_researcher_collection'):
-            q = q.join('collection_id', 'pid', researcher_access=True)
-            q = q.join('collection_id', 'pid', has_access_copy=True)
+            q = q.filter(has_researcher_content=True)
 
         # make a list of user-viewable archive pids
         archives = [pid for pid, count in q.execute().facet_counts.facet_fields['archive_id']]
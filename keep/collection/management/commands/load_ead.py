@@ -1,8 +1,9 @@
 from optparse import make_option
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from eulexistdb.exceptions import DoesNotExist, ReturnedMultiple
+from keep.common.batch import pool_map
 from keep.common.fedora import Repository
+from keep.common.utils import solr_cursor, solr_interface
 from keep.collection.models import CollectionObject, FindingAid
 
 class Command(BaseCommand):
@@ -15,13 +16,19 @@ class Command(BaseCommand):
     object).  Also takes a list of collection ids; for each id specified, this script
     will look for the corresponding EAD document within the requested numbering
     scheme and generate a new :class:`~keep.collection.models.CollectionObject`.
+
+    Existing collections are found with a single Solr query, EAD documents
+    are retrieved from eXist in batches, and new collections are ingested
+    concurrently, so that large numbers of collections can be loaded at once.
     '''
     help = '''Create a new collection based on a Finding Aid EAD document.
 Takes a pid or pid alias for the archive the new collection will belong to
 and the collection number, which are used to find the appropriate Finding Aid
-document.  Can also take a list of multiple collection numbers.  Example use:
+document.  Can also take a list of multiple collection numbers, or read them
+from a file.  Example use:
 
     load_ead marbl 488 1000
+    load_ead marbl --file=collection-numbers.txt
 
 '''
     args = 'num-scheme-pid collection-id [...]'
@@ -31,11 +38,26 @@ document.  Can also take a list of multiple collection numbers.  Example use:
             dest='dryrun',
             action='store_true',
             help="Report what would be done, but don't ingest any Fedora objects."),
+        make_option('--file', '-f',
+            dest='idfile',
+            help='File with collection ids to load, one per line'),
+        make_option('--workers',
+            dest='workers', type='int',
+            help='Number of eXist queries and Fedora ingests to run concurrently'),
         )
 
     def handle(self, numbering_pid, *ids, **options):
         verbosity = int(options['verbosity'])
 
+        ids = list(ids)
+        if options['idfile']:
+            with open(options['idfile']) as idfile:
+                ids.extend(line.strip() for line in idfile if line.strip())
+        try:
+            ids = [int(id) for id in ids]
+        except ValueError as err:
+            raise CommandError('Collection ids must be numeric: %s' % err)
+
         numbering = self.get_numbering(numbering_pid)
         if not numbering.exists:
             raise CommandError('Numbering scheme %s not found' % (numbering_pid,))
@@ -44,36 +66,51 @@ document.  Can also take a list of multiple collection numbers.  Example use:
         created = 0
         errors = 0
 
+        # check for existing collections before creating new
+        existing = self.existing_collections(numbering.pid)
+        new_ids = []
         for id in ids:
-            # check for existing collection before creating new
-            existing_coll = list(CollectionObject.
-                                 find_by_collection_number(id, numbering.pid))
-            if existing_coll:
+            if id in existing:
                 print 'Collection %s already exists as %s' % \
-                      (id, ', '.join([coll.pid for coll in existing_coll]))
-                continue
+                      (id, ', '.join(existing[id]))
+            elif id not in new_ids:
+                new_ids.append(id)
 
-            coll = None
-            try:
-                fa = FindingAid.find_by_unitid(id, numbering_title)
-                coll = fa.generate_collection()
-                # new collection parent collection is the archive collection object
-                coll.collection = numbering
-                if not options['dryrun']:
-                    coll.save()
-                if verbosity:
-                    print 'Added %s for collection %s: %s (from %s)' % (coll, id, coll.mods.content.title, numbering_title)
-                created += 1
-            except DoesNotExist:
+        findingaids = FindingAid.find_by_unitids(new_ids, numbering_title,
+                                                 workers=options['workers'])
+        to_load = []
+        for id in new_ids:
+            found = findingaids.get(id, [])
+            if not found:
                 print 'No EAD found for id %s in %s' % (id, numbering_title)
                 errors += 1
-            except ReturnedMultiple:
+            elif len(found) > 1:
                 print 'Multiple EADs found for id %s in %s' % (id, numbering_title)
                 errors += 1
-            except:
-                if coll is not None:
-                    print 'Failed to save %s for collection %s: %s (from %s)' %  (coll, id, coll.mods.content.title, numbering_title)
-                raise
+            else:
+                to_load.append((id, found[0]))
+
+        def load_collection(item):
+            # generate in the worker thread so that each thread
+            # saves with its own Fedora connection
+            id, fa = item
+            coll = fa.generate_collection()
+            # new collection parent collection is the archive collection object
+            coll.collection = numbering
+            if not options['dryrun']:
+                coll.save()
+            return coll
+
+        for item, coll, err in pool_map(load_collection, to_load, options['workers']):
+            id, fa = item
+            if err is not None:
+                print 'Failed to save collection %s: %s (from %s): %s' % \
+                      (id, unicode(fa.unittitle.short), numbering_title, err)
+                errors += 1
+                continue
+            if verbosity:
+                print 'Added %s for collection %s: %s (from %s)' % (coll, id, coll.mods.content.title, numbering_title)
+            created += 1
 
         if verbosity > 1:
             print '%d records created' % (created,)
@@ -85,3 +122,20 @@ document.  Can also take a list of multiple collection numbers.  Example use:
         repo = Repository()
         return repo.get_object(pid, type=CollectionObject)
 
+    def existing_collections(self, archive_pid):
+        '''Find the collections that already belong to an archive, with a
+        single Solr query.
+
+        :returns: dictionary of collection number (source id) to list of
+            collection pids
+        '''
+        solr = solr_interface()
+        solrquery = solr.query(content_model=CollectionObject.COLLECTION_CONTENT_MODEL,
+                               pid='%s:*' % settings.FEDORA_PIDSPACE,
+                               archive_id=archive_pid) \
+                        .field_limit(['pid', 'source_id'])
+        existing = {}
+        for coll in solr_cursor(solrquery):
+            if 'source_id' in coll:
+                existing.setdefault(coll['source_id'], []).append(coll['pid'])
+        return existing
@@ -1,16 +1,20 @@
+import math
 from optparse import make_option
+import os
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
-from eulfedora.models import DigitalObjectSaveFailure
 from eulxml.xmlmap import mods
+import unicodecsv
 
 from pidservices.djangowrapper.shortcuts import DjangoPidmanRestClient
 from pidservices.clients import parse_ark
 
 from keep.collection.models import CollectionObject
 from keep.audio.models import AudioObject
+from keep.common.bulkedit import BulkEdit
 from keep.common.fedora import Repository
+from keep.common.utils import solr_cursor, solr_interface
 
 LOG_LEVEL = ['QUIET', 'INFO', 'WARNING']
 
@@ -20,11 +24,16 @@ class Command(BaseCommand):
     '''Repair missing ARKs for :class:`~keep.collection.models.CollectionObject` objects
     based on the correct ARK from PIDMAN.
 
+    Objects without an ARK are found in Solr, ARK targets are retrieved
+    from PIDMAN a page at a time (or individually, when only a few objects
+    need repair), and objects are updated concurrently using
+    :class:`~keep.common.bulkedit.BulkEdit`.
     '''
     args = '[PID [PID...]]'
     help = '''Repair ARKs on Keep Collections or Audio objects.
     Optionally accepts a list of PIDs to be repaired.  If no pids are specified,
-    will find all collection objects and attempt to repair them.'''
+    will find all collection objects without an ARK in Solr and attempt to
+    repair them.'''
 
     option_list = BaseCommand.option_list + (
         make_option('--dry-run',
@@ -32,6 +41,18 @@ class Command(BaseCommand):
             action='store_true',
             default=False,
             help='Report which ARKs would be repaired'),
+        make_option('--audio',
+            action='store_true',
+            default=False,
+            help='Also repair audio objects without an ARK (when no pids are specified)'),
+        make_option('--report',
+            help='CSV file to append the outcome for each object to as it is processed'),
+        make_option('--checkpoint',
+            help='Name to record progress under; rerunning with the same name ' +
+                 'skips objects already repaired'),
+        make_option('--workers',
+            type='int',
+            help='Number of objects to update concurrently'),
         )
 
     def handle(self, *args, **options):
@@ -39,70 +60,155 @@ class Command(BaseCommand):
         self.repaired_count = 0
         self.unrepaired_count = 0
 
-        repo = Repository()
         self.pidman = DjangoPidmanRestClient()
 
-        # populate list of objects to be processed
-        objects = []
-        for pid in args:
-            try:
-                obj = repo.get_object(pid=pid, type=CollectionObject)
-                if obj.has_requisite_content_models:
-                    objects.append(obj)
-                else:
-                    obj = repo.get_object(pid=pid, type=AudioObject)
+        # populate list of objects to be processed, by type
+        objects = {CollectionObject: [], AudioObject: []}
+        if args:
+            repo = Repository()
+            for pid in args:
+                try:
+                    obj = repo.get_object(pid=pid, type=CollectionObject)
                     if obj.has_requisite_content_models:
-                        objects.append(obj)
-            except Exception:
-                self.log(message="Could not find Collection or Audio object for: %s" % pid)
-
-        # get list of all collections from the repository
-        # limited to the COLLECTION_CONTENT_MODEL as well as returns a Keep specific collection object
-        if not args:
-            objects = repo.get_objects_with_cmodel(CollectionObject.COLLECTION_CONTENT_MODEL, type=CollectionObject)
+                        objects[CollectionObject].append(pid)
+                    else:
+                        obj = repo.get_object(pid=pid, type=AudioObject)
+                        if obj.has_requisite_content_models:
+                            objects[AudioObject].append(pid)
+                except Exception:
+                    self.log(message="Could not find Collection or Audio object for: %s" % pid)
+
+        # find collections (and optionally audio) without an ARK in Solr
+        else:
+            objects[CollectionObject] = self.missing_arks(CollectionObject.COLLECTION_CONTENT_MODEL)
+            if options['audio']:
+                objects[AudioObject] = self.missing_arks(AudioObject.AUDIO_CONTENT_MODEL)
 
-        if not objects:
+        if not any(objects.values()):
             self.log(message="No Collections were found.")
+            return
 
-        for obj in objects:
-            self.repair_ark(obj)
+        self.targets = self.ark_targets([pid.split(':')[-1] for pids in objects.values()
+                                         for pid in pids])
+
+        report = None
+        if options['report']:
+            # append, so that a resumed run adds to the same report
+            new_report = not os.path.exists(options['report'])
+            report_file = open(options['report'], 'ab')
+            report = unicodecsv.writer(report_file, encoding='utf-8')
+            if new_report:
+                report.writerow(['pid', 'outcome', 'ark_uri', 'error'])
+
+        for objtype, pids in objects.iteritems():
+            if not pids:
+                continue
+            editor = BulkEdit(self.repair_ark, type=objtype,
+                              log_message='Fixing missing ARK',
+                              noact=options['dry_run'],
+                              checkpoint=options['checkpoint'],
+                              workers=options['workers'])
+            for result in editor.run(pids):
+                self.log_result(result)
+                if report is not None:
+                    report.writerow([result.pid, result.outcome,
+                                     self.targets.get(result.pid.split(':')[-1], ''),
+                                     result.error or ''])
+                    report_file.flush()
+
+            if editor.stats['skipped']:
+                self.log(message='%d objects were already repaired under checkpoint %s' %
+                         (editor.stats['skipped'], options['checkpoint']))
+
+        if report is not None:
+            report_file.close()
 
         self.log(message="\n\n%s ARKs repaired\n%s ARKs were not repaired" % (self.repaired_count, self.unrepaired_count), no_label=True)
 
-    def repair_ark(self, obj):
-        ark_target = None
+    def missing_arks(self, content_model):
+        '''Find pids for objects of the specified content model that do
+        not have an ARK in the Solr index.'''
+        solr = solr_interface()
+        solrquery = solr.query(content_model=content_model,
+                               pid='%s:*' % settings.FEDORA_PIDSPACE) \
+                        .exclude(ark_uri__any=True)
+        return [r['pid'] for r in solr_cursor(solrquery.field_limit('pid'))]
+
+    def ark_targets(self, noids):
+        '''Retrieve ARK access urls from PIDMAN for the specified noids.
+        Pids in the configured PIDMAN domain are retrieved a page at a
+        time, unless it would take fewer requests to look up each noid
+        individually; any noids not found that way are looked up
+        individually.
+
+        :returns: dictionary of noid to ARK access uri
+        '''
+        targets = {}
+        needed = set(noids)
+
         try:
-            ark_target = self.pidman.get_ark_target(noid=obj.noid, qualifier='')
-        except:
-            self.unrepaired_count += 1
-            self.log(level=WARNING, message="Failed to find ARK target for %s" % (obj.pid))
+            results = self.pidman.search_pids(domain_uri=settings.PIDMAN_DOMAIN)
+            pages = int(math.ceil(results['results_count'] /
+                                  float(results['max_results_per_page'] or 1)))
+        except Exception as err:
+            self.log(level=WARNING, message='Failed to search PIDMAN domain: %s' % err)
+            pages = None
+
+        if pages is not None and pages < len(needed):
+            page = 1
+            while needed:
+                for result in results['results']:
+                    if result['pid'] in needed and result['targets']:
+                        targets[result['pid']] = result['targets'][0]['access_uri']
+                        needed.discard(result['pid'])
+                page += 1
+                if page > pages:
+                    break
+                results = self.pidman.search_pids(domain_uri=settings.PIDMAN_DOMAIN, page=page)
+
+        for noid in needed:
+            try:
+                targets[noid] = self.pidman.get_ark_target(noid=noid, qualifier='')['access_uri']
+            except Exception:
+                self.log(level=WARNING, message="Failed to find ARK target for %s" % noid)
+        return targets
+
+    def repair_ark(self, obj):
+        '''Add the ARK from PIDMAN to an object that does not have one;
+        objects that already have an ARK are not changed.'''
+        if obj.ark_access_uri:
             return
 
+        access_uri = self.targets.get(obj.noid)
+        if access_uri is None:
+            raise Exception("Failed to find ARK target for %s" % obj.pid)
 
-        parsed_ark = parse_ark(ark_target['access_uri'])
+        parsed_ark = parse_ark(access_uri)
         naan = parsed_ark['naan']
         noid = parsed_ark['noid']
 
         if hasattr(obj, 'mods'):
             obj.mods.content.identifiers.extend([
                 mods.Identifier(type='ark', text='ark:/%s/%s' % (naan, noid)),
-                mods.Identifier(type='uri', text=ark_target['access_uri'])
+                mods.Identifier(type='uri', text=access_uri)
                 ])
         else:
-            obj.dc.content.identifier_list(ark_target['access_uri'])
-
-        if self.options['dry_run']:
+            obj.dc.content.identifier_list.append(access_uri)
+
+    def log_result(self, result):
+        if result.outcome == 'updated':
+            if self.options['dry_run']:
+                self.unrepaired_count += 1
+                self.log(message='ARK target found for %s' % result.pid)
+            else:
+                self.repaired_count += 1
+                self.log(level=WARNING, message='Repaired ARK for %s' % result.pid)
+        elif result.outcome == 'unchanged':
+            self.log(level=WARNING, message='%s already has an ARK' % result.pid)
+        else:
             self.unrepaired_count += 1
-            self.log(message='ARK target found for %s' % obj.pid)
-            return
-
-        # save the collection object w/ updated ark
-        try:
-            self.log(level=INFO, message="Attempting to save %s" % obj.pid)
-            obj.save(logMessage='Fixing missing ARK')
-            self.repaired_count += 1
-        except DigitalObjectSaveFailure:
-            self.log(message="An error occurred while saving %s" % (obj.pid))
+            self.log(message="An error occurred while repairing %s: %s" %
+                     (result.pid, result.error or result.outcome))
 
     def log(self, level=INFO, message='', no_label=False):
         '''
@@ -1,7 +1,9 @@
+from collections import defaultdict
 import logging
 from rdflib import RDF
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 
 from eulexistdb.manager import Manager
@@ -16,6 +18,7 @@ from eulxml import xmlmap
 from eulxml.xmlmap import mods
 from eulxml.xmlmap.eadmap import EAD_NAMESPACE, EncodedArchivalDescription
 
+from keep.common.batch import pool_map
 from keep.common.fedora import ArkPidDigitalObject, Repository
 from keep.common.rdfns import REPO
 from keep.common.utils import solr_interface
@@ -41,6 +44,13 @@ class SimpleCollection(Collectionv1_0, ArkPidDigitalObject):
 
     type = Relation(RDF.type)
 
+    OPTIONS_CACHE_KEY = 'simple-collection-options'
+    'cache key for simple collection choices used in search forms'
+    OPTIONS_CACHE_TIMEOUT = 60 * 5
+    '''seconds simple collection choices are cached; choices are also
+    cleared when a simple collection is indexed, but this limits how long
+    choices loaded before Solr is updated (or after a collection is
+    purged) are used'''
 
     # override this function and add additional functionality
     def __init__(self, *args, **kwargs):
@@ -59,6 +69,10 @@ class SimpleCollection(Collectionv1_0, ArkPidDigitalObject):
         # NOTE: we don't want to rely on other objects being indexed in Solr,
         # so index data should not use Solr to find any related object info
 
+        # collection is being reindexed; choices in search forms are
+        # reloaded from solr once the cached copy is cleared
+        cache.delete(SimpleCollection.OPTIONS_CACHE_KEY)
+
         # FIXME: is it worth splitting out descriptive index data here?
         data = super(SimpleCollection, self).index_data()
         data['object_type'] = 'collection'
@@ -69,6 +83,12 @@ class SimpleCollection(Collectionv1_0, ArkPidDigitalObject):
 
         return data
 
+    def partial_index_data(self, dsids):
+        '''Extend :meth:`keep.common.fedora.ArkPidDigitalObject.partial_index_data`
+        to clear cached simple collection choices, as for a full reindex.'''
+        cache.delete(SimpleCollection.OPTIONS_CACHE_KEY)
+        return super(SimpleCollection, self).partial_index_data(dsids)
+
     @staticmethod
     def find_by_pid(pid):
         'Find a collection by pid and return a dictionary with collection information.'
@@ -96,15 +116,44 @@ class SimpleCollection(Collectionv1_0, ArkPidDigitalObject):
         """
 
         # search solr for simpleCollection objects
-        solr = solr_interface()
-        solrquery = solr.query(content_model=SimpleCollection.COLLECTION_CONTENT_MODEL, \
-                    type=REPO.SimpleCollection)
+        solrquery = SimpleCollection.simple_collection_query()
 
         # by default, only returns 10; get everything
         # - solr response is a list of dictionary with collection info
         # use dictsort and regroup in templates for sorting where appropriate
         return solrquery.paginate(start=0, rows=1000).execute()
 
+    @staticmethod
+    def simple_collection_query():
+        """Solr query for all simpleCollection objects, sorted by label.
+
+        :returns: :class:`sunburnt.SolrSearch`
+        """
+        solr = solr_interface()
+        return solr.query(content_model=SimpleCollection.COLLECTION_CONTENT_MODEL,
+                          type=REPO.SimpleCollection).sort_by('label')
+
+    @staticmethod
+    def simple_collections_indexed(repo=None):
+        """Check whether the Solr index is current for simpleCollection
+        objects, by comparing the number of indexed simple collections
+        with a single RIsearch lookup of objects with the simpleCollection
+        type.  Browse views should only fall back to loading simple
+        collections from Fedora when this returns False.
+
+        :param repo: optional :class:`eulfedora.server.Repository`
+            to use an existing connection with specific credentials
+        :rtype: bool
+        """
+        if repo is None:
+            repo = Repository()
+        try:
+            total = len(list(repo.risearch.get_subjects(RDF.type, REPO.SimpleCollection)))
+        except RequestFailed as rf:
+            # if fedora can't be queried, assume the index is usable
+            logger.error('Error counting simple collections in Fedora: %s' % rf)
+            return True
+        return SimpleCollection.simple_collection_query().count() == total
 
     @property
     def total_members(self):
@@ -118,6 +167,22 @@ class SimpleCollection(Collectionv1_0, ArkPidDigitalObject):
     def members(self):
         return [DigitalObject(self.api, pid=p) for p in self.member_pids]
 
+    def solr_members_query(self):
+        'Solr query for all items that are members of this simple collection'
+        solr = solr_interface()
+        # member items index the simple collection as a uri
+        return solr.query(simpleCollection_id=self.uri)
+
+    def members_indexed(self):
+        '''Check whether the Solr index is current for members of this
+        simple collection, by comparing the number of indexed members
+        with the hasMember relations in RELS-EXT.  Member listings should
+        only fall back to :attr:`member_pids` when this returns False.
+
+        :rtype: bool
+        '''
+        return self.solr_members_query().count() == self.total_members
+
     @models.permalink
     def get_absolute_url(self):
         'Absolute url to view this object within the site'
@@ -187,7 +252,18 @@ class CollectionObject(Collectionv1_1, ArkPidDigitalObject):
             # if either has changed, update DC and object label to keep them in sync
             self._update_dc()
 
-        return super(CollectionObject, self).save(logMessage)
+        # items and collections are indexed with data from their
+        # collection or archive, which must be updated when it changes
+        propagate = self.exists and \
+            (self.mods.isModified() or self.rels_ext.isModified())
+
+        saved = super(CollectionObject, self).save(logMessage)
+
+        if propagate:
+            # NOTE: imported here to avoid a circular import
+            from keep.collection.tasks import queue_propagate_collection_changes
+            queue_propagate_collection_changes(self)
+        return saved
 
     def solr_items_query(self):
         'Solr query for all items in this collection'
@@ -195,6 +271,20 @@ class CollectionObject(Collectionv1_1, ArkPidDigitalObject):
         # search for all items that belong to this collection
         return solr.query(collection_id=self.pid)
 
+    def has_researcher_content(self, exclude=None):
+        '''Check if any items in this collection are accessible to
+        researchers (have researcher access rights and an access copy),
+        based on the items indexed in Solr.
+
+        :param exclude: optional item pid to leave out, e.g. when the
+            item has changed and has not yet been reindexed
+        '''
+        q = self.solr_items_query().filter(researcher_access=True,
+                                           has_access_copy=True)
+        if exclude is not None:
+            q = q.exclude(pid=exclude)
+        return q.count() > 0
+
     def old_dm_media_path(self):
         'Path to media in old Digital Masters interface.'
         logger.info("IN COLLECTION-OLD-DM-MEDIA-PATH")
@@ -347,6 +437,19 @@ class CollectionObject(Collectionv1_1, ArkPidDigitalObject):
         for coll in collections:
             yield repo.get_object(coll['pid'], type=CollectionObject)
 
+    def index_data(self):
+        '''Extend the default
+        :meth:`eulfedora.models.DigitalObject.index_data` method to
+        flag collections with researcher-accessible items, so that
+        researcher views can filter collections without a Solr join.'''
+        data = super(CollectionObject, self).index_data()
+        # NOTE: unlike other index data, this depends on items being
+        # indexed in Solr; it is kept current when items change by
+        # keep.collection.tasks.update_researcher_content
+        if self.collection:
+            data['has_researcher_content'] = self.has_researcher_content()
+        return data
+
     def index_data_descriptive(self):
         '''Extend the default
         :meth:`eulfedora.models.DigitalObject.index_data_descriptive`
@@ -367,6 +470,36 @@ class CollectionObject(Collectionv1_1, ArkPidDigitalObject):
 
         return data
 
+    def item_index_data(self, archive=True):
+        '''Index data copied from this collection onto the items that
+        belong to it (see :meth:`keep.audio.models.AudioObject.index_data`).
+        Fields with a value of None should be removed from the item.
+
+        :param archive: include archive fields; these are only indexed
+            on audio and video items, not on disk images or arrangement
+            objects
+        '''
+        data = {
+            'collection_label': self.label,
+            'collection_source_id': self.mods.content.source_id,
+        }
+        if archive:
+            data.update({
+                'archive_id': None,
+                'archive_label': None,
+                'archive_short_name': None,
+            })
+            data.update(self._index_data_archive())
+        return data
+
+    def archive_index_data(self):
+        '''Index data copied from this object, as an archive, onto the
+        collections and items that belong to it.'''
+        return {
+            'archive_label': self.label,
+            'archive_short_name': self.mods.content.short_name
+        }
+
     def _index_data_archive(self):
         data = {}
         archive = self.collection
@@ -503,3 +636,35 @@ class FindingAid(XmlModel, EncodedArchivalDescription):
         return FindingAid.objects.get(archdesc__did__unitid__identifier=id,
                 repository=archive_name)
 
+    @staticmethod
+    def find_by_unitids(ids, archive_name, batch_size=100, workers=None):
+        '''Retrieve Finding Aids for a list of archive unitids in a single
+        repository.  Rather than querying for each id separately, ids are
+        queried in batches, with up to ``workers`` batch queries running
+        concurrently.
+
+        :param ids: list of integer unitids
+        :param archive_name: name of the repository/subarea (numbering scheme)
+        :param batch_size: maximum number of ids to include in a single query
+        :param workers: number of concurrent queries (see
+            :meth:`keep.common.batch.pool_map`)
+        :returns: dictionary of integer unitid to a list of matching
+            :class:`~keep.collection.models.FindingAid` instances; ids
+            with no match are not included
+        '''
+        ids = [unicode(id) for id in ids]
+        batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+        def query(batch):
+            return list(FindingAid.objects.filter(
+                archdesc__did__unitid__identifier__in=batch,
+                repository=archive_name))
+
+        found = defaultdict(list)
+        for batch, results, err in pool_map(query, batches, workers):
+            if err is not None:
+                raise err
+            for fa in results:
+                found[fa.archdesc.did.unitid.identifier].append(fa)
+        return dict(found)
+
@@ -2,19 +2,29 @@ from __future__ import absolute_import
 
 from celery import shared_task
 from celery.utils.log import get_task_logger
-from eulfedora.rdfns import relsext as relsextns
 
 from keep.arrangement.models import ArrangementObject
-from keep.collection.models import SimpleCollection
+from keep.collection.models import CollectionObject, SimpleCollection
+from keep.common.batch import ThreadRepositories, pool_map
 from keep.common.fedora import Repository
+from keep.common.models import BatchItemResult
+from keep.common.utils import solr_atomic_update, solr_cursor, solr_interface
 
 from eulcommon.djangoextras.taskresult.models import TaskResult
 
 logger = get_task_logger(__name__)
 
 
-@shared_task
-def batch_set_status(pid, status):
+@shared_task(bind=True)
+def batch_set_status(self, pid, status):
+    '''Update the status of every member of a processing batch
+    (:class:`~keep.collection.models.SimpleCollection`) using a bounded
+    pool of worker threads.  The outcome for each item is recorded in
+    :class:`~keep.common.models.BatchItemResult`, so if any items fail
+    the task can be run again and only the failed or unprocessed items
+    will be updated.  Recorded results are cleared once every item and
+    the batch itself have been updated.
+    '''
     repo = Repository()
     batch = repo.get_object(pid, type=SimpleCollection)
     # keep track of totals for success and failure
@@ -33,21 +43,42 @@ def batch_set_status(pid, status):
     else:
         state = codes[status]
 
-    # finp all pids associated with this object
-    pids = list(batch.rels_ext.content.objects(batch.uriref, relsextns.hasMember))
+    # results from a previous run with a different status are no longer relevant
+    BatchItemResult.objects.filter(batch=batch.pid).exclude(action=status).delete()
+    # skip any items already updated by a previous run of this status change
+    completed = BatchItemResult.completed(batch.pid, status)
+
+    # find all pids associated with this object
+    pids = [p.replace('info:fedora/', '') for p in batch.member_pids]
+    todo = [p for p in pids if p not in completed]
+    success = len(pids) - len(todo)
+    if success:
+        logger.info('Resuming status update for %s; %d items already updated'
+                    % (batch.pid, success))
+
+    # use credentials from batch object for all member updates
+    repos = ThreadRepositories.from_api(batch.api)
+    log_message = 'Marking as %s via SimpleCollection %s' % (status, batch.pid)
 
-    for pid in pids:
-        try:
-            # pass in api from batch object to retain user credentials
-            obj = ArrangementObject(batch.api, pid)
-            obj.state = state
-            obj.save('Marking as %s via SimpleCollection %s'
-                     % (status, batch.pid))
+    def update_item(item_pid):
+        obj = repos.repo.get_object(item_pid, type=ArrangementObject)
+        obj.state = state
+        obj.save(log_message)
+
+    total = len(pids)
+    for item_pid, result, err in pool_map(update_item, todo):
+        BatchItemResult.record(batch.pid, status, item_pid, err)
+        if err is None:
             success += 1
-        except Exception as e:
-            logger.error('Failed to update %s : %s' % (pid, e))
+        else:
+            logger.error('Failed to update %s : %s' % (item_pid, err))
             error += 1
 
+        # report progress when running as a queued task
+        if self.request.id:
+            self.update_state(state='PROGRESS',
+                meta={'current': success + error, 'total': total})
+
     info = {
         'success': success,
         'error': error,
@@ -58,13 +89,11 @@ def batch_set_status(pid, status):
 
     summary_msg = "Successfully updated %(success)s item%(success_plural)s; error updating %(error)s" % info
 
-    # if not all objects were updated correctly, exit with error
+    # if not all objects were updated correctly, exit with error;
+    # queueing the same status again will retry only the failed items
     if error > 0:
         raise Exception(summary_msg)
 
-    # FIXME: this is based on the current form logic, but could leave
-    # some member items stranded in a different status than the parent object
-
     batch.mods.content.create_restrictions_on_access()
     batch.mods.content.restrictions_on_access.text = status  # Change collection status
     try:
@@ -72,10 +101,15 @@ def batch_set_status(pid, status):
                    % info)
 
     except Exception as e:
-        save_err = "Error updating SimpleCollection %s - %s" % (obj.pid, e)
+        save_err = "Error updating SimpleCollection %s - %s" % (batch.pid, e)
         logger.error(save_err)
         raise Exception('%s; %s' % (save_err, summary_msg))
 
+    # the run is complete; applying this status again later (e.g. after
+    # items are edited individually or new members are added) should
+    # update every item
+    BatchItemResult.objects.filter(batch=batch.pid).delete()
+
     # success
     return 'Successfully updated %(success)s item%(success_plural)s' % info
 
@@ -89,3 +123,142 @@ def queue_batch_status_update(batch_obj, status):
                         url=batch_obj.get_absolute_url(), task_id=task.task_id)
     result.save()
 
+
+@shared_task
+def update_researcher_content(collection_pids, item_pid=None, visible_in=None):
+    '''Reindex collections in Solr to update the
+    ``has_researcher_content`` flag after a member item has changed.
+    Items are not reindexed immediately when they are saved, so the
+    changed item is not counted based on its (possibly stale) index
+    data; instead, ``visible_in`` indicates the collection where it is
+    now accessible to researchers, if any.
+
+    :param collection_pids: list of collection pids to update, e.g. the
+        item's current collection and the collection it was removed from
+    :param item_pid: pid of the item that changed
+    :param visible_in: pid of the collection where the changed item is
+        now accessible to researchers
+    '''
+    repo = Repository()
+    docs = []
+    for pid in collection_pids:
+        coll = repo.get_object(pid, type=CollectionObject)
+        if not coll.exists:
+            continue
+        data = coll.index_data()
+        data['has_researcher_content'] = pid == visible_in or \
+            coll.has_researcher_content(exclude=item_pid)
+        docs.append(data)
+
+    if docs:
+        solr_interface().add(docs)
+    logger.info('Updated researcher content flag for %d collection(s) after change to %s'
+                % (len(docs), item_pid))
+
+
+def indexed_collection(pid):
+    '''Find the collection an item is currently indexed under in Solr,
+    i.e. before any unsaved changes to its collection membership.
+
+    :returns: collection pid, or None if not indexed, not in a
+        collection, or Solr is not available
+    '''
+    solr = solr_interface()
+    try:
+        results = solr.query(pid=pid).field_limit('collection_id') \
+                      .paginate(rows=1).execute()
+    except Exception as err:
+        logger.error('Error finding indexed collection for %s: %s' % (pid, err))
+        return None
+    if results:
+        return results[0].get('collection_id')
+
+
+def queue_researcher_content_update(item, visible, previous_collection=None):
+    '''Queue :meth:`update_researcher_content` for the collection(s)
+    affected by a change to an item's rights, access copy, or collection
+    membership.  Errors are logged rather than raised, since the item
+    itself has already been saved; the flag will be corrected the next
+    time the collection is reindexed.
+
+    :param item: saved item (e.g., :class:`~keep.audio.models.AudioObject`)
+    :param visible: True if the item is now accessible to researchers
+    :param previous_collection: pid of the collection the item was
+        in before it was saved, if it has changed
+    '''
+    current = item.collection.pid if item.collection else None
+    collections = [pid for pid in set([current, previous_collection])
+                   if pid is not None]
+    if not collections:
+        return
+    try:
+        update_researcher_content.delay(collections, item.pid,
+                                        current if visible else None)
+    except Exception as err:
+        logger.error('Error queueing researcher content update for %s: %s'
+                     % (item.pid, err))
+
+
+def _index_value_changed(indexed, value):
+    # compare as text, since solr returns values based on the field type
+    if value is None or indexed is None:
+        return value is not indexed
+    return unicode(indexed) != unicode(value)
+
+
+@shared_task
+def propagate_collection_changes(pid):
+    '''Update the Solr index data that is copied from a collection
+    onto its member items (collection label and number, archive), or
+    from an archive onto its collections and items (archive label and
+    short name), when the collection or archive has changed.  Only the
+    copied fields of documents with out-of-date values are updated,
+    using Solr atomic updates, so the dependent objects do not need to
+    be reindexed.
+
+    :returns: number of documents updated
+    '''
+    # imported here to avoid a circular import
+    from keep.audio.models import AudioObject
+    from keep.video.models import Video
+
+    repo = Repository()
+    obj = repo.get_object(pid, type=CollectionObject)
+    solr = solr_interface()
+
+    # archive fields are only indexed on audio and video items; other
+    # items (disk images, arrangement objects) only get collection fields
+    archive_items = solr.Q(solr.Q(content_model=AudioObject.AUDIO_CONTENT_MODEL) |
+                           solr.Q(content_model=Video.VIDEO_CONTENT_MODEL))
+    items = solr.query(collection_id=pid)
+    dependents = [
+        (items.filter(archive_items), obj.item_index_data()),
+        (items.exclude(archive_items), obj.item_index_data(archive=False)),
+        (solr.query(archive_id=pid), obj.archive_index_data()),
+    ]
+    updates = []
+    for q, values in dependents:
+        q = q.field_limit(['pid'] + values.keys())
+        for doc in solr_cursor(q):
+            changed = dict((field, value) for field, value in values.iteritems()
+                           if _index_value_changed(doc.get(field), value))
+            if changed:
+                changed['pid'] = doc['pid']
+                updates.append(changed)
+
+    if updates:
+        solr_atomic_update(updates, solr=solr)
+    logger.info('Updated index data for %d object(s) copied from %s'
+                % (len(updates), pid))
+    return len(updates)
+
+
+def queue_propagate_collection_changes(obj):
+    '''Queue :meth:`propagate_collection_changes` for a collection or
+    archive that has been saved.  Errors are logged rather than raised,
+    since the object itself has already been saved.'''
+    try:
+        propagate_collection_changes.delay(obj.pid)
+    except Exception as err:
+        logger.error('Error queueing index update for objects in %s: %s'
+                     % (obj.pid, err))
@@ -10,6 +10,7 @@ from sunburnt import sunburnt
 from unittest import skip
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import reverse, resolve
 from django.contrib import messages
 from django.test import Client
@@ -26,11 +27,14 @@ from keep.accounts.models import ResearcherIP
 from keep.arrangement.models import ArrangementObject
 from keep.collection.fixtures import FedoraFixtures
 from keep.collection import forms as cforms
+from keep.collection.management.commands import load_ead, repair_arks
 from keep.collection import views
 from keep.collection.models import CollectionObject, FindingAid, SimpleCollection
 from keep.collection.views import _objects_by_type
-from keep.collection.tasks import batch_set_status
-from keep.common.fedora import DigitalObject, Repository
+from keep.collection.tasks import batch_set_status, update_researcher_content, \
+    queue_researcher_content_update, propagate_collection_changes
+from keep.common.fedora import DigitalObject, LocalMODS, Repository
+from keep.common.models import BatchItemResult
 from keep.common.rdfns import REPO
 from keep.testutil import KeepTestCase
 
@@ -257,6 +261,36 @@ class CollectionObjectTest(KeepTestCase):
         self.assertEqual([], found,
             'when solr returns no results, find by collection number returns an empty list')
 
+    @patch('keep.collection.models.solr_interface')
+    def test_has_researcher_content(self, mock_solr_interface):
+        mocksolr = mock_solr_interface.return_value
+        mocksolr.query.return_value = mocksolr.query
+        for method in ['filter', 'exclude']:
+            getattr(mocksolr.query, method).return_value = mocksolr.query
+
+        obj = self.repo.get_object(type=CollectionObject)
+        obj.pid = 'coll:1'
+        mocksolr.query.count.return_value = 2
+        self.assertTrue(obj.has_researcher_content())
+        mocksolr.query.assert_called_with(collection_id=obj.pid)
+        mocksolr.query.filter.assert_called_with(researcher_access=True,
+                                                 has_access_copy=True)
+        self.assertEqual(0, mocksolr.query.exclude.call_count,
+                         'items should not be excluded unless requested')
+
+        mocksolr.query.count.return_value = 0
+        self.assertFalse(obj.has_researcher_content(exclude='item:1'))
+        mocksolr.query.exclude.assert_called_with(pid='item:1')
+
+        # flag is indexed only for collections that belong to an archive
+        with patch.object(obj, 'has_researcher_content', Mock(return_value=True)):
+            data = obj.index_data()
+            self.assert_('has_researcher_content' not in data)
+            with patch('keep.collection.models.CollectionObject.collection',
+                       Mock(CollectionObject)):
+                data = obj.index_data()
+                self.assertEqual(True, data['has_researcher_content'])
+
     def test_index_data_descriptive(self):
         # test descriptive metadata used for indexing objects in solr
 
@@ -660,9 +694,15 @@ class CollectionViewsTest(KeepTestCase):
         self.assertEqual(code, expected, 'Expected %s but returned %s for %s (non-existing pid)'
                              % (expected, code, edit_url))
 
+    @patch('keep.collection.views.SolrPaginator')
     @patch('keep.collection.views.solr_interface')
-    def test_search(self, mock_solr_interface):
+    def test_search(self, mock_solr_interface, mockpaginator):
         search_url = reverse('collection:search')
+        mockpage = NonCallableMock()
+        mockpaginator.return_value.page.return_value = mockpage
+        mockpage.object_list = []
+        mockpage.has_other_pages = False
+        mockpage.paginator.count = 0
 
         # using a mock for sunburnt so we can inspect method calls,
         # simulate search results, etc.
@@ -730,26 +770,27 @@ class CollectionViewsTest(KeepTestCase):
             self.assertEqual(collection.pid, response.context['search_info']['Archive']['pid'],
                 'archive label should be included in search info for display to user')
 
-        # shortcut to set the solr return value
-        # NOTE: call order here has to match the way methods are called in view
+        # results are paginated
         solrquery = mock_solr_interface.return_value.query.return_value.sort_by.return_value
-        solr_exec = solrquery.paginate.return_value.execute
+        mockpaginator.assert_called_with(solrquery, 50)
 
         # no match
         # - set mock solr to return an empty result list
-        solr_exec.return_value = []
         response = self.client.get(search_url, {'collection-title': 'not-a-collection'})
         self.assertContains(response, 'no results',
                 msg_prefix='Message should be displayed to user when search finds no matches')
 
         # when a result has  no title, default text should be displayed
         # sunburnt solr queries return a list of dictionaries; return one with an empty title
-        solr_exec.return_value = [
+        mockpage.object_list = [
             {'pid': 'foo', 'creator': 'so and so', 'title': ''}
         ]
+        mockpage.paginator.count = 1
+        mockpage.start_index = mockpage.end_index = 1
         response = self.client.get(search_url,)
         self.assertContains(response, '(no title present)',
             msg_prefix='when a collection has no title, default no-title text is displayed')
+        self.assertContains(response, 'Displaying collection 1')
 
     @patch('keep.collection.views.solr_interface')
     @patch('keep.collection.views.CollectionObject')
@@ -820,9 +861,10 @@ class CollectionViewsTest(KeepTestCase):
         researchip = ResearcherIP(name='test client', ip_address='127.0.0.1')
         researchip.save()
         response = self.client.get(archive_url)
-        # check that join query for researcher perms was called
-        mockcollq.join.assert_any_call('collection_id', 'pid', researcher_access=True)
-        mockcollq.join.assert_any_call('collection_id', 'pid', has_access_copy=True)
+        # check that collections were filtered for researcher content
+        mockcollq.filter.assert_any_call(has_researcher_content=True)
+        self.assertEqual(0, mockcollq.join.call_count,
+            'researcher archive list should not require a join query')
         researchip.delete()
 
     @patch('keep.collection.views.solr_interface')
@@ -927,7 +969,7 @@ class CollectionViewsTest(KeepTestCase):
 
 
     @patch('keep.collection.views.solr_interface')
-    @patch('keep.collection.views.Paginator')
+    @patch('keep.collection.views.SolrPaginator')
     def test_browse_archive(self, mockpaginator, mocksolr_interface):
         browse_url = reverse('collection:browse-archive', kwargs={'archive': 'marbl'})
 
@@ -1048,9 +1090,8 @@ class CollectionViewsTest(KeepTestCase):
             mock_item_collection_query.return_value = mocksolr.query
             response = self.client.get(browse_url)
 
-            # check that join query for researcher perms was called
-            mocksolr.query.join.assert_any_call('collection_id', 'pid', researcher_access=True)
-            mocksolr.query.join.assert_any_call('collection_id', 'pid', has_access_copy=True)
+            # check that collections were filtered for researcher content
+            mocksolr.query.filter.assert_any_call(has_researcher_content=True)
 
             # basic check that page renders (i.e., no permissions redirect)
             self.assertContains(response, archive_obj.label,
@@ -1117,13 +1158,15 @@ class CollectionViewsTest(KeepTestCase):
                 % (expected, got, audit_url))
         self.assertContains(response, 'justification>audit trail test</audit')
 
-    @patch('keep.collection.views.solr_interface')
-    def test_suggest(self, mock_solr_interface):
+    @patch('keep.common.suggest.solr_cursor')
+    @patch('keep.common.suggest.solr_interface')
+    def test_suggest(self, mock_solr_interface, mock_solr_cursor):
         solrquery = mock_solr_interface.return_value
         solrquery.query.return_value = solrquery
         solrquery.filter.return_value = solrquery
         solrquery.field_limit.return_value = solrquery
-        solrquery.sort_by.return_value = solrquery
+        views.collection_suggestions.expire()
+        views.collection_suggestions.last_indexed = None
 
         self.client.login(**ADMIN_CREDENTIALS)
         suggest_url = reverse('collection:suggest')
@@ -1143,44 +1186,49 @@ class CollectionViewsTest(KeepTestCase):
         result = [
             {'pid': 'test:1', 'title': 'Rushdie Papers'},
             {'pid': 'test:2', 'title': 'Salman Rushdie Collection',
-             'source_id': '1000', 'archive_short_name': 'MARBL',
-             'creator': 'Rushdie, Salman'}
+             'source_id': 1000, 'archive_short_name': 'MARBL',
+             'creator': ['Rushdie, Salman']},
+            {'pid': 'test:3', 'title': 'Seamus Heaney Papers',
+             'source_id': 960, 'archive_short_name': 'MARBL'},
         ]
-        solrquery.__getitem__.return_value = result
+        mock_solr_cursor.return_value = result
         # search term, inspect query args and json result
-        response = self.client.get(suggest_url, {'term': '1000 rushd'})
+        response = self.client.get(suggest_url, {'term': 'rushd'})
         solrquery.filter.assert_any_call(content_model=CollectionObject.COLLECTION_CONTENT_MODEL)
         solrquery.filter.assert_any_call(archive_id__any=True)
         solrquery.field_limit.assert_called_with(['pid', 'source_id', 'title',
-                                                        'archive_short_name', 'creator', 'archive_id'])
-        solrquery.sort_by.assert_called_with('-score')
-        # search terms
-        solrquery.query.assert_called_with(['1000', 'rushd*'])
+                                                  'archive_short_name', 'creator',
+                                                  'archive_id', 'timestamp'])
         data = json.loads(response.content)
-        self.assertEqual(result[0]['pid'], data[0]['value'],
+        self.assertEqual(2, len(data))
+        # numbered collections first
+        self.assertEqual(result[1]['pid'], data[0]['value'],
                          'value should be set as item pid')
-        self.assertEqual(' ' + result[0]['title'], data[0]['label'],
-                         'label sholud be item title when there is no source id')
-        # second result has source id
         self.assertEqual('%s %s' % (result[1]['source_id'],
-                                    result[1]['title']), data[1]['label'],
+                                    result[1]['title']), data[0]['label'],
                          'label should be source id + title when both are present')
+        self.assertEqual(' ' + result[0]['title'], data[1]['label'],
+                         'label sholud be item title when there is no source id')
         # description - should use creator, if any
-        self.assertEqual('', data[0]['desc'])
-        self.assertEqual(result[1]['creator'], data[1]['desc'])
+        self.assertEqual(result[1]['creator'], data[0]['desc'])
+        self.assertEqual('', data[1]['desc'])
         # category - should use archive short name, if any
-        self.assertEqual('', data[0]['category'])
-        self.assertEqual(result[1]['archive_short_name'], data[1]['category'])
+        self.assertEqual(result[1]['archive_short_name'], data[0]['category'])
+        self.assertEqual('', data[1]['category'])
 
-        # if wildcard returns no results, should try again without wildcard
-        solrquery.count.return_value = 0
-        response = self.client.get(suggest_url, {'term': '1000 rushd'})
-        # should query with the wildcard, then without when count is 0
-        solrquery.query.assert_any_call(['1000', 'rushd*'])
-        solrquery.query.assert_any_call(['1000', 'rushd'])
+        # all words must match; case-insensitive; number or creator match
+        response = self.client.get(suggest_url, {'term': '1000 salm'})
+        data = json.loads(response.content)
+        self.assertEqual(['test:2'], [d['value'] for d in data])
+        response = self.client.get(suggest_url, {'term': 'PAPERS '})
+        data = json.loads(response.content)
+        self.assertEqual(['test:3', 'test:1'], [d['value'] for d in data])
+
+        # collections are loaded from solr once, not on every request
+        self.assertEqual(1, mock_solr_cursor.call_count)
 
     @patch('keep.collection.views.CollectionObject.solr_items_query')
-    @patch('keep.collection.views.Paginator')
+    @patch('keep.collection.views.SolrPaginator')
     def test_view(self, mockpaginator, mocksolr_items):
         # configure solr response for collection item query
         mockquery = mocksolr_items.return_value
@@ -1567,6 +1615,28 @@ class SimpleCollectionTest(KeepTestCase):
         # should not raise exception by trying to set type
         self.repo.get_object(type=SimpleCollection, pid='foo:1')
 
+    def test_index_data_clears_options(self):
+        # cached search form choices are cleared when a collection is indexed
+        cache.set(SimpleCollection.OPTIONS_CACHE_KEY, [('', '')])
+        self.simple_collection_1.index_data()
+        self.assertEqual(None, cache.get(SimpleCollection.OPTIONS_CACHE_KEY))
+
+        cache.set(SimpleCollection.OPTIONS_CACHE_KEY, [('', '')])
+        self.simple_collection_1.partial_index_data(['DC'])
+        self.assertEqual(None, cache.get(SimpleCollection.OPTIONS_CACHE_KEY))
+
+    @patch('keep.collection.models.solr_interface')
+    def test_members_indexed(self, mock_solr_interface):
+        mocksolr = mock_solr_interface.return_value
+        mocksolr.query.return_value.count.return_value = 0
+        # no members in rels-ext and none indexed
+        self.assertTrue(self.simple_collection_1.members_indexed())
+        mocksolr.query.assert_called_with(simpleCollection_id=self.simple_collection_1.uri)
+
+        # index has members that are not in rels-ext
+        mocksolr.query.return_value.count.return_value = 2
+        self.assertFalse(self.simple_collection_1.members_indexed())
+
     def test__objects_by_type(self):
         # run an RIsearch query with flush changes so test does not fail
         # when syncUpdates is turned off
@@ -1688,3 +1758,237 @@ class TestBatchUpdateStatusTask(KeepTestCase):
         # item state unchanged
         self.assertEqual(self.repo.get_object(pid=self.arrangement_1.pid, type=ArrangementObject).state, 'I')
         self.assertEqual(self.repo.get_object(pid=self.arrangement_2.pid, type=ArrangementObject).state, 'I')
+
+    def test_batch_update_resume(self):
+        status = 'Processed'
+        # simulate a previous partial run where only the first item succeeded
+        BatchItemResult.record(self.simple_collection_2.pid, status, self.arrangement_1.pid)
+        BatchItemResult.record(self.simple_collection_2.pid, status, self.arrangement_2.pid,
+                               Exception('failed'))
+
+        result = batch_set_status(self.simple_collection_2.pid, status)
+        self.assertEqual('Successfully updated 2 items', result)
+        # previously completed item is not updated again
+        self.assertEqual(self.repo.get_object(pid=self.arrangement_1.pid, type=ArrangementObject).state, 'I')
+        # previously failed item is retried
+        self.assertEqual(self.repo.get_object(pid=self.arrangement_2.pid, type=ArrangementObject).state, 'A')
+        # results are cleared once the whole batch has been updated
+        self.assertEqual(set(), BatchItemResult.completed(self.simple_collection_2.pid, status))
+
+        # applying the same status again updates every item
+        arr1 = self.repo.get_object(pid=self.arrangement_1.pid, type=ArrangementObject)
+        arr1.state = 'I'
+        arr1.save()
+        result = batch_set_status(self.simple_collection_2.pid, status)
+        self.assertEqual('Successfully updated 2 items', result)
+        self.assertEqual(self.repo.get_object(pid=self.arrangement_1.pid, type=ArrangementObject).state, 'A')
+        self.assertFalse(BatchItemResult.objects.filter(batch=self.simple_collection_2.pid).exists())
+
+
+class TestResearcherContentTask(KeepTestCase):
+
+    @patch('keep.collection.tasks.solr_interface')
+    @patch('keep.collection.tasks.Repository')
+    def test_update_researcher_content(self, mockrepo, mock_solr_interface):
+        mockcoll = Mock(CollectionObject)
+        mockcoll.exists = True
+        mockcoll.index_data.return_value = {'pid': 'coll:1'}
+        mockcoll.has_researcher_content.return_value = False
+        mockrepo.return_value.get_object.return_value = mockcoll
+        mocksolr = mock_solr_interface.return_value
+
+        # item now visible in collection; no need to check other items
+        update_researcher_content(['coll:1'], 'item:1', visible_in='coll:1')
+        mocksolr.add.assert_called_with([{'pid': 'coll:1', 'has_researcher_content': True}])
+        self.assertEqual(0, mockcoll.has_researcher_content.call_count)
+
+        # item no longer visible; check other items, excluding changed item
+        update_researcher_content(['coll:1'], 'item:1')
+        mockcoll.has_researcher_content.assert_called_with(exclude='item:1')
+        mocksolr.add.assert_called_with([{'pid': 'coll:1', 'has_researcher_content': False}])
+
+        # collections that don't exist are skipped
+        mocksolr.reset_mock()
+        mockcoll.exists = False
+        update_researcher_content(['coll:1'], 'item:1')
+        self.assertEqual(0, mocksolr.add.call_count)
+
+    @patch('keep.collection.tasks.update_researcher_content')
+    def test_queue_researcher_content_update(self, mocktask):
+        item = Mock(AudioObject)
+        item.pid = 'item:1'
+        item.collection.pid = 'coll:2'
+
+        queue_researcher_content_update(item, True, 'coll:1')
+        args, kwargs = mocktask.delay.call_args
+        self.assertEqual(set(['coll:1', 'coll:2']), set(args[0]))
+        self.assertEqual(('item:1', 'coll:2'), args[1:])
+
+        queue_researcher_content_update(item, False)
+        mocktask.delay.assert_called_with(['coll:2'], 'item:1', None)
+
+        # errors queueing the task should not be raised
+        mocktask.delay.side_effect = Exception('broker unavailable')
+        queue_researcher_content_update(item, False)
+
+
+class TestPropagateCollectionChanges(KeepTestCase):
+
+    def test_item_index_data(self):
+        repo = Repository()
+        obj = repo.get_object(type=CollectionObject)
+        obj.label = 'Rushdie papers'
+        obj.mods.content.source_id = 1000
+        with patch.object(obj, '_index_data_archive',
+                          Mock(return_value={'archive_id': 'archive:1'})):
+            data = obj.item_index_data()
+        self.assertEqual('Rushdie papers', data['collection_label'])
+        self.assertEqual(1000, data['collection_source_id'])
+        self.assertEqual('archive:1', data['archive_id'])
+        # archive fields not set on the collection should be removed from items
+        self.assertEqual(None, data['archive_label'])
+        # archive fields are not copied to items that don't index them
+        self.assertNotIn('archive_id', obj.item_index_data(archive=False))
+
+    @patch('keep.collection.tasks.solr_atomic_update')
+    @patch('keep.collection.tasks.solr_cursor')
+    @patch('keep.collection.tasks.solr_interface')
+    @patch('keep.collection.tasks.Repository')
+    def test_propagate(self, mockrepo, mock_solr_interface, mock_solr_cursor,
+                       mock_atomic_update):
+        mockcoll = Mock(CollectionObject)
+        def item_index_data(archive=True):
+            data = {'collection_label': 'New label', 'collection_source_id': 100}
+            if archive:
+                data['archive_id'] = 'archive:1'
+            return data
+        mockcoll.item_index_data.side_effect = item_index_data
+        mockcoll.archive_index_data.return_value = {
+            'archive_label': 'Coll label', 'archive_short_name': None}
+        mockrepo.return_value.get_object.return_value = mockcoll
+        mocksolr = mock_solr_interface.return_value
+
+        mock_solr_cursor.side_effect = [
+            # audio and video items in the collection
+            [{'pid': 'item:1', 'collection_label': 'Old label',
+              'collection_source_id': u'100', 'archive_id': 'archive:1'},
+             {'pid': 'item:2', 'collection_label': 'New label',
+              'collection_source_id': u'100', 'archive_id': 'archive:1'}],
+            # other items in the collection, without archive fields
+            [{'pid': 'item:3', 'collection_label': 'Old label',
+              'collection_source_id': u'100'}],
+            # objects in the archive
+            [{'pid': 'coll:2', 'archive_label': 'Coll label',
+              'archive_short_name': 'CL'}],
+        ]
+        self.assertEqual(3, propagate_collection_changes('coll:1'))
+        mocksolr.query.assert_any_call(collection_id='coll:1')
+        mocksolr.query.assert_any_call(archive_id='coll:1')
+        mock_atomic_update.assert_called_with([
+            {'pid': 'item:1', 'collection_label': 'New label'},
+            {'pid': 'item:3', 'collection_label': 'New label'},
+            {'pid': 'coll:2', 'archive_short_name': None}
+        ], solr=mocksolr)
+
+        # nothing to update
+        mock_atomic_update.reset_mock()
+        mock_solr_cursor.side_effect = [[], [], []]
+        self.assertEqual(0, propagate_collection_changes('coll:1'))
+        self.assertEqual(0, mock_atomic_update.call_count)
+
+
+class TestLoadEad(KeepTestCase):
+
+    def _mock_findingaid(self, unitid, title='A collection'):
+        fa = MagicMock()
+        fa.archdesc.did.unitid.identifier = unitid
+        fa.unittitle.short = title
+        return fa
+
+    @patch('keep.collection.models.FindingAid.objects')
+    def test_find_by_unitids(self, mockobjects):
+        fa1, fa2, fa2b = [self._mock_findingaid(i) for i in (1, 2, 2)]
+        mockobjects.filter.side_effect = [[fa1, fa2], [fa2b]]
+        found = FindingAid.find_by_unitids([1, 2, 3], 'MARBL', batch_size=2,
+                                           workers=1)
+        self.assertEqual({1: [fa1], 2: [fa2, fa2b]}, found)
+        mockobjects.filter.assert_any_call(
+            archdesc__did__unitid__identifier__in=[u'1', u'2'], repository='MARBL')
+        mockobjects.filter.assert_any_call(
+            archdesc__did__unitid__identifier__in=[u'3'], repository='MARBL')
+
+    @patch.object(load_ead.FindingAid, 'find_by_unitids')
+    @patch.object(load_ead.Command, 'existing_collections')
+    @patch.object(load_ead.Command, 'get_numbering')
+    def test_command(self, mockgetnumbering, mockexisting, mockfind):
+        numbering = mockgetnumbering.return_value
+        numbering.pid = 'archive:1'
+        numbering.mods.content.title = 'MARBL'
+        mockexisting.return_value = {488: ['coll:1']}
+        fa = self._mock_findingaid(1000)
+        mockfind.return_value = {1000: [fa], 5: [Mock(), Mock()]}
+
+        cmd = load_ead.Command()
+        cmd.handle('marbl', '488', '1000', '5', '7', verbosity=0, dryrun=True,
+                   idfile=None, workers=1)
+        mockexisting.assert_called_with('archive:1')
+        # existing collection should not be looked up in eXist
+        mockfind.assert_called_with([1000, 5, 7], 'MARBL', workers=1)
+        fa.generate_collection.assert_called_with()
+        coll = fa.generate_collection.return_value
+        self.assertEqual(numbering, coll.collection)
+        self.assertEqual(0, coll.save.call_count, 'dry run should not save')
+
+
+class TestRepairArks(KeepTestCase):
+
+    def setUp(self):
+        self.cmd = repair_arks.Command()
+        self.cmd.options = {'verbosity': 0, 'dry_run': False}
+        self.cmd.pidman = Mock()
+
+    def _pidman_page(self, noids, count=6, per_page=2):
+        return {'results_count': count, 'max_results_per_page': per_page,
+                'results': [{'pid': noid, 'targets': [
+                    {'access_uri': 'http://pid.co/ark:/25593/%s' % noid}]}
+                    for noid in noids]}
+
+    def test_ark_targets(self):
+        # more noids needed than pages: pidman domain is paged through
+        self.cmd.pidman.search_pids.side_effect = [
+            self._pidman_page(['a', 'b']), self._pidman_page(['c', 'd']),
+            self._pidman_page(['e', 'f'])]
+        self.cmd.pidman.get_ark_target.return_value = {
+            'access_uri': 'http://pid.co/ark:/25593/x'}
+        targets = self.cmd.ark_targets(['a', 'c', 'd', 'x'])
+        self.assertEqual('http://pid.co/ark:/25593/c', targets['c'])
+        self.assertEqual(4, len(targets))
+        # all pages are searched for noids that have not been found
+        self.assertEqual(3, self.cmd.pidman.search_pids.call_count)
+        # noid not found in the domain is looked up individually
+        self.cmd.pidman.get_ark_target.assert_called_once_with(noid='x', qualifier='')
+
+        # only a few noids needed: individual lookups
+        self.cmd.pidman.reset_mock()
+        self.cmd.pidman.search_pids.side_effect = [self._pidman_page(['a', 'b'])]
+        targets = self.cmd.ark_targets(['a'])
+        self.assertEqual(1, self.cmd.pidman.search_pids.call_count)
+        self.cmd.pidman.get_ark_target.assert_called_once_with(noid='a', qualifier='')
+
+    def test_repair_ark(self):
+        self.cmd.targets = {'123': 'http://pid.co/ark:/25593/123'}
+        obj = Mock(pid='keep:123', noid='123', ark_access_uri=None)
+        obj.mods.content = LocalMODS()
+        self.cmd.repair_ark(obj)
+        self.assertEqual('http://pid.co/ark:/25593/123', obj.mods.content.ark_uri)
+        self.assertEqual('ark:/25593/123', obj.mods.content.ark)
+
+        # object with an ARK is not modified
+        obj.mods.content = LocalMODS()
+        obj.ark_access_uri = 'http://pid.co/ark:/25593/other'
+        self.cmd.repair_ark(obj)
+        self.assertEqual(0, len(obj.mods.content.identifiers))
+
+        # no target found
+        obj = Mock(pid='keep:456', noid='456', ark_access_uri=None)
+        self.assertRaises(Exception, self.cmd.repair_ark, obj)
@@ -21,7 +21,6 @@ from eulcommon.djangoextras.auth import permission_required_with_403, \
     permission_required_with_ajax, user_passes_test_with_403
 from eulcommon.djangoextras.http import HttpResponseSeeOtherRedirect
 from eulfedora.views import raw_datastream, raw_audit_trail
-from eulcommon.searchutil import search_terms
 from eulfedora.util import RequestFailed
 from eulexistdb.exceptions import DoesNotExist, ReturnedMultiple
 
@@ -32,7 +31,9 @@ from keep.collection.models import CollectionObject, SimpleCollection, \
     FindingAid
 from keep.collection.tasks import queue_batch_status_update
 from keep.common.fedora import Repository, history_view
+from keep.common.paginator import SolrPaginator
 from keep.common.rdfns import REPO
+from keep.common.suggest import CollectionSuggestions
 from keep.common.utils import solr_interface
 
 
@@ -40,6 +41,9 @@ logger = logging.getLogger(__name__)
 
 json_serializer = DjangoJSONEncoder(ensure_ascii=False, indent=2)
 
+# in-memory index of collections for autocomplete
+collection_suggestions = CollectionSuggestions()
+
 
 def view_some_collections(user):
     '''Check that a user *either* can view all collections or has the
@@ -71,15 +75,8 @@ def view(request, pid):
     # (includes researcher-accessible content filter when appropriate)
     q = filter_by_perms(q, request.user)
 
-    # if current user can only view researcher-accesible collections and
-    # no items were found, they don't have permission to view this collection
-    if not request.user.has_perm('collection.view_collection') and \
-           request.user.has_perm('collection.view_researcher_collection') and \
-           q.count() == 0:
-       return prompt_login_or_403(request)
-
     # paginate the solr result set
-    paginator = Paginator(q, 30)
+    paginator = SolrPaginator(q, 30)
     try:
         page = int(request.GET.get('page', '1'))
     except ValueError:
@@ -89,6 +86,14 @@ def view(request, pid):
     except (EmptyPage, InvalidPage):
         results = paginator.page(paginator.num_pages)
 
+    # if current user can only view researcher-accesible collections and
+    # no items were found, they don't have permission to view this collection
+    # (count is from the page request, so no separate count query is needed)
+    if not request.user.has_perm('collection.view_collection') and \
+           request.user.has_perm('collection.view_researcher_collection') and \
+           paginator.count == 0:
+       return prompt_login_or_403(request)
+
     # url parameters for pagination links
     url_params = request.GET.copy()
     if 'page' in url_params:
@@ -338,9 +343,28 @@ def search(request):
 
         solr = solr_interface()
         solrquery = solr.query(**search_opts).sort_by('source_id')
-        # TODO: eventually, we'll need proper pagination here;
-        # for now, set a large max to return everything
-        context['results'] = solrquery.paginate(start=0, rows=1000).execute()
+
+        # paginate the solr result set
+        paginator = SolrPaginator(solrquery, 50)
+        try:
+            page = int(request.GET.get('page', '1'))
+        except ValueError:
+            page = 1
+        try:
+            results = paginator.page(page)
+        except (EmptyPage, InvalidPage):
+            results = paginator.page(paginator.num_pages)
+
+        # url parameters for pagination links
+        url_params = request.GET.copy()
+        if 'page' in url_params:
+            del url_params['page']
+
+        context.update({
+            'results': results.object_list,
+            'page': results,
+            'url_params': urlencode(url_params)
+        })
 
     # if the form was not valid, set the current instance of the form
     # as the sidebar form instance to display the error
@@ -413,8 +437,7 @@ def list_archives(request, archive=None):
      # - depending on permissions, restrict to collections with researcher audio
     if not request.user.has_perm('collection.view_collection') and \
            request.user.has_perm('collection.view_researcher_collection'):
-        q = q.join('collection_id', 'pid', researcher_access=True)
-        q = q.join('collection_id', 'pid', has_access_copy=True)
+        q = q.filter(has_researcher_content=True)
 
     facets = q.execute().facet_counts.facet_fields
 
@@ -485,8 +508,7 @@ def browse_archive(request, archive):
      # - depending on permissions, restrict to collections with researcher audio
     if not request.user.has_perm('collection.view_collection') and \
            request.user.has_perm('collection.view_researcher_collection'):
-        q = q.join('collection_id', 'pid', researcher_access=True)
-        q = q.join('collection_id', 'pid', has_access_copy=True)
+        q = q.filter(has_researcher_content=True)
 
     logger.debug('Solr query for collections in %s: %s' % \
                  (archive, unicode(q.query_obj)))
@@ -505,7 +527,7 @@ def browse_archive(request, archive):
         q = q.query(source_id=collection_filter)
 
     # paginate the solr result set
-    paginator = Paginator(q, 30)
+    paginator = SolrPaginator(q, 30)
     try:
         page = int(request.GET.get('page', '1'))
     except ValueError:
@@ -520,12 +542,11 @@ def browse_archive(request, archive):
     if 'page' in url_params:
         del url_params['page']
 
-    # there are currently two dates in the index; for display,
-    # we want single date or date range only (not fedora timestamp)
+    # for display, we want single date or date range only
     date_re = re.compile('\d{4}(-\d{4})?$')
     for c in collections.object_list:
         c['collection_dates'] = []
-        for d in c['date']:
+        for d in c.get('date', []):
             if date_re.match(d):
                 c['collection_dates'].append(d)
 
@@ -601,6 +622,26 @@ def simple_edit(request, pid=None):
     if pid is not None:
         context['obj'] = obj
 
+        # list members from solr when the index is current; otherwise
+        # fall back to the member pids in RELS-EXT
+        if obj.members_indexed():
+            members = obj.solr_members_query() \
+                         .field_limit(['pid', 'title', 'label', 'state']) \
+                         .sort_by('pid')
+        else:
+            members = [{'pid': p.replace('info:fedora/', '')}
+                       for p in obj.member_pids]
+
+        paginator = Paginator(members, 50)
+        try:
+            page = int(request.GET.get('page', '1'))
+        except ValueError:
+            page = 1
+        try:
+            context['members'] = paginator.page(page)
+        except (EmptyPage, InvalidPage):
+            context['members'] = paginator.page(paginator.num_pages)
+
     return TemplateResponse(request, 'collection/simple_edit.html', context)
 
 
@@ -622,12 +663,35 @@ def _objects_by_type(type_uri, type=None):
 
 @permission_required_with_403("common.arrangement_allowed")
 def simple_browse(request):
+    '''Browse a paginated list of
+    :class:`~keep.collection.models.SimpleCollection` objects.  Uses
+    the Solr index when it is current, and only falls back to loading
+    every simple collection from Fedora when the index is stale.
+    '''
     response_code = None
     context = {}
     try:
-        objs = _objects_by_type(REPO.SimpleCollection, SimpleCollection)
-        objs = sorted(objs, key=lambda s: s.label)
-        context['objs'] = objs
+        if SimpleCollection.simple_collections_indexed():
+            objs = SimpleCollection.simple_collection_query() \
+                                   .field_limit(['pid', 'label'])
+        else:
+            logger.warning('Solr index is stale for simple collections; ' +
+                           'loading simple collections from Fedora')
+            objs = _objects_by_type(REPO.SimpleCollection, SimpleCollection)
+            objs = sorted(objs, key=lambda s: s.label)
+
+        # paginate the solr result set or fallback list of objects
+        paginator = Paginator(objs, 50)
+        try:
+            page = int(request.GET.get('page', '1'))
+        except ValueError:
+            page = 1
+        try:
+            results = paginator.page(page)
+        except (EmptyPage, InvalidPage):
+            results = paginator.page(paginator.num_pages)
+        context['objs'] = results
+
     except RequestFailed:
         response_code = 500
         # FIXME: this is duplicate logic from generic search view
@@ -647,8 +711,10 @@ def simple_browse(request):
 def collection_suggest(request):
     '''Suggest view for collections, for use with use with `JQuery UI
     Autocomplete`_ widget.  Searches for collections on all of the
-    terms passed in (as multiple keywords), similar to the way the
-    combined search works.
+    terms passed in (as multiple keywords), matching case-insensitively
+    at the start of any word.  Collections are matched from an
+    in-memory index (see :mod:`keep.common.suggest`) rather than by
+    querying Solr for each request.
 
     .. _JQuery UI Autocomplete: http://jqueryui.com/demos/autocomplete/
 
@@ -660,38 +726,15 @@ def collection_suggest(request):
     suggestions = []
 
     if term:
-        # If the search term doesn't end in space, add a wildcard to
-        # the last word to allow for partial word matching.
-        if term[-1] != ' ':
-            term += '*'
-        terms = search_terms(term)
-
-        solr = solr_interface()
-        # common query parameters and options
-        base_query = solr.query() \
-                    .filter(content_model=CollectionObject.COLLECTION_CONTENT_MODEL) \
-                    .field_limit(['pid', 'source_id', 'title', 'archive_short_name',
-                                  'creator', 'archive_id']) \
-                    .sort_by('-score')
-
-        q = base_query.query(terms)
-
-        # NOTE: there seems to be a Lucene/Solr bug/quirk where adding
-        # a wildcard at the end of a word causes Solr not to match the
-        # exact word (even though docs indicate this should work).
-        # As a work-around, if we added a * and got 0 results,
-        # try the search again without the wildcard.
-        if term[-1] == '*' and q.count() == 0:
-            q = base_query.query(search_terms(term[:-1]))
-            #Exclude archival collection (Top-level library)
-        q=q.filter(archive_id__any=True)
-
+        # match collections from the in-memory index instead of querying solr;
+        # every word must match the start of a word in the collection number,
+        # title, archive, or creator
         suggestions = [{'label': '%s %s' % (c.get('source_id', ''),
                                             c.get('title', '(no title')),
                         'value': c['pid'],  # FIXME: do we need URI here?
                         'category':c.get('archive_short_name', ''),
                         'desc': c.get('creator', '')}
-                       for c in q[:15]]
+                       for c in collection_suggestions.suggest(term, limit=15)]
 
     return HttpResponse(json_serializer.encode(suggestions),
                          content_type='application/json')
@@ -0,0 +1,103 @@
+'''
+Utilities for applying an operation to many repository objects at once,
+using a bounded pool of worker threads.  Most of the time spent updating
+Fedora objects is waiting on HTTP requests, so a small number of threads
+is enough to keep Fedora busy without overloading it.
+
+Configure the default number of workers with **BATCH_WORKERS** in
+Django settings.
+'''
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+
+from django.conf import settings
+
+from keep.common import instrumentation
+from keep.common.fedora import Repository
+
+logger = logging.getLogger(__name__)
+
+
+def default_workers():
+    'Number of worker threads to use when not otherwise specified.'
+    return getattr(settings, 'BATCH_WORKERS', 4)
+
+
+class ThreadRepositories(object):
+    '''Provide a separate :class:`~keep.common.fedora.Repository` for
+    each worker thread, all connecting with the same Fedora credentials,
+    so that HTTP sessions are not shared across threads.
+
+    :param username: fedora username (optional)
+    :param password: fedora password (optional)
+    '''
+
+    def __init__(self, username=None, password=None):
+        self.username = username
+        self.password = password
+        self._local = threading.local()
+
+    @classmethod
+    def from_api(cls, api):
+        '''Initialize with the credentials from an existing Fedora api,
+        e.g. the api of an object loaded with a logged-in user's
+        credentials.'''
+        return cls(username=api.username, password=api.password)
+
+    @property
+    def repo(self):
+        'Repository for the current thread'
+        repo = getattr(self._local, 'repo', None)
+        if repo is None:
+            repo = Repository(username=self.username, password=self.password)
+            self._local.repo = repo
+        return repo
+
+
+def pool_map(func, items, workers=None):
+    '''Apply a function to every item using a bounded pool of worker
+    threads.  Exceptions raised by the function are caught and returned
+    rather than raised, so that one failed item does not stop the rest
+    of the batch.
+
+    Results are generated in completion order, which allows callers
+    to record outcomes and report progress as the batch runs.  Callers
+    should do any database work with the results in the calling thread.
+    Backend calls made by the workers are recorded on the calling
+    thread's request or task (see :mod:`keep.common.instrumentation`).
+
+    :param func: function that takes a single item
+    :param items: iterable of items to process
+    :param workers: number of worker threads; defaults to
+        :meth:`default_workers`.  With a single worker, items are
+        processed serially in the current thread.
+    :returns: generator of tuples of item, result, and exception
+        (exception is None on success)
+    '''
+    if workers is None:
+        workers = default_workers()
+
+    collectors = instrumentation.active()
+
+    def _call(item):
+        try:
+            with instrumentation.using(collectors):
+                return item, func(item), None
+        except Exception as err:
+            logger.debug('Error processing %s: %s' % (item, err))
+            return item, None, err
+
+    if workers <= 1:
+        for item in items:
+            yield _call(item)
+        return
+
+    pool = ThreadPool(workers)
+    try:
+        for result in pool.imap_unordered(_call, items):
+            yield result
+    finally:
+        # stop any outstanding work if the caller stops early
+        pool.terminate()
+        pool.join()
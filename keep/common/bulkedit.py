@@ -0,0 +1,167 @@
+'''
+Reusable engine for bulk metadata changes to Keep objects.
+
+A bulk edit applies a transformation function to a set of objects,
+found either by a list of pids or by a Solr query.  The transformation
+modifies an object's metadata in place (e.g. MODS, Rights, or DC); the
+object is only saved when one of its datastreams was actually modified.
+Updates are run through a bounded pool of worker threads, and the
+outcome for each object can be checkpointed in
+:class:`~keep.common.models.BatchItemResult` so that an interrupted
+bulk edit can be resumed.
+
+Example::
+
+    def set_rights(obj):
+        obj.rights.content.create_access_status()
+        obj.rights.content.access_status.code = '10'
+
+    editor = BulkEdit(set_rights, type=AudioObject, noact=True)
+    for result in editor.run(editor.pids_from_query(content_model=cmodel)):
+        print result.pid, result.outcome
+        print result.diff
+
+'''
+from collections import defaultdict, namedtuple
+import difflib
+import logging
+
+from eulfedora.models import XmlDatastreamObject
+
+from keep.common.batch import ThreadRepositories, pool_map
+from keep.common.fedora import DigitalObject
+from keep.common.models import BatchItemResult
+from keep.common.utils import solr_cursor, solr_interface
+
+logger = logging.getLogger(__name__)
+
+
+BulkEditResult = namedtuple('BulkEditResult', 'pid outcome diff error')
+'''Result of a bulk edit for a single object.  ``outcome`` is one of
+``updated``, ``unchanged``, ``not found``, or ``error``;
+``diff`` is a unified diff of modified XML datastreams (empty when
+nothing was changed).'''
+
+
+class BulkEdit(object):
+    '''Apply a metadata transformation to many objects.
+
+    :param transform: function that takes a single object and modifies
+        its metadata in place; return value is ignored
+    :param type: :class:`~eulfedora.models.DigitalObject` subclass to
+        initialize objects as
+    :param datastreams: names of the object datastreams that the
+        transformation may change, used to check for modifications and
+        to generate diffs; defaults to MODS, Rights, and DC (any that
+        are not defined on the object type are ignored)
+    :param log_message: fedora log message to use when saving objects
+    :param noact: if True, report changes but do not save anything
+    :param checkpoint: optional name for this bulk edit; when set, the
+        outcome for each object is recorded and objects that were already
+        successfully processed under the same name will be skipped
+    :param username: fedora username (optional)
+    :param password: fedora password (optional)
+    :param workers: number of worker threads; see
+        :meth:`keep.common.batch.default_workers`
+    '''
+
+    default_datastreams = ('mods', 'rights', 'dc')
+
+    def __init__(self, transform, type=DigitalObject, datastreams=None,
+                 log_message='bulk metadata edit', noact=False,
+                 checkpoint=None, username=None, password=None,
+                 workers=None):
+        self.transform = transform
+        self.type = type
+        if datastreams is None:
+            datastreams = self.default_datastreams
+        self.datastreams = [ds for ds in datastreams if hasattr(type, ds)]
+        self.log_message = log_message
+        self.noact = noact
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.repos = ThreadRepositories(username=username, password=password)
+        self.stats = defaultdict(int)
+
+    def pids_from_query(self, solrquery=None, rows=500, **kwargs):
+        '''Generate pids for all objects matching a Solr query.  Either
+        pass in a sunburnt query or keyword arguments to use as query
+        terms, e.g. ``content_model=AudioObject.AUDIO_CONTENT_MODEL``.
+
+        :param rows: number of results to retrieve from Solr at a time
+        '''
+        if solrquery is None:
+            solr = solr_interface()
+            solrquery = solr.query(**kwargs)
+        for r in solr_cursor(solrquery.field_limit('pid'), rows=rows):
+            yield r['pid']
+
+    def _serialize(self, obj, dsname):
+        ds = getattr(obj, dsname)
+        if isinstance(ds, XmlDatastreamObject) and ds.exists:
+            return ds.content.serialize(pretty=True).splitlines(True)
+        return []
+
+    def edit(self, pid):
+        '''Load, transform, and (unless in noact mode) save a single
+        object.
+
+        :returns: tuple of outcome and diff
+        '''
+        obj = self.repos.repo.get_object(pid, type=self.type)
+        if not obj.exists:
+            return 'not found', ''
+
+        # snapshot current content to generate a diff of any changes
+        original = dict((ds, self._serialize(obj, ds)) for ds in self.datastreams)
+
+        self.transform(obj)
+
+        diff = []
+        for ds in self.datastreams:
+            if getattr(obj, ds).isModified():
+                diff.extend(difflib.unified_diff(original[ds],
+                    self._serialize(obj, ds),
+                    fromfile='%s/%s' % (pid, getattr(obj, ds).id),
+                    tofile='%s/%s (modified)' % (pid, getattr(obj, ds).id)))
+        modified = any(getattr(obj, ds).isModified() for ds in self.datastreams)
+
+        if not modified:
+            return 'unchanged', ''
+        if not self.noact:
+            obj.save(self.log_message)
+        return 'updated', ''.join(diff)
+
+    def run(self, pids):
+        '''Apply the transformation to all the specified objects.
+        Statistics for outcomes are tallied in :attr:`stats`, including
+        the number of objects ``skipped`` because they were already
+        processed under the same checkpoint name.
+
+        :param pids: iterable of pids, e.g. from :meth:`pids_from_query`
+        :returns: generator of :class:`BulkEditResult`, in completion order
+        '''
+        completed = set()
+        if self.checkpoint is not None and not self.noact:
+            completed = BatchItemResult.completed(self.checkpoint, 'bulk-edit')
+
+        todo = []
+        for pid in pids:
+            self.stats['total'] += 1
+            if pid in completed:
+                self.stats['skipped'] += 1
+            else:
+                todo.append(pid)
+
+        for pid, result, err in pool_map(self.edit, todo, self.workers):
+            if err is not None:
+                outcome, diff = 'error', ''
+                logger.error('Error editing %s: %s' % (pid, err))
+            else:
+                outcome, diff = result
+            self.stats[outcome] += 1
+
+            if self.checkpoint is not None and not self.noact:
+                BatchItemResult.record(self.checkpoint, 'bulk-edit', pid, err)
+
+            yield BulkEditResult(pid, outcome, diff, err)
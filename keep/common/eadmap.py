@@ -1,3 +1,7 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
 from eulxml import xmlmap
 from eulxml.xmlmap import eadmap
 
@@ -121,4 +125,117 @@ def shortform_id(id, eadid=None):
     return id
 
 
+class SeriesTree(object):
+    """Series and subseries ids and titles for a single finding aid,
+    loaded from eXist in a single query and indexed by id, so that it
+    can be cached and used for lookups without querying eXist.  Use
+    :meth:`series_tree` to get a cached copy.
+
+    :param eadid: eadid of the finding aid
+    :param ark: ARK url for the finding aid
+    :param last_modified: last modification date of the EAD document
+        in eXist
+    """
 
+    def __init__(self, eadid, ark=None, last_modified=None):
+        self.eadid = eadid
+        self.ark = ark
+        self.last_modified = last_modified
+        #: list of series dictionaries, in document order; each series
+        #: has a list of subseries
+        self.series = []
+        #: dictionary of series and subseries details by full id; subseries
+        #: include the id of their parent series
+        self.by_id = {}
+        #: time the EAD document modification date was last checked
+        self.checked = None
+
+    @classmethod
+    def load(cls, eadid):
+        """Query eXist for the series and subseries of a finding aid.
+
+        :param eadid: eadid of the finding aid
+        """
+        queryset = Series.objects.filter(eadid=eadid) \
+                         .only('id', 'did__unittitle', 'subseries', 'eadid',
+                               'last_modified')
+        tree = cls(eadid)
+        for series in queryset:
+            if not tree.series:
+                tree.ark = series.eadid.url
+                tree.last_modified = series.last_modified
+            info = tree.add(series.id, series.title, series.short_id)
+            for subseries in series.subseries:
+                tree.add(subseries.id, subseries.title, subseries.short_id,
+                         series=info)
+        tree.checked = time.time()
+        return tree
+
+    def add(self, id, title, short_id, series=None):
+        """Add a series, or a subseries if the parent series is specified.
+
+        :returns: dictionary of series details
+        """
+        info = {'id': id, 'title': title, 'short_id': short_id}
+        if series is None:
+            info['subseries'] = []
+            self.series.append(info)
+        else:
+            info['series'] = series['id']
+            series['subseries'].append(info)
+        self.by_id[id] = info
+        return info
+
+    def parent(self, id):
+        """Parent series for a subseries id, if any."""
+        info = self.by_id.get(id)
+        if info is not None and 'series' in info:
+            return self.by_id[info['series']]
+
+    def choices(self):
+        """Selectable subseries (or series, if a series has no subseries)
+        as a list of dictionaries with id and display value, in document
+        order."""
+        choices = []
+        for series in self.series:
+            if series['subseries']:
+                for subseries in series['subseries']:
+                    choices.append({'id': subseries['id'],
+                                    'value': '%s: %s' % (series['title'], subseries['title'])})
+            else:
+                choices.append({'id': series['id'], 'value': series['title']})
+        return choices
+
+    def is_current(self):
+        """Check whether the EAD document has been modified in eXist since
+        this tree was loaded."""
+        try:
+            last_modified = Series.objects.filter(eadid=self.eadid) \
+                                  .only('last_modified')[0].last_modified
+        except IndexError:
+            last_modified = None
+        return last_modified == self.last_modified
+
+
+def series_tree(eadid):
+    """Get the :class:`SeriesTree` for a finding aid, from the django
+    cache if possible.  The cached copy is reused without querying eXist
+    for up to **EAD_SERIES_CHECK_INTERVAL** seconds (default 5 minutes),
+    after which the modification date of the EAD document is checked and
+    the tree is reloaded if the document has changed.
+
+    :param eadid: eadid of the finding aid
+    """
+    cache_key = 'ead-series-tree-%s' % eadid
+    tree = cache.get(cache_key)
+    interval = getattr(settings, 'EAD_SERIES_CHECK_INTERVAL', 300)
+    if tree is not None and time.time() - tree.checked < interval:
+        return tree
+
+    if tree is not None and tree.is_current():
+        tree.checked = time.time()
+    else:
+        tree = SeriesTree.load(eadid)
+    # no expiration; cached tree is replaced when the document changes
+    cache.set(cache_key, tree, None)
+    return tree
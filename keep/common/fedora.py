@@ -1,3 +1,4 @@
+from collections import defaultdict, OrderedDict
 from datetime import timedelta
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -5,6 +6,8 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
 from django.http import Http404
 from django.shortcuts import render
+import hashlib
+import threading
 import urllib, logging, urllib2
 
 from eulfedora import models, server
@@ -16,6 +19,7 @@ from pidservices.clients import parse_ark
 from pidservices.djangowrapper.shortcuts import DjangoPidmanRestClient
 
 from keep.accounts.views import decrypt
+from keep.common.instrumentation import InstrumentedClient
 from keep.common.utils import absolutize_url, solr_interface
 
 logger = logging.getLogger(__name__)
@@ -24,7 +28,7 @@ logger = logging.getLogger(__name__)
 
 # try to configure a pidman client to get pids.
 try:
-    pidman = DjangoPidmanRestClient()
+    pidman = InstrumentedClient(DjangoPidmanRestClient(), 'pidman')
 except:
     # if we're in dev mode then we can fall back on the fedora default
     # pid allocator. in non-dev, though, we really need pidman
@@ -34,6 +38,13 @@ except:
         raise
 
 
+#: Dublin Core fields included in default index data
+DC_INDEX_FIELDS = ['title', 'contributor', 'coverage', 'creator', 'date',
+                   'description', 'format', 'identifier', 'language',
+                   'publisher', 'relation', 'rights', 'source', 'subject',
+                   'type']
+
+
 # keep-specific mods with common fields for all Keep objects
 class LocalMODS(xmlmap.mods.MODS):
     # short-cut to type-specific identifiers
@@ -303,6 +314,42 @@ class ArkPidDigitalObject(models.DigitalObject):
         data['original_pid'] = self.pid
         return data
 
+    #: methods to generate the index data derived from a single datastream,
+    #: by datastream id; when only these datastreams are modified, the
+    #: index can be updated without regenerating the full index data
+    #: (see :mod:`keep.common.indexdata`)
+    partial_index_methods = {'DC': '_index_data_dc'}
+
+    def _index_data_dc(self):
+        data = dict.fromkeys(DC_INDEX_FIELDS)
+        data.update(models.DigitalObject.index_data_descriptive(self))
+        return data
+
+    def partial_index_data(self, dsids):
+        '''Generate index data for only the fields derived from the
+        specified datastreams, along with object properties such as label
+        and state.  Fields that should be removed from the index have a
+        value of None.
+
+        :param dsids: list of modified datastream ids
+        :returns: dictionary of index data, or None if any of the
+            datastreams require a full reindex
+        '''
+        if not all(dsid in self.partial_index_methods for dsid in dsids):
+            return None
+        data = {
+            'label': self.label,
+            'owner': self.owners,
+            'state': self.state,
+        }
+        # last modified won't be set unless the object exists in Fedora
+        if self.exists:
+            data['last_modified'] = self.modified.isoformat()
+        # DC first, since other datastreams may override DC fields
+        for dsid in sorted(dsids, key=lambda dsid: dsid != 'DC'):
+            data.update(getattr(self, self.partial_index_methods[dsid])())
+        return data
+
     def save(self, logMessage=None):
         # check for duplicate content before initial ingest
         if self._create and self.content_md5 is not None:
@@ -323,6 +370,14 @@ class ArkPidDigitalObject(models.DigitalObject):
         # update the ark label in pidman when there is a name conflict
         self.update_ark_label()
 
+        # record modified datastreams before saving, so that the next
+        # index update can use partial index data if possible
+        if not self._create:
+            # NOTE: imported here to avoid a circular import
+            from keep.common.indexdata import record_changes
+            record_changes(self, [dsid for dsid, ds in self.dscache.iteritems()
+                                  if ds.isModified()])
+
         return super(DigitalObject, self).save(logMessage)
 
     # map datastream IDs to human-readable names for inherited history_events method
@@ -430,21 +485,101 @@ def user_full_name(username):
     return name
 
 
+def request_credentials(request):
+    '''Fedora username and password for the current request, if a user
+    is logged in and the required credentials are available in the session;
+    otherwise returns a tuple of None, None.  The password is only
+    decrypted once per request.'''
+    if not hasattr(request, '_fedora_credentials'):
+        username = password = None
+        if request.user.is_authenticated() and \
+            'fedora_password' in request.session:
+                username = request.user.username
+                password = decrypt(request.session['fedora_password'])
+        request._fedora_credentials = (username, password)
+    return request._fedora_credentials
+
+
+# Fedora API connections for recently used credentials, per thread,
+# keyed on a hash of the credentials, least recently used first
+_api_connections = threading.local()
+
+#: default number of Fedora API connections kept open in each thread
+DEFAULT_CONNECTION_CACHE_SIZE = 5
+
+connection_stats = defaultdict(int)
+'''Counts of Fedora API connections ``created`` and ``reused`` by
+:class:`Repository` in the current process; see :meth:`prometheus_text`.'''
+_connection_stats_lock = threading.Lock()
+
+
+def _count_connection(outcome):
+    with _connection_stats_lock:
+        connection_stats[outcome] += 1
+
+
+def prometheus_text():
+    'Fedora API connection reuse counters in Prometheus text format.'
+    with _connection_stats_lock:
+        stats = dict(connection_stats)
+    lines = ['# HELP keep_fedora_connections_total Fedora API connections created or reused.',
+             '# TYPE keep_fedora_connections_total counter']
+    for outcome in ('created', 'reused'):
+        lines.append('keep_fedora_connections_total{outcome="%s"} %d'
+                     % (outcome, stats.get(outcome, 0)))
+    return '\n'.join(lines) + '\n'
+
+
 class Repository(server.Repository):
     """Extend the Django-ized Fedora Repository object to take a request object
     and connect to Fedora using a user is logged in and the required credentials
     are available.  If no request is specified or no user is logged in, falls
     back to the default logic, which uses Django settings for Fedora credentials.
+
+    The Fedora API connection (and its HTTP session, so that connections
+    to Fedora are kept alive) is reused for all Repository instances with
+    the same credentials in the same thread, across requests.  Each thread
+    keeps connections for the most recently used
+    **FEDORA_CONNECTION_CACHE_SIZE** sets of credentials (default 5).
+    Counts of connections created and reused are included in the
+    ``metrics`` view.
     """
 
     default_object_type = ArkPidDigitalObject
 
     def __init__(self, username=None, password=None, request=None):
-        if request is not None and request.user.is_authenticated() and \
-            'fedora_password' in request.session:
-                username = request.user.username
-                password = decrypt(request.session['fedora_password'])
+        if request is not None:
+            req_username, req_password = request_credentials(request)
+            if req_username is not None:
+                username, password = req_username, req_password
+        # default credentials, as determined by server.Repository
+        if username is None and password is None:
+            username = getattr(settings, 'FEDORA_USER', None)
+            if username is not None:
+                password = getattr(settings, 'FEDORA_PASSWORD', None)
+
+        if not hasattr(_api_connections, 'apis'):
+            _api_connections.apis = OrderedDict()
+        apis = _api_connections.apis
+        # don't keep plaintext passwords as cache keys
+        key = hashlib.sha1(u'\0'.join(unicode(val) for val in
+            [settings.FEDORA_ROOT, username, password]).encode('utf-8')).hexdigest()
+
         super(Repository, self).__init__(username=username, password=password)
+        api = apis.pop(key, None)
+        if api is None:
+            _count_connection('created')
+        else:
+            # the new api has an unused session, which does not open any
+            # connections; use the cached api with its open connections
+            self.api = api
+            _count_connection('reused')
+
+        # most recently used last; drop the least recently used
+        apis[key] = self.api
+        while len(apis) > getattr(settings, 'FEDORA_CONNECTION_CACHE_SIZE',
+                                  DEFAULT_CONNECTION_CACHE_SIZE):
+            apis.popitem(last=False)
 
 
 class ManagementRepository(server.Repository):
@@ -0,0 +1,326 @@
+'''
+Repository-wide fixity checks.
+
+Fixity checks re-read the binary content of an object's file datastreams
+from Fedora and compare the calculated checksum against the checksum
+stored in Fedora.  Object types that should be checked declare the
+datastreams to check with a ``fixity_datastreams`` attribute (a list of
+datastream attribute names); see
+:class:`keep.audio.models.AudioObject`, :class:`keep.video.models.Video`,
+and :class:`keep.file.models.DiskImage`.
+
+Checks are scheduled from Solr, oldest first: objects that have never
+been checked, and then objects in order of ``last_fixity_check``.  Each
+run checks a limited number of objects (**FIXITY_BATCH_SIZE**, default
+500) using a small pool of worker threads (**FIXITY_WORKERS**, default
+2), with content read at no more than **FIXITY_BANDWIDTH** bytes per
+second (default 50 MB/s) for all workers in a process, so that fixity
+checks do not starve other access to the repository storage.  Runs are
+intended to be started periodically by celery beat (see
+:meth:`keep.repoadmin.tasks.run_fixity_checks`).  At the default rate, a
+single worker process reads about 380 TB in a 90 day window, as long as
+runs are scheduled often enough to keep it busy; to check more content
+in the same window, run fixity checks on more than one celery node or
+raise the bandwidth limit outside of peak hours.
+
+Results are recorded as :class:`~keep.common.models.BatchItemResult`
+items, so that they are included when objects are reindexed, and the
+``last_fixity_check`` and ``last_fixity_result`` fields are updated on
+the indexed objects with Solr atomic updates.  The result is ``pass`` or
+``fail`` when every datastream could be checked; ``unverified`` when a
+datastream has no checksum in Fedora to check against; or ``error`` when
+the object could not be checked at all (e.g., because it has been
+purged, or Fedora was not available).  Objects are checked again in
+their turn regardless of the result.
+'''
+from datetime import datetime
+import hashlib
+import logging
+import threading
+import time
+
+from dateutil.parser import parse as parse_date
+from django.conf import settings
+from django.utils import timezone
+from django.utils.timezone import utc
+
+from keep.common.batch import ThreadRepositories, pool_map
+from keep.common.models import BatchItemResult, TaskLock
+from keep.common.utils import solr_interface, solr_atomic_update, solr_value
+
+logger = logging.getLogger(__name__)
+
+#: batch and action used to record fixity results as
+#: :class:`~keep.common.models.BatchItemResult` items
+FIXITY_BATCH = 'fixity'
+FIXITY_ACTION = 'fixity check'
+
+#: default maximum number of bytes per second read by fixity checks
+DEFAULT_BANDWIDTH = 50 * 1024 * 1024
+#: default number of objects checked in a single run
+DEFAULT_BATCH_SIZE = 500
+#: default number of worker threads
+DEFAULT_WORKERS = 2
+
+# size of chunks read from fedora when calculating checksums
+CHUNK_SIZE = 1024 * 1024
+# name of the lock used to prevent overlapping runs
+LOCK_NAME = 'fixity-check-running'
+# results other than pass and fail are recorded with messages starting
+# with the result name
+UNVERIFIED = 'unverified'
+ERROR = 'error'
+
+
+class Throttle(object):
+    '''Limit the rate at which data is read, across all threads that
+    share the throttle.  Readers call :meth:`consume` after reading each
+    chunk of data, and are delayed as needed to keep the total rate at
+    or below the configured number of bytes per second.
+
+    :param rate: maximum bytes per second; if not set, reading is not
+        limited
+    '''
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        # time when the data read so far will have been "paid for"
+        self._available = time.time()
+
+    def consume(self, nbytes):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.time()
+            start = max(now, self._available)
+            self._available = start + float(nbytes) / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+
+def process_throttle():
+    '''The :class:`Throttle` shared by all fixity checks in the current
+    process, configured by **FIXITY_BANDWIDTH**.'''
+    global _throttle
+    with _throttle_lock:
+        rate = getattr(settings, 'FIXITY_BANDWIDTH', DEFAULT_BANDWIDTH)
+        if _throttle is None or _throttle.rate != rate:
+            _throttle = Throttle(rate)
+    return _throttle
+
+
+def checksum_valid(ds, throttle=None):
+    '''Check a datastream by reading the content from Fedora and
+    comparing the calculated checksum with the checksum stored in Fedora.
+
+    :param ds: :class:`eulfedora.models.DatastreamObject`
+    :param throttle: optional :class:`Throttle` to limit read bandwidth
+    :returns: True if the checksum matches, False if it does not, or None
+        if Fedora does not have a checksum for the datastream
+    '''
+    if not ds.checksum or ds.checksum_type in (None, 'DISABLED'):
+        return None
+    # fedora checksum types are named like MD5, SHA-1, SHA-256
+    digest = hashlib.new(ds.checksum_type.replace('-', '').lower())
+    for chunk in ds.get_chunked_content(CHUNK_SIZE):
+        digest.update(chunk)
+        if throttle is not None:
+            throttle.consume(len(chunk))
+    return digest.hexdigest() == ds.checksum.lower()
+
+
+def check_object(obj, throttle=None):
+    '''Check all of the ``fixity_datastreams`` that exist on an object.
+
+    :returns: tuple of lists of ids for datastreams that failed the check
+        and datastreams that could not be checked because Fedora does not
+        have a checksum for them
+    '''
+    failed = []
+    unverified = []
+    for name in obj.fixity_datastreams:
+        ds = getattr(obj, name)
+        if not ds.exists:
+            continue
+        valid = checksum_valid(ds, throttle)
+        if valid is False:
+            failed.append(ds.id)
+        elif valid is None:
+            unverified.append(ds.id)
+    return failed, unverified
+
+
+def fixity_result(result):
+    '''Result name (``pass``, ``fail``, ``unverified``, or ``error``) for a
+    fixity check recorded as a :class:`~keep.common.models.BatchItemResult`.'''
+    if result.success:
+        return 'pass'
+    for name in (UNVERIFIED, ERROR):
+        if result.message.startswith('%s:' % name):
+            return name
+    return 'fail'
+
+
+def fixity_index_data(pid):
+    '''Index data for the most recent fixity check recorded for an
+    object, if any.'''
+    try:
+        result = BatchItemResult.objects.get(batch=FIXITY_BATCH,
+                                             action=FIXITY_ACTION, pid=pid)
+    except BatchItemResult.DoesNotExist:
+        return {}
+    updated = result.updated
+    if timezone.is_naive(updated):
+        updated = timezone.make_aware(updated, timezone.get_default_timezone())
+    return {
+        'last_fixity_check': solr_value(updated),
+        'last_fixity_result': fixity_result(result)
+    }
+
+
+def fixity_check_datetime(value):
+    '''Parse the date of a fixity check (e.g., a PREMIS event date, or
+    ``last_fixity_check`` from :meth:`fixity_index_data`) as a
+    timezone-aware datetime, so that dates with different timezone
+    offsets can be compared.  Dates without a timezone are assumed to be
+    in the default timezone.
+
+    :raises: ValueError if the date cannot be parsed
+    '''
+    date = parse_date(value)
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date, timezone.get_default_timezone())
+    return date
+
+
+class FixityChecker(object):
+    '''Select objects that are due for a fixity check from Solr, check
+    them, and record the results.
+
+    :param types: list of :class:`~keep.common.fedora.DigitalObject`
+        classes to be checked; each must define ``fixity_datastreams``
+    :param workers: number of worker threads (default:
+        **FIXITY_WORKERS**)
+    :param repos: optional :class:`~keep.common.batch.ThreadRepositories`;
+        defaults to the configured Fedora credentials
+    '''
+
+    #: number of results to update in Solr at once
+    update_batch_size = 100
+
+    def __init__(self, types, workers=None, repos=None):
+        self.types = dict((t.CONTENT_MODELS[0], t) for t in types)
+        if workers is None:
+            workers = getattr(settings, 'FIXITY_WORKERS', DEFAULT_WORKERS)
+        self.workers = workers
+        self.repos = repos or ThreadRepositories()
+        self.throttle = process_throttle()
+
+    def query(self):
+        solr = solr_interface()
+        cmodel_q = solr.Q()
+        for cmodel in self.types:
+            cmodel_q |= solr.Q(content_model=cmodel)
+        return solr.query(cmodel_q).field_limit(['pid', 'content_model'])
+
+    def select(self, limit):
+        '''Find the objects that were least recently checked, starting
+        with objects that have never been checked (in pid order, so that
+        the order is stable from one run to the next).
+
+        :returns: list of Solr result dictionaries with pid and content
+            model
+        '''
+        q = self.query()
+        docs = list(q.exclude(last_fixity_check__any=True)
+                     .sort_by('pid')
+                     .paginate(rows=limit).execute())
+        if len(docs) < limit:
+            docs.extend(q.filter(last_fixity_check__any=True)
+                         .sort_by('last_fixity_check')
+                         .paginate(rows=limit - len(docs)).execute())
+        return docs
+
+    def object_type(self, doc):
+        cmodels = doc['content_model']
+        if not isinstance(cmodels, list):
+            cmodels = [cmodels]
+        for cmodel in cmodels:
+            if cmodel in self.types:
+                return self.types[cmodel]
+
+    def check(self, doc):
+        obj = self.repos.repo.get_object(doc['pid'], type=self.object_type(doc))
+        return check_object(obj, self.throttle)
+
+    def run(self, limit=None):
+        '''Check the objects that are most overdue for a fixity check.
+        Failed checks are logged as errors.  Objects that could not be
+        checked (e.g., because Fedora was not available, or the object
+        was purged) are recorded with an ``error`` result, so that they
+        are not selected again until other objects have been checked.
+
+        :param limit: number of objects to check (default:
+            **FIXITY_BATCH_SIZE**)
+        :returns: dictionary of counts for pass, fail, unverified, and
+            error
+        '''
+        if limit is None:
+            limit = getattr(settings, 'FIXITY_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        stats = {'pass': 0, 'fail': 0, UNVERIFIED: 0, ERROR: 0}
+        updates = []
+        for doc, checked, err in pool_map(self.check, self.select(limit),
+                                          workers=self.workers):
+            pid = doc['pid']
+            if err is not None:
+                logger.warning('Error checking fixity for %s: %s' % (pid, err))
+                result = ERROR
+                message = '%s: %s' % (ERROR, err)
+            else:
+                failed, unverified = checked
+                if failed:
+                    logger.error('Fixity check failed for %s: %s' % (pid, ', '.join(failed)))
+                    result = 'fail'
+                    message = 'checksum mismatch: %s' % ', '.join(failed)
+                elif unverified:
+                    logger.warning('No checksum to verify for %s: %s'
+                                   % (pid, ', '.join(unverified)))
+                    result = UNVERIFIED
+                    message = '%s: no checksum for %s' % (UNVERIFIED, ', '.join(unverified))
+                else:
+                    result = 'pass'
+                    message = None
+            BatchItemResult.record(FIXITY_BATCH, FIXITY_ACTION, pid, error=message)
+            stats[result] += 1
+            updates.append({
+                'pid': pid,
+                'last_fixity_check': datetime.utcnow().replace(tzinfo=utc),
+                'last_fixity_result': result
+            })
+            if len(updates) >= self.update_batch_size:
+                solr_atomic_update(updates)
+                updates = []
+
+        if updates:
+            solr_atomic_update(updates)
+        return stats
+
+
+def run_fixity_checks(types, limit=None):
+    '''Run a :class:`FixityChecker` for the specified types, unless a
+    run is already in progress.
+
+    :returns: dictionary of counts, or None if a run is already in progress
+    '''
+    # lock expires in case a run is killed without releasing it
+    if not TaskLock.acquire(LOCK_NAME, 60 * 60 * 24):
+        return None
+    try:
+        return FixityChecker(types).run(limit=limit)
+    finally:
+        TaskLock.release(LOCK_NAME)
@@ -2,6 +2,7 @@ import logging
 from django import forms
 from django.conf import settings
 from django.contrib import messages
+from django.core.cache import cache
 import django.forms
 from django.utils.safestring import mark_safe
 from eulcommon.djangoextras.formfields import DynamicChoiceField
@@ -33,12 +34,19 @@ rights_access_options.insert(0, ('', ''))
 EMPTY_LABEL_TEXT = ''
 
 def _simple_collection_options():
-    sc_opts = SimpleCollection.simple_collections()
-
-    options = [('info:fedora/' + sc.get('pid', ''), '%s ' % ( sc.get('label', '')))
-    for sc in sorted(sc_opts, key=lambda k: k['label'])]
-
-    options.insert(0, ("", ""))
+    # choices are cached, since the search form is available on every page;
+    # cache is cleared when a simple collection is indexed, and expires
+    # quickly in case choices were loaded before the index was updated
+    options = cache.get(SimpleCollection.OPTIONS_CACHE_KEY)
+    if options is None:
+        sc_opts = SimpleCollection.simple_collections()
+
+        options = [('info:fedora/' + sc.get('pid', ''), '%s ' % ( sc.get('label', '')))
+        for sc in sorted(sc_opts, key=lambda k: k['label'])]
+
+        options.insert(0, ("", ""))
+        cache.set(SimpleCollection.OPTIONS_CACHE_KEY, options,
+                  SimpleCollection.OPTIONS_CACHE_TIMEOUT)
 
     return options
 
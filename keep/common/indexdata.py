@@ -0,0 +1,138 @@
+'''
+Partial index updates.
+
+Objects are indexed in Solr by :mod:`eulindexer`, which requests the
+full index data for an object from the ``indexdata`` view whenever the
+object is modified in Fedora.  Generating full index data is expensive
+(it reads the audit trail, related collections, and most of the
+metadata datastreams), but most edits only change one or two small
+metadata datastreams.
+
+When an object is saved, the datastreams being modified are recorded
+by :meth:`record_changes`.  If index data for all of them can be
+generated on its own (see
+:attr:`keep.common.fedora.ArkPidDigitalObject.partial_index_methods`),
+index data requests for the object are answered by
+:meth:`partial_index_document`, which applies just the affected fields
+to the document already stored in Solr, like a Solr atomic update.
+Changes are recorded for **PARTIAL_INDEX_TIMEOUT** seconds (default 10
+minutes), which should be longer than it takes eulindexer to process an
+update.
+'''
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from keep.common.fedora import user_full_name
+from keep.common.utils import solr_interface, solr_value
+
+logger = logging.getLogger(__name__)
+
+#: default number of seconds that changes are recorded
+DEFAULT_TIMEOUT = 60 * 10
+
+# solr fields that are generated by solr and should not be reindexed
+_generated_fields = ['_version_', 'timestamp', 'score']
+
+
+def _cache_key(pid):
+    return 'partial-index-%s' % pid
+
+
+def _full_cache_key(pid):
+    # flag for objects that require a full reindex; kept separate from
+    # the partial changes, so that saves of the same object that overlap
+    # can't replace the flag with partial changes
+    return 'partial-index-full-%s' % pid
+
+
+def record_changes(obj, dsids):
+    '''Record the datastreams modified on an object that is being saved,
+    along with the user saving it.  If any of the datastreams require a
+    full reindex, the object is flagged for a full reindex until it has
+    been reindexed, even if it is saved again with partial changes.
+
+    :param obj: :class:`~keep.common.fedora.ArkPidDigitalObject`
+    :param dsids: list of modified datastream ids
+    '''
+    timeout = getattr(settings, 'PARTIAL_INDEX_TIMEOUT', DEFAULT_TIMEOUT)
+    if not all(dsid in obj.partial_index_methods for dsid in dsids):
+        # users are only needed for partial index data
+        cache.set(_full_cache_key(obj.pid), True, timeout)
+        return
+
+    key = _cache_key(obj.pid)
+    changes = cache.get(key) or {'dsids': set(), 'users': set()}
+    changes['dsids'].update(dsids)
+    if obj.api.username:
+        changes['users'].add(obj.api.username)
+    cache.set(key, changes, timeout)
+
+
+def pending_changes(pid):
+    '''Changes recorded by :meth:`record_changes` for an object, if any.
+
+    :returns: dictionary with ``dsids`` (set of modified datastream ids,
+        or None if a full reindex is required) and ``users`` (set of
+        usernames)
+    '''
+    key, full_key = _cache_key(pid), _full_cache_key(pid)
+    recorded = cache.get_many([key, full_key])
+    if not recorded:
+        return None
+    changes = recorded.get(key) or {'dsids': set(), 'users': set()}
+    if recorded.get(full_key):
+        changes['dsids'] = None
+    return changes
+
+
+def clear_changes(pid):
+    '''Clear recorded changes, e.g. once an object has been fully
+    reindexed.'''
+    cache.delete_many([_cache_key(pid), _full_cache_key(pid)])
+
+
+def partial_index_document(obj, changes):
+    '''Generate index data for an object by updating the document
+    currently indexed in Solr with the fields affected by the recorded
+    changes.
+
+    :param obj: :class:`~keep.common.fedora.ArkPidDigitalObject`
+    :param changes: changes, as returned by :meth:`pending_changes`
+    :returns: dictionary of index data, or None if the object must be
+        fully reindexed
+    '''
+    if changes is None or changes['dsids'] is None or \
+       not hasattr(obj, 'partial_index_data'):
+        return None
+    data = obj.partial_index_data(changes['dsids'])
+    if data is None:
+        return None
+
+    solr = solr_interface()
+    results = solr.query(pid=obj.pid).paginate(rows=1).execute()
+    if not results:
+        return None
+    doc = dict(results[0])
+    for field in _generated_fields:
+        doc.pop(field, None)
+
+    # users who modified the object are normally found in the audit trail
+    users = set(doc.get('audit_trail_users', [])) | changes['users']
+    if users - set(doc.get('audit_trail_users', [])):
+        doc['audit_trail_users'] = sorted(users)
+        doc['users'] = [user_full_name(u) for u in doc['audit_trail_users']]
+
+    doc.update(data)
+    index_data = {}
+    for field, value in doc.iteritems():
+        if value is None:
+            continue
+        # convert values returned by solr so they can be serialized as json
+        if isinstance(value, (list, tuple, set)):
+            value = [solr_value(val) for val in value]
+        elif not isinstance(value, (bool, int, long, float)):
+            value = solr_value(value)
+        index_data[field] = value
+    return index_data
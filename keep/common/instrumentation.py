@@ -0,0 +1,398 @@
+'''
+Accounting for calls to the backend services that the Keep depends on
+(Fedora, Solr, pidman and eXist), so that it is possible to see how many
+calls a web request or celery task made, how long they took and how much
+data they returned.
+
+Calls are recorded on the :class:`Collector` for the current request or
+task (see :class:`keep.common.middleware.BackendCallsMiddleware` and the
+celery signal handlers below), and in process-wide latency histograms
+that can be exported in Prometheus text format with
+:meth:`prometheus_text`.  Histograms are kept in memory by each process,
+so a deployment with several web or worker processes reports metrics
+per process.
+
+Fedora and eXist calls are recorded using the signals sent by
+:mod:`eulfedora` and :mod:`eulexistdb`; Solr calls are recorded by
+:meth:`instrument_http`, which is used by
+:meth:`keep.common.utils.solr_interface`; pidman calls are recorded by
+wrapping the client in :class:`InstrumentedClient`.
+'''
+from collections import defaultdict
+import contextlib
+import json
+import logging
+import threading
+import time
+
+from celery.signals import task_prerun, task_postrun
+from django.conf import settings
+from eulfedora.api import api_called
+
+logger = logging.getLogger(__name__)
+
+#: upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class Collector(object):
+    '''Backend calls and named stages for a single request or task.
+    Calls may be recorded from several threads (e.g., by
+    :meth:`keep.common.batch.pool_map` workers).
+
+    :param kind: type of work being measured, e.g. request or task
+    :param name: name of the view or task
+    '''
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.started = time.time()
+        self.duration = None
+        #: per-backend dictionary of call count, time and bytes
+        self.calls = defaultdict(lambda: {'count': 0, 'time': 0.0, 'bytes': 0})
+        #: list of tuples of stage name and duration
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def record(self, backend, seconds, nbytes=0):
+        with self._lock:
+            stats = self.calls[backend]
+            stats['count'] += 1
+            stats['time'] += seconds
+            stats['bytes'] += nbytes
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages.append((name, seconds))
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.time() - self.started
+        return self.duration
+
+    def summary(self):
+        'Dictionary summary of the calls made, suitable for logging as JSON.'
+        with self._lock:
+            info = {
+                'type': self.kind,
+                'name': self.name,
+                'backends': dict((backend, dict(stats))
+                                 for backend, stats in self.calls.iteritems()),
+            }
+            if self.stages:
+                info['stages'] = [{'name': name, 'time': round(seconds, 4)}
+                                  for name, seconds in self.stages]
+        if self.duration is not None:
+            info['duration'] = round(self.duration, 4)
+        for stats in info['backends'].itervalues():
+            stats['time'] = round(stats['time'], 4)
+        return info
+
+    def server_timing(self):
+        '''Backend call times formatted as the value of a ``Server-Timing``
+        HTTP header, which browser developer tools display alongside
+        the request timeline.'''
+        with self._lock:
+            return ', '.join('%s;desc="%d call%s";dur=%.1f' %
+                             (backend, stats['count'],
+                              '' if stats['count'] == 1 else 's',
+                              stats['time'] * 1000)
+                             for backend, stats in sorted(self.calls.iteritems()))
+
+
+class Histogram(object):
+    'Cumulative latency histogram, as used by Prometheus.'
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class Metrics(object):
+    'Process-wide totals for backend calls, requests and tasks.'
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.backend_seconds = defaultdict(Histogram)
+        self.backend_bytes = defaultdict(int)
+        #: histograms keyed on kind (request or task) and name
+        self.durations = defaultdict(Histogram)
+        #: histograms keyed on task name and stage
+        self.stages = defaultdict(Histogram)
+
+    def record(self, backend, seconds, nbytes=0):
+        with self._lock:
+            self.backend_seconds[backend].observe(seconds)
+            self.backend_bytes[backend] += nbytes
+
+    def record_stage(self, name, stage, seconds):
+        with self._lock:
+            self.stages[(name, stage)].observe(seconds)
+
+    def record_duration(self, kind, name, seconds):
+        with self._lock:
+            self.durations[(kind, name)].observe(seconds)
+
+    def text(self):
+        '''Metrics in the Prometheus text exposition format.'''
+        lines = []
+        with self._lock:
+            lines.extend(_histogram_lines(
+                'keep_backend_call_seconds', 'Time spent in calls to backend services.',
+                [({'backend': backend}, hist)
+                 for backend, hist in sorted(self.backend_seconds.iteritems())]))
+            lines.append('# HELP keep_backend_response_bytes_total Bytes returned by backend services.')
+            lines.append('# TYPE keep_backend_response_bytes_total counter')
+            for backend, total in sorted(self.backend_bytes.iteritems()):
+                lines.append('keep_backend_response_bytes_total%s %d' %
+                             (_labels({'backend': backend}), total))
+            for kind in ('request', 'task'):
+                label = 'view' if kind == 'request' else 'task'
+                lines.extend(_histogram_lines(
+                    'keep_%s_seconds' % kind, 'Duration of %ss.' % kind,
+                    [({label: name}, hist)
+                     for (hist_kind, name), hist in sorted(self.durations.iteritems())
+                     if hist_kind == kind]))
+            lines.extend(_histogram_lines(
+                'keep_task_stage_seconds', 'Duration of named task stages.',
+                [({'task': name, 'stage': stage}, hist)
+                 for (name, stage), hist in sorted(self.stages.iteritems())]))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    return '{%s}' % ','.join('%s="%s"' % (key, unicode(val).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, val in sorted(labels.iteritems()))
+
+
+def _histogram_lines(metric, description, histograms):
+    if not histograms:
+        return []
+    lines = ['# HELP %s %s' % (metric, description),
+             '# TYPE %s histogram' % metric]
+    for labels, hist in histograms:
+        for bound, count in zip(BUCKETS, hist.buckets):
+            lines.append('%s_bucket%s %d' % (metric, _labels(dict(labels, le=repr(bound))), count))
+        lines.append('%s_bucket%s %d' % (metric, _labels(dict(labels, le='+Inf')), hist.count))
+        lines.append('%s_sum%s %f' % (metric, _labels(labels), hist.sum))
+        lines.append('%s_count%s %d' % (metric, _labels(labels), hist.count))
+    return lines
+
+
+#: process-wide metrics
+metrics = Metrics()
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current():
+    'The innermost active :class:`Collector` for this thread, if any.'
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def start(kind, name):
+    '''Start collecting backend calls for a request or task in the
+    current thread.  Collectors may be nested (e.g., a celery task run
+    eagerly within a request); calls are recorded on all active
+    collectors.
+
+    :returns: :class:`Collector`
+    '''
+    collector = Collector(kind, name)
+    _stack().append(collector)
+    return collector
+
+
+def finish(collector):
+    '''Stop collecting for a :class:`Collector` returned by
+    :meth:`start` and add its duration to the process-wide metrics.'''
+    stack = _stack()
+    if collector in stack:
+        stack.remove(collector)
+    collector.finish()
+    metrics.record_duration(collector.kind, collector.name, collector.duration)
+    return collector
+
+
+@contextlib.contextmanager
+def collect(kind, name):
+    'Context manager version of :meth:`start` and :meth:`finish`.'
+    collector = start(kind, name)
+    try:
+        yield collector
+    finally:
+        finish(collector)
+
+
+@contextlib.contextmanager
+def using(collectors):
+    '''Record calls in the current thread on collectors from another
+    thread, e.g. in a worker thread doing work for a request.
+
+    :param collectors: list of collectors, as returned by :meth:`active`
+    '''
+    stack = _stack()
+    previous = list(stack)
+    stack[:] = collectors
+    try:
+        yield
+    finally:
+        stack[:] = previous
+
+
+def active():
+    'List of the active collectors for this thread.'
+    return list(_stack())
+
+
+def record(backend, seconds, nbytes=0):
+    '''Record a single backend call on all active collectors and in the
+    process-wide metrics.
+
+    :param backend: name of the backend, e.g. fedora or solr
+    :param seconds: time taken by the call
+    :param nbytes: size of the response, if known
+    '''
+    for collector in _stack():
+        collector.record(backend, seconds, nbytes)
+    metrics.record(backend, seconds, nbytes)
+
+
+@contextlib.contextmanager
+def stage(name):
+    '''Time a named stage of a task (e.g., download or convert) and
+    record it on the current collector.'''
+    started = time.time()
+    try:
+        yield
+    finally:
+        seconds = time.time() - started
+        collector = current()
+        if collector is not None:
+            collector.add_stage(name, seconds)
+            metrics.record_stage(collector.name, name, seconds)
+
+
+def log_summary(collector, **extra):
+    '''Log a JSON summary of a finished collector.  Requests and tasks
+    that take longer than **INSTRUMENTATION_LOG_THRESHOLD** seconds
+    (default 1) are logged at INFO level, all others at DEBUG.'''
+    info = collector.summary()
+    info.update(extra)
+    threshold = getattr(settings, 'INSTRUMENTATION_LOG_THRESHOLD', 1.0)
+    level = logging.INFO if collector.duration >= threshold else logging.DEBUG
+    logger.log(level, json.dumps(info, sort_keys=True))
+
+
+def prometheus_text():
+    'Process-wide metrics in Prometheus text format.'
+    return metrics.text()
+
+
+def instrument_http(http, backend='solr'):
+    '''Record the time and response size of requests made with an
+    :class:`httplib2.Http` instance.
+
+    :param http: :class:`httplib2.Http` instance
+    :param backend: backend name to record calls under (default: solr)
+    :returns: the same instance, with its request method wrapped
+    '''
+    request = http.request
+
+    def timed_request(*args, **kwargs):
+        started = time.time()
+        response, content = request(*args, **kwargs)
+        record(backend, time.time() - started, len(content or ''))
+        return response, content
+    http.request = timed_request
+    return http
+
+
+class InstrumentedClient(object):
+    '''Wrap an API client object (e.g., the pidman client) so that every
+    method call is recorded as a backend call.
+
+    :param client: client object to wrap
+    :param backend: backend name to record calls under
+    '''
+
+    def __init__(self, client, backend):
+        self._client = client
+        self._backend = backend
+
+    def __getattr__(self, attr):
+        value = getattr(self._client, attr)
+        if not callable(value):
+            return value
+
+        def timed(*args, **kwargs):
+            started = time.time()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                record(self._backend, time.time() - started)
+        return timed
+
+
+def _fedora_called(sender, time_taken=0, method=None, response=None, **kwargs):
+    # risearch queries are signalled twice, once for the underlying
+    # http request and once for the query
+    if method == 'risearch':
+        return
+    nbytes = 0
+    if response is not None:
+        try:
+            nbytes = int(response.headers.get('content-length', 0))
+        except ValueError:
+            pass
+    record('fedora', time_taken, nbytes)
+
+api_called.connect(_fedora_called, dispatch_uid='keep-instrumentation-fedora')
+
+
+def _exist_called(sender, time_taken=0, **kwargs):
+    record('exist', time_taken)
+
+try:
+    from eulexistdb.db import xquery_called
+    xquery_called.connect(_exist_called, dispatch_uid='keep-instrumentation-exist')
+except ImportError:
+    # older versions of eulexistdb do not send a signal
+    pass
+
+
+def _task_started(sender=None, task_id=None, task=None, **kwargs):
+    collector = start('task', task.name if task is not None else sender)
+    collector.task_id = task_id
+    _local.tasks = getattr(_local, 'tasks', {})
+    _local.tasks[task_id] = collector
+
+
+def _task_finished(sender=None, task_id=None, task=None, state=None, **kwargs):
+    collector = getattr(_local, 'tasks', {}).pop(task_id, None)
+    if collector is None:
+        return
+    finish(collector)
+    log_summary(collector, task_id=task_id, state=state)
+
+task_prerun.connect(_task_started, dispatch_uid='keep-instrumentation-task-start')
+task_postrun.connect(_task_finished, dispatch_uid='keep-instrumentation-task-finish')
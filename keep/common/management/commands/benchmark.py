@@ -0,0 +1,94 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from keep.benchmarks import suite
+
+
+class Command(BaseCommand):
+    '''Run benchmarks for performance-sensitive code paths against local
+    stand-ins for Fedora and Solr, so that no repository services are
+    needed (see :mod:`keep.benchmarks`).  Benchmarks can be selected by
+    name; by default all benchmarks are run.  Results can be saved as
+    JSON and compared with a previous run to flag regressions.
+
+    Example::
+
+        python manage.py benchmark --output=before.json
+        python manage.py benchmark --compare=before.json keyword_search index_data
+    '''
+    args = "[benchmark benchmark ...]"
+    help = __doc__
+
+    option_list = BaseCommand.option_list + (
+        make_option('--output', '-o',
+                    action='store',
+                    help='Save results as JSON to the specified file'),
+        make_option('--compare',
+                    action='store',
+                    help='JSON results from a previous run to compare against'),
+        make_option('--threshold',
+                    action='store', type='float', default=0.2,
+                    help='Relative slowdown in median time to report as a regression ' +
+                         '(default: %default)'),
+        make_option('--repeat',
+                    action='store', type='int', default=5,
+                    help='Number of times to run each benchmark (default: %default)'),
+        make_option('--corpus-size',
+                    action='store', type='int', default=suite.DEFAULT_CORPUS_SIZE,
+                    help='Number of documents in the Solr index (default: %default)'),
+        make_option('--fedora-latency',
+                    action='store', type='float', default=suite.DEFAULT_FEDORA_LATENCY,
+                    help='Seconds added to each Fedora response (default: %default)'),
+        make_option('--solr-latency',
+                    action='store', type='float', default=suite.DEFAULT_SOLR_LATENCY,
+                    help='Seconds added to each Solr response (default: %default)'),
+        make_option('--list',
+                    action='store_true', default=False,
+                    help='List available benchmarks and exit'),
+        )
+
+    def handle(self, *names, **options):
+        available = [benchmark.name for benchmark in suite.BENCHMARKS]
+        if options['list']:
+            self.stdout.write('\n'.join(available))
+            return
+        for name in names:
+            if not any(b == name or b.startswith(name + '.') for b in available):
+                raise CommandError('Unknown benchmark %s; use --list to see available benchmarks'
+                                   % name)
+
+        previous = None
+        if options['compare']:
+            try:
+                previous = suite.load_results(options['compare'])
+            except (IOError, ValueError) as err:
+                raise CommandError('Error loading %s: %s' % (options['compare'], err))
+
+        results = suite.run_benchmarks(names, repeat=options['repeat'],
+                                       corpus_size=options['corpus_size'],
+                                       fedora_latency=options['fedora_latency'],
+                                       solr_latency=options['solr_latency'])
+
+        self.stdout.write('%-28s %9s %9s %9s %7s %7s' %
+                          ('benchmark', 'min', 'median', 'max', 'fedora', 'solr'))
+        for name, result in sorted(results['benchmarks'].iteritems()):
+            if 'skipped' in result:
+                self.stdout.write('%-28s skipped: %s' % (name, result['skipped']))
+            elif 'error' in result:
+                self.stdout.write('%-28s error: %s' % (name, result['error']))
+            else:
+                self.stdout.write('%-28s %8.3fs %8.3fs %8.3fs %7d %7d' %
+                    (name, result['min'], result['median'], result['max'],
+                     result['fedora_requests'], result['solr_requests']))
+
+        if options['output']:
+            suite.save_results(results, options['output'])
+            self.stdout.write('Results saved to %s' % options['output'])
+
+        if previous is not None:
+            regressions = suite.compare(previous, results, threshold=options['threshold'])
+            if not regressions:
+                self.stdout.write('No regressions compared to %s' % options['compare'])
+            for name, old, new in regressions:
+                self.stdout.write('REGRESSION %s: median %.3fs -> %.3fs' % (name, old, new))
@@ -0,0 +1,115 @@
+from getpass import getpass
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from keep.common.bulkedit import BulkEdit
+from keep.common.fedora import DigitalObject
+
+
+class Command(BaseCommand):
+    '''Apply a metadata transformation to a set of objects, specified
+    either by pid or by Solr search terms.  The transformation should be
+    a python function that takes a single object and modifies MODS,
+    Rights, and/or DC in place; objects are only saved when something
+    was actually changed.
+
+    Example::
+
+        python manage.py bulk_edit --transform=myscripts.fix_titles \\
+            --type=keep.audio.models.AudioObject \\
+            --filter content_model=info:fedora/emory-control:EuterpeAudio-1.0 \\
+            --checkpoint=fix-titles-2016 --noact
+    '''
+    args = "[pid pid ...]"
+    help = __doc__
+
+    option_list = BaseCommand.option_list + (
+        make_option('--transform',
+                    action='store',
+                    help='Python path for the transformation function to apply (REQUIRED)'),
+        make_option('--type',
+                    action='store',
+                    help='Python path for the DigitalObject type to load objects as'),
+        make_option('--filter',
+                    action='append', dest='filters', default=[],
+                    help='Solr search term as field=value; can be repeated. ' +
+                         'Used to find objects when no pids are specified'),
+        make_option('--message', '-m',
+                    action='store', default='bulk metadata edit',
+                    help='Log message to use when saving objects'),
+        make_option('--noact', '-n',
+                    action='store_true',
+                    default=False,
+                    help='Report the changes that would be made as diffs, but do not save anything'),
+        make_option('--checkpoint',
+                    action='store',
+                    help='Name to record progress under; rerunning with the same name skips objects already processed'),
+        make_option('--workers',
+                    action='store', type='int',
+                    help='Number of objects to update concurrently'),
+        make_option('--username',
+                    action='store',
+                    help='Username of fedora user to connect as'),
+        make_option('--password',
+                    action='store',
+                    help='Password for fedora user,  password=  will prompt for password'),
+        )
+
+    def handle(self, *pids, **options):
+        if not options['transform']:
+            raise CommandError('Transformation function is required')
+        if not pids and not options['filters']:
+            raise CommandError('Specify pids or at least one search filter')
+
+        try:
+            transform = import_string(options['transform'])
+            objtype = DigitalObject
+            if options['type']:
+                objtype = import_string(options['type'])
+        except ImportError as err:
+            raise CommandError(err)
+
+        if options['username'] and not options['password']:
+            options['password'] = getpass()
+
+        editor = BulkEdit(transform, type=objtype,
+                          log_message=options['message'],
+                          noact=options['noact'],
+                          checkpoint=options['checkpoint'],
+                          username=options['username'],
+                          password=options['password'],
+                          workers=options['workers'])
+
+        if not pids:
+            terms = {}
+            for search_filter in options['filters']:
+                if '=' not in search_filter:
+                    raise CommandError('Search filter %s should be in the format field=value'
+                                       % search_filter)
+                field, value = search_filter.split('=', 1)
+                terms[field] = value
+            pids = editor.pids_from_query(**terms)
+
+        verbosity = int(options['verbosity'])
+        for result in editor.run(pids):
+            if result.outcome == 'error':
+                self.stdout.write('Error updating %s: %s' % (result.pid, result.error))
+            elif result.outcome == 'not found':
+                self.stdout.write('%s not found' % result.pid)
+            elif result.outcome == 'updated':
+                if verbosity >= 1:
+                    self.stdout.write('%s %s' % ('Would update' if options['noact'] else 'Updated',
+                                                 result.pid))
+                if options['noact'] or verbosity > 1:
+                    self.stdout.write(result.diff)
+
+        stats = editor.stats
+        self.stdout.write('\nProcessed %d objects; %s %d, %d unchanged, %d not found, %d errors'
+            % (stats['total'], 'would update' if options['noact'] else 'updated',
+               stats['updated'], stats['unchanged'], stats['not found'],
+               stats['error']))
+        if stats['skipped']:
+            self.stdout.write('Skipped %d objects already processed for %s'
+                              % (stats['skipped'], options['checkpoint']))
@@ -0,0 +1,80 @@
+'''
+Manage command to report the number and size of master files in the
+repository, grouped by format or other technical metadata, using
+statistics calculated by Solr.
+
+'''
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+import unicodecsv
+
+from keep.common.reports import content_statistics, REPORT_FACETS
+from keep.common.utils import solr_interface
+from keep.audio.models import AudioObject
+from keep.file.models import DiskImage
+from keep.video.models import Video
+
+
+class Command(BaseCommand):
+    '''Report the number and total, minimum, maximum and average size of
+    master files for audio, video and disk images, grouped by format,
+    mimetype, codec or collection.  Requires that objects have been
+    indexed with technical metadata (``content_size``, etc.).
+    '''
+    help = __doc__
+
+    content_models = {
+        'audio': AudioObject.AUDIO_CONTENT_MODEL,
+        'video': Video.VIDEO_CONTENT_MODEL,
+        'disk-image': DiskImage.DISKIMAGE_CONTENT_MODEL,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'types', nargs='*', metavar='TYPE',
+            help='Types of content to report on: %s (default: all)' %
+                 ', '.join(sorted(self.content_models.keys())))
+        parser.add_argument(
+            '--by', choices=REPORT_FACETS, default='content_format',
+            help='Field to group statistics by (default: %(default)s)')
+        parser.add_argument(
+            '--collection',
+            help='Only report on content in the specified collection (pid)')
+        parser.add_argument(
+            '--csv', action='store_true', default=False,
+            help='Output CSV with sizes in bytes instead of a summary table')
+
+    def handle(self, *args, **options):
+        types = options['types'] or sorted(self.content_models.keys())
+        unknown = set(types) - set(self.content_models.keys())
+        if unknown:
+            raise CommandError('Unknown content type: %s' % ', '.join(unknown))
+        solr = solr_interface()
+
+        if options['csv']:
+            csvwriter = unicodecsv.writer(self.stdout, encoding='utf-8')
+            csvwriter.writerow(['type', options['by'], 'count', 'missing size',
+                                'total size', 'min size', 'max size', 'mean size'])
+
+        for objtype in types:
+            q = solr.query(content_model=self.content_models[objtype])
+            if options['collection']:
+                q = q.query(collection_id=options['collection'])
+            stats = content_statistics(q, facet=options['by'])
+
+            rows = stats['facets'].items() + [('total', stats['total'])]
+            if options['csv']:
+                for value, row in rows:
+                    csvwriter.writerow([objtype, value, row['count'], row['missing'],
+                                        row['sum'], row['min'], row['max'],
+                                        int(row['mean']) if row['mean'] is not None else None])
+                continue
+
+            self.stdout.write('%s by %s' % (objtype, options['by']))
+            for value, row in rows:
+                self.stdout.write('  %-40s %8d %12s total %12s average' % \
+                    (value, row['count'], filesizeformat(row['sum'] or 0),
+                     filesizeformat(row['mean'] or 0)))
+            if stats['total']['missing']:
+                self.stdout.write('  %d %s objects have no indexed size' %
+                                  (stats['total']['missing'], objtype))
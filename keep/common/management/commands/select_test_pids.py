@@ -4,13 +4,11 @@ synchronized from production to QA to allow testing on a subset
 of real data.
 
 '''
-from collections import defaultdict
 import random
 
 # from django.template.defaultfilters import filesizeformat, pluralize
 from django.core.management.base import BaseCommand
 
-from keep.common.fedora import Repository
 from keep.common.utils import solr_interface
 from keep.arrangement.models import ArrangementObject
 from keep.audio.models import AudioObject
@@ -76,7 +74,6 @@ class Command(BaseCommand):
         # Clifton (94kf4), and Grennan (9k0st)
 
         solr = solr_interface()
-        repo = Repository()
         q = solr.query(content_model=DiskImage.DISKIMAGE_CONTENT_MODEL) \
                 .exclude(collection_id=self.collections['trethewey']) \
                 .exclude(collection_id=self.collections['rushdie']) \
@@ -87,30 +84,19 @@ class Command(BaseCommand):
         if self.verbosity >= self.v_normal:
             self.stderr.write('Found %d disk images not in restricted collections' % q.count())
 
-        # currently there is no way to filter on format or size in either
-        # solr or fedora risearch
-        # so, go through individually and group them by type,
-        # then sort by size and pick the smallest ones
-        diskimgs_by_type = defaultdict(list)
-        for result in q:
-            diskimg = repo.get_object(result['pid'], type=DiskImage)
-            if not diskimg.exists:
-                if self.verbosity >= self.v_normal:
-                    self.stderr.write('Referenced disk image %s does not exist or is inaccessible' \
-                        % result['pid'])
-                continue
-
-            fmt = diskimg.provenance.content.object.format.name
-            diskimgs_by_type[fmt].append(diskimg)
+        # group by indexed format, then sort by indexed size and
+        # pick the smallest ones
+        facet_q = q.facet_by('content_format', mincount=1, limit=-1) \
+                   .paginate(rows=0)
+        formats = facet_q.execute().facet_counts.facet_fields['content_format']
 
-        for fmt, diskimages in diskimgs_by_type.iteritems():
+        for fmt, count in formats:
             if self.verbosity >= self.v_normal:
                 self.stderr.write('Selecting %s disk images' % fmt)
-            # sort on binary file size so we sync the smallest ones
-            diskimages = sorted(diskimages, key=lambda diskimg: diskimg.content.size)
+            # sort on binary file size so we sync the smallest ones;
             # use the first 10 of each type
-            for d in diskimages[:10]:
-                self.stdout.write(d.pid)
+            for r in q.filter(content_format=fmt).sort_by('content_size')[:10]:
+                self.stdout.write(r['pid'])
 
     def video(self):
         self.stderr.write('Video')
@@ -122,12 +108,6 @@ class Command(BaseCommand):
         # 5-10 collections represented
         # about 40 objects total (can be smallest size objects)
 
-        # NOTE: there is currently no easy way to ensure we have
-        # a representative sample of all mimetypes (master mimetypes are
-        # not indexed, and there is too much content, so it would be too
-        # slow to look in fedora.  Hopefully the diversity of codes and
-        # old dm content will provide sufficient representation.
-
         solr = solr_interface()
         # desired minimum number of collections
         # (minimum since more may be added in order to find
@@ -138,18 +118,19 @@ class Command(BaseCommand):
 
         pids = []
         collections = set()
+        mimetypes = set()
 
         # find all video, and sort smallest first
         all_video = solr.query(content_model=Video.VIDEO_CONTENT_MODEL) \
-               .field_limit(['pid', 'collection_id']).sort_by('access_copy_size')
-        # master size is not indexed, but hopefully access copy
-        # can serve as a proxy
+               .field_limit(['pid', 'collection_id', 'content_mimetype']) \
+               .sort_by('content_size')
         total_pids = all_video.count()
 
         if self.verbosity >= self.v_normal:
             self.stderr.write('Found %d total video objects' % all_video.count())
         facet_q = all_video.facet_by('collection_id', sort='count', mincount=1) \
                            .facet_by('access_code', sort='count', mincount=1) \
+                           .facet_by('content_mimetype', sort='count', mincount=1) \
                            .paginate(rows=0)
         facets = facet_q.execute().facet_counts.facet_fields
 
@@ -192,6 +173,7 @@ class Command(BaseCommand):
             for r in pids_by_code[:num_pids]:
                 pids.append(r['pid'])
                 collections.add(r['collection_id'])
+                mimetypes.add(r.get('content_mimetype'))
 
         # other codes will provide slightly more than half,
         # because we are rounding up; get the rest of the
@@ -200,6 +182,10 @@ class Command(BaseCommand):
         for r in q.filter(access_code=old_dm_code)[:remainder]:
             pids.append(r['pid'])
             collections.add(r['collection_id'])
+            mimetypes.add(r.get('content_mimetype'))
+
+        self.add_mimetypes(all_video, facets['content_mimetype'], pids,
+                           collections, mimetypes)
 
         if self.verbosity >= self.v_normal:
             self.stderr.write('Selected %d pids from %d collections' % \
@@ -231,18 +217,19 @@ class Command(BaseCommand):
 
         pids = []
         collections = set()
+        mimetypes = set()
 
         # find all audioo, and sort smallest first
         all_audio = solr.query(content_model=AudioObject.AUDIO_CONTENT_MODEL) \
-               .field_limit(['pid', 'collection_id']).sort_by('access_copy_size')
-        # master size is not indexed, but hopefully access copy
-        # can serve as a proxy
+               .field_limit(['pid', 'collection_id', 'content_mimetype']) \
+               .sort_by('content_size')
         total_pids = all_audio.count()
 
         if self.verbosity >= self.v_normal:
             self.stderr.write('Found %d total audio objects' % all_audio.count())
         facet_q = all_audio.facet_by('collection_id', sort='count', mincount=1) \
                            .facet_by('access_code', sort='count', mincount=1) \
+                           .facet_by('content_mimetype', sort='count', mincount=1) \
                            .paginate(rows=0)
         facets = facet_q.execute().facet_counts.facet_fields
 
@@ -283,6 +270,10 @@ class Command(BaseCommand):
             for r in pids_by_code[:num_pids]:
                 pids.append(r['pid'])
                 collections.add(r['collection_id'])
+                mimetypes.add(r.get('content_mimetype'))
+
+        self.add_mimetypes(all_audio, facets['content_mimetype'], pids,
+                           collections, mimetypes)
 
         if self.verbosity >= self.v_normal:
             self.stderr.write('Selected %d pids from %d collections' % \
@@ -291,3 +282,16 @@ class Command(BaseCommand):
         for p in pids:
             self.stdout.write(p)
 
+    def add_mimetypes(self, query, mimetype_facets, pids, collections, mimetypes):
+        '''Ensure the selected pids include at least one object for every
+        master file mimetype, adding the smallest object of any mimetype
+        that is not yet represented.'''
+        for mimetype, count in mimetype_facets:
+            if mimetype in mimetypes:
+                continue
+            if self.verbosity >= self.v_normal:
+                self.stderr.write('  Adding a pid for mimetype %s' % mimetype)
+            for r in query.filter(content_mimetype=mimetype)[:1]:
+                pids.append(r['pid'])
+                collections.add(r['collection_id'])
+                mimetypes.add(mimetype)
@@ -0,0 +1,42 @@
+from django.conf import settings
+
+from keep.common import instrumentation
+
+
+class BackendCallsMiddleware(object):
+    '''Record the Fedora, Solr, pidman and eXist calls made while
+    handling each request (see :mod:`keep.common.instrumentation`) and
+    log a summary.  When **INSTRUMENTATION_HEADERS** is enabled (defaults
+    to **DEBUG**), call counts and times are added to the response as a
+    ``Server-Timing`` header.
+
+    Should be listed first in **MIDDLEWARE_CLASSES** so that calls made by
+    other middleware are included.
+    '''
+
+    def process_request(self, request):
+        # named for the view once the url is resolved; requests that never
+        # reach a view (e.g. 404s) are grouped together, so that arbitrary
+        # urls do not each add a new metric
+        request.backend_calls = instrumentation.start('request', 'unresolved')
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        collector = getattr(request, 'backend_calls', None)
+        if collector is not None:
+            # aggregate metrics by view rather than by url
+            collector.name = '%s.%s' % (view_func.__module__,
+                                        getattr(view_func, '__name__', view_func.__class__.__name__))
+
+    def process_response(self, request, response):
+        collector = getattr(request, 'backend_calls', None)
+        if collector is None:
+            return response
+
+        instrumentation.finish(collector)
+        if getattr(settings, 'INSTRUMENTATION_HEADERS', settings.DEBUG) \
+                and collector.calls:
+            response['Server-Timing'] = collector.server_timing()
+        instrumentation.log_summary(collector, method=request.method,
+                                    path=request.path,
+                                    status=response.status_code)
+        return response
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchItemResult',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('batch', models.CharField(max_length=255, db_index=True)),
+                ('action', models.CharField(max_length=255)),
+                ('pid', models.CharField(max_length=255)),
+                ('success', models.BooleanField(default=False)),
+                ('message', models.TextField(blank=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='batchitemresult',
+            unique_together=set([('batch', 'action', 'pid')]),
+        ),
+    ]
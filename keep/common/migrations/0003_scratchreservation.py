@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_batchitemresult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScratchReservation',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('area', models.CharField(max_length=50, db_index=True)),
+                ('task_name', models.CharField(max_length=255)),
+                ('task_id', models.CharField(max_length=255, blank=True)),
+                ('size', models.BigIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expires', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
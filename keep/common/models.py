@@ -1,5 +1,8 @@
 from collections import namedtuple
-from django.db import models
+from contextlib import contextmanager
+from datetime import timedelta
+from django.db import models, transaction
+from django.utils import timezone
 from eulxml import xmlmap
 from eulxml.xmlmap import premis
 
@@ -11,6 +14,143 @@ class Permissions(models.Model):
             ("marbl_allowed", "Access to MARBL material is allowed."),
         )
 
+
+class BatchItemResult(models.Model):
+    '''Outcome of a batch operation on a single repository object.
+    Recording per-item results allows a batch that was interrupted or
+    partially failed to be rerun, retrying only the items that did not
+    succeed.'''
+    #: identifier for the batch, e.g. the pid of a processing batch
+    batch = models.CharField(max_length=255, db_index=True)
+    #: action applied to the item, e.g. the requested status
+    action = models.CharField(max_length=255)
+    #: pid of the item the action was applied to
+    pid = models.CharField(max_length=255)
+    success = models.BooleanField(default=False)
+    #: error message, when the action failed
+    message = models.TextField(blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('batch', 'action', 'pid')
+
+    def __unicode__(self):
+        return '%s %s %s: %s' % (self.batch, self.action, self.pid,
+                                 'success' if self.success else 'error')
+
+    @classmethod
+    def completed(cls, batch, action):
+        '''Set of pids that have already been successfully processed for
+        the specified batch and action.'''
+        return set(cls.objects.filter(batch=batch, action=action, success=True) \
+                              .values_list('pid', flat=True))
+
+    @classmethod
+    def record(cls, batch, action, pid, error=None):
+        '''Record the outcome for a single item; any previous outcome
+        for the same item, batch, and action is replaced.
+
+        :param error: exception or error message if the action failed
+        '''
+        cls.objects.update_or_create(batch=batch, action=action, pid=pid,
+            defaults={'success': error is None,
+                      'message': unicode(error) if error is not None else ''})
+
+
+class TaskLock(models.Model):
+    '''Named lock shared by every process that uses the Keep database,
+    for serializing work across celery workers and hosts.  Locks are
+    taken with ``SELECT ... FOR UPDATE`` on the lock row, so acquiring
+    one is atomic regardless of the configured cache backend.  Use
+    :meth:`hold` for a short critical section, or :meth:`acquire` and
+    :meth:`release` to keep other processes from starting the same
+    long-running job.'''
+    name = models.CharField(max_length=255, unique=True)
+    #: time a lock taken with :meth:`acquire` expires, in case the
+    #: process holding it is killed; None when the lock is not held
+    expires = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return self.name
+
+    @classmethod
+    def _lock_row(cls, name):
+        # must be called within a transaction; the row stays locked
+        # until the transaction ends
+        lock, created = cls.objects.select_for_update().get_or_create(name=name)
+        return lock
+
+    @classmethod
+    @contextmanager
+    def hold(cls, name):
+        '''Context manager that holds the named lock for the duration of
+        a block of code, in a database transaction; other processes
+        wait until the block completes.'''
+        with transaction.atomic():
+            cls._lock_row(name)
+            yield
+
+    @classmethod
+    def acquire(cls, name, timeout):
+        '''Acquire the named lock for up to ``timeout`` seconds, unless
+        another process already holds it.
+
+        :returns: True if the lock was acquired
+        '''
+        with transaction.atomic():
+            lock = cls._lock_row(name)
+            now = timezone.now()
+            if lock.expires is not None and lock.expires > now:
+                return False
+            lock.expires = now + timedelta(seconds=timeout)
+            lock.save()
+        return True
+
+    @classmethod
+    def release(cls, name):
+        '''Release a lock taken with :meth:`acquire`.'''
+        cls.objects.filter(name=name).update(expires=None)
+
+
+class ScratchReservation(models.Model):
+    '''Disk space in a staging area reserved by a task for temporary
+    files, so that concurrent tasks do not fill up the staging disk.
+    See :mod:`keep.common.scratch`.'''
+    #: staging area name, e.g. ``ingest`` or ``large-file``
+    area = models.CharField(max_length=50, db_index=True)
+    #: name of the task holding the reservation
+    task_name = models.CharField(max_length=255)
+    #: celery task id, if known
+    task_id = models.CharField(max_length=255, blank=True)
+    #: number of bytes reserved
+    size = models.BigIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    #: reservations are ignored after this time, in case a task is
+    #: killed without releasing its reservation
+    expires = models.DateTimeField(db_index=True)
+
+    def __unicode__(self):
+        return '%s %s (%s): %d bytes' % (self.area, self.task_name,
+                                         self.task_id, self.size)
+
+    @classmethod
+    def active(cls, area=None):
+        '''Queryset of reservations that have not expired, optionally
+        filtered by staging area.'''
+        reservations = cls.objects.filter(expires__gt=timezone.now())
+        if area is not None:
+            reservations = reservations.filter(area=area)
+        return reservations
+
+    @classmethod
+    def reserved(cls, area):
+        '''Total number of bytes currently reserved in a staging area.'''
+        return cls.active(area).aggregate(total=models.Sum('size'))['total'] or 0
+
+    def release(self):
+        '''Release the reserved space.'''
+        ScratchReservation.objects.filter(pk=self.pk).delete()
+
 _access_term = namedtuple('_access_term', 'code abbreviation access text') # wraps terms below
 
 rights_access_terms =  (
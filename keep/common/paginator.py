@@ -0,0 +1,115 @@
+'''
+Pagination for Solr search results.
+'''
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+
+from keep.common.utils import solr_select
+
+#: default number of seconds to cache result counts and cursor marks;
+#: override with **SOLR_PAGINATOR_CACHE_TIMEOUT** in settings
+DEFAULT_CACHE_TIMEOUT = 120
+
+
+class SolrPaginator(Paginator):
+    '''Paginator for a :class:`sunburnt.SolrSearch` query, for use in
+    place of :class:`django.core.paginator.Paginator`.
+
+    Each page is retrieved from Solr with a single request, and the total
+    number of results is taken from that response rather than from a
+    separate count query.  After a page is retrieved, the Solr cursor
+    mark for the following page is cached briefly, so that "next page"
+    navigation through a deep result set uses Solr cursor paging instead
+    of requiring Solr to sort and skip every preceding result.  The total
+    count is cached along with the cursor marks, so that requests beyond
+    the last page can go directly to the last page.
+
+    Results are sorted by the query sort (or by relevance, if the query
+    is not sorted) and then by pid, since cursor paging requires a sort
+    on the unique key.  Grouped queries do not support cursor paging and
+    are always retrieved by offset.
+    '''
+
+    def __init__(self, object_list, per_page, allow_empty_first_page=True):
+        options = object_list.options()
+        sort = options.get('sort', '')
+        if not sort:
+            object_list = object_list.sort_by('-score')
+        if 'pid ' not in sort:
+            object_list = object_list.sort_by('pid')
+        super(SolrPaginator, self).__init__(object_list, per_page,
+            allow_empty_first_page=allow_empty_first_page)
+
+        self.use_cursor = not any(opt.startswith('group') for opt in options)
+        # cache key based on the query, excluding page-specific options
+        query_opts = sorted((key, val) for key, val in options.iteritems()
+                            if key not in ['start', 'rows'])
+        self.cache_key = 'solr-paginator-%s-%d' % \
+            (hashlib.md5(repr(query_opts)).hexdigest(), per_page)
+
+    @property
+    def cache_timeout(self):
+        return getattr(settings, 'SOLR_PAGINATOR_CACHE_TIMEOUT',
+                       DEFAULT_CACHE_TIMEOUT)
+
+    def _set_count(self, count):
+        # count and num_pages are cached properties on the django paginator
+        self.__dict__['count'] = count
+        self.__dict__.pop('num_pages', None)
+
+    def _check_number(self, number):
+        if number > self.num_pages:
+            if number == 1 and self.allow_empty_first_page:
+                return
+            raise EmptyPage('That page contains no results')
+
+    def validate_number(self, number):
+        # validate without requiring a count; range is checked once
+        # the number of results is known
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        '''Return a :class:`~django.core.paginator.Page` for the given
+        1-based page number.  The page ``object_list`` is the
+        :class:`sunburnt.schema.SolrResponse`, so facets and other
+        response information are available.'''
+        number = self.validate_number(number)
+        cursor_key = '%s-cursor-%d' % (self.cache_key, number)
+        cached = cache.get_many([self.cache_key, cursor_key])
+
+        # don't query for a page that is past the end of the results
+        if self.cache_key in cached:
+            self._set_count(cached[self.cache_key])
+            self._check_number(number)
+
+        cursor = cached.get(cursor_key, '*' if number == 1 else None)
+        if self.use_cursor and cursor is not None:
+            response, next_cursor = solr_select(self.object_list, start=None,
+                rows=self.per_page, cursorMark=cursor)
+            # convert results as sunburnt would
+            constructor = self.object_list.result_constructor
+            if constructor is not dict:
+                response.result.docs = [constructor(**doc)
+                                        for doc in response.result.docs]
+        else:
+            response = self.object_list.paginate(
+                start=(number - 1) * self.per_page, rows=self.per_page).execute()
+            next_cursor = None
+
+        self._set_count(response.result.numFound)
+        values = {self.cache_key: self.count}
+        if next_cursor is not None:
+            values['%s-cursor-%d' % (self.cache_key, number + 1)] = next_cursor
+        cache.set_many(values, self.cache_timeout)
+
+        self._check_number(number)
+        return self._get_page(response, number, self)
@@ -0,0 +1,94 @@
+'''
+Statistics on repository content (e.g., the number and total size of
+master files by format), calculated by Solr from indexed technical
+metadata, so that sampling and capacity planning reports do not require
+loading every object from Fedora.
+
+Audio, video and disk image objects are indexed with the size, format
+and mimetype of their master file (``content_size``, ``content_format``
+and ``content_mimetype``), and audio and video with codec quality and
+software from their digital technical metadata (``codec_quality`` and
+``codec_software``).
+'''
+from collections import OrderedDict
+
+from lxml import etree
+from sunburnt.search import params_from_dict
+
+#: indexed fields that content statistics can be grouped by
+REPORT_FACETS = ('content_format', 'content_mimetype', 'codec_quality',
+                 'codec_software', 'collection_id', 'object_type')
+
+
+def _stats_values(lst):
+    # convert a Solr stats result for a single field or facet value
+    # to a dictionary of count, missing, sum, min, max, and mean
+    values = {}
+    for el in lst:
+        name = el.get('name')
+        if el.tag == 'null' or el.text is None:
+            values[name] = None
+        elif el.tag in ('int', 'long'):
+            values[name] = int(el.text)
+        elif el.tag in ('float', 'double'):
+            values[name] = float(el.text)
+
+    stats = {
+        'count': values.get('count') or 0,
+        'missing': values.get('missing') or 0,
+        'mean': values.get('mean'),
+    }
+    # sizes are whole numbers, although solr reports them as doubles
+    for key in ('sum', 'min', 'max'):
+        stats[key] = int(values[key]) if values.get(key) is not None else None
+    return stats
+
+
+def content_statistics(solrquery, facet=None, field='content_size'):
+    '''Calculate the count and total, minimum, maximum and mean size of
+    the content for objects matching a Solr query, using the Solr stats
+    component.  Optionally calculates the same statistics for each value
+    of an indexed field, e.g. by format.  Objects without an indexed size
+    are counted as ``missing``.
+
+    Example::
+
+        solr = solr_interface()
+        q = solr.query(content_model=Video.VIDEO_CONTENT_MODEL)
+        stats = content_statistics(q, facet='content_mimetype')
+        stats['total']['sum']                  # total size of all video
+        stats['facets']['video/quicktime']     # size stats for quicktime
+
+    :param solrquery: :class:`sunburnt.SolrSearch` query
+    :param facet: optional field to group statistics by; see
+        :attr:`REPORT_FACETS`
+    :param field: numeric field to calculate statistics for
+        (default: content_size)
+    :returns: dictionary with ``total`` statistics for all matching
+        objects, and (if a facet is specified) ``facets``, an ordered
+        dictionary of statistics by facet value, largest total first
+    '''
+    solr = solrquery.interface
+    options = dict(solrquery.options(), rows=0, stats='true')
+    options['stats.field'] = field
+    if facet is not None:
+        options['stats.facet'] = facet
+    options = dict((key, val) for key, val in options.iteritems()
+                   if val is not None and key not in ('start', 'sort'))
+    response = etree.fromstring(solr.conn.select(params_from_dict(**options)))
+
+    field_stats = response.find('lst[@name="stats"]/lst[@name="stats_fields"]/lst[@name="%s"]' % field)
+    if field_stats is None:
+        # solr returns null when no documents match
+        stats = {'total': _stats_values([])}
+        if facet is not None:
+            stats['facets'] = OrderedDict()
+        return stats
+
+    stats = {'total': _stats_values(field_stats)}
+    if facet is not None:
+        facet_values = field_stats.findall('lst[@name="facets"]/lst[@name="%s"]/lst' % facet)
+        facet_stats = [(lst.get('name'), _stats_values(lst)) for lst in facet_values]
+        facet_stats.sort(key=lambda item: item[1]['sum'] or 0, reverse=True)
+        stats['facets'] = OrderedDict(facet_stats)
+    return stats
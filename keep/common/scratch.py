@@ -0,0 +1,247 @@
+'''
+Admission control for tasks that write large temporary files to a
+staging area ("scratch" space), e.g. audio conversion and AFF disk image
+migration, so that several large tasks running at once do not fill up a
+staging disk part way through.
+
+Before creating any temporary files, a task reserves the space it
+expects to need, estimated from the size of the datastream it will
+download multiplied by a per-task factor (see :data:`DEFAULT_MULTIPLIERS`
+and **SCRATCH_MULTIPLIERS**).  A reservation is only granted if it fits
+in the free space on the staging disk, less the space reserved by other
+running tasks and the **STAGING_FREE_SPACE_THRESHOLD** fraction of the
+disk that should always be kept free (see :mod:`keep.common.staging`).
+Tasks that do not fit are deferred with a celery retry after
+**SCRATCH_RETRY_DELAY** seconds (default 15 minutes), up to
+**SCRATCH_MAX_RETRIES** times.
+
+Reservations are stored in the database
+(:class:`~keep.common.models.ScratchReservation`) so that they are
+shared by all celery workers, and checks for each staging area are
+serialized by a database row lock
+(:class:`~keep.common.models.TaskLock`).  Reservations are released
+when the task finishes, and expire after **SCRATCH_RESERVATION_TIMEOUT**
+seconds (default 12 hours) in case a worker is killed.  Space used by
+files a task has already written is counted both in its reservation and
+in the disk usage, so admission errs on the side of deferring tasks.
+
+Current utilization is available from :meth:`utilization`, and is
+included in the ``metrics`` view.
+
+Example::
+
+    @shared_task(bind=True, base=ScratchSpaceTask)
+    def convert(self, pid):
+        obj = Repository().get_object(pid)
+        self.reserve_scratch('ingest', obj.content.size)
+        ...
+
+'''
+from contextlib import contextmanager
+from datetime import timedelta
+import logging
+import math
+
+from celery import Task
+from django.conf import settings
+from django.utils import timezone
+
+from keep.common.models import ScratchReservation, TaskLock
+from keep.common.staging import staging_areas, free_space, \
+    DEFAULT_FREE_SPACE_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+#: default scratch space needed by each task, as a multiple of the size
+#: of the datastream it processes; can be overridden by task name with
+#: **SCRATCH_MULTIPLIERS**
+DEFAULT_MULTIPLIERS = {
+    # downloaded wav plus the generated mp3, which is much smaller
+    'keep.audio.tasks.convert_wav_to_mp3': 1.2,
+    # downloaded aff plus an uncompressed E01 (which may be considerably
+    # larger than a compressed AFF) and ftkimager output
+    'keep.file.tasks.migrate_aff_diskimage': 3.0,
+}
+#: default number of seconds before a deferred task is retried
+DEFAULT_RETRY_DELAY = 60 * 15
+#: default number of times a task is deferred before it fails
+DEFAULT_MAX_RETRIES = 4 * 24
+#: default number of seconds before an unreleased reservation expires
+DEFAULT_RESERVATION_TIMEOUT = 60 * 60 * 12
+
+# name of the lock used to serialize reservations in a staging area
+LOCK_NAME = 'scratch-reservation-%s'
+
+
+class ScratchSpaceUnavailable(Exception):
+    '''Raised when a scratch space reservation cannot be granted.
+
+    :param area: staging area name
+    :param size: number of bytes requested
+    :param available: number of bytes available
+    '''
+
+    def __init__(self, area, size, available):
+        self.area = area
+        self.size = size
+        self.available = available
+        msg = '%d bytes of scratch space requested in %s staging area, but only %d available' \
+            % (size, area, max(available, 0))
+        super(ScratchSpaceUnavailable, self).__init__(msg)
+
+
+def multiplier(task_name):
+    'Scratch space multiplier for a task; see :data:`DEFAULT_MULTIPLIERS`.'
+    multipliers = dict(DEFAULT_MULTIPLIERS)
+    multipliers.update(getattr(settings, 'SCRATCH_MULTIPLIERS', {}))
+    return multipliers.get(task_name, 1.0)
+
+
+def estimate(task_name, size):
+    '''Estimated scratch space in bytes needed by a task to process
+    content of the specified size.'''
+    return int(math.ceil((size or 0) * multiplier(task_name)))
+
+
+def area_path(area):
+    'Directory for a configured staging area, by name.'
+    paths = dict((name, path) for name, path, conventions in staging_areas())
+    if area not in paths:
+        raise ValueError('Staging area %s is not configured' % area)
+    return paths[area]
+
+
+def available(area):
+    '''Number of bytes that can currently be reserved in a staging area:
+    free space on the staging disk, less existing reservations and the
+    fraction of the disk that should be kept free.'''
+    free, total = free_space(area_path(area))
+    threshold = getattr(settings, 'STAGING_FREE_SPACE_THRESHOLD',
+                        DEFAULT_FREE_SPACE_THRESHOLD)
+    return free - ScratchReservation.reserved(area) - int(total * threshold)
+
+
+def reserve(area, size, task_name, task_id=None, timeout=None):
+    '''Reserve scratch space in a staging area.
+
+    :param area: staging area name, e.g. ``ingest`` or ``large-file``
+    :param size: number of bytes to reserve
+    :param task_name: name of the task the space is reserved for
+    :param task_id: celery task id, if any
+    :param timeout: seconds before the reservation expires; defaults to
+        **SCRATCH_RESERVATION_TIMEOUT**
+    :returns: :class:`~keep.common.models.ScratchReservation`, which
+        should be released when the space is no longer needed
+    :raises: :class:`ScratchSpaceUnavailable` if there is not enough space
+    '''
+    if timeout is None:
+        timeout = getattr(settings, 'SCRATCH_RESERVATION_TIMEOUT',
+                          DEFAULT_RESERVATION_TIMEOUT)
+    # checking available space and adding the reservation must not be
+    # interleaved with another reservation in the same area
+    with TaskLock.hold(LOCK_NAME % area):
+        ScratchReservation.objects.filter(expires__lte=timezone.now()).delete()
+        space = available(area)
+        if size > space:
+            raise ScratchSpaceUnavailable(area, size, space)
+        reservation = ScratchReservation.objects.create(
+            area=area, size=size, task_name=task_name, task_id=task_id or '',
+            expires=timezone.now() + timedelta(seconds=timeout))
+    logger.debug('Reserved %d bytes in %s staging area for %s %s',
+                 size, area, task_name, task_id)
+    return reservation
+
+
+@contextmanager
+def scratch_space(area, size, task_name, task_id=None):
+    '''Context manager to reserve scratch space for the duration of a
+    block of code; see :meth:`reserve`.'''
+    reservation = reserve(area, size, task_name, task_id)
+    try:
+        yield reservation
+    finally:
+        reservation.release()
+
+
+def utilization():
+    '''Current scratch space utilization for each configured staging
+    area.  Areas that cannot be read are logged and skipped.
+
+    :returns: dictionary by staging area name of ``path``, ``free`` and
+        ``total`` bytes on the staging disk, ``reserved`` bytes, and
+        number of active ``reservations``
+    '''
+    usage = {}
+    for area, path, conventions in staging_areas():
+        try:
+            free, total = free_space(path)
+        except OSError as err:
+            logger.warning('Failure checking %s staging directory %s: %s',
+                           area, path, err)
+            continue
+        reservations = ScratchReservation.active(area)
+        usage[area] = {
+            'path': path, 'free': free, 'total': total,
+            'reserved': ScratchReservation.reserved(area),
+            'reservations': reservations.count(),
+        }
+    return usage
+
+
+#: metric name, utilization key, and description for scratch space gauges
+METRICS = [
+    ('keep_scratch_free_bytes', 'free', 'Free space on staging disks.'),
+    ('keep_scratch_total_bytes', 'total', 'Size of staging disks.'),
+    ('keep_scratch_reserved_bytes', 'reserved', 'Staging space reserved by running tasks.'),
+    ('keep_scratch_reservations', 'reservations', 'Number of active staging space reservations.'),
+]
+
+
+def prometheus_text():
+    'Scratch space utilization gauges in Prometheus text format.'
+    usage = sorted(utilization().iteritems())
+    lines = []
+    for metric, key, description in METRICS:
+        lines.extend(['# HELP %s %s' % (metric, description),
+                      '# TYPE %s gauge' % metric])
+        for area, stats in usage:
+            lines.append('%s{area="%s"} %d' % (metric, area, stats[key]))
+    return '\n'.join(lines) + '\n'
+
+
+class ScratchSpaceTask(Task):
+    '''Base class for celery tasks that reserve scratch space with
+    :meth:`reserve_scratch`.  Reservations are released when a task run
+    by a worker (or eagerly) returns, whether it succeeds or fails; a
+    task called directly should release its reservation itself.'''
+    abstract = True
+
+    def reserve_scratch(self, area, size, staged=0):
+        '''Reserve scratch space for the current run of this task, or
+        defer the task with a retry if there is not enough space.  If the
+        task was called directly or eagerly, it is not retried and
+        :class:`ScratchSpaceUnavailable` is raised instead.
+
+        :param area: staging area name
+        :param size: size of the content to be processed; the space
+            reserved is estimated using the multiplier for this task
+        :param staged: number of bytes of the content that are already in
+            the staging area, and do not need to be reserved
+        :returns: :class:`~keep.common.models.ScratchReservation`
+        '''
+        nbytes = max(estimate(self.name, size) - staged, 0)
+        try:
+            return reserve(area, nbytes, self.name, self.request.id)
+        except ScratchSpaceUnavailable as err:
+            if self.request.called_directly or self.request.is_eager:
+                # an eager retry would run again immediately
+                raise
+            logger.warning('Deferring %s %s: %s', self.name, self.request.id, err)
+            raise self.retry(
+                exc=err,
+                countdown=getattr(settings, 'SCRATCH_RETRY_DELAY', DEFAULT_RETRY_DELAY),
+                max_retries=getattr(settings, 'SCRATCH_MAX_RETRIES', DEFAULT_MAX_RETRIES))
+
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        if task_id:
+            ScratchReservation.objects.filter(task_id=task_id).delete()
@@ -0,0 +1,293 @@
+'''
+Cleanup of the staging areas used for ingest, so that files left behind
+by abandoned uploads or failed tasks do not fill up the staging disks.
+
+Content in each staging area is identified by the naming conventions of
+the code that creates it:
+
+* **INGEST_STAGING_TEMP_DIR**
+
+  - ``checksum``: MD5 files for uploads, named the same as the upload
+    with ``.md5`` added (:meth:`keep.file.views.ajax_upload`); removed
+    with the upload, or as soon as the upload is gone
+  - ``conversion``: temporary files for audio conversion and duration
+    checks, named ``tmpXXXXXX`` or ``tmpXXXXXX.mp3``
+    (:meth:`keep.audio.tasks.convert_wav_to_mp3` and
+    :meth:`keep.audio.models.check_wav_mp3_duration`)
+  - ``upload``: files uploaded for ingest, and anything else
+  - ``directory``: directories, which are removed once nothing within
+    them has been modified for the keep age
+
+* **LARGE_FILE_STAGING_DIR**
+
+  - ``aff-migration``: temporary directories used to migrate AFF disk
+    images to E01, named ``XXXXXX-aff-migration``
+    (:meth:`keep.file.tasks.migrate_aff_diskimage`)
+  - ``bag``: BagIt uploads waiting for ingest, and anything else; these
+    are measured, but never removed
+
+Anything not modified for **INGEST_STAGING_KEEP_AGE** seconds is removed.
+If the free space on a staging disk is still below
+**STAGING_FREE_SPACE_THRESHOLD** (fraction of the disk, default 0.1)
+after cleanup, content older than **STAGING_URGENT_KEEP_AGE** seconds
+(default one day) is removed as well, and an error is logged if that
+is still not enough.  Top-level entries in both areas are examined and
+removed concurrently using :meth:`keep.common.batch.pool_map`.
+
+Cleanup is run periodically by celery beat (see
+:meth:`keep.repoadmin.tasks.clean_staging_areas`) and can be run
+manually with the ``ingest_cleanup`` script.
+'''
+from collections import defaultdict, namedtuple
+import logging
+import os
+import re
+import shutil
+import time
+
+from django.conf import settings
+
+from keep.common.batch import pool_map
+from keep.common.models import TaskLock
+
+try:
+    from os import scandir
+except ImportError:
+    # python 2 backport
+    from scandir import scandir
+
+logger = logging.getLogger(__name__)
+
+#: default fraction of each staging disk that should be kept free
+DEFAULT_FREE_SPACE_THRESHOLD = 0.1
+#: default age in seconds of content removed when disk space is low
+DEFAULT_URGENT_KEEP_AGE = 60 * 60 * 24
+
+# name of the lock used to prevent overlapping runs
+LOCK_NAME = 'staging-cleanup-running'
+
+#: naming conventions for content in the ingest staging directory,
+#: as a list of kind and filename regular expression; first match wins
+INGEST_STAGING_CONTENT = [
+    ('checksum', re.compile(r'.+\.md5$')),
+    ('conversion', re.compile(r'^tmp[A-Za-z0-9_]{6}(\.mp3)?$')),
+]
+#: naming conventions for content in the large-file staging directory
+LARGE_FILE_STAGING_CONTENT = [
+    ('aff-migration', re.compile(r'.+-aff-migration$')),
+]
+#: kinds of content that are never removed
+PRESERVED = ('bag',)
+
+
+#: result of examining a single top-level entry in a staging area;
+#: size is the total size in bytes (including directory contents),
+#: modified is the most recent modification time, and error is None
+#: unless the entry could not be read or removed
+StagingItem = namedtuple('StagingItem', ['area', 'name', 'kind', 'size',
+                                         'modified', 'removed', 'error'])
+
+
+def tree_stats(path):
+    '''Walk a directory and calculate the total size of its contents
+    and the most recent modification time of anything in it.
+
+    :returns: tuple of size in bytes, modification time
+    '''
+    size = 0
+    modified = os.lstat(path).st_mtime
+    for entry in scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            dirsize, dirmodified = tree_stats(entry.path)
+        else:
+            stat = entry.stat(follow_symlinks=False)
+            dirsize, dirmodified = stat.st_size, stat.st_mtime
+        size += dirsize
+        modified = max(modified, dirmodified)
+    return size, modified
+
+
+def staging_areas():
+    '''Configured staging areas, as a list of tuples of name, directory,
+    and naming conventions.'''
+    areas = [('ingest', settings.INGEST_STAGING_TEMP_DIR, INGEST_STAGING_CONTENT)]
+    large_file_dir = getattr(settings, 'LARGE_FILE_STAGING_DIR', None)
+    if large_file_dir:
+        areas.append(('large-file', large_file_dir, LARGE_FILE_STAGING_CONTENT))
+    return areas
+
+
+def free_space(path):
+    '''Free space on the disk that contains a path, in bytes available
+    to unprivileged users.
+
+    :returns: tuple of free bytes, total bytes
+    '''
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize, stat.f_blocks * stat.f_frsize
+
+
+class StagingJanitor(object):
+    '''Remove expired content from the ingest and large-file staging
+    areas, reporting the number of bytes reclaimed.  Call :meth:`run`
+    and iterate over the results; totals by area are available as
+    :attr:`stats` once the run is complete.
+
+    :param keep_age: age in seconds of content to be removed; defaults to
+        **INGEST_STAGING_KEEP_AGE**
+    :param noact: if True, report what would be removed without
+        removing anything
+    :param workers: number of entries to examine and remove concurrently;
+        see :meth:`keep.common.batch.pool_map`
+    '''
+
+    def __init__(self, keep_age=None, noact=False, workers=None):
+        if keep_age is None:
+            keep_age = settings.INGEST_STAGING_KEEP_AGE
+        self.keep_age = keep_age
+        self.noact = noact
+        self.workers = workers
+        self.free_threshold = getattr(settings, 'STAGING_FREE_SPACE_THRESHOLD',
+                                      DEFAULT_FREE_SPACE_THRESHOLD)
+        self.urgent_keep_age = min(keep_age, getattr(settings, 'STAGING_URGENT_KEEP_AGE',
+                                                     DEFAULT_URGENT_KEEP_AGE))
+        #: statistics by staging area name
+        self.stats = {}
+
+    def areas(self):
+        'Staging areas to clean; see :meth:`staging_areas`.'
+        return staging_areas()
+
+    def kind(self, area, conventions, entry):
+        'Determine the kind of content for a top-level staging entry.'
+        for kind, regex in conventions:
+            if regex.match(entry.name):
+                return kind
+        if area == 'large-file':
+            return 'bag'
+        return 'directory' if entry.is_dir(follow_symlinks=False) else 'upload'
+
+    def run(self):
+        '''Clean up all configured staging areas.  Areas that cannot be
+        read are logged and skipped, and recorded with an ``error`` in
+        :attr:`stats`.
+
+        :returns: generator of :class:`StagingItem`
+        '''
+        for area, path, conventions in self.areas():
+            stats = self.stats[area] = {
+                'path': path, 'entries': 0, 'bytes': 0, 'removed': 0,
+                'reclaimed': 0, 'errors': 0, 'urgent': False, 'error': None,
+                'kinds': defaultdict(lambda: {'removed': 0, 'reclaimed': 0}),
+            }
+            try:
+                for item in self.clean(area, path, conventions, self.keep_age):
+                    self._count(stats, item, measure=True)
+                    yield item
+
+                free, total = free_space(path)
+                if total and float(free) / total < self.free_threshold and \
+                   self.urgent_keep_age < self.keep_age and not self.noact:
+                    logger.warning('Free space on %s staging disk is %s bytes; removing content older than %s seconds',
+                                   area, free, self.urgent_keep_age)
+                    stats['urgent'] = True
+                    for item in self.clean(area, path, conventions, self.urgent_keep_age):
+                        self._count(stats, item)
+                        yield item
+                    free, total = free_space(path)
+            except OSError as err:
+                logger.error('Failure reading %s staging directory %s: %s', area, path, err)
+                stats['error'] = unicode(err)
+                continue
+            finally:
+                stats['kinds'] = dict(stats['kinds'])
+
+            stats.update({'free': free, 'total': total})
+            if total and float(free) / total < self.free_threshold:
+                logger.error('Free space on %s staging disk %s is still low after cleanup: %s of %s bytes',
+                             area, path, free, total)
+
+    def _count(self, stats, item, measure=False):
+        if measure and item.size is not None:
+            stats['entries'] += 1
+            stats['bytes'] += item.size
+        if item.removed:
+            stats['removed'] += 1
+            stats['reclaimed'] += item.size
+            stats['kinds'][item.kind]['removed'] += 1
+            stats['kinds'][item.kind]['reclaimed'] += item.size
+        if item.error is not None:
+            stats['errors'] += 1
+
+    def clean(self, area, path, conventions, keep_age):
+        '''Examine every top-level entry in a staging area and remove
+        those that have expired.
+
+        :returns: generator of :class:`StagingItem`
+        '''
+        entries = list(scandir(path))
+        names = set(entry.name for entry in entries)
+        cutoff = time.time() - keep_age
+
+        def clean_entry(entry):
+            return self.clean_entry(area, conventions, entry, names, cutoff)
+
+        for entry, item, err in pool_map(clean_entry, entries, self.workers):
+            if err is not None:
+                item = StagingItem(area, entry.name, None, None, None, False,
+                                   "Error reading file '%s': %s" % (entry.name, err))
+            yield item
+
+    def clean_entry(self, area, conventions, entry, names, cutoff):
+        '''Examine a single top-level staging entry, and remove it if it
+        was last modified before the cutoff time (or, for a checksum
+        file, if the corresponding upload is gone).'''
+        kind = None
+        try:
+            kind = self.kind(area, conventions, entry)
+            if entry.is_dir(follow_symlinks=False):
+                size, modified = tree_stats(entry.path)
+            else:
+                stat = entry.stat(follow_symlinks=False)
+                size, modified = stat.st_size, stat.st_mtime
+        except OSError as err:
+            return StagingItem(area, entry.name, kind, None, None, False,
+                               "Error reading file '%s': %s" % (entry.name, err))
+
+        expired = modified < cutoff
+        if kind == 'checksum' and entry.name[:-len('.md5')] not in names:
+            expired = True
+        if not expired or kind in PRESERVED:
+            return StagingItem(area, entry.name, kind, size, modified, False, None)
+
+        if not self.noact:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.unlink(entry.path)
+            except OSError as err:
+                return StagingItem(area, entry.name, kind, size, modified, False,
+                                   "Error removing file '%s': %s" % (entry.name, err))
+        return StagingItem(area, entry.name, kind, size, modified, True, None)
+
+
+def run_cleanup(**kwargs):
+    '''Run a :class:`StagingJanitor` over all staging areas, unless a
+    run is already in progress.  Keyword arguments are passed to the
+    janitor.
+
+    :returns: dictionary of statistics by staging area, or None if a run
+        is already in progress
+    '''
+    # lock expires in case a run is killed without releasing it
+    if not TaskLock.acquire(LOCK_NAME, 60 * 60 * 6):
+        return None
+    try:
+        janitor = StagingJanitor(**kwargs)
+        for item in janitor.run():
+            if item.error is not None:
+                logger.warning(item.error)
+        return janitor.stats
+    finally:
+        TaskLock.release(LOCK_NAME)
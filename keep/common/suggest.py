@@ -0,0 +1,299 @@
+'''
+In-memory indexes for autocomplete suggestions.
+
+Autocomplete views are requested on every keystroke, so rather than
+querying Solr for each request, the values to be suggested are loaded
+from Solr into a sorted in-memory :class:`PrefixIndex` and refreshed
+periodically (every **SUGGEST_REFRESH_INTERVAL** seconds, default
+120).  Matching is case-insensitive, and can optionally match at the
+start of any word in a value rather than only at the beginning.
+
+Example::
+
+    suggestions = FacetSuggestions(['users_facet'], infix=['users_facet'])
+    suggestions.suggest('users_facet', 'smi')   # => [(u'Jane Smith', 12)]
+
+'''
+from bisect import bisect_left
+from collections import defaultdict
+import heapq
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from keep.collection.models import CollectionObject
+from keep.common.utils import solr_interface, solr_cursor
+
+logger = logging.getLogger(__name__)
+
+#: default number of seconds between refreshes from Solr
+DEFAULT_REFRESH_INTERVAL = 120
+
+# the start of a word: a word character not preceded by a word character
+_word_start = re.compile(r'(?<!\w)\w', re.UNICODE)
+
+
+def normalize(text):
+    '''Normalize text for case-insensitive matching.'''
+    if not isinstance(text, unicode):
+        text = unicode(str(text), 'utf-8')
+    return text.lower()
+
+
+class PrefixIndex(object):
+    '''Sorted in-memory index for case-insensitive prefix matching.
+    Initialize with a list of term, item tuples; items are returned by
+    :meth:`search` in the order they were added.  If ``infix`` is True,
+    terms are also indexed from the start of every word, so that a search
+    matches at the beginning of any word in the term (e.g., ``rush``
+    matches ``Salman Rushdie papers``).
+    '''
+
+    def __init__(self, items=(), infix=False):
+        self.infix = infix
+        self.items = []
+        self._item_keys = []
+        index = []
+        for term, item in items:
+            keys = self._term_keys(term)
+            self.items.append(item)
+            self._item_keys.append(keys)
+            index.extend((key, len(self.items) - 1) for key in keys)
+        index.sort()
+        self._sorted_keys = [key for key, i in index]
+        self._ids = [i for key, i in index]
+
+    def __len__(self):
+        return len(self.items)
+
+    def _term_keys(self, term):
+        term = normalize(term)
+        if not self.infix:
+            return [term]
+        keys = set(term[match.start():] for match in _word_start.finditer(term))
+        keys.add(term)
+        return sorted(keys)
+
+    def _search_ids(self, prefix):
+        # all items match an empty search
+        if not prefix:
+            return range(len(self.items))
+        found = set()
+        keys = self._sorted_keys
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            found.add(self._ids[i])
+            i += 1
+        return sorted(found)
+
+    def search(self, prefix):
+        '''Find all items with a term that starts with the specified prefix
+        (or a word that starts with the prefix, if ``infix`` is enabled).'''
+        return [self.items[i] for i in self._search_ids(normalize(prefix))]
+
+    def search_words(self, text):
+        '''Find all items matching every word in the search text.  Requires
+        ``infix``, so that each word can match anywhere in the term.'''
+        words = normalize(text).split()
+        if not words:
+            return self.search('')
+        # find candidates by the longest (most selective) word, then
+        # check that the remaining words also match
+        words.sort(key=len, reverse=True)
+        ids = self._search_ids(words[0])
+        return [self.items[i] for i in ids
+                if all(any(key.startswith(w) for key in self._item_keys[i])
+                       for w in words[1:])]
+
+
+class SolrSuggestIndex(object):
+    '''Base class for suggestion indexes loaded from Solr.  Subclasses
+    must implement :meth:`refresh` to load data from Solr; the data is
+    refreshed when it is used if the refresh interval has passed.
+    Instances are intended to be created once per process (e.g., at
+    module level), and are safe to use from multiple threads.
+    '''
+
+    def __init__(self):
+        #: time of the last refresh
+        self.updated = None
+        self._lock = threading.Lock()
+
+    @property
+    def refresh_interval(self):
+        return getattr(settings, 'SUGGEST_REFRESH_INTERVAL',
+                       DEFAULT_REFRESH_INTERVAL)
+
+    def refresh(self):
+        '''Load or update data from Solr.'''
+        raise NotImplementedError
+
+    def expire(self):
+        '''Mark the index as out of date so it will be refreshed the
+        next time it is used.'''
+        self.updated = None
+
+    def is_current(self):
+        return self.updated is not None and \
+            time.time() - self.updated < self.refresh_interval
+
+    def load(self):
+        '''Refresh from Solr if the index is out of date.  If the index
+        has been loaded and another thread is already refreshing it, the
+        current data is used rather than waiting on the refresh.'''
+        if self.is_current():
+            return
+        loaded = self.updated is not None
+        if not self._lock.acquire(not loaded):
+            return
+        try:
+            # another thread may have refreshed while we were waiting
+            if self.is_current():
+                return
+            try:
+                self.refresh()
+            except Exception as err:
+                # nothing to fall back on if the index was never loaded
+                if not loaded:
+                    raise
+                logger.warning('Error refreshing %s from Solr; using existing data: %s',
+                               self.__class__.__name__, err)
+            self.updated = time.time()
+        finally:
+            self._lock.release()
+
+
+class FacetSuggestions(SolrSuggestIndex):
+    '''Suggestions for the values of Solr facet fields, with counts.
+    All facet values are loaded in a single Solr facet query.
+
+    :param facet_fields: list of Solr facet fields to index
+    :param infix: list of fields that should match at the start of any
+        word instead of only at the beginning of the value
+    :param rollups: optional dictionary of additional facets generated
+        by truncating the values of an indexed field; key is the name to
+        use for the new facet and value is a tuple of field name and
+        value length, e.g. ``{'created_year': ('created_date', 4)}``
+    '''
+
+    def __init__(self, facet_fields, infix=None, rollups=None):
+        super(FacetSuggestions, self).__init__()
+        self.facet_fields = facet_fields
+        self.infix = infix or []
+        self.rollups = rollups or {}
+        self.indexes = {}
+
+    def refresh(self):
+        solr = solr_interface()
+        facetq = solr.query().paginate(rows=0)
+        for field in self.facet_fields:
+            facetq = facetq.facet_by(field, sort='index', limit=-1, mincount=1)
+        facets = facetq.execute().facet_counts.facet_fields
+
+        values = dict((field, facets.get(field, [])) for field in self.facet_fields)
+        for name, (field, length) in self.rollups.iteritems():
+            counts = defaultdict(int)
+            for value, count in values[field]:
+                counts[value[:length]] += count
+            values[name] = sorted(counts.iteritems())
+
+        # build new indexes and replace them all at once, so that
+        # concurrent requests never see a partially refreshed set
+        self.indexes = dict(
+            (field, PrefixIndex(((value, (value, count)) for value, count in vals),
+                                infix=field in self.infix))
+            for field, vals in values.iteritems())
+
+    def suggest(self, field, prefix, sort='count', limit=15):
+        '''Find facet values for a field that match a prefix.
+
+        :param field: facet field name
+        :param prefix: search prefix (case-insensitive)
+        :param sort: ``count`` to return the most common values first,
+            or ``index`` to return values in order
+        :param limit: maximum number of values to return
+        :returns: list of tuples of facet value and count
+        '''
+        self.load()
+        matches = self.indexes[field].search(prefix)
+        if sort == 'count':
+            return heapq.nsmallest(limit, matches,
+                                   key=lambda item: (-item[1], item[0]))
+        return matches[:limit]
+
+
+class CollectionSuggestions(SolrSuggestIndex):
+    '''Suggestions for archival collections, matched by collection number,
+    title, creator, or archive.  After the initial load, only collections
+    that have been indexed since the last refresh are retrieved from
+    Solr, unless the number of collections in Solr has changed (e.g.,
+    because a collection was removed).
+    '''
+
+    fields = ['pid', 'source_id', 'title', 'archive_short_name',
+              'creator', 'archive_id', 'timestamp']
+
+    def __init__(self):
+        super(CollectionSuggestions, self).__init__()
+        self.collections = {}
+        self.last_indexed = None
+        self.index = PrefixIndex(infix=True)
+
+    def query(self):
+        solr = solr_interface()
+        return solr.query() \
+                   .filter(content_model=CollectionObject.COLLECTION_CONTENT_MODEL) \
+                   .filter(archive_id__any=True) \
+                   .field_limit(self.fields)
+
+    def refresh(self):
+        q = self.query()
+        collections = self.collections
+        if self.last_indexed is not None:
+            changed = q.filter(timestamp__gte=self.last_indexed)
+        else:
+            collections = {}
+            changed = q
+
+        last_indexed = self.last_indexed
+        for doc in solr_cursor(changed):
+            collections[doc['pid']] = doc
+            if last_indexed is None or doc.get('timestamp') > last_indexed:
+                last_indexed = doc.get('timestamp')
+
+        # removed collections can only be detected by reloading everything
+        if self.last_indexed is not None and q.count() != len(collections):
+            self.last_indexed = None
+            return self.refresh()
+
+        docs = sorted(collections.itervalues(), key=self.sort_key)
+        self.index = PrefixIndex(((self.text(doc), doc) for doc in docs),
+                                 infix=True)
+        self.collections = collections
+        self.last_indexed = last_indexed
+
+    @staticmethod
+    def sort_key(doc):
+        # order by collection number, with unnumbered collections last
+        return (doc.get('source_id') is None, doc.get('source_id'),
+                doc.get('title', ''))
+
+    @staticmethod
+    def text(doc):
+        creator = doc.get('creator', [])
+        if not isinstance(creator, list):
+            creator = [creator]
+        return u' '.join(unicode(val) for val in
+                         [doc.get('source_id', ''), doc.get('title', ''),
+                          doc.get('archive_short_name', '')] + creator)
+
+    def suggest(self, text, limit=15):
+        '''Find collections matching every word in the search text.
+
+        :returns: list of Solr result dictionaries
+        '''
+        self.load()
+        return self.index.search_words(text)[:limit]
@@ -1,27 +1,60 @@
+import base64
 from datetime import date, datetime, timedelta
+from celery.exceptions import Retry
 from dateutil.tz import tzutc
+import json
 import logging
+from lxml import etree
 from mock import Mock, MagicMock, patch
 import os
+import shutil
+from StringIO import StringIO
 from sunburnt import sunburnt
+import tempfile
+import time
 import urllib2
 
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, PageNotAnInteger
 from django.core.urlresolvers import reverse
+from django.http import HttpResponse
 from django.test import TestCase, Client, override_settings
+from django.utils import timezone
 
 from eulfedora.models import XmlDatastream
 from eulfedora.xml import AuditTrailRecord
 from eulxml.xmlmap import mods
 
 from keep.audio import models as audiomodels
+from keep.audio.context_processors import item_search
+from keep.audio.tasks import convert_wav_to_mp3
+from keep.benchmarks import suite as benchmark_suite
+from keep.benchmarks.fedora import FakeFedora
+from keep.benchmarks.solr import FakeSolr, QueryParser
 from keep.collection.fixtures import FedoraFixtures
+from keep.common.batch import pool_map
+from keep.common.bulkedit import BulkEdit
+from keep.common import eadmap
+from keep.common import fedora
 from keep.common.fedora import DigitalObject, LocalMODS, AuditTrailEvent, \
-    DuplicateContent
-from keep.common.forms import ItemSearch
-from keep.common.models import _DirPart #, FileMasterTech, FileMasterTech_Base
-from keep.common.utils import absolutize_url, solr_interface
+    DuplicateContent, Repository, request_credentials
+from keep.common import fixity
+from keep.common import foxml
+from keep.common.forms import ItemSearch, _simple_collection_options
+from keep.common import indexdata
+from keep.common import instrumentation
+from keep.common.models import _DirPart, BatchItemResult, ScratchReservation, \
+    TaskLock #, FileMasterTech, FileMasterTech_Base
+from keep.common.paginator import SolrPaginator
+from keep.common import reports
+from keep.common import scratch
+from keep.common import staging
+from keep.common.suggest import CollectionSuggestions, PrefixIndex
+from keep.common import utils
+from keep.common.utils import absolutize_url, redact_email, solr_cursor, \
+    solr_interface, solr_atomic_update
 from keep.common.templatetags import rights_extras
 from keep.testutil import KeepTestCase
 
@@ -103,6 +136,164 @@ class TestSolrInterface(TestCase):
         mockhttplib.Http.assert_called_with(ca_certs=settings.SOLR_CA_CERT_PATH)
 
 
+class TestSolrCursor(TestCase):
+
+    page_xml = '''<response><result name="response" numFound="3" start="0"/>
+<str name="nextCursorMark">%s</str></response>'''
+
+    @patch('keep.common.utils.SolrResponse')
+    def test_solr_cursor(self, mocksolrresponse):
+        q = Mock()
+        q.options.return_value = {'q': 'pid:*', 'start': 10, 'sort': 'title asc'}
+        # solr returns the same cursor mark when results are exhausted
+        q.interface.conn.select.side_effect = [self.page_xml % 'AoE1',
+                                               self.page_xml % 'AoE2',
+                                               self.page_xml % 'AoE2']
+        mocksolrresponse.from_xml.side_effect = [[{'pid': 'a:1'}, {'pid': 'a:2'}],
+                                                 [{'pid': 'a:3'}], []]
+
+        results = list(solr_cursor(q, rows=2))
+        self.assertEqual(['a:1', 'a:2', 'a:3'], [r['pid'] for r in results])
+        self.assertEqual(3, q.interface.conn.select.call_count,
+            'solr should be queried until the cursor mark stops changing')
+        params = dict(q.interface.conn.select.call_args[0][0])
+        self.assertEqual('AoE2', params['cursorMark'])
+        self.assertEqual('title asc, pid asc', params['sort'],
+            'pid should be added to sort as a tie-breaker')
+        self.assertEqual('2', str(params['rows']))
+        self.assertNotIn('start', params)
+
+
+class TestSolrAtomicUpdate(TestCase):
+
+    def test_solr_atomic_update(self):
+        solr = Mock()
+        solr_atomic_update([
+            {'pid': 'a:1', 'collection_label': u'Rushdie papers',
+             'researcher_access': True, 'archive_id': None},
+            {'pid': 'a:2', 'users': ['jsmith', 'jdoe'], 'source_id': 100},
+            {'pid': 'a:3', 'collection_label': 'ignored'},
+        ], solr=solr, batch_size=2)
+
+        self.assertEqual(2, solr.conn.update.call_count,
+            'updates should be sent in batches')
+        xml = etree.fromstring(solr.conn.update.call_args_list[0][0][0])
+        docs = xml.xpath('/add/doc')
+        self.assertEqual(2, len(docs))
+        self.assertEqual('a:1', docs[0].xpath('string(field[@name="pid"])'))
+        self.assertEqual(0, len(docs[0].xpath('field[@name="pid"][@update]')),
+            'unique key should not be updated')
+        self.assertEqual('Rushdie papers',
+            docs[0].xpath('string(field[@name="collection_label"][@update="set"])'))
+        self.assertEqual('true',
+            docs[0].xpath('string(field[@name="researcher_access"][@update="set"])'))
+        self.assertEqual('true',
+            docs[0].xpath('string(field[@name="archive_id"][@update="set"]/@null)'),
+            'None should remove a field')
+        self.assertEqual(['jsmith', 'jdoe'],
+            docs[1].xpath('field[@name="users"][@update="set"]/text()'),
+            'lists should set all values of a multi-valued field')
+        self.assertEqual('100', docs[1].xpath('string(field[@name="source_id"])'))
+
+
+class TestSolrPaginator(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.q = Mock()
+        self.q.options.return_value = {'q': 'isPartOf:mailbox'}
+        self.q.sort_by.return_value = self.q
+        self.q.result_constructor = dict
+
+    def tearDown(self):
+        cache.clear()
+
+    def mock_response(self, count):
+        response = MagicMock()
+        response.result.numFound = count
+        return response
+
+    @patch('keep.common.paginator.solr_select')
+    def test_page(self, mocksolr_select):
+        # unsorted query: sort by relevance, then pid
+        paginator = SolrPaginator(self.q, 30)
+        self.q.sort_by.assert_any_call('-score')
+        self.q.sort_by.assert_called_with('pid')
+
+        # first page: count and results in a single cursor request
+        mocksolr_select.return_value = (self.mock_response(95), 'AoE1')
+        page = paginator.page(1)
+        mocksolr_select.assert_called_with(self.q, start=None, rows=30,
+                                           cursorMark='*')
+        self.assertEqual(95, paginator.count)
+        self.assertEqual(4, paginator.num_pages)
+        self.assertEqual(mocksolr_select.return_value[0], page.object_list)
+        self.assertEqual(0, self.q.count.call_count,
+            'paginator should not run a separate count query')
+
+        # next page uses the cached cursor mark
+        paginator = SolrPaginator(self.q, 30)
+        mocksolr_select.return_value = (self.mock_response(95), 'AoE2')
+        paginator.page(2)
+        mocksolr_select.assert_called_with(self.q, start=None, rows=30,
+                                           cursorMark='AoE1')
+
+        # page with no cached cursor uses start and rows
+        self.q.paginate.return_value.execute.return_value = self.mock_response(95)
+        paginator = SolrPaginator(self.q, 30)
+        paginator.page(4)
+        self.q.paginate.assert_called_with(start=90, rows=30)
+        self.assertEqual(2, mocksolr_select.call_count)
+
+        # page past the cached count fails without querying solr
+        paginator = SolrPaginator(self.q, 30)
+        self.assertRaises(EmptyPage, paginator.page, 5)
+        self.assertEqual(1, self.q.paginate.call_count)
+        self.assertRaises(EmptyPage, paginator.page, 0)
+        self.assertRaises(PageNotAnInteger, paginator.page, 'one')
+
+    @patch('keep.common.paginator.solr_select')
+    def test_grouped(self, mocksolr_select):
+        # grouped queries can't use cursors
+        self.q.options.return_value = {'q': '*:*', 'group': True,
+                                       'sort': 'created desc'}
+        self.q.paginate.return_value.execute.return_value = self.mock_response(0)
+        paginator = SolrPaginator(self.q, 30)
+        self.q.sort_by.assert_called_once_with('pid')
+        page = paginator.page(1)
+        self.q.paginate.assert_called_with(start=0, rows=30)
+        self.assertEqual(0, mocksolr_select.call_count)
+        # empty first page is allowed
+        self.assertEqual(0, paginator.count)
+        self.assertEqual(1, page.number)
+
+
+class TestRedactEmail(TestCase):
+
+    redactions = Mock(redactions={
+        r'[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}': 'IP address',
+        r'(jane|john)\.doe@example\.com': 'email address',
+    })
+
+    def setUp(self):
+        # clear any cached redaction pattern
+        utils._redaction_regex = None
+
+    def tearDown(self):
+        utils._redaction_regex = None
+
+    def test_redact_email(self):
+        with patch.dict('sys.modules', {'keep.email_redactions': self.redactions}):
+            redacted = redact_email('From: John.Doe@example.com\nReceived: from 10.0.0.1\n')
+        self.assertEqual('From: [REDACTED: email address]\nReceived: from [REDACTED: IP address]\n',
+                         redacted)
+
+        # pattern is compiled once and reused
+        with patch('keep.common.utils.re') as mockre:
+            redact_email('no sensitive content')
+            mockre.compile.assert_not_called()
+
+
 
 
 # FIXME: why is this in keep.common instead of arrangement ?
@@ -406,12 +597,17 @@ class SearchTest(KeepTestCase):
     mocksolr.query.__or__.return_value = mocksolr.query
     mocksolr.query.filter.return_value = mocksolr.query
     mocksolr.query.count.return_value = 0
+    mocksolr.query.options.return_value = {}
     mocksolr.Q.return_value = mocksolr.query
 
     @patch('keep.common.views.solr_interface', mocksolr)
     @patch('keep.search.views.solr_interface', mocksolr)  # redirect to home page
     @patch('keep.common.forms.CollectionObject')
-    def test_search(self, mockcollobj):
+    @patch('keep.common.paginator.solr_select')
+    def test_search(self, mocksolr_select, mockcollobj):
+        # paginated results are retrieved directly from solr
+        mocksolr_select.return_value = (MagicMock(), None)
+        mocksolr_select.return_value[0].result.numFound = 0
         collections = [
             {'pid': 'pid:1', 'source_id': 1, 'title': 'mss 1'}
             ]
@@ -657,6 +853,33 @@ class ItemSearchTest(TestCase):
         self.assert_('output' not in search_info,
                      'output formatting fields should not be included in search info')
 
+    @patch('keep.common.forms.SimpleCollection')
+    def test_simple_collection_options(self, mocksimplecoll):
+        mocksimplecoll.OPTIONS_CACHE_KEY = 'test-simple-collection-options'
+        mocksimplecoll.OPTIONS_CACHE_TIMEOUT = 60
+        mocksimplecoll.simple_collections.return_value = [
+            {'pid': 'coll:2', 'label': 'second'},
+            {'pid': 'coll:1', 'label': 'first'},
+        ]
+        cache.delete(mocksimplecoll.OPTIONS_CACHE_KEY)
+        options = _simple_collection_options()
+        self.assertEqual([('', ''), ('info:fedora/coll:1', 'first '),
+                          ('info:fedora/coll:2', 'second ')], options)
+
+        # cached options should be used until the cache is cleared
+        mocksimplecoll.simple_collections.reset_mock()
+        self.assertEqual(options, _simple_collection_options())
+        mocksimplecoll.simple_collections.assert_not_called()
+        cache.delete(mocksimplecoll.OPTIONS_CACHE_KEY)
+
+    @patch('keep.audio.context_processors.ItemSearch')
+    def test_context_processor(self, mockitemsearch):
+        context = item_search(Mock())
+        mockitemsearch.assert_not_called()
+        # form is only initialized when used
+        context['item_search'].is_bound
+        mockitemsearch.assert_called_with(prefix='audio')
+
 
 
 
@@ -715,3 +938,981 @@ class TestAuditTrailEvent(TestCase):
 
         modify_event = AuditTrailEvent(self.modify)
         self.assertEqual('modify', ingest_event.action)
+
+
+class TestRepository(TestCase):
+
+    @patch('keep.common.fedora.decrypt')
+    def test_request_credentials(self, mockdecrypt):
+        mockdecrypt.return_value = 'secret'
+        request = Mock(session={'fedora_password': 'encrypted'})
+        request.user.is_authenticated.return_value = True
+        request.user.username = 'staff'
+        self.assertEqual(('staff', 'secret'), request_credentials(request))
+        # password should only be decrypted once per request
+        request_credentials(request)
+        self.assertEqual(1, mockdecrypt.call_count)
+
+        request = Mock(session={})
+        request.user.is_authenticated.return_value = False
+        self.assertEqual((None, None), request_credentials(request))
+
+    def test_connection_reuse(self):
+        repo = Repository()
+        reused = fedora.connection_stats['reused']
+        self.assertEqual(repo.api, Repository().api,
+            'api connection should be reused for the same credentials')
+        self.assertEqual(reused + 1, fedora.connection_stats['reused'])
+        self.assertIn('keep_fedora_connections_total{outcome="reused"} %d' % (reused + 1),
+                      fedora.prometheus_text())
+        self.assertNotEqual(repo.api, Repository(username='other', password='pass').api,
+            'api connection should not be shared for different credentials')
+        for key in fedora._api_connections.apis:
+            self.assertNotIn('pass', key, 'credentials should not be stored as keys')
+
+        # connections for least recently used credentials are dropped
+        with override_settings(FEDORA_CONNECTION_CACHE_SIZE=2):
+            Repository(username='third', password='pass')
+            self.assertEqual(2, len(fedora._api_connections.apis))
+            self.assertNotEqual(repo.api, Repository().api)
+
+
+class TestPrefixIndex(TestCase):
+
+    def test_search(self):
+        index = PrefixIndex([('2012-01', 1), ('2012-04', 2), ('2013-01', 3)])
+        self.assertEqual([1, 2], index.search('2012'))
+        self.assertEqual([3], index.search('2013-01'))
+        self.assertEqual([], index.search('01'),
+            'without infix, should only match at the start of the term')
+        self.assertEqual([1, 2, 3], index.search(''))
+
+    def test_infix(self):
+        index = PrefixIndex([(u'Salman Rushdie papers', 'rushdie'),
+                             (u'Seamus Heaney papers', 'heaney'),
+                             (u'Rushdie, Salman', 'creator')], infix=True)
+        # case-insensitive; items returned in order added, once each
+        self.assertEqual(['rushdie', 'creator'], index.search('RUSH'))
+        self.assertEqual(['rushdie', 'heaney'], index.search('pap'))
+        self.assertEqual([], index.search('ushdie'),
+            'should match at the start of words only')
+        self.assertEqual(['rushdie'], index.search_words('papers salm'))
+        self.assertEqual([], index.search_words('heaney salm'))
+
+
+class TestCollectionSuggestions(TestCase):
+
+    @patch('keep.common.suggest.solr_cursor')
+    @patch('keep.common.suggest.solr_interface')
+    def test_refresh(self, mock_solr_interface, mock_solr_cursor):
+        solrquery = mock_solr_interface.return_value.query.return_value
+        solrquery.filter.return_value = solrquery
+        solrquery.field_limit.return_value = solrquery
+        indexed = datetime(2015, 3, 1, 12, 0)
+        mock_solr_cursor.return_value = [
+            {'pid': 'coll:1', 'source_id': 1000, 'title': 'Rushdie papers',
+             'timestamp': indexed},
+            {'pid': 'coll:2', 'source_id': 960, 'title': 'Heaney papers',
+             'timestamp': indexed - timedelta(days=1)},
+        ]
+        suggestions = CollectionSuggestions()
+        self.assertEqual(['coll:2', 'coll:1'],
+                         [c['pid'] for c in suggestions.suggest('papers')])
+        self.assertEqual(indexed, suggestions.last_indexed)
+
+        # incremental update: only collections indexed since the last refresh
+        mock_solr_cursor.return_value = [
+            {'pid': 'coll:1', 'source_id': 1000, 'title': 'Salman Rushdie papers',
+             'timestamp': indexed + timedelta(hours=1)}
+        ]
+        solrquery.count.return_value = 2
+        suggestions.expire()
+        self.assertEqual(['coll:1'], [c['pid'] for c in suggestions.suggest('salm')])
+        solrquery.filter.assert_called_with(timestamp__gte=indexed)
+        self.assertEqual(2, len(suggestions.collections))
+
+        # collection count mismatch: full reload
+        mock_solr_cursor.return_value = [
+            {'pid': 'coll:2', 'source_id': 960, 'title': 'Heaney papers',
+             'timestamp': indexed}
+        ]
+        solrquery.count.return_value = 1
+        suggestions.expire()
+        self.assertEqual(['coll:2'], [c['pid'] for c in suggestions.suggest('papers')])
+        self.assertEqual(1, len(suggestions.collections))
+
+        # solr errors after the initial load: existing data is used
+        mock_solr_cursor.side_effect = Exception('solr unavailable')
+        suggestions.expire()
+        self.assertEqual(['coll:2'], [c['pid'] for c in suggestions.suggest('papers')])
+
+
+class TestPoolMap(TestCase):
+
+    def test_pool_map(self):
+        def double(i):
+            if i == 3:
+                raise Exception('bad item')
+            return i * 2
+
+        for workers in [1, 3]:
+            results = dict((item, (result, err)) for item, result, err
+                           in pool_map(double, range(5), workers=workers))
+            self.assertEqual(5, len(results))
+            self.assertEqual((8, None), results[4])
+            result, err = results[3]
+            self.assertEqual(None, result,
+                'item with an error should not have a result')
+            self.assertEqual('bad item', str(err),
+                'error should be returned, not raised')
+
+
+class TestBatchItemResult(TestCase):
+
+    def test_record_completed(self):
+        BatchItemResult.record('batch:1', 'Processed', 'item:1')
+        BatchItemResult.record('batch:1', 'Processed', 'item:2', Exception('failed'))
+        BatchItemResult.record('batch:1', 'Accessioned', 'item:3')
+        self.assertEqual(set(['item:1']),
+                         BatchItemResult.completed('batch:1', 'Processed'))
+        self.assertEqual('failed', BatchItemResult.objects.get(pid='item:2').message)
+
+        # second outcome for the same item replaces the first
+        BatchItemResult.record('batch:1', 'Processed', 'item:2')
+        self.assertEqual(set(['item:1', 'item:2']),
+                         BatchItemResult.completed('batch:1', 'Processed'))
+
+
+class TestBulkEdit(TestCase):
+
+    def setUp(self):
+        self.obj = Mock()
+        self.obj.exists = True
+        self.obj.mods.isModified.return_value = False
+        self.obj.dc.isModified.return_value = False
+
+    def get_editor(self, transform, **kwargs):
+        editor = BulkEdit(transform, type=ModsDigitalObject, **kwargs)
+        editor.repos = Mock()
+        editor.repos.repo.get_object.return_value = self.obj
+        return editor
+
+    def test_edit_unchanged(self):
+        editor = self.get_editor(lambda obj: None)
+        self.assertEqual(('unchanged', ''), editor.edit('pid:1'))
+        self.assertEqual(0, self.obj.save.call_count,
+            'object should not be saved when nothing was modified')
+
+    def test_edit_modified(self):
+        def transform(obj):
+            obj.mods.isModified.return_value = True
+
+        editor = self.get_editor(transform, log_message='fix titles')
+        outcome, diff = editor.edit('pid:1')
+        self.assertEqual('updated', outcome)
+        self.obj.save.assert_called_with('fix titles')
+
+        # noact - changes reported but not saved
+        self.obj.reset_mock()
+        self.obj.mods.isModified.return_value = False
+        editor = self.get_editor(transform, noact=True)
+        outcome, diff = editor.edit('pid:1')
+        self.assertEqual('updated', outcome)
+        self.assertEqual(0, self.obj.save.call_count)
+
+    def test_run(self):
+        self.obj.exists = False
+        editor = self.get_editor(lambda obj: None, workers=1)
+        results = list(editor.run(['pid:1', 'pid:2']))
+        self.assertEqual(2, len(results))
+        self.assertEqual('not found', results[0].outcome)
+        self.assertEqual(2, editor.stats['total'])
+        self.assertEqual(2, editor.stats['not found'])
+
+
+class TestPartialIndexData(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.obj = Mock()
+        self.obj.pid = 'pid:1'
+        self.obj.partial_index_methods = {'DC': '_index_data_dc',
+                                          'MODS': '_index_data_mods'}
+        self.obj.api.username = 'joe'
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_record_changes(self):
+        self.assertEqual(None, indexdata.pending_changes('pid:1'))
+        indexdata.record_changes(self.obj, ['DC'])
+        indexdata.record_changes(self.obj, ['MODS'])
+        changes = indexdata.pending_changes('pid:1')
+        self.assertEqual(set(['DC', 'MODS']), changes['dsids'])
+        self.assertEqual(set(['joe']), changes['users'])
+
+        # once a full reindex is required, partial changes don't clear it
+        indexdata.record_changes(self.obj, ['RELS-EXT'])
+        indexdata.record_changes(self.obj, ['DC'])
+        self.assertEqual(None, indexdata.pending_changes('pid:1')['dsids'])
+        # an overlapping partial save that read the changes before the
+        # full reindex was flagged can't clear it either
+        cache.set('partial-index-pid:1', {'dsids': set(['DC']), 'users': set()})
+        self.assertEqual(None, indexdata.pending_changes('pid:1')['dsids'])
+
+        indexdata.clear_changes('pid:1')
+        self.assertEqual(None, indexdata.pending_changes('pid:1'))
+
+    @patch('keep.common.indexdata.solr_interface')
+    def test_partial_index_document(self, mocksolr_interface):
+        mocksolr = mocksolr_interface.return_value
+        mockquery = mocksolr.query.return_value.paginate.return_value
+        mockquery.execute.return_value = [{
+            'pid': 'pid:1', 'label': 'old label', 'title': ['old title'],
+            'subject': ['history'], 'collection_id': 'coll:1',
+            'created': datetime(2012, 1, 3, 10, 15, tzinfo=tzutc()),
+            'audit_trail_users': ['jane'], 'users': ['Jane Doe'],
+            '_version_': 1234, 'timestamp': datetime.now()
+        }]
+        self.obj.partial_index_data.return_value = {
+            'label': 'new label', 'title': ['new title'], 'subject': None}
+
+        # full reindex required
+        self.assertEqual(None, indexdata.partial_index_document(self.obj, None))
+        self.assertEqual(None, indexdata.partial_index_document(self.obj,
+            {'dsids': None, 'users': set()}))
+        self.assertEqual(0, mocksolr.query.call_count)
+
+        changes = {'dsids': set(['DC']), 'users': set(['joe'])}
+        with patch('keep.common.indexdata.user_full_name',
+                   new=lambda user: user.upper()):
+            data = indexdata.partial_index_document(self.obj, changes)
+        self.obj.partial_index_data.assert_called_with(changes['dsids'])
+        mocksolr.query.assert_called_with(pid='pid:1')
+
+        self.assertEqual('new label', data['label'])
+        self.assertEqual(['new title'], data['title'])
+        self.assert_('subject' not in data,
+            'fields set to None should be removed from the index')
+        # unaffected fields are preserved from the indexed document
+        self.assertEqual('coll:1', data['collection_id'])
+        self.assertEqual('2012-01-03T10:15:00Z', data['created'])
+        self.assertEqual(['jane', 'joe'], data['audit_trail_users'])
+        self.assertEqual(['JANE', 'JOE'], data['users'])
+        for field in ['_version_', 'timestamp']:
+            self.assert_(field not in data,
+                'solr generated field %s should not be included' % field)
+
+        # not indexed - full reindex required
+        mockquery.execute.return_value = []
+        self.assertEqual(None, indexdata.partial_index_document(self.obj, changes))
+
+    @patch('keep.common.views.indexdata')
+    @patch('keep.common.views.indexdata_views')
+    @patch('keep.common.views.TypeInferringRepository')
+    def test_index_data_view(self, mockrepo, mockindexviews, mockindexdata):
+        mockindexviews._permission_denied_check.return_value = False
+        mockindexviews.index_data.return_value = HttpResponse('full')
+        url = reverse('keep.common.views.index_data', kwargs={'id': 'pid:1'})
+
+        # partial changes
+        mockindexdata.pending_changes.return_value = {'dsids': set(['DC']),
+                                                      'users': set()}
+        mockindexdata.partial_index_document.return_value = {'pid': 'pid:1'}
+        response = self.client.get(url)
+        self.assertEqual('application/json', response['Content-Type'])
+        self.assertEqual({'pid': 'pid:1'}, json.loads(response.content))
+        self.assertEqual(0, mockindexviews.index_data.call_count)
+
+        # full reindex
+        mockindexdata.pending_changes.return_value = {'dsids': None,
+                                                      'users': set()}
+        response = self.client.get(url)
+        self.assertEqual('full', response.content)
+        mockindexdata.clear_changes.assert_called_with('pid:1')
+
+        mockindexviews._permission_denied_check.return_value = True
+        response = self.client.get(url)
+        self.assertEqual(403, response.status_code)
+
+
+class TestFixity(TestCase):
+
+    def test_throttle(self):
+        throttle = fixity.Throttle(1000)
+        with patch('keep.common.fixity.time') as mocktime:
+            mocktime.time.return_value = throttle._available
+            throttle.consume(500)
+            # first read is not delayed
+            self.assertEqual(0, mocktime.sleep.call_count)
+            throttle.consume(500)
+            mocktime.sleep.assert_called_with(0.5)
+
+        # no rate - not limited
+        throttle = fixity.Throttle(None)
+        with patch('keep.common.fixity.time') as mocktime:
+            throttle.consume(500)
+            throttle.consume(500)
+            self.assertEqual(0, mocktime.sleep.call_count)
+
+    def test_checksum_valid(self):
+        ds = Mock()
+        ds.checksum_type = 'MD5'
+        ds.checksum = '5d41402abc4b2a76b9719d911017c592'  # md5 of 'hello'
+        ds.get_chunked_content.return_value = ['hel', 'lo']
+        throttle = Mock()
+        self.assertTrue(fixity.checksum_valid(ds, throttle))
+        throttle.consume.assert_called_with(2)
+
+        ds.get_chunked_content.return_value = ['jello']
+        self.assertFalse(fixity.checksum_valid(ds))
+
+        ds.checksum_type = 'SHA-1'
+        ds.checksum = 'aaf4c61ddcc5e8a2dabede0f3b482cd9aea9434d'  # sha1 of 'hello'
+        ds.get_chunked_content.return_value = ['hello']
+        self.assertTrue(fixity.checksum_valid(ds))
+
+        ds.checksum_type = 'DISABLED'
+        self.assertEqual(None, fixity.checksum_valid(ds))
+
+    @patch('keep.common.fixity.checksum_valid')
+    def test_check_object(self, mockvalid):
+        obj = Mock(fixity_datastreams=['audio', 'compressed_audio'])
+        obj.audio.id = 'AUDIO'
+        obj.compressed_audio.exists = False
+        mockvalid.return_value = False
+        self.assertEqual((['AUDIO'], []), fixity.check_object(obj))
+        mockvalid.assert_called_once_with(obj.audio, None)
+        mockvalid.return_value = True
+        self.assertEqual(([], []), fixity.check_object(obj))
+        # no checksum to compare against
+        mockvalid.return_value = None
+        self.assertEqual(([], ['AUDIO']), fixity.check_object(obj))
+
+    def test_fixity_index_data(self):
+        self.assertEqual({}, fixity.fixity_index_data('pid:1'))
+        BatchItemResult.record(fixity.FIXITY_BATCH, fixity.FIXITY_ACTION, 'pid:1',
+                               error='checksum mismatch: AUDIO')
+        data = fixity.fixity_index_data('pid:1')
+        self.assertEqual('fail', data['last_fixity_result'])
+        self.assert_(data['last_fixity_check'].endswith('Z'))
+
+        BatchItemResult.record(fixity.FIXITY_BATCH, fixity.FIXITY_ACTION, 'pid:1',
+                               error='unverified: no checksum for AUDIO')
+        self.assertEqual('unverified', fixity.fixity_index_data('pid:1')['last_fixity_result'])
+        BatchItemResult.record(fixity.FIXITY_BATCH, fixity.FIXITY_ACTION, 'pid:1',
+                               error='error: object not found')
+        self.assertEqual('error', fixity.fixity_index_data('pid:1')['last_fixity_result'])
+        BatchItemResult.record(fixity.FIXITY_BATCH, fixity.FIXITY_ACTION, 'pid:1')
+        self.assertEqual('pass', fixity.fixity_index_data('pid:1')['last_fixity_result'])
+
+    @patch('keep.common.fixity.solr_atomic_update')
+    def test_run(self, mockupdate):
+        checker = fixity.FixityChecker([audiomodels.AudioObject], workers=1,
+                                       repos=Mock())
+        docs = [{'pid': 'pid:1'}, {'pid': 'pid:2'}, {'pid': 'pid:3'}, {'pid': 'pid:4'}]
+        results = {'pid:1': ([], []), 'pid:2': (['AUDIO'], []),
+                   'pid:4': ([], ['AUDIO'])}
+
+        def check(doc):
+            if doc['pid'] not in results:
+                raise Exception('connection error')
+            return results[doc['pid']]
+
+        with patch.object(checker, 'select', return_value=docs):
+            with patch.object(checker, 'check', new=check):
+                stats = checker.run(limit=4)
+
+        self.assertEqual({'pass': 1, 'fail': 1, 'unverified': 1, 'error': 1}, stats)
+        self.assertEqual(set(['pid:1']),
+            BatchItemResult.completed(fixity.FIXITY_BATCH, fixity.FIXITY_ACTION))
+        # objects that could not be checked are recorded, so they are
+        # not selected first on the next run
+        self.assertEqual('error', fixity.fixity_index_data('pid:3')['last_fixity_result'])
+        updates = mockupdate.call_args[0][0]
+        self.assertEqual(['pid:1', 'pid:2', 'pid:3', 'pid:4'], [u['pid'] for u in updates])
+        self.assertEqual(['pass', 'fail', 'error', 'unverified'],
+                         [u['last_fixity_result'] for u in updates])
+
+    def test_select(self):
+        checker = fixity.FixityChecker([audiomodels.AudioObject], repos=Mock())
+        with patch.object(checker, 'query') as mockquery:
+            unchecked = mockquery.return_value.exclude.return_value
+            unchecked.sort_by.return_value.paginate.return_value.execute.return_value = \
+                [{'pid': 'pid:1'}]
+            checked = mockquery.return_value.filter.return_value
+            checked.sort_by.return_value.paginate.return_value.execute.return_value = \
+                [{'pid': 'pid:2'}]
+            self.assertEqual([{'pid': 'pid:1'}, {'pid': 'pid:2'}], checker.select(2))
+            # never-checked objects are selected in a stable order
+            unchecked.sort_by.assert_called_with('pid')
+            checked.sort_by.assert_called_with('last_fixity_check')
+            checked.sort_by.return_value.paginate.assert_called_with(rows=1)
+
+    def test_fixity_check_datetime(self):
+        # 8pm eastern is after 11pm UTC the same day, although the
+        # strings sort the other way
+        premis_date = fixity.fixity_check_datetime('2012-01-01T20:00:00-05:00')
+        recorded_date = fixity.fixity_check_datetime('2012-01-01T23:00:00Z')
+        self.assert_(premis_date > recorded_date)
+        self.assertFalse(timezone.is_naive(fixity.fixity_check_datetime('2012-01-01T20:00:00')))
+        self.assertRaises(ValueError, fixity.fixity_check_datetime, 'not a date')
+
+    def test_object_type(self):
+        checker = fixity.FixityChecker([audiomodels.AudioObject], repos=Mock())
+        self.assertEqual(audiomodels.AudioObject, checker.object_type(
+            {'content_model': [audiomodels.AudioObject.AUDIO_CONTENT_MODEL]}))
+        self.assertEqual(None, checker.object_type({'content_model': 'info:fedora/other'}))
+
+    @patch('keep.common.fixity.FixityChecker')
+    def test_run_fixity_checks(self, mockchecker):
+        mockchecker.return_value.run.return_value = {'pass': 1}
+        self.assertEqual({'pass': 1}, fixity.run_fixity_checks([], limit=5))
+        mockchecker.return_value.run.assert_called_with(limit=5)
+        # lock released after the run
+        self.assertEqual(None, TaskLock.objects.get(name=fixity.LOCK_NAME).expires)
+
+        # skipped if a run is in progress
+        TaskLock.acquire(fixity.LOCK_NAME, 60)
+        self.assertEqual(None, fixity.run_fixity_checks([]))
+        TaskLock.release(fixity.LOCK_NAME)
+
+
+class TestBenchmarkStandIns(TestCase):
+
+    def setUp(self):
+        self.solr = FakeSolr(settings.SOLR_SCHEMA).start()
+        self.fedora = FakeFedora().start()
+
+    def tearDown(self):
+        self.solr.stop()
+        self.fedora.stop()
+
+    def test_solr_query_parser(self):
+        parse = QueryParser.parse
+        self.assertEqual(('all',), parse('*:*'))
+        self.assertEqual(('term', 'pid', 'emory:1', False), parse('pid:emory\\:1'))
+        self.assertEqual(('bool', [('+', ('all',)), ('-', ('range', 'archive_id', None, None, True, True))]),
+                         parse('(*:* AND NOT archive_id:[* TO *])'))
+        self.assertEqual(('bool', [('', ('term', 'title', 'oral history', True)),
+                                   ('', ('wildcard', None, 'jaz*'))]),
+                         parse('{!tag=t}title:"oral history" OR jaz*'))
+        self.assertRaises(ValueError, parse, 'title:[a TO')
+
+    def test_solr_search(self):
+        self.solr.add({'pid': 'test:1', 'title': 'Oral history interview',
+                       'content_model': ['info:fedora/test:Audio'],
+                       'created': datetime(2015, 3, 1), 'collection_id': 'test:c1'})
+        self.solr.add({'pid': 'test:2', 'title': 'History lecture',
+                       'content_model': ['info:fedora/test:Audio'],
+                       'created': datetime(2014, 3, 1), 'collection_id': 'test:c1'})
+        with override_settings(SOLR_SERVER_URL=self.solr.url):
+            solr = solr_interface()
+            self.assertEqual(2, solr.query('history').count())
+            self.assertEqual(['test:1'], [d['pid'] for d in solr.query(title='oral history')])
+            results = solr.query(collection_id='test:c1').sort_by('created') \
+                          .facet_by('collection_id').execute()
+            self.assertEqual(['test:2', 'test:1'], [d['pid'] for d in results])
+            self.assertEqual([('test:c1', 2)], results.facet_counts.facet_fields['collection_id'])
+            self.assertEqual(['test:1'], [d['pid'] for d in
+                             solr.query(created__gte=datetime(2015, 1, 1))])
+
+            solr_atomic_update([{'pid': 'test:1', 'title': 'Concert'}], solr=solr)
+            self.assertEqual(['test:2'], [d['pid'] for d in solr.query('history')])
+            # fields that were not updated are preserved
+            self.assertEqual('test:c1', solr.query(title='concert').execute()[0]['collection_id'])
+
+            pids = [d['pid'] for d in solr_cursor(solr.query(), rows=1)]
+            self.assertEqual(['test:1', 'test:2'], sorted(pids))
+
+    def test_fedora_round_trip(self):
+        with override_settings(FEDORA_ROOT=self.fedora.url, FEDORA_PIDSPACE='bench'):
+            repo = Repository()
+            obj = repo.get_object(type=DcDigitalObject)
+            obj.label = 'benchmark object'
+            obj.dc.content.title = 'benchmark title'
+            obj.save('test ingest')
+            self.assert_(obj.pid.startswith('bench:'))
+
+            obj = repo.get_object(obj.pid, type=DcDigitalObject)
+            self.assertEqual('benchmark object', obj.label)
+            self.assertEqual('benchmark title', obj.dc.content.title)
+            obj.dc.content.title = 'new title'
+            obj.save('test update')
+            obj = repo.get_object(obj.pid, type=DcDigitalObject)
+            self.assertEqual('new title', obj.dc.content.title)
+            self.assertEqual(['ingest', 'modifyDatastreamByValue'],
+                             [r.action for r in obj.audit_trail.records][:2])
+            self.assertFalse(repo.get_object('bench:missing').exists)
+
+    def test_compare(self):
+        previous = {'benchmarks': {
+            'a': {'median': 1.0, 'fedora_requests': 5, 'solr_requests': 1},
+            'b': {'median': 1.0, 'fedora_requests': 5, 'solr_requests': 1},
+            'c': {'median': 1.0, 'fedora_requests': 5, 'solr_requests': 1},
+            'd': {'skipped': 'ffmpeg is not installed'}}}
+        current = {'benchmarks': {
+            'a': {'median': 1.1, 'fedora_requests': 5, 'solr_requests': 1},
+            'b': {'median': 1.5, 'fedora_requests': 5, 'solr_requests': 1},
+            'c': {'median': 0.9, 'fedora_requests': 6, 'solr_requests': 1},
+            'd': {'median': 1.0, 'fedora_requests': 5, 'solr_requests': 1}}}
+        self.assertEqual([('b', 1.0, 1.5), ('c', 1.0, 0.9)],
+                         benchmark_suite.compare(previous, current, threshold=0.2))
+
+
+class TestInstrumentation(TestCase):
+
+    def setUp(self):
+        instrumentation.metrics.reset()
+
+    def test_collect(self):
+        with instrumentation.collect('request', 'test') as collector:
+            instrumentation.record('fedora', 0.02, 100)
+            instrumentation.record('fedora', 0.5, 20)
+            with instrumentation.stage('convert'):
+                instrumentation.record('solr', 0.001)
+        # calls made outside the collector are not recorded on it
+        instrumentation.record('solr', 0.3)
+
+        self.assertEqual({'count': 2, 'time': 0.52, 'bytes': 120},
+                         collector.calls['fedora'])
+        self.assertEqual(1, collector.calls['solr']['count'])
+        self.assertEqual('convert', collector.stages[0][0])
+        self.assertNotEqual(None, collector.duration)
+        self.assertEqual(None, instrumentation.current())
+        self.assertEqual('fedora;desc="2 calls";dur=520.0, solr;desc="1 call";dur=1.0',
+                         collector.server_timing())
+
+        summary = collector.summary()
+        self.assertEqual('request', summary['type'])
+        self.assertEqual(120, summary['backends']['fedora']['bytes'])
+
+        text = instrumentation.prometheus_text()
+        self.assertIn('keep_backend_call_seconds_bucket{backend="fedora",le="0.025"} 1', text)
+        self.assertIn('keep_backend_call_seconds_bucket{backend="fedora",le="+Inf"} 2', text)
+        self.assertIn('keep_backend_call_seconds_count{backend="solr"} 2', text)
+        self.assertIn('keep_backend_response_bytes_total{backend="fedora"} 120', text)
+        self.assertIn('keep_request_seconds_count{view="test"} 1', text)
+        self.assertIn('keep_task_stage_seconds_count{stage="convert",task="test"} 1', text)
+
+    def test_nested_and_threads(self):
+        with instrumentation.collect('request', 'view') as outer:
+            with instrumentation.collect('task', 'task') as inner:
+                instrumentation.record('pidman', 0.1)
+            # calls made by worker threads are recorded on the caller
+            list(pool_map(lambda i: instrumentation.record('fedora', 0.01),
+                          range(4), workers=2))
+        self.assertEqual(1, inner.calls['pidman']['count'])
+        self.assertEqual(1, outer.calls['pidman']['count'])
+        self.assertEqual(4, outer.calls['fedora']['count'])
+        self.assertNotIn('fedora', inner.calls)
+
+    def test_fedora_signal(self):
+        repo = fedora.Repository()
+        with instrumentation.collect('request', 'test') as collector:
+            repo.api.describeRepository()
+        self.assertEqual(1, collector.calls['fedora']['count'])
+
+    def test_instrumented_client(self):
+        client = Mock()
+        client.get_ark.return_value = {'name': 'foo'}
+        wrapped = instrumentation.InstrumentedClient(client, 'pidman')
+        with instrumentation.collect('request', 'test') as collector:
+            self.assertEqual({'name': 'foo'}, wrapped.get_ark('123'))
+        client.get_ark.assert_called_with('123')
+        self.assertEqual(1, collector.calls['pidman']['count'])
+
+    @override_settings(INSTRUMENTATION_HEADERS=True, METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_middleware_and_metrics_view(self):
+        metrics_url = reverse('common:metrics')
+        response = self.client.get(metrics_url, REMOTE_ADDR='127.0.0.1')
+        self.assertEqual('text/plain; version=0.0.4', response['Content-Type'])
+        # previous request was recorded by the middleware
+        response = self.client.get(metrics_url, REMOTE_ADDR='127.0.0.1')
+        self.assertIn('keep_request_seconds_count{view="keep.common.views.metrics"} 1',
+                      response.content)
+        self.assertIn('keep_fedora_connections_total{outcome="created"}', response.content)
+
+        # urls that don't resolve to a view are not recorded individually
+        self.client.get('/not/a/real/url/')
+        response = self.client.get(metrics_url, REMOTE_ADDR='127.0.0.1')
+        self.assertIn('view="unresolved"', response.content)
+        self.assertNotIn('/not/a/real/url/', response.content)
+
+        with override_settings(METRICS_ALLOWED_IPS=[]):
+            response = self.client.get(metrics_url, REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(403, response.status_code)
+
+
+class TestSeriesTree(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.tree = eadmap.SeriesTree('rushdie1000', ark='http://pid.co/ark:/1/2')
+        writings = self.tree.add('rushdie1000_series2', 'Writings by Rushdie', 'series2')
+        self.tree.add('rushdie1000_subseries2.1', 'Fiction', 'subseries2.1', series=writings)
+        self.tree.add('rushdie1000_series4', 'Correspondence', 'series4')
+        self.tree.checked = time.time()
+
+    def test_lookups(self):
+        self.assertEqual([
+            {'id': 'rushdie1000_subseries2.1', 'value': 'Writings by Rushdie: Fiction'},
+            {'id': 'rushdie1000_series4', 'value': 'Correspondence'}],
+            self.tree.choices())
+        self.assertEqual('rushdie1000_series2',
+                         self.tree.parent('rushdie1000_subseries2.1')['id'])
+        self.assertEqual(None, self.tree.parent('rushdie1000_series4'))
+        self.assertEqual(None, self.tree.parent('bogus'))
+
+    @patch.object(eadmap.SeriesTree, 'load')
+    def test_series_tree(self, mockload):
+        mockload.return_value = self.tree
+        self.assertEqual(self.tree.by_id, eadmap.series_tree('rushdie1000').by_id)
+        mockload.assert_called_with('rushdie1000')
+        # cached copy is used without checking eXist until the interval passes
+        with patch.object(eadmap.SeriesTree, 'is_current') as mockcurrent:
+            eadmap.series_tree('rushdie1000')
+            self.assertEqual(1, mockload.call_count)
+            self.assertEqual(0, mockcurrent.call_count)
+
+            with override_settings(EAD_SERIES_CHECK_INTERVAL=0):
+                mockcurrent.return_value = True
+                eadmap.series_tree('rushdie1000')
+                self.assertEqual(1, mockload.call_count,
+                    'series should not be reloaded if the EAD is unchanged')
+                mockcurrent.return_value = False
+                eadmap.series_tree('rushdie1000')
+                self.assertEqual(2, mockload.call_count,
+                    'series should be reloaded when the EAD has been modified')
+
+
+class TestFoxmlRewriter(TestCase):
+
+    rels = '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">' + \
+        '<rdf:Description rdf:about="info:fedora/emory:old"/></rdf:RDF>'
+    export = '''<?xml version="1.0" encoding="UTF-8"?>
+<foxml:digitalObject VERSION="1.1" PID="emory:old"
+    xmlns:foxml="info:fedora/fedora-system:def/foxml#">
+<foxml:datastream ID="DC" STATE="A" CONTROL_GROUP="X">
+<foxml:datastreamVersion ID="DC.0" MIMETYPE="text/xml">
+<foxml:contentDigest TYPE="MD5" DIGEST="aaa"/>
+<foxml:xmlContent><identifier>emory:old</identifier></foxml:xmlContent>
+</foxml:datastreamVersion></foxml:datastream>
+<foxml:datastream ID="RELS-EXT" STATE="A" CONTROL_GROUP="X">
+<foxml:datastreamVersion ID="RELS-EXT.0" MIMETYPE="application/rdf+xml">
+<foxml:contentDigest TYPE="MD5" DIGEST="bbb"/>
+<foxml:binaryContent>%s</foxml:binaryContent>
+</foxml:datastreamVersion></foxml:datastream>
+<foxml:datastream ID="MODS" STATE="A" CONTROL_GROUP="X">
+<foxml:datastreamVersion ID="MODS.0" MIMETYPE="text/xml">
+<foxml:contentDigest TYPE="MD5" DIGEST="ccc"/>
+<foxml:xmlContent><!-- copy of emory:old --><title lang="en" type="main">mods</title><note><![CDATA[see emory:old & <others>]]></note></foxml:xmlContent>
+</foxml:datastreamVersion></foxml:datastream>
+<foxml:datastream ID="MIME-DATA" STATE="A" CONTROL_GROUP="M">
+<foxml:datastreamVersion ID="MIME-DATA.0" MIMETYPE="message/rfc822">
+<foxml:contentDigest TYPE="MD5" DIGEST="ddd"/>
+<foxml:binaryContent>%s</foxml:binaryContent>
+</foxml:datastreamVersion></foxml:datastream>
+</foxml:digitalObject>'''
+
+    def rewrite(self, checksums='xml'):
+        source = StringIO(self.export % (base64.b64encode(self.rels),
+                                         base64.b64encode('message from emory:old')))
+        out = StringIO()
+        foxml.rewrite_foxml(source, out, 'emory:old', 'emory:new', checksums)
+        return etree.fromstring(out.getvalue())
+
+    def digests(self, doc):
+        return doc.xpath('//foxml:contentDigest/@DIGEST',
+                         namespaces={'foxml': 'info:fedora/fedora-system:def/foxml#'})
+
+    def test_rewrite(self):
+        ns = {'foxml': 'info:fedora/fedora-system:def/foxml#'}
+        doc = self.rewrite()
+        self.assertEqual('emory:new', doc.get('PID'))
+        self.assertEqual('emory:new', doc.xpath('string(//identifier)'))
+        rels = base64.b64decode(doc.xpath('string(//foxml:datastream[@ID="RELS-EXT"]//foxml:binaryContent)',
+                                          namespaces=ns))
+        self.assertIn('info:fedora/emory:new', rels)
+        self.assertNotIn('emory:old', rels)
+        # other binary content is copied through unchanged
+        content = doc.xpath('string(//foxml:datastream[@ID="MIME-DATA"]//foxml:binaryContent)',
+                            namespaces=ns)
+        self.assertEqual('message from emory:old', base64.b64decode(content))
+        # comments and CDATA in inline xml are preserved
+        self.assertEqual([' copy of emory:new '], [str(c.text) for c in doc.xpath('//comment()')])
+        self.assertEqual('see emory:new & <others>', doc.xpath('string(//note)'))
+
+    def test_checksum_cleanup(self):
+        # inline xml is re-serialized, so its checksums are always removed
+        self.assertEqual(['ddd'], self.digests(self.rewrite('affected')))
+        self.assertEqual(['ddd'], self.digests(self.rewrite('xml')))
+        self.assertEqual([], self.digests(self.rewrite('all')))
+        self.assertRaises(ValueError, foxml.FoxmlRewriter, StringIO(),
+                          'emory:old', 'emory:new', 'bogus')
+
+    def test_spool_response(self):
+        response = Mock()
+        response.iter_content.return_value = iter(['abc', 'def'])
+        out = StringIO()
+        self.assertEqual(6, foxml.spool_response(response, out))
+        self.assertEqual('abcdef', out.getvalue())
+
+
+class TestContentStatistics(TestCase):
+
+    stats_response = '''<response>
+<lst name="stats"><lst name="stats_fields"><lst name="content_size">
+  <double name="min">100.0</double><double name="max">5000.0</double>
+  <long name="count">3</long><long name="missing">1</long>
+  <double name="sum">5300.0</double><double name="mean">1766.67</double>
+  <lst name="facets"><lst name="content_format">
+    <lst name="AD1"><double name="min">100.0</double><double name="max">200.0</double>
+      <long name="count">2</long><long name="missing">0</long>
+      <double name="sum">300.0</double><double name="mean">150.0</double></lst>
+    <lst name="E01"><double name="min">5000.0</double><double name="max">5000.0</double>
+      <long name="count">1</long><long name="missing">0</long>
+      <double name="sum">5000.0</double><double name="mean">5000.0</double></lst>
+  </lst></lst>
+</lst></lst></lst>
+</response>'''
+
+    def test_content_statistics(self):
+        solrquery = Mock()
+        solrquery.options.return_value = {'q': 'content_model:foo', 'start': 0}
+        solrquery.interface.conn.select.return_value = self.stats_response
+
+        stats = reports.content_statistics(solrquery, facet='content_format')
+        params = dict(solrquery.interface.conn.select.call_args[0][0])
+        self.assertEqual('true', params['stats'])
+        self.assertEqual('content_size', params['stats.field'])
+        self.assertEqual('content_format', params['stats.facet'])
+        self.assertEqual(0, int(params['rows']))
+        self.assert_('start' not in params)
+
+        self.assertEqual({'count': 3, 'missing': 1, 'sum': 5300, 'min': 100,
+                          'max': 5000, 'mean': 1766.67}, stats['total'])
+        # facets are ordered by total size, largest first
+        self.assertEqual(['E01', 'AD1'], stats['facets'].keys())
+        self.assertEqual(300, stats['facets']['AD1']['sum'])
+        self.assertEqual(2, stats['facets']['AD1']['count'])
+
+        # no matching documents
+        solrquery.interface.conn.select.return_value = \
+            '<response><lst name="stats"><lst name="stats_fields">' + \
+            '<null name="content_size"/></lst></lst></response>'
+        stats = reports.content_statistics(solrquery, facet='content_format')
+        self.assertEqual(0, stats['total']['count'])
+        self.assertEqual(None, stats['total']['sum'])
+        self.assertEqual({}, stats['facets'])
+
+
+class TestStagingJanitor(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='keep-staging-test-')
+        self.ingest_dir = os.path.join(self.tmpdir, 'ingest')
+        self.large_file_dir = os.path.join(self.tmpdir, 'large-file')
+        os.mkdir(self.ingest_dir)
+        os.mkdir(self.large_file_dir)
+        self.old = time.time() - 1000
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_file(self, path, size=10, old=False):
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(path, 'w') as outfile:
+            outfile.write('x' * size)
+        if old:
+            for p in [path, dirname]:
+                os.utime(p, (self.old, self.old))
+
+    def run_janitor(self, **kwargs):
+        with override_settings(INGEST_STAGING_TEMP_DIR=self.ingest_dir,
+                               LARGE_FILE_STAGING_DIR=self.large_file_dir,
+                               INGEST_STAGING_KEEP_AGE=100):
+            janitor = staging.StagingJanitor(workers=1, **kwargs)
+            return janitor, dict((item.name, item) for item in janitor.run())
+
+    def test_run(self):
+        ingest, large = self.ingest_dir, self.large_file_dir
+        self.make_file(os.path.join(ingest, 'old_a1b2c3.wav'), 100, old=True)
+        self.make_file(os.path.join(ingest, 'old_a1b2c3.wav.md5'), 32, old=True)
+        self.make_file(os.path.join(ingest, 'new_d4e5f6.wav'))
+        self.make_file(os.path.join(ingest, 'new_d4e5f6.wav.md5'))
+        # checksum file for an upload that has already been removed
+        self.make_file(os.path.join(ingest, 'gone_g7h8i9.wav.md5'))
+        self.make_file(os.path.join(ingest, 'tmpAb_123.mp3'), 20, old=True)
+        self.make_file(os.path.join(ingest, 'subdir', 'nested', 'file.txt'), 5, old=True)
+        os.utime(os.path.join(ingest, 'subdir'), (self.old, self.old))
+        self.make_file(os.path.join(large, 'x1y2z3-aff-migration', 'disk.E01'), 500, old=True)
+        self.make_file(os.path.join(large, 'a1b2c3-aff-migration', 'disk.E01'), 500)
+        self.make_file(os.path.join(large, 'bag', 'data', 'file.txt'), 50, old=True)
+
+        janitor, items = self.run_janitor()
+        self.assertEqual('upload', items['old_a1b2c3.wav'].kind)
+        self.assertEqual('checksum', items['old_a1b2c3.wav.md5'].kind)
+        self.assertEqual('conversion', items['tmpAb_123.mp3'].kind)
+        self.assertEqual('directory', items['subdir'].kind)
+        self.assertEqual('aff-migration', items['x1y2z3-aff-migration'].kind)
+        self.assertEqual('bag', items['bag'].kind)
+        self.assertEqual(5, items['subdir'].size,
+                         'directory size should include nested content')
+
+        self.assertEqual(['new_d4e5f6.wav', 'new_d4e5f6.wav.md5'],
+                         sorted(os.listdir(ingest)),
+                         'expired content and orphaned checksums should be removed')
+        self.assertEqual(['a1b2c3-aff-migration', 'bag'], sorted(os.listdir(large)),
+                         'expired aff migration directories should be removed, but not bags')
+
+        stats = janitor.stats['ingest']
+        self.assertEqual(7, stats['entries'])
+        self.assertEqual(5, stats['removed'])
+        self.assertEqual(100 + 32 + 10 + 20 + 5, stats['reclaimed'])
+        self.assertEqual({'removed': 2, 'reclaimed': 42}, stats['kinds']['checksum'])
+        self.assertEqual(500, janitor.stats['large-file']['reclaimed'])
+        self.assert_(janitor.stats['large-file']['free'])
+
+    def test_dry_run(self):
+        self.make_file(os.path.join(self.ingest_dir, 'old_a1b2c3.wav'), 100, old=True)
+        janitor, items = self.run_janitor(noact=True)
+        self.assertTrue(items['old_a1b2c3.wav'].removed)
+        self.assertEqual(100, janitor.stats['ingest']['reclaimed'])
+        self.assertEqual(['old_a1b2c3.wav'], os.listdir(self.ingest_dir))
+
+    @patch('keep.common.staging.free_space')
+    def test_low_space(self, mockfree):
+        # more recent than keep age, but older than urgent keep age
+        self.make_file(os.path.join(self.ingest_dir, 'old_a1b2c3.wav'), 100)
+        os.utime(os.path.join(self.ingest_dir, 'old_a1b2c3.wav'), (self.old, self.old))
+        mockfree.return_value = (5, 100)
+        with override_settings(STAGING_URGENT_KEEP_AGE=10):
+            with override_settings(INGEST_STAGING_KEEP_AGE=10000):
+                janitor = staging.StagingJanitor(workers=1)
+            with override_settings(INGEST_STAGING_TEMP_DIR=self.ingest_dir,
+                                   LARGE_FILE_STAGING_DIR=None):
+                list(janitor.run())
+        self.assertTrue(janitor.stats['ingest']['urgent'])
+        self.assertEqual(1, janitor.stats['ingest']['removed'])
+        self.assertEqual([], os.listdir(self.ingest_dir))
+
+    def test_missing_area(self):
+        with override_settings(INGEST_STAGING_TEMP_DIR=os.path.join(self.tmpdir, 'missing'),
+                               LARGE_FILE_STAGING_DIR=self.large_file_dir,
+                               INGEST_STAGING_KEEP_AGE=100):
+            janitor = staging.StagingJanitor(workers=1)
+            list(janitor.run())
+        self.assert_(janitor.stats['ingest']['error'])
+        self.assertEqual(None, janitor.stats['large-file']['error'])
+
+    def test_run_cleanup(self):
+        self.make_file(os.path.join(self.ingest_dir, 'old_a1b2c3.wav'), 100, old=True)
+        with override_settings(INGEST_STAGING_TEMP_DIR=self.ingest_dir,
+                               LARGE_FILE_STAGING_DIR=self.large_file_dir,
+                               INGEST_STAGING_KEEP_AGE=100):
+            stats = staging.run_cleanup(workers=1)
+            self.assertEqual(1, stats['ingest']['removed'])
+            # lock released after the run
+            self.assertEqual(None, TaskLock.objects.get(name=staging.LOCK_NAME).expires)
+
+            # skipped if a run is in progress
+            TaskLock.acquire(staging.LOCK_NAME, 60)
+            self.assertEqual(None, staging.run_cleanup(workers=1))
+            TaskLock.release(staging.LOCK_NAME)
+
+
+class TestTaskLock(TestCase):
+
+    def test_acquire_release(self):
+        self.assertTrue(TaskLock.acquire('test-lock', 60))
+        self.assertFalse(TaskLock.acquire('test-lock', 60),
+                         'lock should not be acquired while it is held')
+        TaskLock.release('test-lock')
+        self.assertTrue(TaskLock.acquire('test-lock', 60))
+
+        # expired lock can be acquired by another process
+        TaskLock.objects.filter(name='test-lock') \
+            .update(expires=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(TaskLock.acquire('test-lock', 60))
+
+    def test_hold(self):
+        with TaskLock.hold('test-lock'):
+            self.assertEqual(1, TaskLock.objects.filter(name='test-lock').count())
+        with TaskLock.hold('test-lock'):
+            pass
+        self.assertEqual(1, TaskLock.objects.filter(name='test-lock').count())
+
+
+@override_settings(INGEST_STAGING_TEMP_DIR='/tmp', LARGE_FILE_STAGING_DIR=None,
+                   STAGING_FREE_SPACE_THRESHOLD=0.1)
+@patch('keep.common.scratch.free_space', Mock(return_value=(1000, 1000)))
+class TestScratchSpace(TestCase):
+
+    task_name = 'keep.audio.tasks.convert_wav_to_mp3'
+
+    def test_estimate(self):
+        self.assertEqual(120, scratch.estimate(self.task_name, 100))
+        self.assertEqual(100, scratch.estimate('unknown.task', 100))
+        self.assertEqual(0, scratch.estimate(self.task_name, None))
+        with override_settings(SCRATCH_MULTIPLIERS={self.task_name: 2}):
+            self.assertEqual(200, scratch.estimate(self.task_name, 100))
+
+    def test_reserve(self):
+        # 10% of the disk is kept free
+        self.assertEqual(900, scratch.available('ingest'))
+        first = scratch.reserve('ingest', 600, self.task_name, 'task-1')
+        self.assertEqual(300, scratch.available('ingest'))
+        with self.assertRaises(scratch.ScratchSpaceUnavailable) as cm:
+            scratch.reserve('ingest', 400, self.task_name, 'task-2')
+        self.assertEqual(300, cm.exception.available)
+
+        first.release()
+        with scratch.scratch_space('ingest', 400, self.task_name):
+            self.assertEqual(500, scratch.available('ingest'))
+        self.assertEqual(0, ScratchReservation.objects.count())
+
+        # expired reservations are ignored and removed
+        ScratchReservation.objects.create(area='ingest', size=900, task_name=self.task_name,
+                                          expires=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(900, scratch.available('ingest'))
+        scratch.reserve('ingest', 900, self.task_name)
+        self.assertEqual(1, ScratchReservation.objects.count())
+
+        self.assertRaises(ValueError, scratch.reserve, 'large-file', 10, self.task_name)
+
+    def test_utilization(self):
+        scratch.reserve('ingest', 600, self.task_name, 'task-1')
+        usage = scratch.utilization()
+        self.assertEqual({'path': '/tmp', 'free': 1000, 'total': 1000,
+                          'reserved': 600, 'reservations': 1}, usage['ingest'])
+        self.assertIn('keep_scratch_reserved_bytes{area="ingest"} 600',
+                      scratch.prometheus_text())
+
+    def test_task(self):
+        task = convert_wav_to_mp3
+        task.push_request(id='task-1', called_directly=False, is_eager=False)
+        try:
+            reservation = task.reserve_scratch('ingest', 500, staged=100)
+            self.assertEqual(500, reservation.size)
+            self.assertEqual('task-1', reservation.task_id)
+
+            # task is deferred when there is not enough space
+            with patch.object(task, 'retry', side_effect=Retry()) as mockretry:
+                self.assertRaises(Retry, task.reserve_scratch, 'ingest', 500)
+            args, kwargs = mockretry.call_args
+            self.assert_(isinstance(kwargs['exc'], scratch.ScratchSpaceUnavailable))
+            self.assertEqual(scratch.DEFAULT_RETRY_DELAY, kwargs['countdown'])
+
+            # reservations are released when the task returns
+            task.after_return('SUCCESS', None, 'task-1', [], {}, None)
+            self.assertEqual(0, ScratchReservation.objects.count())
+        finally:
+            task.pop_request()
+
+        # tasks called directly are not retried
+        scratch.reserve('ingest', 900, self.task_name)
+        self.assertRaises(scratch.ScratchSpaceUnavailable, task.reserve_scratch,
+                          'ingest', 100)
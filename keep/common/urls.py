@@ -2,4 +2,5 @@ from django.conf.urls import patterns, url
 
 urlpatterns = patterns('keep.common.views',
         url(r'^search/$', 'search', name='search'),
+        url(r'^metrics/$', 'metrics', name='metrics'),
 )
\ No newline at end of file
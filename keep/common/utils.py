@@ -1,13 +1,20 @@
+from datetime import datetime
 import hashlib
 import httplib2
 import logging
+from lxml import etree
 import os
 import re
 from sunburnt import sunburnt
+from sunburnt.schema import SolrResponse
+from sunburnt.search import params_from_dict
 from urlparse import urlparse
 
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.utils.timezone import utc
+
+from keep.common.instrumentation import instrument_http
 
 
 logger = logging.getLogger(__name__)
@@ -37,7 +44,8 @@ def solr_interface():
     :class:`sunburnt.SolrInterface` based on django settings and
     evironment.  Uses **SOLR_SERVER_URL** and **SOLR_CA_CERT_PATH** if
     one is set.  Additionally, if an **HTTP_PROXY** is set in the
-    environment, it will be configured.
+    environment, it will be configured.  Solr requests are recorded
+    by :mod:`keep.common.instrumentation`.
     '''
     http_opts = {}
     if hasattr(settings, 'SOLR_CA_CERT_PATH'):
@@ -56,7 +64,7 @@ def solr_interface():
                                         proxy_host=parsed_proxy.hostname,
                                         proxy_port=parsed_proxy.port)
         http_opts['proxy_info'] = proxy_info
-    http = httplib2.Http(**http_opts)
+    http = instrument_http(httplib2.Http(**http_opts))
 
     solr_opts = {'http_connection': http}
     # since we have the schema available, don't bother requesting it
@@ -69,6 +77,139 @@ def solr_interface():
     return solr
 
 
+def solr_select(solrquery, **params):
+    '''Run a sunburnt query directly against the Solr connection, with
+    additional or overridden request parameters (e.g., ``cursorMark``,
+    which sunburnt does not support).  Parameters with a value of None
+    are removed from the request.
+
+    :param solrquery: :class:`sunburnt.SolrSearch` query
+    :returns: tuple of :class:`sunburnt.schema.SolrResponse` and the
+        next cursor mark returned by Solr (None if not using a cursor)
+    '''
+    solr = solrquery.interface
+    options = dict(solrquery.options(), **params)
+    options = dict((key, val) for key, val in options.iteritems()
+                   if val is not None)
+    xml = solr.conn.select(params_from_dict(**options))
+    next_cursor = etree.fromstring(xml).xpath('string(/response/str[@name="nextCursorMark"])')
+    return SolrResponse.from_xml(xml, solr.schema), next_cursor or None
+
+
+def solr_cursor(solrquery, rows=500):
+    '''Generator to iterate over all results for a sunburnt query using
+    Solr cursorMark deep paging.  Unlike start/rows pagination, the cost
+    of each request does not grow with the offset, so this is
+    appropriate for scanning a large result set in a single pass.
+
+    Results are sorted by any sort specified on the query, with pid
+    (the index unique key) added as a tie-breaker, as required by Solr.
+
+    :param solrquery: :class:`sunburnt.SolrSearch` query
+    :param rows: number of results to retrieve per request
+    :returns: generator of result documents
+    '''
+    sort = solrquery.options().get('sort', '')
+    if 'pid ' not in sort:
+        sort = ', '.join([s for s in [sort, 'pid asc'] if s])
+
+    cursor = '*'
+    while True:
+        response, next_cursor = solr_select(solrquery, start=None, rows=rows,
+                                            sort=sort, cursorMark=cursor)
+        for doc in response:
+            yield doc
+        # solr returns the same cursor when there are no more results
+        if not next_cursor or next_cursor == cursor:
+            break
+        cursor = next_cursor
+
+
+_redaction_regex = None
+_redaction_labels = None
+
+def solr_value(value):
+    '''Convert a python value (e.g., a boolean or datetime, as returned
+    by sunburnt) to text, as expected by Solr in an update request.'''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(utc).replace(tzinfo=None)
+        return value.isoformat() + 'Z'
+    if not isinstance(value, unicode):
+        value = unicode(str(value), 'utf-8')
+    return value
+
+
+def solr_atomic_update(updates, solr=None, batch_size=500):
+    '''Send Solr atomic updates to set specific fields on existing
+    documents, without reposting (or regenerating) the entire document.
+    Requires the Solr update log and ``_version_`` field, and that all
+    fields be stored (other than copyField destinations); see
+    ``solr/schema.xml``.
+
+    :param updates: list of dictionaries with the ``pid`` of the document
+        to update and the new values for any fields to be changed; a
+        value of None removes the field, and a list sets all values of a
+        multi-valued field
+    :param solr: optional :class:`sunburnt.SolrInterface`
+    :param batch_size: maximum number of documents per update request
+    '''
+    if solr is None:
+        solr = solr_interface()
+    for i in range(0, len(updates), batch_size):
+        add = etree.Element('add')
+        for update in updates[i:i + batch_size]:
+            doc = etree.SubElement(add, 'doc')
+            etree.SubElement(doc, 'field', name='pid').text = update['pid']
+            for field, value in update.iteritems():
+                if field == 'pid':
+                    continue
+                if not isinstance(value, (list, tuple, set)):
+                    value = [value] if value is not None else []
+                if not value:
+                    etree.SubElement(doc, 'field', name=field, update='set',
+                                     null='true')
+                for val in value:
+                    etree.SubElement(doc, 'field', name=field,
+                                     update='set').text = solr_value(val)
+        solr.conn.update(etree.tostring(add, encoding='UTF-8'))
+
+
+def _redaction_pattern():
+    # compile all configured redactions into a single regular
+    # expression the first time it is needed, with a named group
+    # for each redaction so the matching label can be identified
+    global _redaction_regex, _redaction_labels
+    if _redaction_regex is None:
+        # ** ONLY required for this method **
+        # Should error if import file is not available.
+        from keep.email_redactions import redactions
+
+        # content should look something like this:
+        # redactions = {
+        #    r'[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}': 'IP address',
+        # }
+        #    regex to replace : label to display (i.e., [REDACTED: IP address])
+
+        labels = {}
+        patterns = []
+        for i, (regex, label) in enumerate(redactions.iteritems()):
+            group = 'redaction%d' % i
+            labels[group] = label
+            patterns.append('(?P<%s>%s)' % (group, regex))
+
+        _redaction_labels = labels
+        if patterns:
+            _redaction_regex = re.compile('|'.join(patterns),
+                                          flags=re.MULTILINE | re.IGNORECASE)
+        else:
+            _redaction_regex = False
+
+    return _redaction_regex, _redaction_labels
+
+
 def redact_email(content):
     '''Replace any sensitive information in the email message with
     a redacted text label.
@@ -79,18 +220,12 @@ def redact_email(content):
         be added to version control because it contains the
         sensitive information to be redacted from email message.
 
+    All redaction patterns are combined into a single regular
+    expression, compiled once per process, so content is only scanned
+    once.  Patterns should not overlap or use numbered back-references.
     '''
-    # ** ONLY required for this method **
-    # Should error if import file is not available.
-    from keep.email_redactions import redactions
-
-    # content should look something like this:
-    # redactions = {
-    #    r'[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}': 'IP address',
-    # }
-    #    regex to replace : label to display (i.e., [REDACTED: IP address])
-
-    for regex, label in redactions.iteritems():
-        compiled_re = re.compile(regex, flags=re.MULTILINE | re.IGNORECASE)
-        content = compiled_re.sub('[REDACTED: %s]' % label, content)
-    return content
+    regex, labels = _redaction_pattern()
+    if not regex:
+        return content
+    return regex.sub(lambda match: '[REDACTED: %s]' % labels[match.lastgroup],
+                     content)
@@ -1,16 +1,24 @@
+import base64
 from datetime import date
 from exceptions import ValueError
+import json
 from eulcommon.searchutil import pages_to_show
+from eulfedora.indexdata import views as indexdata_views
+from eulfedora.server import TypeInferringRepository
+from eulfedora.util import RequestFailed
+from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
-from django.core.paginator import Paginator, EmptyPage, InvalidPage
-from django.http import HttpResponse
+from django.core.paginator import EmptyPage, InvalidPage
+from django.http import HttpResponse, HttpResponseForbidden, Http404
 from django.template.response import TemplateResponse
 
 from keep.arrangement.models import ArrangementObject
 from keep.audio.models import AudioObject
 from keep.video.models import Video
 from keep.common import forms as commonforms
+from keep.common import fedora, indexdata, instrumentation, scratch
 #from keep.common.models import Rights
+from keep.common.paginator import SolrPaginator
 from keep.common.utils import solr_interface
 import unicodecsv
 
@@ -97,7 +105,7 @@ def search(request):
                 return response
 
 
-        paginator = Paginator(solrquery, 30)
+        paginator = SolrPaginator(solrquery, 30)
         try:
             page = int(request.GET.get('page', '1'))
         except ValueError:
@@ -119,3 +127,51 @@ def search(request):
         })
 
     return TemplateResponse(request, 'common/search.html', ctx_dict)
+
+
+def index_data(request, id):
+    '''Index data for a single object, for use by eulindexer.  Extends
+    :meth:`eulfedora.indexdata.views.index_data` to use partial index
+    data when an object has only been saved with changes that do not
+    require a full reindex; see :mod:`keep.common.indexdata`.'''
+    # NOTE: uses the same access check as the eulfedora view
+    if indexdata_views._permission_denied_check(request):
+        return HttpResponseForbidden('Access to this web service was denied.',
+                                     content_type='text/html')
+
+    repo_opts = {}
+    # if credentials are specified via Basic Auth, use them for Fedora access
+    auth_info = request.META.get('HTTP_AUTHORIZATION', None)
+    basic = 'Basic '
+    if auth_info and auth_info.startswith(basic):
+        username, password = base64.b64decode(auth_info[len(basic):]).split(':', 1)
+        repo_opts.update({'username': username, 'password': password})
+    repo = TypeInferringRepository(**repo_opts)
+
+    changes = indexdata.pending_changes(id)
+    if changes is not None and changes['dsids'] is not None:
+        try:
+            data = indexdata.partial_index_document(repo.get_object(id), changes)
+        except RequestFailed:
+            raise Http404
+        if data is not None:
+            return HttpResponse(json.dumps(data), content_type='application/json')
+
+    # fully reindexed; any recorded changes are no longer needed
+    indexdata.clear_changes(id)
+    return indexdata_views.index_data(request, id, repo=repo)
+
+
+def metrics(request):
+    '''Backend call metrics and Fedora connection reuse for this process,
+    and staging scratch space utilization, in Prometheus text format (see
+    :mod:`keep.common.instrumentation`, :class:`keep.common.fedora.Repository`,
+    and :mod:`keep.common.scratch`).  Access is restricted to
+    the IP addresses configured in **METRICS_ALLOWED_IPS**, or any address
+    if it is set to ``'ANY'``.'''
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', [])
+    if allowed != 'ANY' and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden('Access to metrics was denied.',
+                                     content_type='text/plain')
+    return HttpResponse(instrumentation.prometheus_text() + fedora.prometheus_text()
+                        + scratch.prometheus_text(), content_type='text/plain; version=0.0.4')
@@ -15,6 +15,7 @@ from eulfedora.rdfns import relsext
 from eulxml import xmlmap
 from eulxml.xmlmap import mods, premis
 from keep.common.fedora import DigitalObject, LocalMODS, Repository
+from keep.common.fixity import fixity_index_data, fixity_check_datetime
 from keep.common.rdfns import REPO
 from keep.collection.models import CollectionObject
 from keep.file.utils import md5sum, sha1sum
@@ -113,6 +114,10 @@ class DiskImage(DigitalObject):
     # NOTE: Mimetypes for AD1 and AFF are custom mimetypes and must be configured
     # in your local magic files.  See the deploy notes for more information.
 
+    #: file datastreams verified by periodic fixity checks; see
+    #: :mod:`keep.common.fixity`
+    fixity_datastreams = ['content']
+
     collection = Relation(relsext.isMemberOfCollection, type=CollectionObject)
     ''':class:`~keep.collection.models.CollectionObject that this object belongs to,
     via `isMemberOfCollection` relation.
@@ -164,6 +169,13 @@ class DiskImage(DigitalObject):
         'provenanceMetadata': 'provenance metadata',
     }
 
+    partial_index_methods = dict(DigitalObject.partial_index_methods, **{
+        'MODS': '_index_data_mods',
+        # rights are not currently indexed for disk images
+        'Rights': '_index_data_rights',
+        'provenanceMetadata': '_index_data_provenance',
+    })
+
     def get_default_pid(self):
         # extend common default pid logic in to also set ARK identifier
         # in the premis object
@@ -532,9 +544,8 @@ class DiskImage(DigitalObject):
             data['collection_id'] = self.collection.pid
             data['collection_label'] = self.collection.label
 
-        # include resolvable ARK if available
-        if self.mods.content.ark_uri:
-            data['ark_uri'] = self.mods.content.ark_uri
+        data.update(self._index_data_mods())
+        data.update(self._index_data_provenance())
 
         if self.content.checksum:
             data['content_md5'] = self.content.checksum
@@ -550,24 +561,58 @@ class DiskImage(DigitalObject):
         # if self.rights.content.ip_note:
         #     data['ip_note'] = self.rights.content.ip_note
 
+        # store disk image size and mimetype
+        data['content_size'] = self.content.size
+        data['content_mimetype'] = self.content.mimetype
+
+        if self.original:
+            data['original_pid'] = self.original.pid
+
+        # fields that are not set are not indexed
+        return dict((field, value) for field, value in data.iteritems()
+                    if value is not None)
+
+    # index data for individual datastreams, for use in full or partial
+    # index data; fields that are not set have a value of None
+
+    def _index_data_mods(self):
+        # include resolvable ARK if available
+        return {'ark_uri': self.mods.content.ark_uri or None}
+
+    def _index_data_rights(self):
+        return {}
+
+    def _index_data_provenance(self):
+        data = {
+            'last_fixity_check': None,
+            'last_fixity_result': None,
+            'content_format': None,
+        }
         if self.provenance.content.fixity_checks:
             last_fixity_check = self.provenance.content.fixity_checks[-1]
             data['last_fixity_check'] = last_fixity_check.date
             data['last_fixity_result'] = last_fixity_check.outcome
-
-        # store disk image format and size
+        # use the fixity check recorded by keep if it is more recent;
+        # compare as datetimes, since the dates may use different timezones
+        recorded = fixity_index_data(self.pid)
+        if recorded:
+            try:
+                newer = data['last_fixity_check'] is None or \
+                    fixity_check_datetime(recorded['last_fixity_check']) > \
+                    fixity_check_datetime(data['last_fixity_check'])
+            except ValueError:
+                # premis event date could not be parsed
+                newer = True
+            if newer:
+                data.update(recorded)
+
+        # store disk image format
         # - some disk images (i.e., objects migrated from AD1/AFF)
         # will have two sets of object characteristics; we want the
         # format from the last one listed
         if self.provenance.content.object and \
           self.provenance.content.object.latest_format:
             data['content_format'] = self.provenance.content.object.latest_format.name
-
-        data['content_size'] = self.content.size
-
-        if self.original:
-            data['original_pid'] = self.original.pid
-
         return data
 
 
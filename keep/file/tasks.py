@@ -17,6 +17,7 @@ import uuid
 from keep.common.fedora import Repository, DuplicateContent
 from keep.common.models import PremisRelationship, PremisEvent, \
     PremisLinkingObject
+from keep.common.scratch import ScratchSpaceTask
 from keep.file.models import DiskImage
 from keep.file.utils import md5sum
 
@@ -24,7 +25,7 @@ from keep.file.utils import md5sum
 logger = get_task_logger(__name__)
 
 
-@shared_task(bind=True)
+@shared_task(bind=True, base=ScratchSpaceTask)
 def migrate_aff_diskimage(self, pid):
     creating_application = 'AccessData FTK Imager'
     application_version = 'v3.1.1 CLI'
@@ -33,14 +34,6 @@ def migrate_aff_diskimage(self, pid):
     migration_event_outcome = 'AFF reformatted as E01 using command line ' + \
         'FTK program with settings: --e01 --compress 0 --frag 100T --quiet'
 
-    # use the configured ingesting staging area as the base tmp dir
-    # create
-    # for all temporary files
-    staging_dir = getattr(settings, 'LARGE_FILE_STAGING_DIR', None)
-    # create a tempdir within the large file staging area
-    tmpdir = tempfile.mkdtemp(suffix='-aff-migration', dir=staging_dir)
-    logger.debug('Using tmpdir %s', tmpdir)
-
     # Retrieve the object to be migrated
     repo = Repository()
     original = repo.get_object(pid, type=DiskImage)
@@ -60,6 +53,22 @@ def migrate_aff_diskimage(self, pid):
     if original.migrated is not None:
         raise Exception('%s has already been migrated' % original.pid)
 
+    # use the configured large file staging area as the base tmp dir
+    # for all temporary files
+    staging_dir = getattr(settings, 'LARGE_FILE_STAGING_DIR', None)
+
+    # reserve space for the AFF, the generated E01 and ftkimager output;
+    # the task is deferred if the staging disk is too full (reservation
+    # is released when the task returns).  Without a large file staging
+    # area, the system temp dir is used, which is not managed as scratch
+    # space.
+    reservation = None
+    if staging_dir:
+        reservation = self.reserve_scratch('large-file', original.content.size)
+    # create a tempdir within the large file staging area
+    tmpdir = tempfile.mkdtemp(suffix='-aff-migration', dir=staging_dir)
+    logger.debug('Using tmpdir %s', tmpdir)
+
     # download the aff disk image to a tempfile
     aff_file = tempfile.NamedTemporaryFile(suffix='.aff',
         prefix='keep-%s_' % original.noid, dir=tmpdir, delete=False)
@@ -267,6 +276,8 @@ def migrate_aff_diskimage(self, pid):
         except OSError as os_err:
             logger.warning('Failed to remove tmpdir %s : %s',
                 tmpdir, os_err)
+    if reservation is not None:
+        reservation.release()
 
     logger.info('Migrated %s AFF to %s E01' % (original.pid, migrated.pid))
     return 'Migrated %s to %s' % (original.pid, migrated.pid)
@@ -14,7 +14,7 @@ from django.test import TestCase
 
 from eulfedora.server import Repository
 from eulcommon.djangoextras.taskresult.models import TaskResult
-from eulxml.xmlmap import mods
+from eulxml.xmlmap import mods, premis
 
 from keep.audio import models as audiomodels
 from keep.audio.tests import ADMIN_CREDENTIALS, mp3_filename, wav_filename, \
@@ -1320,6 +1320,7 @@ class DiskImageTest(KeepTestCase):
             mods.Identifier(type='uri', text='http://some.co/ark:/naan/1234')
         )
         obj.content.checksum = 'bogusmd5'
+        obj.content.mimetype = 'application/x-aff'
 
         # collection is an eulfedora.models.Relation, so patch on the class
         with patch('keep.file.models.DiskImage.collection') as mockcoll:
@@ -1347,6 +1348,8 @@ class DiskImageTest(KeepTestCase):
                          'ark uri should be present in index data')
         self.assertEqual(obj.content.checksum, desc_data['content_md5'],
                          'content datastream checksum should be included in index data')
+        self.assertEqual(obj.content.mimetype, desc_data['content_mimetype'],
+                         'content datastream mimetype should be included in index data')
 
         # test format
         # - normal object with only one set of object characteristics
@@ -1363,6 +1366,23 @@ class DiskImageTest(KeepTestCase):
         desc_data = obj.index_data()
         self.assertEqual('E01', desc_data['content_format'])
 
+        # fixity check: most recent of premis event and keep fixity result,
+        # compared as dates rather than strings
+        fixity_event = premis.Event(type='fixity check', outcome='pass',
+                                    date='2012-01-01T20:00:00-05:00')
+        obj.provenance.content.events.append(fixity_event)
+        with patch('keep.file.models.fixity_index_data') as mockfixity:
+            mockfixity.return_value = {'last_fixity_check': '2012-01-01T23:00:00Z',
+                                       'last_fixity_result': 'fail'}
+            desc_data = obj.index_data()
+            self.assertEqual('2012-01-01T20:00:00-05:00', desc_data['last_fixity_check'])
+            self.assertEqual('pass', desc_data['last_fixity_result'])
+
+            mockfixity.return_value = {'last_fixity_check': '2012-01-02T02:00:00Z',
+                                       'last_fixity_result': 'fail'}
+            desc_data = obj.index_data()
+            self.assertEqual('fail', desc_data['last_fixity_result'])
+
 
     def test_supplemental_content(self):
         # test properties for interacting with supplemental file datastreams
@@ -1,8 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
 from keep.repoadmin.forms import KeywordSearch
 
 def search(request):
     '''Template context processor: add the keyword search form
     (:class:`~keep.repoadmin.forms.KeywordSearch`) to context
-    so it can be used on any page (e.g., in the site sidebar).'''
-    return {'admin_search': KeywordSearch()}
-
+    so it can be used on any page (e.g., in the site sidebar).
+    The form is only initialized if it is used when rendering the page.'''
+    return {'admin_search': SimpleLazyObject(KeywordSearch)}
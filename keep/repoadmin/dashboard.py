@@ -0,0 +1,116 @@
+'''
+Statistics for the admin dashboard.
+
+Dashboard statistics are based on Solr facet queries, which get more
+expensive as the index grows, so they are calculated once and cached
+rather than being queried on every dashboard page load.  The cached
+statistics are refreshed periodically by
+:meth:`keep.repoadmin.tasks.refresh_dashboard_stats`, and can be
+refreshed on demand from the dashboard.
+'''
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+
+from keep.common.utils import solr_interface
+
+
+CACHE_KEY = 'repoadmin-dashboard-stats'
+#: how long cached statistics are used (in seconds) if they are not
+#: refreshed by the periodic task; override with
+#: **DASHBOARD_STATS_TIMEOUT** in settings
+DEFAULT_TIMEOUT = 60 * 60
+
+
+def calculate_stats():
+    '''Query Solr for recently added items and recent fixity checks.
+
+    :returns: dictionary with ``recent_items`` (list of date, count for
+        the 10 most recent days), ``recent_months`` (list of month,
+        count), ``recent_collections`` (list of collection label, count),
+        ``recent_fixity_checks`` (list of result, count), ``month_ago``
+        (start date for the daily and fixity statistics), and
+        ``updated`` (when the statistics were calculated)
+    '''
+    today = date.today()
+    month_ago = today - timedelta(days=30)
+    three_months = today - timedelta(days=31 * 3)
+
+    solr = solr_interface()
+
+    # search for all content added in the last month
+    # and return just the facets for date created and collection name
+    # - limit of 31 to ensure we get all dates in range
+    facetq = solr.query().filter(created_date__range=(month_ago, today))  \
+                .facet_by('created_date', sort='index',
+                          limit=31, mincount=1) \
+                .facet_by('collection_label_facet', sort='count',
+                          limit=10, mincount=1) \
+                .paginate(rows=0)
+    facets = facetq.execute().facet_counts.facet_fields
+
+    # reverse order and convert to datetime.date for use with naturalday
+    recent_items = []
+    recent_dates = list(facets['created_date'])
+    recent_dates.reverse()
+    # limit to just the 10 most recent dates
+    for day, count in recent_dates[:10]:
+        y, m, d = day.split('-')
+        recent_items.append((date(int(y), int(m), int(d)), count))
+
+    recent_collections = facets['collection_label_facet']
+
+    # search for content added in the last few months
+    # and return just the facets for year-month
+    facetq = solr.query().filter(created_date__range=(three_months, today))  \
+                .facet_by('created_month', sort='index',
+                          mincount=1) \
+                .paginate(rows=0)
+    recent_month_facet = list(facetq.execute().facet_counts.facet_fields['created_month'])
+    recent_month_facet.reverse()
+    recent_months = []
+    for month, count in recent_month_facet:
+        y, m = month.split('-')
+        recent_months.append((date(int(y), int(m), 1), count))
+
+    # search for fixity checks in the last 30 days
+    facetq = solr.query().filter(last_fixity_check__range=(month_ago, today))  \
+                .facet_by('last_fixity_result', mincount=1) \
+                .paginate(rows=0)
+    facets = facetq.execute().facet_counts.facet_fields
+    recent_fixity_checks = facets['last_fixity_result']
+
+    return {
+        'recent_items': recent_items,
+        'recent_months': recent_months,
+        'recent_collections': recent_collections,
+        'recent_fixity_checks': recent_fixity_checks,
+        'month_ago': month_ago,
+        'updated': datetime.now()
+    }
+
+
+def refresh_stats():
+    '''Calculate dashboard statistics and store them in the cache.
+
+    :returns: statistics, as returned by :meth:`calculate_stats`
+    '''
+    stats = calculate_stats()
+    cache.set(CACHE_KEY, stats,
+              getattr(settings, 'DASHBOARD_STATS_TIMEOUT', DEFAULT_TIMEOUT))
+    return stats
+
+
+def get_stats(refresh=False):
+    '''Get dashboard statistics from the cache, calculating them if
+    they are not cached or if a refresh is requested.
+
+    :param refresh: recalculate statistics even if they are cached
+    '''
+    stats = None
+    if not refresh:
+        stats = cache.get(CACHE_KEY)
+    if stats is None:
+        stats = refresh_stats()
+    return stats
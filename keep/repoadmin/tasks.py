@@ -0,0 +1,60 @@
+from __future__ import absolute_import
+
+from celery import shared_task
+from celery.utils.log import get_task_logger
+
+from keep.audio.models import AudioObject
+from keep.common import fixity, staging
+from keep.file.models import DiskImage
+from keep.repoadmin import dashboard
+from keep.video.models import Video
+
+logger = get_task_logger(__name__)
+
+
+@shared_task
+def refresh_dashboard_stats():
+    '''Recalculate and cache the admin dashboard statistics, so that
+    the dashboard does not need to query Solr when it is loaded.
+    Intended to be run periodically by celery beat; see
+    **CELERYBEAT_SCHEDULE** in settings.
+    '''
+    stats = dashboard.refresh_stats()
+    logger.info('Refreshed dashboard statistics (%d recent days, %d recent months)'
+                % (len(stats['recent_items']), len(stats['recent_months'])))
+
+
+@shared_task
+def run_fixity_checks(limit=None):
+    '''Check the fixity of the audio, video, and disk image content that
+    was least recently verified; see :mod:`keep.common.fixity`.
+    Intended to be run periodically by celery beat.
+    '''
+    stats = fixity.run_fixity_checks([AudioObject, Video, DiskImage], limit=limit)
+    if stats is None:
+        logger.info('Fixity checks already in progress; skipping')
+        return
+    logger.info('Fixity checks: %(pass)d passed, %(fail)d failed, '
+                '%(unverified)d unverified, %(error)d errors' % stats)
+    return stats
+
+
+@shared_task
+def clean_staging_areas():
+    '''Remove expired uploads and temporary files from the ingest and
+    large-file staging areas, removing more if disk space is low; see
+    :mod:`keep.common.staging`.  Intended to be run periodically by
+    celery beat.
+    '''
+    stats = staging.run_cleanup()
+    if stats is None:
+        logger.info('Staging cleanup already in progress; skipping')
+        return
+    for area, area_stats in sorted(stats.iteritems()):
+        if area_stats['error'] is None:
+            logger.info('Staging cleanup for %s: removed %d of %d entries, '
+                        'reclaimed %d bytes; %d errors; %d of %d bytes free'
+                        % (area, area_stats['removed'], area_stats['entries'],
+                           area_stats['reclaimed'], area_stats['errors'],
+                           area_stats['free'], area_stats['total']))
+    return stats
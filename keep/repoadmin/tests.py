@@ -3,9 +3,11 @@ from django import forms
 from django.http import HttpRequest
 from django.contrib.auth.models import Permission
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.shortcuts import render
 from django.test import TestCase
+from datetime import date
 import json
 from mock import patch, Mock, call
 from sunburnt import sunburnt
@@ -13,7 +15,10 @@ from keep.arrangement.models import ArrangementObject
 from keep.audio.models import AudioObject
 from keep.collection.models import SimpleCollection
 
+from keep.repoadmin import dashboard
 from keep.repoadmin.forms import SolrSearchField, KeywordSearch
+from keep.repoadmin.tasks import refresh_dashboard_stats
+from keep.repoadmin.views import keyword_suggestions
 from keep.testutil import KeepTestCase
 from keep.audio.tests import ADMIN_CREDENTIALS
 
@@ -80,7 +85,7 @@ class RepoAdminViewsTest(KeepTestCase):
         self.user.is_superuser = True
         self.user.save()
 
-    @patch('keep.repoadmin.views.Paginator')
+    @patch('keep.repoadmin.views.SolrPaginator')
     def test_search(self, mockpaginator, mocksolr_interface):
         search_url = reverse('repo-admin:search')
         mocksolr = mocksolr_interface.return_value
@@ -134,7 +139,7 @@ class RepoAdminViewsTest(KeepTestCase):
         # since that logic is now handled in accounts.utils.filter_by_perms
         # and is not specific to this view
 
-    @patch('keep.repoadmin.views.Paginator')
+    @patch('keep.repoadmin.views.SolrPaginator')
     def test_search_by_user(self, mockpaginator, mocksolr_interface):
         search_url = reverse('repo-admin:search')
         mocksolr = mocksolr_interface.return_value
@@ -173,7 +178,7 @@ class RepoAdminViewsTest(KeepTestCase):
         self.client.get(search_url, {'keyword': 'foo:bar'})
         mocksolr.query.query.assert_called_with('foo:bar')
 
-    @patch('keep.repoadmin.views.Paginator')
+    @patch('keep.repoadmin.views.SolrPaginator')
     def test_search_by_coll(self, mockpaginator, mocksolr_interface):
         search_url = reverse('repo-admin:search')
         mocksolr = mocksolr_interface.return_value
@@ -218,7 +223,7 @@ class RepoAdminViewsTest(KeepTestCase):
         args, kwargs = mocksolr.query.field_limit.call_args
         self.assertTrue(kwargs['score'], 'relevance score should be returned from solr')
 
-    @patch('keep.repoadmin.views.Paginator')
+    @patch('keep.repoadmin.views.SolrPaginator')
     def test_search_facets(self, mockpaginator, mocksolr_interface):
         # test facet logic in the search
         search_url = reverse('repo-admin:search')
@@ -273,13 +278,15 @@ class RepoAdminViewsTest(KeepTestCase):
         self.assert_('modified by usr2' in active_filter_labels)
         self.assert_('Undetermined' in active_filter_labels)
 
-    def test_search_suggest(self, mocksolr_interface):
+    @patch('keep.common.suggest.solr_interface', spec=sunburnt.SolrInterface)
+    def test_search_suggest(self, mocksuggest_solr, mocksolr_interface):
         suggest_url = reverse('repo-admin:suggest')
-        mocksolr = mocksolr_interface.return_value
+        mocksolr = mocksuggest_solr.return_value
 
         mocksolr.query.return_value = mocksolr.query
         for method in ['query', 'facet_by', 'paginate', 'filter']:
             getattr(mocksolr.query, method).return_value = mocksolr.query
+        keyword_suggestions.expire()
 
         # log in as staff
         self.client.login(**ADMIN_CREDENTIALS)
@@ -296,6 +303,8 @@ class RepoAdminViewsTest(KeepTestCase):
         # should have a category set
         for item in data:
             self.assertEqual('Search Fields', item['category'])
+        # solr should not be queried for search field suggestions
+        self.assertEqual(0, mocksolr.query.execute.call_count)
 
         # term ending with space should also suggest fields
         search_term = 'end title:one '
@@ -307,37 +316,46 @@ class RepoAdminViewsTest(KeepTestCase):
         # suggestions for user field
         mocksolr.query.execute.return_value.facet_counts.facet_fields = {
             'users_facet': [
-                ('Thing One', 5), ('Thing Two', 4)
+                ('Red Fish', 2), ('Thing One', 5), ('Thing Two', 4)
             ]
         }
         response = self.client.get(suggest_url, {'term': 'user:'})
 
-        mocksolr.query.facet_by.assert_called_with('users_facet', prefix='',
-                                             sort='count', limit=15)
+        # all facet values loaded in a single query
+        mocksolr.query.facet_by.assert_any_call('users_facet', sort='index',
+                                                limit=-1, mincount=1)
         mocksolr.query.paginate.assert_called_with(rows=0)
+        self.assertEqual(1, mocksolr.query.execute.call_count)
 
         data = json.loads(response.content)
-        # inspect results
+        # inspect results - most common first
         self.assertEqual('Thing One (5)', data[0]['label'])
         self.assertEqual('user:"Thing One" ', data[0]['value'])
         self.assertEqual('Users', data[0]['category'])
         self.assertEqual('Thing Two (4)', data[1]['label'])
         self.assertEqual('user:"Thing Two" ', data[1]['value'])
         self.assertEqual('Users', data[1]['category'])
+        self.assertEqual('Red Fish (2)', data[2]['label'])
 
         response = self.client.get(suggest_url, {'term': 'cat user:T'})
-        mocksolr.query.facet_by.assert_called_with('users_facet', prefix='T',
-                                             sort='count', limit=15)
         data = json.loads(response.content)
+        self.assertEqual(2, len(data))
         # value should include preceding search string, if any
         self.assertEqual('cat user:"Thing One" ', data[0]['value'])
         self.assertEqual('cat user:"Thing Two" ', data[1]['value'])
+        # facet values are cached in memory
+        self.assertEqual(1, mocksolr.query.execute.call_count)
+
+        # case-insensitive, matches the start of any word
+        response = self.client.get(suggest_url, {'term': 'user:fi'})
+        data = json.loads(response.content)
+        self.assertEqual(['user:"Red Fish" '], [d['value'] for d in data])
 
         # non-empty but invalid parse result should not error
         response = self.client.get(suggest_url, {'term': ':'})
         self.assertEqual(200, response.status_code)  # was getting a 500 error before fix
 
-    @patch('keep.repoadmin.views.Paginator')
+    @patch('keep.repoadmin.views.SolrPaginator')
     def test_search_by_created(self, mockpaginator, mocksolr_interface):
         search_url = reverse('repo-admin:search')
         mocksolr = mocksolr_interface.return_value
@@ -356,48 +374,118 @@ class RepoAdminViewsTest(KeepTestCase):
         # - query should be called with tokenized search terms
         mocksolr.query.query.assert_any_call(created_date='2012-05*')
 
-    def test_search_suggest_created(self, mocksolr_interface):
+    @patch('keep.common.suggest.solr_interface', spec=sunburnt.SolrInterface)
+    def test_search_suggest_created(self, mocksuggest_solr, mocksolr_interface):
         suggest_url = reverse('repo-admin:suggest')
-        mocksolr = mocksolr_interface.return_value
+        mocksolr = mocksuggest_solr.return_value
 
         mocksolr.query.return_value = mocksolr.query
         for method in ['query', 'facet_by', 'paginate', 'filter']:
             getattr(mocksolr.query, method).return_value = mocksolr.query
+        keyword_suggestions.expire()
+        mocksolr.query.execute.return_value.facet_counts.facet_fields = {
+            'created_date': [('2011-12-01', 3), ('2012-01-15', 9),
+                             ('2012-01-20', 12), ('2012-04-02', 4)]
+        }
 
         # log in as staff
         self.client.login(**ADMIN_CREDENTIALS)
 
-        # < 4 digits should query by year
-        mocksolr.query.execute.return_value.facet_counts.facet_fields = {
-            'created_year': [('2012', 50)]
-        }
-
+        # < 4 digits should suggest year
         response = self.client.get(suggest_url, {'term': 'created:2'})
-        mocksolr.query.facet_by.assert_called_with('created_year', prefix='2',
-                                             sort='index', limit=15)
         data = json.loads(response.content)
-        self.assertEqual('created:2012', data[0]['value'])
+        self.assertEqual('created:2011', data[0]['value'])
+        self.assertEqual('created:2012', data[1]['value'])
+        self.assertEqual('2012 (25)', data[1]['label'])
         self.assertEqual('Date Added', data[0]['category'])
 
-        # between 4 and 7 digits should query by year-month
-        mocksolr.query.execute.return_value.facet_counts.facet_fields = {
-            'created_month': [('2012-01', 21)]
-        }
+        # between 4 and 7 digits should suggest year-month
         response = self.client.get(suggest_url, {'term': 'created:2012'})
-        mocksolr.query.facet_by.assert_called_with('created_month', prefix='2012',
-                                             sort='index', limit=15)
         data = json.loads(response.content)
         self.assertEqual('created:2012-01', data[0]['value'])
+        self.assertEqual('2012-01 (21)', data[0]['label'])
+        self.assertEqual('created:2012-04', data[1]['value'])
 
-        # > 7 digits should query by year-month-day
-        mocksolr.query.execute.return_value.facet_counts.facet_fields = {
-            'created_date': [('2012-01-15', 9)]
-        }
-        response = self.client.get(suggest_url, {'term': 'created:2012-04'})
-        mocksolr.query.facet_by.assert_called_with('created_date', prefix='2012-04',
-                                             sort='index', limit=15)
+        # > 7 digits should suggest year-month-day
+        response = self.client.get(suggest_url, {'term': 'created:2012-01'})
         data = json.loads(response.content)
         self.assertEqual('created:2012-01-15 ', data[0]['value'])
+        self.assertEqual('created:2012-01-20 ', data[1]['value'])
+
+        # all suggestions generated from a single solr query
+        self.assertEqual(1, mocksolr.query.execute.call_count)
+
+
+class DashboardStatsTest(KeepTestCase):
+    fixtures = ['users']
+
+    def setUp(self):
+        cache.delete(dashboard.CACHE_KEY)
+
+    def tearDown(self):
+        cache.delete(dashboard.CACHE_KEY)
+
+    def _mock_facets(self, mocksolr_interface):
+        mocksolr = mocksolr_interface.return_value
+        mocksolr.query.return_value = mocksolr.query
+        for method in ['filter', 'facet_by', 'paginate']:
+            getattr(mocksolr.query, method).return_value = mocksolr.query
+        mocksolr.query.execute.return_value.facet_counts.facet_fields = {
+            'created_date': [('2015-03-01', 2), ('2015-03-04', 5)],
+            'collection_label_facet': [('MSS 123', 7)],
+            'created_month': [('2015-02', 1), ('2015-03', 7)],
+            'last_fixity_result': [('pass', 20), ('fail', 1)],
+        }
+        return mocksolr
+
+    def test_get_stats(self, mocksolr_interface):
+        mocksolr = self._mock_facets(mocksolr_interface)
+
+        stats = dashboard.get_stats()
+        # most recent dates and months first, converted to dates
+        self.assertEqual([(date(2015, 3, 4), 5), (date(2015, 3, 1), 2)],
+                         stats['recent_items'])
+        self.assertEqual([(date(2015, 3, 1), 7), (date(2015, 2, 1), 1)],
+                         stats['recent_months'])
+        self.assertEqual([('MSS 123', 7)], stats['recent_collections'])
+        self.assertEqual([('pass', 20), ('fail', 1)], stats['recent_fixity_checks'])
+        self.assertTrue(stats['updated'])
+        self.assertEqual(3, mocksolr.query.execute.call_count)
+
+        # second request should use cached statistics
+        cached_stats = dashboard.get_stats()
+        self.assertEqual(3, mocksolr.query.execute.call_count,
+            'solr should not be queried when dashboard statistics are cached')
+        self.assertEqual(stats['updated'], cached_stats['updated'])
+
+        # refresh should recalculate
+        dashboard.get_stats(refresh=True)
+        self.assertEqual(6, mocksolr.query.execute.call_count)
+
+    def test_view(self, mocksolr_interface):
+        mocksolr = self._mock_facets(mocksolr_interface)
+        dashboard_url = reverse('repo-admin:dashboard')
+
+        self.client.login(**ADMIN_CREDENTIALS)
+        response = self.client.get(dashboard_url)
+        self.assertEqual(3, mocksolr.query.execute.call_count)
+        self.assertContains(response, 'MSS 123')
+        self.assertContains(response, 'Statistics as of')
+        self.assertContains(response, '%s?refresh=1' % dashboard_url)
+
+        # cached statistics used on subsequent page loads
+        response = self.client.get(dashboard_url)
+        self.assertEqual(3, mocksolr.query.execute.call_count)
+        self.assertContains(response, 'MSS 123')
+
+        # manual refresh
+        self.client.get(dashboard_url, {'refresh': 1})
+        self.assertEqual(6, mocksolr.query.execute.call_count)
+
+    def test_refresh_task(self, mocksolr_interface):
+        self._mock_facets(mocksolr_interface)
+        refresh_dashboard_stats()
+        self.assertTrue(cache.get(dashboard.CACHE_KEY))
 
 
 class SearchTemplatesTest(TestCase):
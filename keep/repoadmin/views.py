@@ -1,7 +1,7 @@
 from django.conf import settings
 import logging
-from datetime import date, timedelta
-from django.core.paginator import Paginator, EmptyPage, InvalidPage
+from datetime import date
+from django.core.paginator import EmptyPage, InvalidPage
 from django.core.serializers.json import DjangoJSONEncoder
 from django.http import HttpResponse
 from django.template.response import TemplateResponse
@@ -14,13 +14,25 @@ from eulcommon.searchutil import pages_to_show, parse_search_terms
 from keep.accounts.utils import filter_by_perms
 from keep.collection.forms import FindCollection
 from keep.common.models import rights_access_terms_dict
+from keep.common.paginator import SolrPaginator
+from keep.common.suggest import FacetSuggestions
 from keep.common.utils import solr_interface
+from keep.repoadmin import dashboard as dashboard_stats
 from keep.repoadmin.forms import KeywordSearch
 
 logger = logging.getLogger(__name__)
 
 json_serializer = DjangoJSONEncoder(ensure_ascii=False, indent=2)
 
+# in-memory index of facet values for keyword search autocomplete;
+# year and month suggestions are generated from date created
+keyword_suggestions = FacetSuggestions(
+    ['users_facet', 'added_by_facet', 'created_date',
+     'collection_label_facet', 'collection_source_id'],
+    infix=['users_facet', 'added_by_facet', 'collection_label_facet'],
+    rollups={'created_year': ('created_date', 4),
+             'created_month': ('created_date', 7)})
+
 
 def is_staff(user):
     return user.is_staff
@@ -30,67 +42,16 @@ def is_staff(user):
 def dashboard(request):
     '''Admin dashboard page for staff users, with links to main
     functionality and date/month facets linking to searches for
-    recently added or checksummed items.
+    recently added or checksummed items.  Facet statistics are
+    cached (see :mod:`keep.repoadmin.dashboard`); pass ``refresh``
+    in the query string to recalculate them.
     '''
-    today = date.today()
-    month_ago = today - timedelta(days=30)
-    three_months = today - timedelta(days=31 * 3)
-
-    solr = solr_interface()
-
-    # search for all content added in the last month
-    # and return just the facets for date created and collection name
-    # - limit of 31 to ensure we get all dates in range
-    facetq = solr.query().filter(created_date__range=(month_ago, today))  \
-                .facet_by('created_date', sort='index',
-                          limit=31, mincount=1) \
-                .facet_by('collection_label_facet', sort='count',
-                          limit=10, mincount=1) \
-                .paginate(rows=0)
-    # filter the facet query by user permissions
-    # facetq = filter_by_perms(facetq, request.user)
-    facets = facetq.execute().facet_counts.facet_fields
-
-    # reverse order and convert to datetime.date for use with naturalday
-    recent_items = []
-    recent_dates = facets['created_date']
-    recent_dates.reverse()
-    # limit to just the 10 most recent dates
-    for day, count in recent_dates[:10]:
-        y, m, d = day.split('-')
-        recent_items.append((date(int(y), int(m), int(d)), count))
-
-    recent_collections = facets['collection_label_facet']
-
-    # search for content added in the last few months
-    # and return just the facets for year-month
-    facetq = solr.query().filter(created_date__range=(three_months, today))  \
-                .facet_by('created_month', sort='index',
-                          mincount=1) \
-                .paginate(rows=0)
-    # also filter this query by user perms
-    # facetq = filter_by_perms(facetq, request.user)
-    recent_month_facet = facetq.execute().facet_counts.facet_fields['created_month']
-    recent_month_facet.reverse()
-    recent_months = []
-    for month, count in recent_month_facet:
-        y, m = month.split('-')
-        recent_months.append((date(int(y), int(m), 1), count))
-
-    # search for fixity checks in the last 30 days
-    facetq = solr.query().filter(last_fixity_check__range=(month_ago, today))  \
-                .facet_by('last_fixity_result', mincount=1) \
-                .paginate(rows=0)
-    # facetq = filter_by_perms(facetq, request.user)
-    facets = facetq.execute().facet_counts.facet_fields
-    recent_fixity_checks = facets['last_fixity_result']
-
-    return TemplateResponse(request, 'repoadmin/site_dashboard.html',
-        {'recent_items': recent_items, 'recent_months': recent_months,
-        'recent_collections': recent_collections,
-        'recent_fixity_checks': recent_fixity_checks,
-        'month_ago': month_ago, 'manual_url': settings.KEEP_MANUAL_URL,
-        'find_collection': FindCollection()})
+    # statistics are cached; staff can request updated statistics
+    stats = dashboard_stats.get_stats(refresh='refresh' in request.GET)
+    ctx = dict(stats)
+    ctx.update({'manual_url': settings.KEEP_MANUAL_URL,
+                'find_collection': FindCollection()})
+    return TemplateResponse(request, 'repoadmin/site_dashboard.html', ctx)
 
 
 @user_passes_test_with_403(is_staff)
@@ -267,7 +228,7 @@ def keyword_search(request):
         known_object_types = ['audio', 'collection', 'born-digital']
 
         # paginate the solr result set
-        paginator = Paginator(q, 30)
+        paginator = SolrPaginator(q, 30)
         try:
             page = int(request.GET.get('page', '1'))
         except ValueError:
@@ -328,11 +289,10 @@ def keyword_search_suggest(request):
     If the search string is empty or ends with a space, suggests
     available search fields with an explanation.
 
-    .. Note::
-
-        Due to the current implementation and the limitations of facet
-        querying in Solr, the search term is case-sensitive and only
-        matches at the beginning of the string.
+    Facet values are matched from an in-memory index (see
+    :mod:`keep.common.suggest`) rather than querying Solr for each
+    request.  Matching is case-insensitive; user and collection names
+    also match at the beginning of any word.
 
     Return format is suitable for use with `JQuery UI Autocomplete`_
     widget.
@@ -409,15 +369,10 @@ def keyword_search_suggest(request):
                 if prefix and prefix.isdigit():
                     facet_field = 'collection_source_id'
 
-            solr = solr_interface()
-            facetq = solr.query().paginate(rows=0)
-            # filter by current user permssions
-            # facetq = filter_by_perms(facetq, request.user)
             # return the 15 most common terms in the requested facet field
             # with a specified prefix
-            facetq = facetq.facet_by(facet_field, prefix=prefix,
-                                     sort=sort, limit=15)
-            facets = facetq.execute().facet_counts.facet_fields
+            facets = keyword_suggestions.suggest(facet_field, prefix,
+                                                 sort=sort, limit=15)
 
             # generate a dictionary to return via json with label (facet value
             # + count), and actual value to use
@@ -425,7 +380,7 @@ def keyword_search_suggest(request):
                             'value': '%s%s:' % (value_prefix, field) + \
                                             result_fmt % facet,
                             'category': category}
-                           for facet, count in facets[facet_field]
+                           for facet, count in facets
                            ]
 
     return HttpResponse(json_serializer.encode(suggestions),
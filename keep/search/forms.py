@@ -81,8 +81,7 @@ class SearchForm(DateFilterSearchForm):
         # - depending on permissions, restrict to collections with researcher content
         if not self.user.has_perm('collection.view_collection') and \
                self.user.has_perm('collection.view_researcher_collection'):
-            q = q.join('collection_id', 'pid', researcher_access=True)
-            q = q.join('collection_id', 'pid', has_access_copy=True)
+            q = q.filter(has_researcher_content=True)
 
         facets = q.execute().facet_counts.facet_fields
 
@@ -3,12 +3,12 @@ from sunburnt import sunburnt
 
 from django.conf import settings
 from django.core.urlresolvers import reverse
-from django.core.paginator import Paginator
 from django.test import TestCase
 
 from keep.testutil import KeepTestCase
 from keep.accounts.models import ResearcherIP
 from keep.audio.models import AudioObject
+from keep.common.paginator import SolrPaginator
 from keep.search.templatetags import search_tags
 from keep.common.utils import solr_interface
 
@@ -20,7 +20,7 @@ class SearchViewsTest(KeepTestCase):
     fixtures = ['initial_groups']
     # default groups must be loaded for anonymous researcher patron access
 
-    @patch('keep.search.views.Paginator', spec=Paginator)
+    @patch('keep.search.views.SolrPaginator', spec=SolrPaginator)
     def test_search(self, mockpaginator, mocksolr_interface, mocksearch_libs):
         search_url = reverse('search:keyword')
         mocksolr = mocksolr_interface.return_value
@@ -129,7 +129,7 @@ class SearchViewsTest(KeepTestCase):
 
         researchip.delete()
 
-    @patch('keep.search.views.Paginator', spec=Paginator)
+    @patch('keep.search.views.SolrPaginator', spec=SolrPaginator)
     def test_search_collections(self, mockpaginator, mocksolr_interface, mocksearch_libs):
         solr = solr_interface()
         search_url = reverse('search:keyword')
@@ -163,7 +163,7 @@ class SearchViewsTest(KeepTestCase):
 
         researchip.delete()
 
-    @patch('keep.search.views.Paginator', spec=Paginator)
+    @patch('keep.search.views.SolrPaginator', spec=SolrPaginator)
     def test_search_bydate(self, mockpaginator, mocksolr_interface, mocksearch_libs):
         solr = solr_interface()
         search_url = reverse('search:keyword')
@@ -216,7 +216,7 @@ class SearchViewsTest(KeepTestCase):
 
         researchip.delete()
 
-    @patch('keep.search.views.Paginator', spec=Paginator)
+    @patch('keep.search.views.SolrPaginator', spec=SolrPaginator)
     def test_search_bylibrary(self, mockpaginator, mocksolr_interface, mocksearch_libs):
         solr = solr_interface()
         search_url = reverse('search:keyword')
@@ -241,7 +241,7 @@ class SearchViewsTest(KeepTestCase):
         response = self.client.get(search_url, {'library': libpid})
         # check solr query args
         # - date should query dates created and issued explicitly
-        mocksolr.query.join.assert_called_with('pid', 'collection_id', archive_id=libpid)
+        mocksolr.query.filter.assert_any_call(archive_id=libpid)
 
         self.assertContains(response,
             '<option value="%s" selected="selected">%s</option>' % (libpid, marbl_name),
@@ -1,6 +1,6 @@
 from urllib import urlencode
 
-from django.core.paginator import Paginator, EmptyPage, InvalidPage
+from django.core.paginator import EmptyPage, InvalidPage
 from django.template.response import TemplateResponse
 
 from eulcommon.djangoextras.auth import user_passes_test_with_403
@@ -9,6 +9,7 @@ from keep.accounts.utils import filter_by_perms
 from keep.audio.models import AudioObject
 from keep.video.models import Video
 from keep.search.forms import SearchForm
+from keep.common.paginator import SolrPaginator
 from keep.common.utils import solr_interface
 
 # NOTE: minimum permission to access these researcher
@@ -81,10 +82,8 @@ def search(request):
         # if a library is specified, filter by archive id on related collection
         if 'library' in search_opts and search_opts['library']:
             library = search_opts['library']
-            # NOTE: requires a join query; items belong to collections, which belong
-            # to libraries; join on pid->collection id in order to filter on
-            # archive id property on the associated collection object
-            q = q.join('pid', 'collection_id', archive_id=library)
+            # items are indexed with the archive id of their collection
+            q = q.filter(archive_id=library)
 
         # if format search term is specified, filter
         if 'format' in search_opts and search_opts['format']:
@@ -134,7 +133,7 @@ def search(request):
             q = q.query(created_q | issued_q)
 
         # paginate the solr result set
-        paginator = Paginator(q, 30)
+        paginator = SolrPaginator(q, 30)
         try:
             page = int(request.GET.get('page', '1'))
         except ValueError:
@@ -66,6 +66,7 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 
 
 MIDDLEWARE_CLASSES = (
+    'keep.common.middleware.BackendCallsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -165,6 +166,27 @@ CELERY_RESULT_BACKEND='djcelery.backends.database:DatabaseBackend'
 # where that needs to be done
 CELERY_DEFAULT_QUEUE = 'keep'
 
+# periodic tasks, run by celery beat
+from datetime import timedelta
+CELERYBEAT_SCHEDULE = {
+    # keep cached admin dashboard statistics up to date
+    'refresh-dashboard-stats': {
+        'task': 'keep.repoadmin.tasks.refresh_dashboard_stats',
+        'schedule': timedelta(minutes=10),
+    },
+    # check fixity of the least recently verified content; runs are
+    # skipped while a previous run is still in progress
+    'run-fixity-checks': {
+        'task': 'keep.repoadmin.tasks.run_fixity_checks',
+        'schedule': timedelta(minutes=30),
+    },
+    # remove expired uploads and temporary files from the staging areas
+    'clean-staging-areas': {
+        'task': 'keep.repoadmin.tasks.clean_staging_areas',
+        'schedule': timedelta(hours=1),
+    },
+}
+
 try:
     from keep.localsettings import *
 except ImportError:
@@ -183,7 +205,11 @@ DEFAULT_EXCEPTION_REPORTER_FILTER = 'eulfedora.util.SafeExceptionReporterFilter'
 # NOTE: setting after including localsettings to allow local override
 CELERY_ROUTES = {
     'keep.audio.tasks.convert_wav_to_mp3': {'queue': CELERY_DEFAULT_QUEUE},
-    'keep.file.tasks.migrate_aff_diskimage': {'queue': CELERY_DEFAULT_QUEUE}
+    'keep.file.tasks.migrate_aff_diskimage': {'queue': CELERY_DEFAULT_QUEUE},
+    'keep.repoadmin.tasks.refresh_dashboard_stats': {'queue': CELERY_DEFAULT_QUEUE},
+    'keep.collection.tasks.update_researcher_content': {'queue': CELERY_DEFAULT_QUEUE},
+    'keep.collection.tasks.propagate_collection_changes': {'queue': CELERY_DEFAULT_QUEUE},
+    'keep.repoadmin.tasks.run_fixity_checks': {'queue': CELERY_DEFAULT_QUEUE},
 }
 
 
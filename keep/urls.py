@@ -21,6 +21,8 @@ urlpatterns = patterns('',
     url(r'^tasks/', include('eulcommon.djangoextras.taskresult.urls', namespace='tasks')),
 
     # index data for solr
+    # - object index data, with support for partial updates
+    url(r'^indexdata/(?P<id>[^/]+)/$', 'keep.common.views.index_data'),
     url(r'^indexdata/', include('eulfedora.indexdata.urls', namespace='indexdata')),
 
     url(r'^common/', include('keep.common.urls', namespace='common')),
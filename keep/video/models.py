@@ -4,7 +4,9 @@ from eulfedora.models import FileDatastream, XmlDatastream, Relation
 from eulfedora.util import RequestFailed
 from eulfedora.rdfns import relsext
 from keep.collection.models import CollectionObject
+from keep.collection.tasks import indexed_collection, queue_researcher_content_update
 from keep.common.fedora import DigitalObject, Repository, LocalMODS
+from keep.common.fixity import fixity_index_data
 from eulxml import xmlmap
 from eulxml.xmlmap import mods
 from eulxml.xmlmap import premis
@@ -216,6 +218,10 @@ class Video(DigitalObject):
     CONTENT_MODELS = [VIDEO_CONTENT_MODEL]
     NEW_OBJECT_VIEW = 'video:view'
 
+    #: file datastreams verified by periodic fixity checks; see
+    #: :mod:`keep.common.fixity`
+    fixity_datastreams = ['content']
+
     # There are several mimetypes for MPEG files
     allowed_master_mimetypes = {
         'video/quicktime' : 'mov',
@@ -298,6 +304,14 @@ class Video(DigitalObject):
     and to support duplicate detection based on checksums, store
     content checksum without sending it to Fedora.'''
 
+    partial_index_methods = dict(DigitalObject.partial_index_methods, **{
+        'MODS': '_index_data_mods',
+        'Rights': '_index_data_rights',
+        'DigitalTech': '_index_data_digitaltech',
+        'SourceTech': '_index_data_sourcetech',
+        'provenanceMetadata': '_index_data_provenance',
+    })
+
     @property
     def content_md5(self):
         return self._content_checksum or self.content.checksum
@@ -332,7 +346,21 @@ class Video(DigitalObject):
         if self.mods.isModified() and self.mods.content.title:
             self.label = self.mods.content.title
 
-        return super(Video, self).save(logMessage)
+        # changes to rights, access copy, or collection may change whether
+        # the collection has content available to researchers
+        researcher_change = not self.exists or self.rights.isModified() or \
+            self.rels_ext.isModified() or self.access_copy.isModified()
+        previous_collection = None
+        if self.exists and self.rels_ext.isModified():
+            previous_collection = indexed_collection(self.pid)
+
+        saved = super(Video, self).save(logMessage)
+
+        if researcher_change:
+            queue_researcher_content_update(self,
+                bool(self.researcher_access) and self.access_copy.exists,
+                previous_collection)
+        return saved
     #
     @models.permalink
     def get_absolute_url(self):
@@ -422,46 +450,20 @@ class Video(DigitalObject):
                 # pull parent & archive collection objects directly from fedora
                 parent = CollectionObject(self.api, self.collection.uri)
                 data['collection_label'] = parent.label
+                # archive fields are denormalized so that items can be
+                # filtered by library without a solr join
+                data.update(parent._index_data_archive())
             except RequestFailed as rf:
                 logger.error('Error accessing collection or archive object in Fedora: %s' % rf)
 
-        # include resolvable ARK if available
-        if self.mods.content.ark_uri:
-            data['ark_uri'] = self.mods.content.ark_uri
-
-        #TODO May have to add these sections if more metada is added
-        # # old identifiers from previous digital masters
-        dm1_ids = []
-        if self.mods.content.dm1_id:
-            dm1_ids.append(self.mods.content.dm1_id)
-        if self.mods.content.dm1_other_id:
-            dm1_ids.append(self.mods.content.dm1_other_id)
-        if dm1_ids:
-            data['dm1_id'] = dm1_ids
-
-        # digitization purpose, if not empty
-        if self.digitaltech.content.digitization_purpose_list:
-            # convert nodelist to a normal list that can be serialized as json
-            data['digitization_purpose'] = [dp for dp in self.digitaltech.content.digitization_purpose_list]
+        data.update(self._index_data_mods())
+        data.update(self._index_data_rights())
+        data.update(self._index_data_digitaltech())
+        data.update(self._index_data_sourcetech())
+        data.update(self._index_data_provenance())
 
-        # sublocation
-        if self.sourcetech.content.sublocation:
-            data['sublocation'] = self.sourcetech.content.sublocation
-
-        # rights access status code
-        if self.rights.content.access_status:
-            data['access_code'] = self.rights.content.access_status.code
-        # copyright date from rights metadata
-        if self.rights.content.copyright_date:
-            data['copyright_date'] = self.rights.content.copyright_date
-        # ip note from rights metadata
-        if self.rights.content.ip_note:
-            data['ip_note'] = self.rights.content.ip_note
-        #
-        # # boolean values that should always be available
+        # boolean values that should always be available
         data.update({
-            # should this item be accessible to researchers?
-            'researcher_access': bool(self.researcher_access),
             # flags to indicate which datastreams are available
             'has_access_copy': self.access_copy.exists,
             'has_original': self.content.exists,
@@ -473,24 +475,67 @@ class Video(DigitalObject):
                 'access_copy_mimetype': self.access_copy.mimetype,
         })
 
-        if self.digitaltech.content.duration:
-            data['duration'] = self.digitaltech.content.duration
+        data['content_size'] = self.content.size
+        data['content_mimetype'] = self.content.mimetype
+
+        data.update(fixity_index_data(self.pid))
+
+        # fields that are not set are not indexed
+        return dict((field, value) for field, value in data.iteritems()
+                    if value is not None)
+
+    # index data for individual datastreams, for use in full or partial
+    # index data; fields that are not set have a value of None
+
+    def _index_data_mods(self):
+        mods = self.mods.content
+        data = {
+            # include resolvable ARK if available
+            'ark_uri': mods.ark_uri or None,
+            # old identifiers from previous digital masters
+            'dm1_id': [dm1 for dm1 in [mods.dm1_id, mods.dm1_other_id] if dm1] or None,
+            'date_issued': None,
+            'date_created': None,
+        }
+        if mods.origin_info and mods.origin_info.issued \
+                and not mods.origin_info.issued.is_empty():
+            data['date_issued'] = [unicode(di) for di in mods.origin_info.issued]
+        if mods.origin_info and mods.origin_info.created \
+                and not mods.origin_info.created.is_empty():
+            data['date_created'] = [unicode(di) for di in mods.origin_info.created]
+        return data
 
-        if self.mods.content.origin_info and \
-           self.mods.content.origin_info.issued \
-                and not self.mods.content.origin_info.issued.is_empty():
-            data['date_issued'] = [unicode(di) for di in self.mods.content.origin_info.issued]
-        if self.mods.content.origin_info and \
-           self.mods.content.origin_info.created \
-                and not self.mods.content.origin_info.created.is_empty():
-            data['date_created'] = [unicode(di) for di in self.mods.content.origin_info.created]
+    def _index_data_rights(self):
+        rights = self.rights.content
+        return {
+            # rights access status code
+            'access_code': rights.access_status.code if rights.access_status else None,
+            # copyright date and ip note from rights metadata
+            'copyright_date': rights.copyright_date or None,
+            'ip_note': rights.ip_note or None,
+            # should this item be accessible to researchers?
+            'researcher_access': bool(self.researcher_access),
+        }
 
-        # store master video format and size
+    def _index_data_digitaltech(self):
+        digitaltech = self.digitaltech.content
+        return {
+            # convert nodelist to a normal list that can be serialized as json
+            'digitization_purpose': list(digitaltech.digitization_purpose_list) or None,
+            'duration': digitaltech.duration or None,
+            'codec_quality': digitaltech.codec_quality or None,
+            'codec_software': (digitaltech.codec_creator.software or None)
+                              if digitaltech.codec_creator else None,
+        }
+
+    def _index_data_sourcetech(self):
+        return {'sublocation': self.sourcetech.content.sublocation or None}
+
+    def _index_data_provenance(self):
+        # master video format
+        data = {'content_format': None}
         if self.provenance.content.object and self.provenance.content.object.format:
             data['content_format'] = self.provenance.content.object.format.name
-        data['content_size'] = self.content.size
-
-
         return data
 
     @staticmethod